@@ -26,6 +26,7 @@
 import os
 import logging
 import signal
+import socket
 import struct
 import sys
 import time
@@ -35,22 +36,59 @@ from multiprocessing.util import _exit_function
 
 import msgpack
 
+from hurray import metrics, trace
+from hurray.append_buffer import AppendBuffer
 from hurray.msgpack_ext import decode, encode
-from hurray.protocol import MSG_LEN, PROTOCOL_VER
-from hurray.request_handler import handle_request
+from hurray.protocol import (MSG_LEN, PROTOCOL_VER, CMD_KW_CMD, CMD_KW_ARGS,
+                             CMD_KW_BUFFER, CMD_KW_DB, CMD_KW_PATH,
+                             CMD_GATHER, CMD_APPEND_DATASET,
+                             CMD_BROADCAST_DATASET, CMD_UPDATE_PYRAMID,
+                             CMD_REPACK, CMD_KW_STATUS, RESPONSE_DATA,
+                             RESPONSE_JOB, CMD_GET_KEYS, CMD_GET_TREE,
+                             CMD_KW_STREAM, CMD_KW_LIMIT, CMD_KW_CURSOR,
+                             RESPONSE_CURSOR, CMD_SERVER_INFO, RESPONSE_TASK,
+                             RESPONSE_PROCESSES, RESPONSE_REPLICATION,
+                             CMD_KW_MIN_SEQ)
+from hurray.request_handler import (handle_request, split_gather,
+                                    gather_partial, merge_gather, response,
+                                    encoding_kwargs, run_job, open_catalog)
 from hurray.server import gen
 from hurray.server import process
-from hurray.server.ioloop import IOLoop
+from hurray.server.ioloop import IOLoop, PeriodicCallback
 from hurray.server.iostream import StreamClosedError
 from hurray.server.log import app_log
 from hurray.server.netutil import bind_unix_socket, bind_sockets
 from hurray.server.options import define, options, parse_config_file
 from hurray.server.tcpserver import TCPServer
-from hurray.status_codes import INTERNAL_SERVER_ERROR
+from hurray.status_codes import (INTERNAL_SERVER_ERROR, OK, ACCEPTED,
+                                 REPLICA_LAG)
 from hurray.swmr import SWMR_SYNC, LOCK_STRATEGY_WRITER_PREFERENCE
+from hurray.swmr import replication
+from hurray.swmr.changelog import REPLICA_SEQ
+from hurray.swmr.lock import PROCESSES, REPLICA
 
 SHUTDOWN_GRACE_PERIOD = 30
 
+# listings that can be streamed as a sequence of pages
+STREAM_COMMANDS = (CMD_GET_KEYS, CMD_GET_TREE)
+
+# default number of names/nodes per page of a streamed listing
+STREAM_PAGE_SIZE = 10000
+
+# event loops (--loop)
+LOOP_IOLOOP = 'ioloop'
+LOOP_ASYNCIO = 'asyncio'
+
+# publish the connection and request counters every this many seconds
+COUNTER_INTERVAL = 1.0
+
+# check whether a replica caught up (min_seq) every this many seconds
+REPLICA_POLL_INTERVAL = 0.02
+
+# modes (--mode)
+MODE_SERVER = 'server'
+MODE_PROXY = 'proxy'
+
 # command line arguments
 define("host", default='localhost', group='application',
        help="IP address or hostname")
@@ -61,10 +99,47 @@ define("socket", default=None, group='application',
 define("processes", default=0, group='application',
        help="Number of sub-processes (0 = detect the number of cores available"
             " on this machine)")
+define("loop", default=LOOP_IOLOOP, group='application',
+       help="Event loop:\n{} = built-in IOLoop\n{} = asyncio with native "
+            "coroutines (Python >= 3.7)".format(LOOP_IOLOOP, LOOP_ASYNCIO))
+define("reuse_port", default=False, group='application',
+       help="Each sub-process binds its own SO_REUSEPORT socket, so that the "
+            "kernel balances the connections (instead of one shared accept "
+            "queue)")
+define("mode", default=MODE_SERVER, group='application',
+       help="{} = serve the databases in the base directory\n{} = distribute "
+            "the databases across the servers given by --nodes (see "
+            "hurray.proxy)".format(MODE_SERVER, MODE_PROXY))
+define("nodes", default=[], type=str, multiple=True, group='application',
+       help="Proxy mode: addresses of the servers (host:port or Unix domain "
+            "socket path)")
+define("routes", default=[], type=str, multiple=True, group='application',
+       help="Proxy mode: static routes pattern=node; databases whose name "
+            "matches a pattern (e.g., archive/*) are stored on the node of "
+            "the first matching route instead of the hashed node")
+define("node_connections", default=4, group='application',
+       help="Proxy mode: maximum number of connections to each node")
 define("workers", default=1, group='application',
        help="Number of workers each sub-processes spawns")
 define("locking", default=LOCK_STRATEGY_WRITER_PREFERENCE, group='application',
        help="File locking strategy:\nw = Writer preference\nn = No starving")
+define("job_workers", default=1, group='application',
+       help="Number of processes each sub-process spawns for background jobs "
+            "(e.g., repacking databases)")
+define("append_flush_interval", default=5.0, group='application',
+       help="Write buffered appends after this many seconds (0 = only write "
+            "complete chunks)")
+define("pyramid_interval", default=2.0, group='application',
+       help="Update the pyramids of written datasets every this many seconds "
+            "(0 = only on request)")
+define("replica_wait", default=5.0, group='application',
+       help="Replica: maximum number of seconds a request waits for the "
+            "change given by its min_seq argument")
+define("metrics_port", default=0, group='application',
+       help="Serve metrics in the Prometheus text format on this local port "
+            "(0 = no metrics port, see hurray.metrics)")
+define("metrics_socket", default=None, group='application',
+       help="Serve metrics on this Unix domain socket")
 define("debug", default=0, group='application',
        help="Write debug information to stdout?")
 define("config", type=str, help="path to config file",
@@ -74,10 +149,21 @@ define("config", type=str, help="path to config file",
 class HurrayServer(TCPServer):
     def __init__(self, *args, **kwargs):
         self.__workers = kwargs.pop('workers', 1)
+        self.__job_workers = kwargs.pop('job_workers', 1)
         # ProcessPoolExecutor can't be initialized here.
         # The HurrayServer instances get forked and this leads to broken
         # process pools.
         self._pool = None
+        self._job_pool = None
+        # datasets written since the last pyramid update: (db, path)
+        self._written = set()
+        self._pyramid_updater = None
+        self._updating = False
+        # counters of this process (see hurray.swmr.processes)
+        self.connections = 0
+        self.open_connections = 0
+        self.requests = 0
+        self._counter_updater = None
         super(HurrayServer, self).__init__(*args, **kwargs)
 
     @property
@@ -86,13 +172,257 @@ class HurrayServer(TCPServer):
             self._pool = ProcessPoolExecutor(max_workers=self.__workers)
         return self._pool
 
+    @property
+    def job_pool(self):
+        """
+        Separate pool for long running jobs, so that they do not block
+        requests
+        """
+        if not self._job_pool:
+            self._job_pool = ProcessPoolExecutor(
+                max_workers=self.__job_workers)
+        return self._job_pool
+
     def shutdown_pool(self):
         if self._pool:
             self._pool.shutdown()
+        if self._job_pool:
+            self._job_pool.shutdown()
+
+    def stop(self):
+        if self._pyramid_updater:
+            self._pyramid_updater.stop()
+        if self._counter_updater:
+            self._counter_updater.stop()
+        super(HurrayServer, self).stop()
+
+    def busy(self):
+        """
+        True while callbacks or timeouts are scheduled on the IOLoop (used to
+        delay the shutdown)
+        """
+        io_loop = IOLoop.current()
+        return bool(io_loop._callbacks or io_loop._timeouts)
+
+    def streamed(self, msg):
+        """
+        True if a request asks for a listing sent as a sequence of pages
+        """
+        return msg.get(CMD_KW_CMD) in STREAM_COMMANDS and \
+            msg.get(CMD_KW_ARGS, {}).get(CMD_KW_STREAM)
+
+    def submit(self, msg):
+        """
+        Submit a request to the worker pool. Returns a future.
+        """
+        if msg.get(CMD_KW_CMD) in (CMD_BROADCAST_DATASET, CMD_APPEND_DATASET):
+            args = msg.get(CMD_KW_ARGS, {})
+            self._written.add((args.get(CMD_KW_DB), args.get(CMD_KW_PATH)))
+        return self.execute(handle_request, msg)
+
+    def execute(self, fn, *args):
+        """
+        Run ``fn(*args)`` in the worker pool. Returns a future.
+        """
+        metrics.submitted()
+        future = self.pool.submit(fn, *args)
+        future.add_done_callback(metrics.completed)
+        return future
+
+    def start_pyramid_updates(self, interval):
+        """
+        Periodically update the pyramids of datasets written by this process
+        """
+        self._pyramid_updater = PeriodicCallback(self.update_pyramids,
+                                                 interval * 1000)
+        self._pyramid_updater.start()
+
+    def start_counter_updates(self, interval):
+        """
+        Periodically publish the counters of this process
+        """
+        self.publish_counters()
+        self._counter_updater = PeriodicCallback(self.publish_counters,
+                                                 interval * 1000)
+        self._counter_updater.start()
+
+    def publish_counters(self):
+        PROCESSES.update(process.task_id() or 0, os.getpid(),
+                         self.connections, self.open_connections,
+                         self.requests)
+
+    def server_info(self):
+        """
+        Report the counters of all server processes (and which process
+        answered).
+        """
+        self.publish_counters()
+        return response(OK, {
+            RESPONSE_TASK: process.task_id() or 0,
+            RESPONSE_PROCESSES: PROCESSES.get(),
+            RESPONSE_REPLICATION: REPLICA.get(),
+        })
+
+    @gen.coroutine
+    def wait_replica(self, seq):
+        """
+        Wait until a replica has applied change ``seq`` of the primary (see
+        hurray.replication)
+
+        Returns:
+            None or a REPLICA_LAG response if the replica did not catch up
+            within --replica_wait seconds
+        """
+        deadline = time.time() + options.replica_wait
+        while True:
+            state = REPLICA.get()
+            if state is not None and state[REPLICA_SEQ] is not None and \
+                    state[REPLICA_SEQ] >= seq:
+                return None
+            if time.time() >= deadline:
+                return response(REPLICA_LAG, state)
+            yield gen.sleep(REPLICA_POLL_INTERVAL)
+
+    @gen.coroutine
+    def update_pyramids(self):
+        """
+        Submit one (batched) pyramid update per dataset written since the
+        last call. Writes only mark the affected tiles, so the work is done
+        here, outside of the write requests.
+        """
+        if self._updating or not self._written:
+            return
+        written, self._written = self._written, set()
+        self._updating = True
+        try:
+            yield [self.execute(handle_request, {
+                CMD_KW_CMD: CMD_UPDATE_PYRAMID,
+                CMD_KW_ARGS: {CMD_KW_DB: db, CMD_KW_PATH: path},
+            }) for db, path in written]
+        except Exception:
+            app_log.exception('Error while updating pyramids')
+        finally:
+            self._updating = False
+
+    @gen.coroutine
+    def gather(self, msg):
+        """
+        Fan a gather request out to the worker pool (one task per database)
+        and merge the partial results.
+        """
+        args = msg.get(CMD_KW_ARGS, {})
+        status, parts = split_gather(args)
+        if status != OK:
+            return response(status)
+        encoding = encoding_kwargs(args)
+        results = yield [self.execute(gather_partial, db, selections,
+                                      encoding)
+                         for db, selections in parts]
+        return merge_gather(args, results)
+
+    @gen.coroutine
+    def dispatch(self, msg, buffers):
+        """
+        Process a request message.
+
+        Args:
+            msg: unpacked request
+            buffers: AppendBuffer of the connection
+
+        Returns:
+            msgpacked response
+        """
+        cmd = msg.get(CMD_KW_CMD)
+        args = msg.get(CMD_KW_ARGS, {})
+        if cmd == CMD_APPEND_DATASET and args.get(CMD_KW_BUFFER, False) and \
+                not options.primary:  # replicas reject the append
+            resp = yield buffers.append(msg)
+            return resp
+
+        if cmd == CMD_SERVER_INFO:
+            return self.server_info()
+
+        if options.primary and args.get(CMD_KW_MIN_SEQ) is not None:
+            resp = yield self.wait_replica(args[CMD_KW_MIN_SEQ])
+            if resp is not None:
+                return resp
+
+        # make sure that requests see the buffered appends of the connection
+        yield buffers.flush_all()
+
+        if cmd == CMD_GATHER:
+            resp = yield self.gather(msg)
+        else:
+            resp = yield self.submit(msg)
+        if cmd == CMD_REPACK:
+            # the request only registers the job
+            result = msgpack.unpackb(resp, object_hook=decode,
+                                     encoding='utf-8')
+            if result[CMD_KW_STATUS] == ACCEPTED:
+                job_id = result[RESPONSE_DATA][RESPONSE_JOB]
+                self.job_pool.submit(run_job, job_id)
+        return resp
+
+    @gen.coroutine
+    def stream_pages(self, msg, buffers, stream):
+        """
+        Answer a listing request (get_keys, get_tree) with one response per
+        page, so that huge listings are never built in one piece. The
+        cursor of the last response is None. The next page is read while
+        the previous one is sent.
+
+        Returns:
+            tuple (number of bytes sent, status of the last response)
+        """
+        args = dict(msg.get(CMD_KW_ARGS, {}))
+        del args[CMD_KW_STREAM]
+        args.setdefault(CMD_KW_LIMIT, STREAM_PAGE_SIZE)
+        msg = dict(msg)
+        msg[CMD_KW_ARGS] = args
+        sending = None
+        sent = 0
+        while True:
+            resp = yield self.dispatch(msg, buffers)
+            if sending is not None:
+                yield sending
+            sending = self.write_response(stream, resp)
+            sent += len(resp) + 2 * MSG_LEN
+            result = msgpack.unpackb(resp, object_hook=decode,
+                                     encoding='utf-8')
+            if result[CMD_KW_STATUS] != OK or \
+                    result[RESPONSE_DATA][RESPONSE_CURSOR] is None:
+                break
+            args[CMD_KW_CURSOR] = result[RESPONSE_DATA][RESPONSE_CURSOR]
+        yield sending
+        return sent, result[CMD_KW_STATUS]
+
+    def write_response(self, stream, resp):
+        """
+        Send a msgpacked response. Returns a future.
+        """
+        # Prefix each message with a 4-byte length (network byte order).
+        # The header and the response are sent without joining them.
+        header = struct.pack('>II', PROTOCOL_VER, len(resp))
+        app_log.debug("Sending: {} bytes ...".format(len(header) +
+                                                     len(resp)))
+        return stream.write_buffers([header, resp])
 
     @gen.coroutine
     def handle_stream(self, stream, address):
         stream.set_nodelay(True)
+        buffers = AppendBuffer(self.submit, options.append_flush_interval)
+        self.connections += 1
+        self.open_connections += 1
+        try:
+            yield self.serve(stream, address, buffers)
+        finally:
+            self.open_connections -= 1
+
+    @gen.coroutine
+    def serve(self, stream, address, buffers):
+        """
+        Read and answer the requests of a connection until it is closed.
+        """
         while True:
             try:
                 # read protocol version
@@ -102,31 +432,55 @@ class HurrayServer(TCPServer):
                 # Read message length (4 bytes) and unpack it into an integer
                 raw_msg_length = yield stream.read_bytes(MSG_LEN)
                 msg_length = struct.unpack('>I', raw_msg_length)[0]
+                received = time.monotonic()
 
                 app_log.debug("Handle request (Protocol: v%d, Msg size: %d)",
                               protocol_ver, msg_length)
 
-                data = yield stream.read_bytes(msg_length)
+                # The body is received straight into one buffer of the
+                # announced size instead of being joined from chunks.
+                data = yield stream.read_bytes_into(msg_length)
+                read = time.monotonic()
                 msg = msgpack.unpackb(data, object_hook=decode,
                                       use_list=False, encoding='utf-8')
+                self.requests += 1
+                cmd = msg.get(CMD_KW_CMD)
+                events = None
 
                 try:
-                    fut = self.pool.submit(handle_request, msg)
-                    response = yield fut
+                    if self.streamed(msg):
+                        sent, status = yield self.stream_pages(msg, buffers,
+                                                               stream)
+                        metrics.request(cmd, time.monotonic() - received,
+                                        msg_length + 2 * MSG_LEN, sent,
+                                        status)
+                        trace.finish(msg, received)
+                        continue
+                    if trace.traced(msg):
+                        events = trace.begin(msg, received, read,
+                                             time.monotonic())
+                    resp = yield self.dispatch(msg, buffers)
+                except StreamClosedError:
+                    raise
                 except Exception:
                     app_log.exception('Error in subprocess')
-                    response = msgpack.packb({
+                    resp = msgpack.packb({
                         'status': INTERNAL_SERVER_ERROR,
                     }, default=encode)
 
-                rsp = struct.pack('>I', PROTOCOL_VER)
-                # Prefix each message with a 4-byte length (network byte order)
-                rsp += struct.pack('>I', len(response))
-                rsp += response
-                app_log.debug("Sending: {} bytes ...".format(len(rsp)))
-                yield stream.write(rsp)
+                returned = time.monotonic()
+                yield self.write_response(stream, resp)
+                if metrics.enabled():
+                    metrics.request(cmd, time.monotonic() - received,
+                                    msg_length + 2 * MSG_LEN,
+                                    len(resp) + 2 * MSG_LEN,
+                                    metrics.response_status(resp))
+                if events is not None:
+                    events = trace.merge(resp, events, returned)
+                trace.finish(msg, received, events, returned)
             except StreamClosedError:
                 app_log.debug("Lost client at host %s", address)
+                yield buffers.flush_all()
                 break
             except Exception:
                 app_log.exception('Error while handling client connection')
@@ -138,7 +492,7 @@ def sig_handler(server, sig, frame):
 
     def stop_loop(deadline):
         now = time.time()
-        if now < deadline and (io_loop._callbacks or io_loop._timeouts):
+        if now < deadline and server.busy():
             io_loop.add_timeout(now + 1, stop_loop, deadline)
         else:
             io_loop.stop()
@@ -162,20 +516,80 @@ def main():
             "In order to specify a config file use "
             "'hurray --config=/path/to/hurray.conf'")
 
-    # check if base directory exists and is writable (TODO)
-    absbase = os.path.abspath(os.path.expanduser(options.base))
-    if not os.access(absbase, os.W_OK):
-        app_log.error("base directory {} does not exist or is not writable!"
-                      .format(absbase))
+    if options.mode not in (MODE_SERVER, MODE_PROXY):
+        app_log.error('Unknown mode %s', options.mode)
         sys.exit(1)
 
-    SWMR_SYNC.set_strategy(options.locking)
+    server = None
+    if options.mode == MODE_PROXY:
+        # the proxy does not store databases itself
+        from hurray.proxy import ProxyServer, parse_routes
+        try:
+            proxy = ProxyServer(options.nodes, parse_routes(options.routes),
+                                options.node_connections)
+        except ValueError as e:
+            app_log.error("Invalid proxy configuration: %s", e)
+            sys.exit(1)
+    else:
+        # check if base directory exists and is writable (TODO)
+        absbase = os.path.abspath(os.path.expanduser(options.base))
+        if not os.access(absbase, os.W_OK):
+            app_log.error("base directory {} does not exist or is not "
+                          "writable!".format(absbase))
+            sys.exit(1)
+
+        SWMR_SYNC.set_strategy(options.locking)
+        # scan the base directory in the background
+        open_catalog()
+
+        if options.primary:
+            if options.changelog:
+                app_log.error("A replica can't log changes (--changelog)")
+                sys.exit(1)
+            from hurray.replication import Replicator
+            try:
+                replicator = Replicator(options.primary, absbase)
+            except ValueError as e:
+                app_log.error("Invalid primary: %s", e)
+                sys.exit(1)
+            replicator.start()
+            app_log.info("Replicating %s", options.primary)
+        elif options.changelog > 0:
+            # before forking, so that all processes log their writes
+            replication.enable(options.changelog)
+
+        trace.configure()
+
+        if options.metrics_port or options.metrics_socket:
+            # shared by all (forked) processes
+            metrics.enable(options.locking)
+            try:
+                metrics.start_exporter(options.metrics_port, 'localhost',
+                                       options.metrics_socket)
+            except OSError as e:
+                app_log.error("Can't serve metrics: %s", e)
+                sys.exit(1)
 
-    server = HurrayServer(workers=options.workers)
+        server = HurrayServer(workers=options.workers,
+                              job_workers=options.job_workers)
 
     sockets = []
-
-    if options.port != 0:
+    reuse_port = options.reuse_port and options.port != 0
+
+    if reuse_port:
+        # The sockets are bound by every forked process (see below). Bind
+        # once here to fail early (SO_REUSEPORT unsupported, address in use)
+        try:
+            for sock in bind_sockets(options.port, options.host,
+                                     reuse_port=True):
+                sock.close()
+        except (ValueError, socket.error) as e:
+            app_log.error("Can't listen on %s:%d: %s", options.host,
+                          options.port, e)
+            sys.exit(1)
+        app_log.info("Listening on %s:%d (SO_REUSEPORT)", options.host,
+                     options.port)
+    elif options.port != 0:
         sockets = bind_sockets(options.port, options.host)
         app_log.info("Listening on %s:%d", options.host, options.port)
 
@@ -184,25 +598,51 @@ def main():
         app_log.info("Listening on {}".format(socket_file))
         sockets.append(bind_unix_socket(socket_file))
 
-    if len(sockets) < 1:
+    if len(sockets) < 1 and not reuse_port:
         app_log.error('Define a socket and/or a port > 0')
         return
 
-    signal.signal(signal.SIGTERM, partial(sig_handler, server))
-    signal.signal(signal.SIGINT, partial(sig_handler, server))
+    if server is None:
+        # the proxy runs on asyncio
+        from hurray.server.platform.asyncio import AsyncIOLoop
+        IOLoop.configure(AsyncIOLoop)
+        acceptor = proxy
+    elif options.loop == LOOP_ASYNCIO:
+        # the IOLoop of each (forked) process runs on an asyncio event loop
+        # and the connections are served by native coroutines
+        from hurray.aioserver import AsyncioFrontend
+        from hurray.server.platform.asyncio import AsyncIOLoop
+        IOLoop.configure(AsyncIOLoop)
+        acceptor = AsyncioFrontend(server, options.append_flush_interval)
+    elif options.loop == LOOP_IOLOOP:
+        acceptor = server
+    else:
+        app_log.error('Unknown event loop %s', options.loop)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, partial(sig_handler, acceptor))
+    signal.signal(signal.SIGINT, partial(sig_handler, acceptor))
 
     # Note that it does not make much sense to start >1 (master) processes
     # because they implement an async event loop that creates worker processes
     # itself.
-    server.start(options.processes)
+    acceptor.start(options.processes)
 
     # deregister the multiprocessing exit handler for the forked children.
-    # Otherwise they try to join the shared (parent) process manager
-    # SWMRSyncManager.
+    # Otherwise they try to join the shared (parent) process managers
+    # (SWMRSyncManager, CatalogManager).
     import atexit
     atexit.unregister(_exit_function)
 
-    server.add_sockets(sockets)
+    if reuse_port:
+        # each process has its own accept queue
+        sockets += bind_sockets(options.port, options.host, reuse_port=True)
+
+    acceptor.add_sockets(sockets)
+    if server is not None:
+        server.start_counter_updates(COUNTER_INTERVAL)
+        if options.pyramid_interval > 0:
+            server.start_pyramid_updates(options.pyramid_interval)
     IOLoop.current().start()
 
 
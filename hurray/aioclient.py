@@ -0,0 +1,257 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Asyncio version of hurray.client.
+
+    client = AsyncClient('localhost', 2222)
+    data = await client.call(CMD_SLICE_DATASET, {...})
+    async for page in client.stream(CMD_GET_KEYS, {...}):
+        ...
+    client.close()
+
+Requests made in the same iteration of the event loop are written to the
+transport together.
+"""
+
+import asyncio
+import collections
+import socket
+
+from hurray.client import (DEFAULT_PORT, HurrayError, pack_request,
+                           unpack_message, result, last_page)
+from hurray.frames import FrameReader
+from hurray.protocol import CMD_KW_STREAM
+
+
+class _Request(object):
+    """
+    A request waiting for its response(s). Requests passed to
+    AsyncConnection.send implement ``feed`` and ``fail``.
+    """
+    __slots__ = ('future', 'pages')
+
+    def __init__(self, loop, streamed=False):
+        self.future = loop.create_future()
+        self.pages = asyncio.Queue() if streamed else None
+
+    def feed(self, frame):
+        """
+        Process a response message
+
+        Returns:
+            True if this was the last response to the request
+        """
+        resp = unpack_message(frame)
+        if self.pages is not None:
+            self.pages.put_nowait(resp)
+            return last_page(resp)
+        if not self.future.done():
+            try:
+                self.future.set_result(result(resp))
+            except HurrayError as e:
+                self.future.set_exception(e)
+        return True
+
+    def fail(self, exc):
+        if self.pages is not None:
+            self.pages.put_nowait(exc)
+        elif not self.future.done():
+            self.future.set_exception(exc)
+
+
+class AsyncConnection(asyncio.BufferedProtocol):
+    """
+    A pipelined connection
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._reader = FrameReader()
+        self._transport = None
+        self._pending = collections.deque()
+        self._outgoing = []
+        self._closed = None
+
+    @classmethod
+    async def connect(cls, host='localhost', port=DEFAULT_PORT,
+                      unix_socket=None):
+        loop = asyncio.get_running_loop()
+        if unix_socket is not None:
+            _, conn = await loop.create_unix_connection(
+                lambda: cls(loop), unix_socket)
+        else:
+            _, conn = await loop.create_connection(lambda: cls(loop), host,
+                                                   port)
+        return conn
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    @property
+    def closed(self):
+        return self._closed is not None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def get_buffer(self, sizehint):
+        return self._reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        for frame in self._reader.buffer_updated(nbytes):
+            if self._pending[0].feed(frame):
+                self._pending.popleft()
+
+    def connection_lost(self, exc):
+        self._fail(ConnectionError(exc or 'connection closed'))
+
+    def _fail(self, exc):
+        if self._closed is None:
+            self._closed = exc
+        while self._pending:
+            self._pending.popleft().fail(self._closed)
+
+    def send(self, buffers, request):
+        """
+        Queue the buffers of a request (sent with the requests of the same
+        loop iteration). ``request`` receives the response messages.
+        """
+        if self._closed is not None:
+            raise self._closed
+        self._pending.append(request)
+        if not self._outgoing:
+            self._loop.call_soon(self._flush)
+        self._outgoing.extend(buffers)
+
+    def _flush(self):
+        buffers, self._outgoing = self._outgoing, []
+        if self._closed is None:
+            self._transport.writelines(buffers)
+
+    def submit(self, cmd, args=None, data=None):
+        """
+        Returns:
+            asyncio future of the response data
+        """
+        request = _Request(self._loop)
+        self.send(pack_request(cmd, args, data), request)
+        return request.future
+
+    async def stream(self, cmd, args=None):
+        """
+        Async iterator over the pages of a listing
+        """
+        args = dict(args or {})
+        args[CMD_KW_STREAM] = True
+        request = _Request(self._loop, streamed=True)
+        self.send(pack_request(cmd, args), request)
+        while True:
+            resp = await request.pages.get()
+            if isinstance(resp, Exception):
+                raise resp
+            yield result(resp)
+            if last_page(resp):
+                return
+
+    def close(self):
+        self._fail(ConnectionError('connection closed'))
+        if self._transport is not None:
+            self._transport.close()
+
+
+class AsyncClient(object):
+    """
+    Client with a pool of pipelined connections (see hurray.client.Client)
+    """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, unix_socket=None,
+                 connections=4):
+        self._address = dict(host=host, port=port, unix_socket=unix_socket)
+        self._size = connections
+        self._connections = []
+        self._connecting = None
+
+    async def connection(self):
+        """
+        Returns:
+            the connection with the fewest pending requests (opened if all
+            connections are busy and the pool is not full)
+        """
+        self._connections = [conn for conn in self._connections
+                             if not conn.closed]
+        conn = min(self._connections, key=lambda c: c.pending, default=None)
+        if conn is not None and (not conn.pending or
+                                 len(self._connections) >= self._size):
+            return conn
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(
+                AsyncConnection.connect(**self._address))
+        connecting = self._connecting
+        try:
+            conn = await connecting
+        finally:
+            if self._connecting is connecting:
+                self._connecting = None
+        if conn not in self._connections:
+            self._connections.append(conn)
+        return conn
+
+    async def submit(self, cmd, args=None, data=None):
+        """
+        Send a request without waiting for the response
+
+        Returns:
+            asyncio future of the response data
+        """
+        return (await self.connection()).submit(cmd, args, data)
+
+    async def call(self, cmd, args=None, data=None):
+        """
+        Send a request and wait for the response
+
+        Raises:
+            HurrayError if the server answers with an error status
+        """
+        return await (await self.submit(cmd, args, data))
+
+    async def stream(self, cmd, args=None):
+        conn = await self.connection()
+        async for page in conn.stream(cmd, args):
+            yield page
+
+    def close(self):
+        connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,331 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+asyncio front end of the server (``hurray --loop=asyncio``). Connections are
+accepted and served by native coroutines on an asyncio event loop instead
+of IOStreams and ``gen.coroutine``: request frames are received with the
+buffer protocol (large bodies straight into a buffer of their size) and
+requests are run in the worker pool of the HurrayServer. Less common
+requests (buffered appends, gathers, repacks, streamed listings, requests
+waiting for a replica) are
+delegated to the coroutines of the HurrayServer, which run on the same loop
+(see hurray.server.platform.asyncio).
+"""
+
+import asyncio
+import collections
+import socket
+import time
+
+import msgpack
+
+from hurray import metrics, trace
+from hurray.msgpack_ext import decode
+from hurray.frames import FrameReader, HEADER, MAX_MESSAGE_SIZE, header
+from hurray.protocol import (CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_BUFFER,
+                             CMD_KW_MIN_SEQ, CMD_APPEND_DATASET, CMD_GATHER,
+                             CMD_REPACK, CMD_SERVER_INFO)
+from hurray.append_buffer import AppendBuffer
+from hurray.request_handler import response
+from hurray.server.ioloop import IOLoop
+from hurray.server.iostream import StreamClosedError
+from hurray.server.log import app_log
+from hurray.server.platform.asyncio import to_asyncio_future, to_hurray_future
+from hurray.status_codes import INTERNAL_SERVER_ERROR
+
+# stop reading from a connection while this many requests are waiting
+MAX_PENDING_FRAMES = 16
+
+# requests handled by the coroutines of HurrayServer
+DELEGATED_COMMANDS = (CMD_GATHER, CMD_REPACK)
+
+
+class Connection(asyncio.BufferedProtocol):
+    """
+    Splits the received data into request messages (without the header)
+    and sends responses. ``write_buffers`` is compatible to IOStream, so a
+    connection can be passed to HurrayServer.write_response.
+    """
+
+    def __init__(self, frontend):
+        self._frontend = frontend
+        self._transport = None
+        self._reader = FrameReader(max_size=frontend.max_buffer_size)
+        self._frames = collections.deque()
+        self._waiter = None
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiters = []
+        self._closed = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._frontend.serve(self)
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._wakeup()
+        self._writing_paused = False
+        self._release_drain_waiters()
+
+    def get_buffer(self, sizehint):
+        return self._reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            frames = self._reader.buffer_updated(nbytes)
+        except ValueError as e:
+            # like IOStream when the maximum read buffer size is reached
+            app_log.error("Closing connection: %s", e)
+            self._transport.close()
+            return
+        for frame in frames:
+            self._push(frame)
+
+    def _push(self, frame):
+        self._frames.append(frame)
+        self._wakeup()
+        if len(self._frames) >= MAX_PENDING_FRAMES and \
+                not self._reading_paused:
+            self._reading_paused = True
+            self._transport.pause_reading()
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    async def read_frame(self):
+        """
+        Returns:
+            the next request message or None if the connection is closed
+        """
+        while not self._frames:
+            if self._closed:
+                return None
+            self._waiter = asyncio.get_event_loop().create_future()
+            await self._waiter
+        frame = self._frames.popleft()
+        if self._reading_paused and \
+                len(self._frames) < MAX_PENDING_FRAMES // 2:
+            self._reading_paused = False
+            self._transport.resume_reading()
+        return frame
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self._release_drain_waiters()
+
+    def _release_drain_waiters(self):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _drained(self):
+        waiter = asyncio.get_event_loop().create_future()
+        if self._writing_paused:
+            self._drain_waiters.append(waiter)
+        else:
+            waiter.set_result(None)
+        return waiter
+
+    async def drain(self):
+        """
+        Wait until the transport accepts more data
+        """
+        if self._writing_paused:
+            await self._drained()
+
+    def write(self, buffers):
+        """
+        Send a sequence of buffers
+        """
+        if self._closed:
+            raise StreamClosedError()
+        self._transport.writelines(buffers)
+
+    def write_buffers(self, buffers):
+        """
+        Send a sequence of buffers. Returns a (hurray) future that resolves
+        when the transport accepts more data.
+        """
+        self.write(buffers)
+        return to_hurray_future(self._drained())
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+class AsyncioFrontend(object):
+    """
+    Accepts and serves the connections of a HurrayServer on the asyncio
+    event loop of an AsyncIOLoop. Provides the methods main() uses to run a
+    HurrayServer (start, add_sockets, stop, busy, shutdown_pool).
+    """
+
+    def __init__(self, server, flush_interval=None):
+        """
+        Args:
+            server: HurrayServer (worker pools, request coroutines, counters)
+            flush_interval: see AppendBuffer
+        """
+        self.server = server
+        # largest request message accepted (like the limit of IOStream)
+        self.max_buffer_size = server.max_buffer_size or MAX_MESSAGE_SIZE
+        self._flush_interval = flush_interval
+        self._servers = []
+        self._tasks = set()
+        self._active = 0  # requests in progress
+
+    def start(self, num_processes=1):
+        """
+        Fork (see TCPServer.start). The current IOLoop must be an
+        AsyncIOLoop.
+        """
+        self.server.start(num_processes)
+
+    def add_sockets(self, sockets):
+        loop = IOLoop.current().asyncio_loop
+        for sock in sockets:
+            self._servers.append(loop.run_until_complete(
+                loop.create_server(lambda: Connection(self), sock=sock)))
+
+    def stop(self):
+        """
+        Stop accepting connections (open connections are still served)
+        """
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        self.server.stop()
+
+    def busy(self):
+        return self._active > 0
+
+    def shutdown_pool(self):
+        self.server.shutdown_pool()
+
+    def serve(self, conn):
+        task = asyncio.get_event_loop().create_task(
+            self.handle_connection(conn))
+        # the loop only keeps a weak reference to the task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def handle_connection(self, conn):
+        server = self.server
+        buffers = AppendBuffer(server.submit, self._flush_interval)
+        server.connections += 1
+        server.open_connections += 1
+        try:
+            while True:
+                data = await conn.read_frame()
+                if data is None:
+                    break
+                self._active += 1
+                try:
+                    await self.handle_message(conn, data, buffers)
+                finally:
+                    self._active -= 1
+        except StreamClosedError:
+            pass
+        except Exception:
+            app_log.exception('Error while handling client connection')
+            conn.close()
+        finally:
+            server.open_connections -= 1
+            app_log.debug("Lost client")
+            try:
+                await to_asyncio_future(buffers.flush_all())
+            except Exception:
+                app_log.exception('Error while flushing appends')
+
+    async def handle_message(self, conn, data, buffers):
+        server = self.server
+        # frames are split off the socket buffer before they are handled,
+        # so the read phase is not timed here
+        received = read = time.monotonic()
+        msg = msgpack.unpackb(data, object_hook=decode, use_list=False,
+                              encoding='utf-8')
+        server.requests += 1
+        cmd = msg.get(CMD_KW_CMD)
+        events = None
+        try:
+            if server.streamed(msg):
+                sent, status = await to_asyncio_future(
+                    server.stream_pages(msg, buffers, conn))
+                metrics.request(cmd, time.monotonic() - received,
+                                len(data) + HEADER.size, sent, status)
+                trace.finish(msg, received)
+                return
+            if trace.traced(msg):
+                events = trace.begin(msg, received, read, time.monotonic())
+            resp = await self.dispatch(msg, buffers)
+        except StreamClosedError:
+            raise
+        except Exception:
+            app_log.exception('Error in subprocess')
+            resp = response(INTERNAL_SERVER_ERROR)
+        returned = time.monotonic()
+        conn.write([header(len(resp)), resp])
+        await conn.drain()
+        if metrics.enabled():
+            metrics.request(cmd, time.monotonic() - received,
+                            len(data) + HEADER.size, len(resp) + HEADER.size,
+                            metrics.response_status(resp))
+        if events is not None:
+            events = trace.merge(resp, events, returned)
+        trace.finish(msg, received, events, returned)
+
+    async def dispatch(self, msg, buffers):
+        """
+        Process a request message (see HurrayServer.dispatch)
+
+        Returns:
+            msgpacked response
+        """
+        server = self.server
+        cmd = msg.get(CMD_KW_CMD)
+        args = msg.get(CMD_KW_ARGS, {})
+        if cmd in DELEGATED_COMMANDS or \
+                args.get(CMD_KW_MIN_SEQ) is not None or (
+                    cmd == CMD_APPEND_DATASET and
+                    args.get(CMD_KW_BUFFER, False)):
+            return await to_asyncio_future(server.dispatch(msg, buffers))
+        if cmd == CMD_SERVER_INFO:
+            return server.server_info()
+        # make sure that requests see the buffered appends of the connection
+        if buffers.pending():
+            await to_asyncio_future(buffers.flush_all())
+        return await asyncio.wrap_future(server.submit(msg))
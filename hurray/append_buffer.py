@@ -0,0 +1,271 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Per-connection buffering of append requests. Appends with the ``buffer``
+flag are kept in memory (in the event loop process) until a full chunk along
+the append axis is available, so that chunks are written once instead of
+being rewritten for every small append. Buffered data becomes visible to
+readers when it is flushed, i.e., when a chunk is complete, when the
+connection sends any other request or is closed, or after
+``append_flush_interval`` seconds.
+
+Buffered appends are acknowledged before they are written. If writing them
+fails later (e.g., because the dataset has been deleted), the buffered data
+is lost; the failure is remembered and returned instead of the response to
+the next buffered append to the same dataset. Appends that are still
+buffered when the server stops are lost as well.
+"""
+
+import msgpack
+import numpy as np
+
+from hurray.msgpack_ext import decode
+from hurray.protocol import (CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DATA, CMD_KW_DB,
+                             CMD_KW_PATH, CMD_KW_AXIS, CMD_KW_STATUS,
+                             CMD_APPEND_DATASET, RESPONSE_NODE_SHAPE,
+                             RESPONSE_LENGTH,
+                             RESPONSE_CHUNK_LENGTH, RESPONSE_PENDING)
+from hurray.request_handler import response
+from hurray.server import gen
+from hurray.server.ioloop import IOLoop
+from hurray.server.log import app_log
+from hurray.status_codes import (OK, INCOMPATIBLE_DATA, MISSING_DATA,
+                                 INTERNAL_SERVER_ERROR)
+
+
+class _Pending(object):
+    """
+    Buffered appends for one dataset
+    """
+
+    def __init__(self, length, chunk_length, row_shape):
+        self.length = length  # logical length of the dataset on disk
+        self.chunk_length = chunk_length
+        self.row_shape = row_shape
+        self.arrays = []
+        self.rows = 0
+        self.timeout = None
+        self.inflight = None  # future of the last flush
+
+
+class AppendBuffer(object):
+    """
+    Buffers appends of a single connection.
+    """
+
+    def __init__(self, submit, flush_interval=None):
+        """
+        Args:
+            submit: function submitting a request message to the worker pool
+                and returning a future of the (msgpacked) response
+            flush_interval: flush buffered data after this many seconds
+                (None: only flush full chunks)
+        """
+        self._submit = submit
+        self._flush_interval = flush_interval
+        self._buffers = {}
+        self._failures = {}  # unreported failed writes of buffered appends
+
+    @gen.coroutine
+    def append(self, msg):
+        """
+        Handle an append request with the ``buffer`` flag.
+
+        Returns:
+            msgpacked response
+        """
+        args = msg.get(CMD_KW_ARGS, {})
+        data = msg.get(CMD_KW_DATA, None)
+        if data is None:
+            return response(MISSING_DATA)
+        key = (args.get(CMD_KW_DB), args.get(CMD_KW_PATH),
+               args.get(CMD_KW_AXIS, 0))
+        failure = self._failures.pop(key, None)
+        if failure is not None:
+            return self._failed(failure)
+        pending = self._buffers.get(key, None)
+
+        if pending is None:
+            # the first append is written directly; its response tells us
+            # the chunk size
+            resp = yield self._submit(msg)
+            result = msgpack.unpackb(resp, object_hook=decode,
+                                     use_list=False, encoding='utf-8')
+            if result[CMD_KW_STATUS] == OK:
+                info = result[CMD_KW_DATA]
+                shape = info[RESPONSE_NODE_SHAPE]
+                axis = key[2] % len(shape)
+                row_shape = shape[:axis] + shape[axis + 1:]
+                self._buffers[key] = _Pending(info[RESPONSE_LENGTH],
+                                              info[RESPONSE_CHUNK_LENGTH],
+                                              row_shape)
+            return resp
+
+        data = np.asarray(data)
+        axis = key[2] % (len(pending.row_shape) + 1)
+        if data.ndim == len(pending.row_shape):
+            data = np.expand_dims(data, axis)
+        if data.shape[:axis] + data.shape[axis + 1:] != pending.row_shape:
+            return response(INCOMPATIBLE_DATA,
+                            "cannot append data of shape {}"
+                            .format(data.shape))
+
+        pending.arrays.append(data)
+        pending.rows += data.shape[axis]
+        to_boundary = (pending.chunk_length -
+                       pending.length % pending.chunk_length)
+        if pending.rows >= to_boundary:
+            # write up to the last complete chunk, keep the rest buffered
+            complete = to_boundary + ((pending.rows - to_boundary) //
+                                      pending.chunk_length *
+                                      pending.chunk_length)
+            result = yield self.flush(key, complete)
+            if result[CMD_KW_STATUS] != OK:
+                return self._failed(result)
+        if pending.rows and pending.timeout is None and self._flush_interval:
+            pending.timeout = IOLoop.current().call_later(
+                self._flush_interval, self._flush_expired, key)
+
+        return response(OK, {
+            RESPONSE_LENGTH: pending.length + pending.rows,
+            RESPONSE_PENDING: pending.rows,
+        })
+
+    @gen.coroutine
+    def flush(self, key, rows=None):
+        """
+        Write the buffered data of a dataset. Flushes of the same dataset
+        are serialized, i.e., data is appended in the order it was received.
+
+        Args:
+            key: (db, path, axis)
+            rows: only write this many rows and keep the rest buffered
+                (default: all)
+
+        Returns:
+            the (unpacked) response of the last flush, or of an earlier
+            failed flush that has not been reported yet
+        """
+        result = yield self._flush(key, rows)
+        failure = self._failures.pop(key, None)
+        return result if failure is None else failure
+
+    @gen.coroutine
+    def _flush(self, key, rows=None):
+        pending = self._buffers.get(key, None)
+        if pending is None:
+            return {CMD_KW_STATUS: OK}
+        if pending.timeout is not None:
+            IOLoop.current().remove_timeout(pending.timeout)
+            pending.timeout = None
+        if not pending.arrays:
+            if pending.inflight is None:
+                return {CMD_KW_STATUS: OK}
+            result = yield pending.inflight
+            return result
+
+        data = np.concatenate(pending.arrays, axis=key[2])
+        pending.arrays = []
+        pending.rows = 0
+        if rows is not None and rows < data.shape[key[2]]:
+            data, rest = np.split(data, [rows], axis=key[2])
+            pending.arrays = [rest]
+            pending.rows = rest.shape[key[2]]
+        pending.inflight = self._write(key, pending, data, pending.inflight)
+        result = yield pending.inflight
+        return result
+
+    def pending(self):
+        """
+        Returns:
+            True if data is buffered or still being written, i.e., if
+            ``flush_all`` has anything to wait for
+        """
+        return any(p.arrays or (p.inflight is not None and
+                                not p.inflight.done())
+                   for p in self._buffers.values())
+
+    @gen.coroutine
+    def flush_all(self):
+        """
+        Write the buffered data of all datasets (failures are reported by
+        the next buffered append to the dataset)
+        """
+        for key in list(self._buffers.keys()):
+            yield self._flush(key)
+
+    @gen.coroutine
+    def _write(self, key, pending, data, previous):
+        if previous is not None:
+            try:
+                yield previous
+            except Exception:
+                app_log.exception('Error while flushing appends')
+        db, path, axis = key
+        try:
+            resp = yield self._submit({
+                CMD_KW_CMD: CMD_APPEND_DATASET,
+                CMD_KW_ARGS: {
+                    CMD_KW_DB: db,
+                    CMD_KW_PATH: path,
+                    CMD_KW_AXIS: axis,
+                },
+                CMD_KW_DATA: data,
+            })
+            result = msgpack.unpackb(resp, object_hook=decode,
+                                     use_list=False, encoding='utf-8')
+        except Exception as e:
+            app_log.exception('Error while flushing appends')
+            result = {CMD_KW_STATUS: INTERNAL_SERVER_ERROR,
+                      CMD_KW_DATA: str(e)}
+        if result[CMD_KW_STATUS] == OK:
+            pending.length = result[CMD_KW_DATA][RESPONSE_LENGTH]
+        else:
+            # the data cannot be appended, e.g., because the dataset has
+            # been deleted in the meantime. Start over with the next append.
+            app_log.error("Failed to append buffered data to %s:%s (status "
+                          "%d)", db, path, result[CMD_KW_STATUS])
+            self._failures[key] = result
+            if self._buffers.get(key, None) is pending:
+                del self._buffers[key]
+        return result
+
+    def _failed(self, result):
+        """
+        Returns:
+            msgpacked response reporting the failed write of buffered data
+        """
+        message = result.get(CMD_KW_DATA, None)
+        return response(result[CMD_KW_STATUS],
+                        "buffered appends were not written{}".format(
+                            '' if message is None else
+                            ': {}'.format(message)))
+
+    def _flush_expired(self, key):
+        pending = self._buffers.get(key, None)
+        if pending is not None:
+            pending.timeout = None
+            IOLoop.current().add_future(self._flush(key),
+                                        lambda f: f.result())
@@ -0,0 +1,427 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Python client of the hurray server.
+
+``Client`` is thread-safe and keeps a pool of connections. Requests are
+pipelined, i.e., sent without waiting for the responses of earlier requests
+(which arrive in order), and requests issued concurrently (by several
+threads or with ``submit``) are sent together with a single system call.
+An asyncio version is in hurray.aioclient.
+
+    with Client('localhost', 2222) as client:
+        client.call(CMD_CREATE_DATABASE, {CMD_KW_DB: 'a.h5'})
+        futures = [client.submit(CMD_SLICE_DATASET, {...}) for ...]
+
+Responses are received into buffers of their size and arrays are decoded
+without copying their data, so arrays in results are read-only.
+
+This module does not depend on the server modules (importing hurray.swmr
+starts the lock manager process).
+"""
+
+import collections
+import concurrent.futures
+import queue
+import socket
+import threading
+from inspect import isclass
+
+import msgpack
+import numpy as np
+from numpy.lib.format import header_data_from_array_1_0
+
+from hurray.frames import FrameReader, header
+from hurray.protocol import (CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DATA,
+                             CMD_KW_STATUS, CMD_KW_STREAM, RESPONSE_DATA,
+                             RESPONSE_CURSOR, RESPONSE_SEQ)
+from hurray.status_codes import OK, UNKNOWN_COMMAND
+
+DEFAULT_PORT = 2222
+
+# maximum number of buffers per sendmsg() call
+SENDMSG_MAX_BUFFERS = 512
+
+
+class HurrayError(Exception):
+    """
+    The server answered a request with an error status
+    """
+
+    def __init__(self, status, data=None):
+        super(HurrayError, self).__init__(status, data)
+        self.status = status
+        self.data = data
+
+
+def encode(obj):
+    """
+    Encode numpy arrays and slices (see hurray.msgpack_ext)
+    """
+    if isinstance(obj, np.ndarray):
+        arr = header_data_from_array_1_0(obj)
+        if obj.flags.c_contiguous or obj.flags.f_contiguous:
+            # packed without an intermediate copy
+            arr['arraydata'] = memoryview(obj.reshape(-1, order='A'))\
+                .cast('B')
+        else:
+            arr['arraydata'] = obj.tobytes()
+        arr['__ndarray__'] = True
+        return arr
+    elif isinstance(obj, slice):
+        return {
+            '__slice__': (obj.start, obj.stop, obj.step)
+        }
+    elif isclass(obj) and issubclass(obj, np.number):
+        return obj().dtype.name
+    elif isinstance(obj, np.dtype):
+        return obj.name
+    elif isinstance(obj, np.number):
+        return obj.item()
+    return obj
+
+
+def decode(obj):
+    """
+    Decode numpy arrays and slices. Arrays share the memory of the unpacked
+    message (read-only).
+    """
+    if '__ndarray__' in obj:
+        arr = np.frombuffer(obj['arraydata'], dtype=np.dtype(obj['descr']))
+        shape = obj['shape']
+        if obj['fortran_order']:
+            return arr.reshape(shape[::-1]).transpose()
+        return arr.reshape(shape)
+    elif '__slice__' in obj:
+        return slice(*obj['__slice__'])
+    return obj
+
+
+def pack_request(cmd, args=None, data=None):
+    """
+    Returns:
+        list of buffers (header, message) of a request
+    """
+    msg = msgpack.packb({
+        CMD_KW_CMD: cmd,
+        CMD_KW_ARGS: args or {},
+        CMD_KW_DATA: data,
+    }, default=encode, use_bin_type=True)
+    return [header(len(msg)), msg]
+
+
+def unpack_message(frame):
+    return msgpack.unpackb(frame, object_hook=decode, use_list=False,
+                           raw=False)
+
+
+def result(resp):
+    """
+    Returns:
+        the data of a response
+
+    Raises:
+        HurrayError if the response has an error status
+    """
+    status = resp.get(CMD_KW_STATUS, UNKNOWN_COMMAND)
+    if status >= 200:
+        raise HurrayError(status, resp.get(RESPONSE_DATA))
+    return resp.get(RESPONSE_DATA)
+
+
+def last_page(resp):
+    """
+    True if ``resp`` is the last response to a streamed listing
+    """
+    return resp.get(CMD_KW_STATUS) != OK or \
+        resp[RESPONSE_DATA][RESPONSE_CURSOR] is None
+
+
+class _Request(object):
+    """
+    A request waiting for its response(s)
+    """
+    __slots__ = ('future', 'pages')
+
+    def __init__(self, streamed=False):
+        self.future = concurrent.futures.Future()
+        self.pages = queue.Queue() if streamed else None
+
+    def feed(self, resp):
+        """
+        Returns:
+            True if this was the last response to the request
+        """
+        if self.pages is not None:
+            self.pages.put(resp)
+            return last_page(resp)
+        try:
+            self.future.set_result(result(resp))
+        except HurrayError as e:
+            self.future.set_exception(e)
+        return True
+
+    def fail(self, exc):
+        if self.pages is not None:
+            self.pages.put(exc)
+        elif not self.future.done():
+            self.future.set_exception(exc)
+
+
+class Connection(object):
+    """
+    A pipelined connection (thread-safe). Responses are received by a
+    background thread.
+    """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, unix_socket=None):
+        """
+        Args:
+            host, port: address of the server
+            unix_socket: path of the server's Unix domain socket (instead of
+                host and port)
+        """
+        if unix_socket is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(unix_socket)
+        else:
+            self._sock = socket.create_connection((host, port))
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._outgoing = []
+        self._flushing = False
+        self._closed = None  # exception once the connection is closed
+        # sequence number of the last write (see last_seq)
+        self.last_seq = None
+        self._receiver = threading.Thread(target=self._receive,
+                                          name='hurray-client-receiver')
+        self._receiver.daemon = True
+        self._receiver.start()
+
+    @property
+    def pending(self):
+        """
+        Number of requests waiting for a response
+        """
+        return len(self._pending)
+
+    @property
+    def closed(self):
+        return self._closed is not None
+
+    def submit(self, cmd, args=None, data=None):
+        """
+        Send a request without waiting for the response
+
+        Returns:
+            concurrent.futures.Future of the response data (see ``result``)
+        """
+        request = _Request()
+        self._send(pack_request(cmd, args, data), request)
+        return request.future
+
+    def stream(self, cmd, args=None):
+        """
+        Request a listing (get_keys, get_tree) as a sequence of pages
+
+        Returns:
+            iterator over the data of the pages
+        """
+        args = dict(args or {})
+        args[CMD_KW_STREAM] = True
+        request = _Request(streamed=True)
+        self._send(pack_request(cmd, args), request)
+        while True:
+            resp = request.pages.get()
+            if isinstance(resp, Exception):
+                raise resp
+            yield result(resp)
+            if last_page(resp):
+                return
+
+    def _send(self, buffers, request):
+        with self._lock:
+            if self._closed is not None:
+                raise self._closed
+            self._pending.append(request)
+            self._outgoing.extend(buffers)
+            if self._flushing:
+                # sent by the thread that is already sending
+                return
+            self._flushing = True
+        while True:
+            with self._lock:
+                buffers, self._outgoing = self._outgoing, []
+                if not buffers:
+                    self._flushing = False
+                    return
+            try:
+                self._sendall(buffers)
+            except OSError as e:
+                with self._lock:
+                    self._flushing = False
+                self.close(ConnectionError(e))
+                raise self._closed
+
+    def _sendall(self, buffers):
+        # all queued requests with as few system calls as possible
+        buffers = [memoryview(buf).cast('B') for buf in buffers]
+        while buffers:
+            sent = self._sock.sendmsg(buffers[:SENDMSG_MAX_BUFFERS])
+            while sent:
+                if sent >= len(buffers[0]):
+                    sent -= len(buffers.pop(0))
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+            while buffers and not len(buffers[0]):
+                buffers.pop(0)
+
+    def _receive(self):
+        reader = FrameReader()
+        try:
+            while True:
+                n = self._sock.recv_into(reader.get_buffer())
+                if not n:
+                    raise ConnectionError('connection closed by the server')
+                for frame in reader.buffer_updated(n):
+                    resp = unpack_message(frame)
+                    seq = resp.get(RESPONSE_SEQ)
+                    if seq is not None and (self.last_seq is None or
+                                            seq > self.last_seq):
+                        self.last_seq = seq
+                    request = self._pending[0]
+                    if request.feed(resp):
+                        self._pending.popleft()
+        except Exception as e:
+            if not isinstance(e, ConnectionError):
+                e = ConnectionError(e)
+            self.close(e)
+
+    def close(self, exc=None):
+        """
+        Close the connection. Requests waiting for a response fail with
+        ``exc`` (a ConnectionError).
+        """
+        with self._lock:
+            if self._closed is not None:
+                return
+            self._closed = exc or ConnectionError('connection closed')
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        while self._pending:
+            self._pending.popleft().fail(self._closed)
+
+
+class Client(object):
+    """
+    Thread-safe client with a pool of pipelined connections. A request is
+    sent on the connection with the fewest pending requests; connections are
+    opened on demand.
+    """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, unix_socket=None,
+                 connections=4):
+        """
+        Args:
+            host, port, unix_socket: see Connection
+            connections: maximum number of connections
+        """
+        self._address = dict(host=host, port=port, unix_socket=unix_socket)
+        self._size = connections
+        self._connections = []
+        self._lock = threading.Lock()
+        self._last_seq = None  # of closed connections
+
+    @property
+    def last_seq(self):
+        """
+        Sequence number of the last write answered by a primary server
+        (None if no write was logged). Pass it as ``min_seq`` argument to
+        the read requests sent to a replica in order to read your own writes
+        (see hurray.replication).
+        """
+        with self._lock:
+            seqs = [conn.last_seq for conn in self._connections]
+            return max((seq for seq in seqs + [self._last_seq]
+                        if seq is not None), default=None)
+
+    def _connection(self):
+        with self._lock:
+            for conn in self._connections:
+                if conn.closed and conn.last_seq is not None:
+                    self._last_seq = max(self._last_seq or 0, conn.last_seq)
+            self._connections = [conn for conn in self._connections
+                                 if not conn.closed]
+            conn = min(self._connections, key=lambda c: c.pending,
+                       default=None)
+            if conn is None or (conn.pending and
+                                len(self._connections) < self._size):
+                conn = Connection(**self._address)
+                self._connections.append(conn)
+            return conn
+
+    def submit(self, cmd, args=None, data=None):
+        """
+        Send a request without waiting for the response
+
+        Returns:
+            concurrent.futures.Future of the response data
+        """
+        return self._connection().submit(cmd, args, data)
+
+    def call(self, cmd, args=None, data=None, timeout=None):
+        """
+        Send a request and wait for the response
+
+        Returns:
+            the response data
+
+        Raises:
+            HurrayError if the server answers with an error status
+        """
+        return self.submit(cmd, args, data).result(timeout)
+
+    def stream(self, cmd, args=None):
+        """
+        Iterate over the pages of a listing (see Connection.stream)
+        """
+        return self._connection().stream(cmd, args)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,135 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Framing of the wire protocol: every message (request or response) is
+prefixed with the protocol version and the length of the message (4 bytes
+each, network byte order).
+"""
+
+import struct
+
+from hurray.protocol import PROTOCOL_VER
+
+HEADER = struct.Struct('>II')
+
+# size of the receive buffer of a FrameReader. Larger messages are received
+# into a buffer of their own.
+READ_BUFFER_SIZE = 65536
+
+# largest message a server accepts by default (like the default
+# max_buffer_size of IOStream)
+MAX_MESSAGE_SIZE = 104857600
+
+
+def header(length):
+    """
+    Returns:
+        header of a message of ``length`` bytes
+    """
+    return HEADER.pack(PROTOCOL_VER, length)
+
+
+class FrameReader(object):
+    """
+    Splits a received byte stream into messages (without the header).
+
+    The data has to be received into the buffer returned by ``get_buffer``
+    (e.g., with ``socket.recv_into`` or as an asyncio.BufferedProtocol).
+    Small messages are collected in a fixed receive buffer; larger messages
+    are received directly into a buffer of their size, so they are never
+    copied or joined.
+    """
+
+    def __init__(self, buffer_size=READ_BUFFER_SIZE, max_size=None):
+        """
+        Args:
+            buffer_size: size of the receive buffer
+            max_size: maximum size of a message (None: unlimited)
+        """
+        self._buffer = bytearray(buffer_size)
+        self._max_size = max_size
+        self._start = 0  # first unparsed byte of _buffer
+        self._end = 0  # end of the data in _buffer
+        self._body = None  # buffer of a message larger than _buffer
+        self._body_pos = 0
+
+    def get_buffer(self):
+        """
+        Returns:
+            writable memoryview to receive the next data into
+        """
+        if self._body is not None:
+            return memoryview(self._body)[self._body_pos:]
+        return memoryview(self._buffer)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """
+        Process ``nbytes`` bytes received into the buffer of ``get_buffer``
+
+        Returns:
+            list of complete messages (bytes or bytearray)
+
+        Raises:
+            ValueError if a message is larger than ``max_size``
+        """
+        if self._body is not None:
+            self._body_pos += nbytes
+            if self._body_pos < len(self._body):
+                return []
+            body, self._body = self._body, None
+            return [body]
+        self._end += nbytes
+        return self._parse()
+
+    def _parse(self):
+        frames = []
+        buf = self._buffer
+        while self._end - self._start >= HEADER.size:
+            _, length = HEADER.unpack_from(buf, self._start)
+            if self._max_size is not None and length > self._max_size:
+                raise ValueError("message of {} bytes exceeds the maximum "
+                                 "size of {} bytes"
+                                 .format(length, self._max_size))
+            start = self._start + HEADER.size
+            available = self._end - start
+            if available >= length:
+                with memoryview(buf) as view:
+                    frames.append(bytes(view[start:start + length]))
+                self._start = start + length
+            elif length > len(buf) - HEADER.size:
+                # receive the rest of the message directly into its buffer
+                self._body = bytearray(length)
+                self._body[:available] = buf[start:self._end]
+                self._body_pos = available
+                self._start = self._end = 0
+                return frames
+            else:
+                break
+        # move an incomplete message to the front of the buffer
+        if self._start:
+            rest = self._end - self._start
+            buf[:rest] = buf[self._start:self._end]
+            self._start, self._end = 0, rest
+        return frames
@@ -0,0 +1,362 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Server metrics in the Prometheus text format (``hurray --metrics_port=N`` or
+``--metrics_socket=PATH``):
+
+* requests, latency histograms, and request and response bytes per command
+* responses per status code
+* requests waiting for or running in the worker pools (queue depth)
+* lock wait and hold times (read and write locks of the locking strategy)
+
+Metrics are kept in an anonymous shared memory region that is created
+before the server forks. Every process (event loop processes, pool workers)
+claims its own slot on its first record, so recording is a few additions to
+local memory, without locks or messages. The exporter process sums the
+slots of all processes when the metrics are scraped. If there are more
+processes than slots, the remaining processes share the last slot (and
+their counts may be slightly off).
+
+Recording is a no-op unless enable() was called.
+"""
+
+import bisect
+import http.server
+import mmap
+import multiprocessing
+import os
+import socketserver
+
+import msgpack
+import numpy as np
+
+from hurray import protocol, status_codes
+from hurray.protocol import CMD_KW_STATUS
+
+# upper bounds of the histogram buckets in seconds (plus +Inf)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# label of unknown commands
+OTHER = 'other'
+
+COMMANDS = tuple(sorted(
+    value for name, value in vars(protocol).items()
+    if name.startswith('CMD_') and not name.startswith('CMD_KW_'))) + (OTHER,)
+STATUSES = tuple(sorted(
+    value for name, value in vars(status_codes).items()
+    if name.isupper() and isinstance(value, int)))
+LOCK_KINDS = ('read', 'write')
+
+# number of slots (processes)
+SLOTS = 1024
+
+# slot layout (float64 values)
+_PID = 0
+_SUBMITTED = 1  # tasks submitted to the worker pools
+_COMPLETED = 2
+_HISTOGRAM = 2 + len(BUCKETS) + 1  # count, sum, buckets (the last is +Inf)
+_COMMAND = _HISTOGRAM + 2  # histogram, request bytes, response bytes
+_COMMANDS = 3
+_STATUSES = _COMMANDS + len(COMMANDS) * _COMMAND
+_LOCKS = _STATUSES + len(STATUSES)  # wait and hold histogram per kind
+SLOT_SIZE = _LOCKS + len(LOCK_KINDS) * 2 * _HISTOGRAM
+
+_COMMAND_INDEX = {cmd: _COMMANDS + i * _COMMAND
+                  for i, cmd in enumerate(COMMANDS)}
+_STATUS_INDEX = {status: _STATUSES + i for i, status in enumerate(STATUSES)}
+_LOCK_INDEX = {kind: _LOCKS + i * 2 * _HISTOGRAM
+               for i, kind in enumerate(LOCK_KINDS)}
+
+_memory = None  # shared memory of all slots
+_next = None  # next free slot (multiprocessing.Value)
+_strategy = None  # locking strategy (label of the lock metrics)
+_slot = None  # memoryview of the slot of this process
+
+
+def _reset_slot():
+    global _slot
+    _slot = None
+
+
+os.register_at_fork(after_in_child=_reset_slot)
+
+
+def enable(strategy, slots=SLOTS):
+    """
+    Allocate the shared memory (before forking)
+
+    Args:
+        strategy: locking strategy (see hurray.swmr.strategies)
+        slots: maximum number of processes
+    """
+    global _memory, _next, _strategy
+    # pages are only allocated once they are written
+    _memory = mmap.mmap(-1, slots * SLOT_SIZE * 8)
+    _next = multiprocessing.Value('i', 0)
+    _strategy = strategy
+    _reset_slot()
+
+
+def enabled():
+    return _memory is not None
+
+
+def _claim():
+    global _slot
+    slots = len(_memory) // (SLOT_SIZE * 8)
+    with _next.get_lock():
+        index = _next.value
+        if index < slots - 1:
+            _next.value = index + 1
+    offset = index * SLOT_SIZE * 8
+    _slot = memoryview(_memory)[offset:offset + SLOT_SIZE * 8].cast('d')
+    _slot[_PID] = os.getpid()
+    return _slot
+
+
+def _observe(slot, index, seconds):
+    slot[index] += 1
+    slot[index + 1] += seconds
+    slot[index + 2 + bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+def request(cmd, seconds, received, sent, status):
+    """
+    Record a request
+
+    Args:
+        cmd: command
+        seconds: time from receiving the request to sending the response
+        received: request size (bytes)
+        sent: response size (bytes)
+        status: status of the response (None: unknown)
+    """
+    if _memory is None:
+        return
+    slot = _slot or _claim()
+    index = _COMMAND_INDEX.get(cmd, _COMMAND_INDEX[OTHER])
+    _observe(slot, index, seconds)
+    slot[index + _HISTOGRAM] += received
+    slot[index + _HISTOGRAM + 1] += sent
+    if status in _STATUS_INDEX:
+        slot[_STATUS_INDEX[status]] += 1
+
+
+def submitted():
+    """
+    Record a task submitted to a worker pool
+    """
+    if _memory is None:
+        return
+    slot = _slot or _claim()
+    slot[_SUBMITTED] += 1
+
+
+def completed(future=None):
+    """
+    Record a completed task (can be used as done callback of the future)
+    """
+    if _memory is None:
+        return
+    slot = _slot or _claim()
+    slot[_COMPLETED] += 1
+
+
+def lock(kind, wait, hold):
+    """
+    Record the time spent waiting for and holding a lock
+
+    Args:
+        kind: 'read' or 'write'
+    """
+    if _memory is None:
+        return
+    slot = _slot or _claim()
+    index = _LOCK_INDEX[kind]
+    _observe(slot, index, wait)
+    _observe(slot, index + _HISTOGRAM, hold)
+
+
+_STATUS_KEY = msgpack.packb(CMD_KW_STATUS, use_bin_type=True)
+
+
+def response_status(resp):
+    """
+    Returns:
+        the status of a msgpacked response without unpacking it (None if
+        the status is not the first entry of the response map)
+    """
+    resp = memoryview(resp)
+    if not resp or resp[0] & 0xf0 != 0x80:  # fixmap
+        return None
+    pos = 1 + len(_STATUS_KEY)
+    if resp[1:pos] != _STATUS_KEY:
+        return None
+    value = resp[pos:pos + 3]
+    if value and value[0] < 0x80:  # positive fixint
+        return value[0]
+    if len(value) > 1 and value[0] == 0xcc:  # uint8
+        return value[1]
+    if len(value) > 2 and value[0] == 0xcd:  # uint16
+        return value[1] << 8 | value[2]
+    return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _histogram(lines, name, labels, values):
+    total = 0
+    for bound, count in zip(BUCKETS + (float('inf'),), values[2:]):
+        total += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, le, total))
+    lines.append('%s_sum{%s} %r' % (name, labels.rstrip(','), values[1]))
+    lines.append('%s_count{%s} %d' % (name, labels.rstrip(','), values[0]))
+
+
+def render():
+    """
+    Returns:
+        the metrics of all processes in the Prometheus text format
+    """
+    used = min(_next.value + 1, len(_memory) // (SLOT_SIZE * 8))
+    slots = np.frombuffer(_memory, dtype=np.float64,
+                          count=used * SLOT_SIZE).reshape(used, SLOT_SIZE)
+    totals = slots.sum(axis=0)
+    queued = sum(slot[_SUBMITTED] - slot[_COMPLETED] for slot in slots
+                 if slot[_PID] and _alive(int(slot[_PID])))
+
+    lines = []
+
+    def header(name, kind, text):
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+    commands = [(cmd, index) for cmd, index in _COMMAND_INDEX.items()
+                if totals[index]]
+    header('hurray_requests_total', 'counter', 'Requests per command')
+    for cmd, index in commands:
+        lines.append('hurray_requests_total{cmd="%s"} %d'
+                     % (cmd, totals[index]))
+    header('hurray_request_duration_seconds', 'histogram',
+           'Time from receiving a request to sending the response')
+    for cmd, index in commands:
+        _histogram(lines, 'hurray_request_duration_seconds',
+                   'cmd="%s",' % cmd, totals[index:index + _HISTOGRAM])
+    header('hurray_request_bytes_total', 'counter', 'Size of the requests')
+    for cmd, index in commands:
+        lines.append('hurray_request_bytes_total{cmd="%s"} %d'
+                     % (cmd, totals[index + _HISTOGRAM]))
+    header('hurray_response_bytes_total', 'counter', 'Size of the responses')
+    for cmd, index in commands:
+        lines.append('hurray_response_bytes_total{cmd="%s"} %d'
+                     % (cmd, totals[index + _HISTOGRAM + 1]))
+
+    header('hurray_responses_total', 'counter', 'Responses per status code')
+    for status, index in _STATUS_INDEX.items():
+        if totals[index]:
+            lines.append('hurray_responses_total{status="%d"} %d'
+                         % (status, totals[index]))
+
+    header('hurray_pool_tasks_total', 'counter',
+           'Tasks submitted to the worker pools')
+    lines.append('hurray_pool_tasks_total %d' % totals[_SUBMITTED])
+    header('hurray_pool_queue_depth', 'gauge',
+           'Tasks waiting in or run by the worker pools')
+    lines.append('hurray_pool_queue_depth %d' % max(0, queued))
+
+    for name, offset, text in (
+            ('hurray_lock_wait_seconds', 0, 'Time spent waiting for locks'),
+            ('hurray_lock_hold_seconds', _HISTOGRAM, 'Time locks are held')):
+        header(name, 'histogram', text)
+        for kind, index in _LOCK_INDEX.items():
+            index += offset
+            _histogram(lines, name,
+                       'strategy="%s",kind="%s",' % (_strategy, kind),
+                       totals[index:index + _HISTOGRAM])
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super(_UnixHTTPServer, self).get_request()
+        return request, ('', 0)
+
+
+def _serve(server):
+    parent = os.getppid()
+    server.timeout = 1.0
+    # exit with the server
+    while os.getppid() == parent:
+        server.handle_request()
+    server.server_close()
+
+
+def start_exporter(port=0, host='localhost', unix_socket=None):
+    """
+    Answer HTTP requests for the metrics on a TCP port and/or a Unix domain
+    socket (in a new process, which exits with the calling process)
+
+    Returns:
+        list of the exporter processes
+    """
+    servers = []
+    if port:
+        servers.append(http.server.HTTPServer((host, port), _Handler))
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        servers.append(_UnixHTTPServer(unix_socket, _Handler))
+    procs = []
+    for server in servers:
+        proc = multiprocessing.Process(target=_serve, args=(server,),
+                                       name='hurray-metrics')
+        proc.daemon = True
+        proc.start()
+        server.server_close()  # served by the child
+        procs.append(proc)
+    return procs
@@ -41,6 +41,7 @@ CMD_KW_COMPRESSION = 'compression'
 CMD_KW_COMPRESSION_OPTS = 'compression_opts'
 CMD_KW_CHUNKS = 'chunks'
 CMD_KW_FILLVALUE = 'fillvalue'
+CMD_KW_MAXSHAPE = 'maxshape'
 CMD_KW_REQUIRE_EXACT = 'exact'
 
 CMD_KW_KEY = 'key'
@@ -48,6 +49,53 @@ CMD_KW_DB = 'db'
 CMD_KW_DB_RENAMETO = 'db_new_name'
 CMD_KW_OVERWRITE = 'overwrite'
 CMD_KW_STATUS = 'status'
+CMD_KW_TARGETS = 'targets'
+CMD_KW_KEYS = 'keys'
+CMD_KW_STACK = 'stack'
+CMD_KW_SOURCES = 'sources'
+CMD_KW_DEST_DB = 'dest_db'
+CMD_KW_DEST_PATH = 'dest_path'
+CMD_KW_AXIS = 'axis'
+# buffered appends are acknowledged before they are written; if a write fails
+# later, the data is lost and the next buffered append to the dataset returns
+# the error (see hurray.append_buffer)
+CMD_KW_BUFFER = 'buffer'
+
+# encoding of read results (see hurray.quantize)
+CMD_KW_OUT_DTYPE = 'out_dtype'
+CMD_KW_KEEPBITS = 'keepbits'
+CMD_KW_PACK = 'pack'
+CMD_KW_SCALE_FACTOR = 'scale_factor'
+CMD_KW_ADD_OFFSET = 'add_offset'
+
+# multi-resolution pyramids
+CMD_KW_FACTOR = 'factor'
+CMD_KW_LEVELS = 'levels'
+CMD_KW_AXES = 'axes'
+CMD_KW_RESOLUTION = 'resolution'
+CMD_KW_JOB = 'job'
+
+# get_tree and get_keys
+CMD_KW_DEPTH = 'depth'
+CMD_KW_ATTRS = 'attrs'
+CMD_KW_LIMIT = 'limit'
+CMD_KW_CURSOR = 'cursor'
+CMD_KW_PREFIX = 'prefix'
+CMD_KW_STREAM = 'stream'
+
+# list_dbs
+CMD_KW_RECURSIVE = 'recursive'
+CMD_KW_SORT = 'sort'
+CMD_KW_REVERSE = 'reverse'
+CMD_KW_DATASETS = 'datasets'
+
+# replication
+CMD_KW_EPOCH = 'epoch'
+CMD_KW_SEQ = 'seq'
+CMD_KW_MIN_SEQ = 'min_seq'  # read-your-writes on a replica
+
+# per-request phase timing (see hurray.trace)
+CMD_KW_TRACE = 'trace'
 
 # commands
 CMD_CREATE_DATABASE = 'create_db'
@@ -66,12 +114,28 @@ CMD_GET_TREE = 'get_tree'
 CMD_GET_FILESIZE = 'get_filesize'
 CMD_SLICE_DATASET = 'slice_dataset'
 CMD_BROADCAST_DATASET = 'broadcast_dataset'
+CMD_GATHER = 'gather'
+CMD_COPY_DATASET = 'copy_dataset'
+CMD_CONCAT_DATASETS = 'concat_datasets'
+CMD_APPEND_DATASET = 'append_dataset'
+CMD_CREATE_PYRAMID = 'create_pyramid'
+CMD_DELETE_PYRAMID = 'delete_pyramid'
+CMD_UPDATE_PYRAMID = 'update_pyramid'
+CMD_CHUNK_ADVICE = 'chunk_advice'
+CMD_REPACK = 'repack'
+CMD_JOB_STATUS = 'job_status'
+CMD_READ_CHUNKS = 'read_chunks'
+CMD_SERVER_INFO = 'server_info'
+CMD_GET_CHANGES = 'get_changes'
 
 # attribute commands
 CMD_ATTRIBUTES_GET = 'attrs_getitem'
 CMD_ATTRIBUTES_SET = 'attrs_setitem'
 CMD_ATTRIBUTES_CONTAINS = 'attrs_contains'
 CMD_ATTRIBUTES_KEYS = 'attrs_keys'
+CMD_ATTRIBUTES_ITEMS = 'attrs_items'
+CMD_ATTRIBUTES_UPDATE = 'attrs_update'
+CMD_ATTRIBUTES_COLLECT = 'attrs_collect'
 
 # response keywords etc.
 RESPONSE_H5FILE = 'h5file'
@@ -84,6 +148,29 @@ RESPONSE_NODE_TREE = 'nodetree'
 RESPONSE_ATTRS_CONTAINS = 'contains'
 RESPONSE_ATTRS_KEYS = 'keys'
 RESPONSE_DATA = 'data'
+RESPONSE_LENGTH = 'length'
+RESPONSE_CHUNK_LENGTH = 'chunklength'
+RESPONSE_PENDING = 'pending'
+RESPONSE_ENCODING = 'encoding'
+RESPONSE_RESOLUTION = 'resolution'
+RESPONSE_JOB = 'job'
+RESPONSE_CURSOR = 'cursor'
+RESPONSE_DATABASES = 'dbs'
+RESPONSE_FILESIZE = 'filesize'
+RESPONSE_MTIME = 'mtime'
+RESPONSE_DATASETS = 'datasets'
+RESPONSE_TASK = 'task'
+RESPONSE_PROCESSES = 'processes'
+RESPONSE_NODES = 'nodes'
+RESPONSE_SEQ = 'seq'  # change log sequence number of a write
+RESPONSE_EPOCH = 'epoch'
+RESPONSE_HEAD = 'head'  # last change logged by the primary
+RESPONSE_CHANGES = 'changes'
+RESPONSE_IMAGE = 'image'
+RESPONSE_ITEMS = 'items'
+RESPONSE_DB = 'db'
+RESPONSE_REPLICATION = 'replication'
+RESPONSE_TRACE = 'trace'
 
 NODE_TYPE_FILE = 'file'
 NODE_TYPE_GROUP = 'group'
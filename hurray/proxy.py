@@ -0,0 +1,615 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Sharding proxy (``hurray --mode=proxy``). The proxy speaks the hurray
+protocol and distributes the databases across several hurray servers
+(nodes): each database name is mapped to a node by consistent hashing,
+optionally overridden by static routes (e.g., ``archive/*`` to a node with
+large disks). Requests are forwarded without re-encoding them over a pool
+of pipelined connections per node; the requests of a client connection
+always use the same connection to a node, so that, e.g., buffered appends
+behave as without the proxy.
+
+Requests that concern several databases are split by node (gather,
+list_dbs, server_info) and the responses are merged. Transfers and renames
+between databases on different nodes are not supported. Job ids are made
+unique across nodes (node index + job id * number of nodes).
+"""
+
+import asyncio
+import bisect
+import hashlib
+from fnmatch import fnmatchcase
+
+from hurray.aioclient import AsyncClient
+from hurray.aioserver import Connection, MAX_PENDING_FRAMES
+from hurray.client import pack_request, unpack_message, last_page
+from hurray.frames import MAX_MESSAGE_SIZE, header
+from hurray.protocol import (CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DB,
+                             CMD_KW_DB_RENAMETO, CMD_KW_STATUS,
+                             CMD_KW_STREAM, CMD_KW_TARGETS, CMD_KW_KEYS,
+                             CMD_KW_KEY, CMD_KW_STACK, CMD_KW_SOURCES,
+                             CMD_KW_DEST_DB, CMD_KW_JOB, CMD_KW_LIMIT,
+                             CMD_KW_CURSOR, CMD_KW_SORT, CMD_KW_REVERSE,
+                             CMD_RENAME_DATABASE, CMD_LIST_DATABASES,
+                             CMD_GATHER, CMD_COPY_DATASET,
+                             CMD_CONCAT_DATASETS, CMD_REPACK,
+                             CMD_JOB_STATUS, CMD_SERVER_INFO, RESPONSE_DATA,
+                             RESPONSE_ENCODING, RESPONSE_DATABASES,
+                             RESPONSE_CURSOR, RESPONSE_FILESIZE,
+                             RESPONSE_MTIME, RESPONSE_JOB, RESPONSE_NODES)
+from hurray.request_handler import (response, split_gather, merge_gather,
+                                    encoding_kwargs, PAGE_KWARGS)
+from hurray.server import process
+from hurray.server.ioloop import IOLoop
+from hurray.server.iostream import StreamClosedError
+from hurray.server.log import app_log
+from hurray.status_codes import (OK, ACCEPTED, FILE_NOT_FOUND,
+                                 INTERNAL_SERVER_ERROR,
+                                 INVALID_ARGUMENT, NOT_IMPLEMENTED,
+                                 NODE_UNAVAILABLE)
+from hurray.swmr.catalog import SORT_NAME, SORT_SIZE
+from hurray.swmr.jobs import JOB_ID
+from hurray.swmr.listing import encode_cursor, decode_cursor
+
+# points per node on the hash ring
+RING_REPLICAS = 64
+
+# default number of connections per node
+NODE_CONNECTIONS = 4
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8],
+                          'big')
+
+
+def parse_address(node):
+    """
+    Returns:
+        keyword arguments of AsyncClient for a node address (``host:port``
+        or the path of a Unix domain socket)
+    """
+    host, sep, port = node.rpartition(':')
+    if not sep or '/' in node:
+        return {'unix_socket': node}
+    try:
+        return {'host': host, 'port': int(port)}
+    except ValueError:
+        raise ValueError("invalid node address {}".format(node))
+
+
+def parse_routes(routes):
+    """
+    Parse static routes ``pattern=node`` (see HashRing)
+
+    Returns:
+        list of (pattern, node) tuples
+    """
+    result = []
+    for route in routes or ():
+        pattern, sep, node = route.partition('=')
+        if not sep or not pattern or not node:
+            raise ValueError("invalid route {}".format(route))
+        result.append((pattern, node))
+    return result
+
+
+class HashRing(object):
+    """
+    Maps database names to nodes. Adding or removing a node only moves the
+    databases of about one node.
+    """
+
+    def __init__(self, nodes, routes=None, replicas=RING_REPLICAS):
+        """
+        Args:
+            nodes: node addresses
+            routes: list of (pattern, node) tuples; databases whose name
+                matches a pattern (fnmatch) are mapped to the node of the
+                first matching route
+            replicas: number of points per node on the ring
+        """
+        if not nodes:
+            raise ValueError("no nodes")
+        self.nodes = list(nodes)
+        self.routes = list(routes or ())
+        for _, node in self.routes:
+            if node not in self.nodes:
+                raise ValueError("unknown node {}".format(node))
+        points = sorted((ring_hash('{}#{}'.format(node, i)), node)
+                        for node in self.nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._points = [node for _, node in points]
+
+    def node(self, db):
+        """
+        Returns:
+            the node that stores the database ``db``
+        """
+        for pattern, node in self.routes:
+            if fnmatchcase(db, pattern):
+                return node
+        i = bisect.bisect(self._hashes, ring_hash(db))
+        return self._points[i % len(self._points)]
+
+
+class _Forward(object):
+    """
+    A request whose response is passed on as is
+    """
+    __slots__ = ('future',)
+
+    def __init__(self, loop):
+        self.future = loop.create_future()
+
+    def feed(self, frame):
+        if not self.future.done():
+            self.future.set_result(frame)
+        return True
+
+    def fail(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class _Stream(object):
+    """
+    A streamed listing whose pages are passed on as they arrive
+    """
+    __slots__ = ('pages',)
+
+    def __init__(self):
+        self.pages = asyncio.Queue()
+
+    def feed(self, frame):
+        self.pages.put_nowait(frame)
+        return last_page(unpack_message(frame))
+
+    def fail(self, exc):
+        self.pages.put_nowait(exc)
+
+    async def frames(self):
+        while True:
+            frame = await self.pages.get()
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+            if last_page(unpack_message(frame)):
+                return
+
+
+def done(loop, resp):
+    future = loop.create_future()
+    future.set_result(resp)
+    return future
+
+
+class ProxyServer(object):
+    """
+    Accepts client connections on the asyncio event loop of an AsyncIOLoop
+    and forwards their requests to the nodes. Provides the methods main()
+    uses to run a server (start, add_sockets, stop, busy, shutdown_pool).
+    """
+
+    def __init__(self, nodes, routes=None, connections=NODE_CONNECTIONS):
+        """
+        Args:
+            nodes: node addresses (``host:port`` or Unix domain socket path)
+            routes: static routes, see HashRing
+            connections: maximum number of connections per node
+        """
+        self.ring = HashRing(nodes, routes)
+        self.nodes = self.ring.nodes
+        self._clients = {node: AsyncClient(connections=connections,
+                                           **parse_address(node))
+                         for node in self.nodes}
+        self._servers = []
+        self._tasks = set()
+        self._active = 0  # requests in progress
+        self.max_buffer_size = MAX_MESSAGE_SIZE  # see AsyncioFrontend
+        # counters (see HurrayServer)
+        self.connections = 0
+        self.open_connections = 0
+        self.requests = 0
+
+    def start(self, num_processes=1):
+        """
+        Fork (see TCPServer.start)
+        """
+        if num_processes != 1:
+            process.fork_processes(num_processes)
+
+    def add_sockets(self, sockets):
+        loop = IOLoop.current().asyncio_loop
+        for sock in sockets:
+            self._servers.append(loop.run_until_complete(
+                loop.create_server(lambda: Connection(self), sock=sock)))
+
+    def stop(self):
+        """
+        Stop accepting connections (open connections are still served)
+        """
+        for server in self._servers:
+            server.close()
+        self._servers = []
+
+    def busy(self):
+        return self._active > 0
+
+    def shutdown_pool(self):
+        for client in self._clients.values():
+            client.close()
+
+    def serve(self, conn):
+        task = asyncio.get_event_loop().create_task(
+            self.handle_connection(conn))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def handle_connection(self, conn):
+        """
+        Forward the requests of a client connection as they arrive and send
+        the responses in order.
+        """
+        session = {}  # node -> connection used by this client
+        replies = asyncio.Queue(MAX_PENDING_FRAMES)
+        writer = asyncio.get_event_loop().create_task(
+            self.write_replies(conn, replies))
+        self.connections += 1
+        self.open_connections += 1
+        try:
+            while True:
+                frame = await conn.read_frame()
+                if frame is None:
+                    break
+                self.requests += 1
+                self._active += 1
+                try:
+                    reply = await self.handle_message(frame, session)
+                except Exception:
+                    app_log.exception('Error while forwarding a request')
+                    reply = done(asyncio.get_event_loop(),
+                                 response(INTERNAL_SERVER_ERROR))
+                await replies.put(reply)
+        except Exception:
+            app_log.exception('Error while handling client connection')
+            conn.close()
+        finally:
+            self.open_connections -= 1
+            await replies.put(None)
+            await writer
+
+    async def write_replies(self, conn, replies):
+        closed = False
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                return
+            try:
+                if isinstance(reply, _Stream):
+                    frames = reply.frames()
+                else:
+                    frames = self._single(reply)
+                async for resp in frames:
+                    if not closed:
+                        conn.write([header(len(resp)), resp])
+                        await conn.drain()
+            except StreamClosedError:
+                closed = True
+            except Exception:
+                app_log.exception('Error while sending a response')
+                if not closed:
+                    resp = response(NODE_UNAVAILABLE)
+                    conn.write([header(len(resp)), resp])
+            finally:
+                self._active -= 1
+
+    async def _single(self, reply):
+        try:
+            resp = await reply
+        except (ConnectionError, OSError) as e:
+            resp = response(NODE_UNAVAILABLE, str(e))
+        yield resp
+
+    async def send(self, session, node, buffers, request):
+        """
+        Send a request to a node on the connection of the client session.
+        A request that can't be sent fails with a ConnectionError.
+        """
+        conn = session.get(node)
+        try:
+            if conn is None or conn.closed:
+                conn = session[node] = \
+                    await self._clients[node].connection()
+            conn.send(buffers, request)
+        except OSError as e:
+            request.fail(ConnectionError('{}: {}'.format(node, e)))
+
+    async def forward(self, session, node, frame):
+        """
+        Returns:
+            future of the (raw) response of a node
+        """
+        request = _Forward(asyncio.get_event_loop())
+        await self.send(session, node, [header(len(frame)), frame], request)
+        return request.future
+
+    async def request(self, session, node, cmd, args):
+        """
+        Send a new request to a node
+
+        Returns:
+            future of the raw response
+        """
+        request = _Forward(asyncio.get_event_loop())
+        await self.send(session, node, pack_request(cmd, args), request)
+        return request.future
+
+    async def handle_message(self, frame, session):
+        """
+        Send a request to the node(s)
+
+        Returns:
+            a future of the response or a _Stream of responses
+        """
+        loop = asyncio.get_event_loop()
+        msg = unpack_message(frame)
+        cmd = msg.get(CMD_KW_CMD)
+        args = msg.get(CMD_KW_ARGS) or {}
+
+        if cmd == CMD_LIST_DATABASES:
+            return loop.create_task(self.list_databases(session, args))
+        if cmd == CMD_SERVER_INFO:
+            return loop.create_task(self.server_info(session))
+        if cmd == CMD_JOB_STATUS:
+            return await self.job_status(session, args)
+
+        if cmd == CMD_GATHER:
+            status, parts = split_gather(args)
+            if status != OK:
+                return done(loop, response(status))
+            nodes = {}
+            for db, selections in parts:
+                nodes.setdefault(self.ring.node(db), []).extend(selections)
+            if len(nodes) > 1:
+                return loop.create_task(self.gather(session, args, nodes))
+            node, = nodes
+        elif cmd in (CMD_RENAME_DATABASE, CMD_COPY_DATASET,
+                     CMD_CONCAT_DATASETS):
+            dbs = self.databases(cmd, args)
+            nodes = set(self.ring.node(db) for db in dbs)
+            if len(nodes) > 1:
+                return done(loop, response(
+                    NOT_IMPLEMENTED, "databases on different nodes"))
+            node = nodes.pop() if nodes else self.nodes[0]
+        else:
+            node = self.node(args.get(CMD_KW_DB))
+
+        if args.get(CMD_KW_STREAM):
+            stream = _Stream()
+            await self.send(session, node, [header(len(frame)), frame],
+                            stream)
+            return stream
+        future = await self.forward(session, node, frame)
+        if cmd == CMD_REPACK:
+            return loop.create_task(self.job_created(node, future))
+        return future
+
+    def node(self, db):
+        if not isinstance(db, str) or not db:
+            # the first node answers invalid requests
+            return self.nodes[0]
+        return self.ring.node(db)
+
+    def databases(self, cmd, args):
+        """
+        Returns:
+            the names of the databases of a rename or transfer request
+        """
+        if cmd == CMD_RENAME_DATABASE:
+            dbs = [args.get(CMD_KW_DB), args.get(CMD_KW_DB_RENAMETO)]
+        elif cmd == CMD_COPY_DATASET:
+            dbs = [args.get(CMD_KW_DB), args.get(CMD_KW_DEST_DB)]
+        else:
+            try:
+                dbs = [db for db, _ in args.get(CMD_KW_SOURCES) or ()]
+            except (TypeError, ValueError):
+                dbs = []
+            dbs.append(args.get(CMD_KW_DEST_DB))
+        return [db for db in dbs if isinstance(db, str) and db]
+
+    async def gather(self, session, args, nodes):
+        """
+        Send one gather request per node and merge the results (see
+        HurrayServer.gather)
+        """
+        targets = args[CMD_KW_TARGETS]
+        node_args = {kw: value for kw, value in args.items()
+                     if kw not in (CMD_KW_TARGETS, CMD_KW_KEYS, CMD_KW_KEY,
+                                   CMD_KW_STACK)}
+        requests = []
+        for node, selections in nodes.items():
+            sub_args = dict(node_args)
+            sub_args[CMD_KW_TARGETS] = [targets[i] for i, _, _ in selections]
+            sub_args[CMD_KW_KEYS] = [key for _, _, key in selections]
+            requests.append(await self.request(session, node, CMD_GATHER,
+                                               sub_args))
+        encoded = bool(encoding_kwargs(args))
+        results = []
+        for (node, selections), future in zip(nodes.items(), requests):
+            try:
+                resp = unpack_message(await future)
+            except ConnectionError as e:
+                return response(NODE_UNAVAILABLE, str(e))
+            if resp[CMD_KW_STATUS] != OK:
+                results.append((resp[CMD_KW_STATUS],
+                                resp.get(RESPONSE_DATA)))
+                continue
+            arrays = resp[RESPONSE_DATA]
+            if encoded:
+                arrays = [(arr[RESPONSE_DATA], arr[RESPONSE_ENCODING])
+                          for arr in arrays]
+            results.append((OK, {i: arr for (i, _, _), arr
+                                 in zip(selections, arrays)}))
+        return merge_gather(args, results)
+
+    async def list_databases(self, session, args):
+        """
+        Merge the listings of all nodes. The cursor of a paginated listing
+        holds the offset of each node.
+        """
+        paginated = any(kw in args for kw in PAGE_KWARGS)
+        offsets = [0] * len(self.nodes)
+        if args.get(CMD_KW_CURSOR) is not None:
+            try:
+                offsets = [int(offset) for offset
+                           in decode_cursor(args[CMD_KW_CURSOR])]
+            except (TypeError, ValueError):
+                return response(INVALID_ARGUMENT, "invalid cursor")
+            if len(offsets) != len(self.nodes):
+                return response(INVALID_ARGUMENT, "invalid cursor")
+
+        requests = []
+        for node, offset in zip(self.nodes, offsets):
+            node_args = dict(args)
+            node_args.pop(CMD_KW_CURSOR, None)
+            if offset:
+                node_args[CMD_KW_CURSOR] = encode_cursor([offset])
+            requests.append(await self.request(
+                session, node, CMD_LIST_DATABASES, node_args))
+
+        listings = []
+        status = FILE_NOT_FOUND  # unless any node has the directory
+        for future in requests:
+            try:
+                resp = unpack_message(await future)
+            except ConnectionError as e:
+                return response(NODE_UNAVAILABLE, str(e))
+            if resp[CMD_KW_STATUS] == FILE_NOT_FOUND:
+                listings.append(({}, None))
+                continue
+            if resp[CMD_KW_STATUS] != OK:
+                return response(resp[CMD_KW_STATUS], resp.get(RESPONSE_DATA))
+            status = OK
+            data = resp[RESPONSE_DATA]
+            if paginated:
+                listings.append((data[RESPONSE_DATABASES],
+                                 data[RESPONSE_CURSOR]))
+            else:
+                listings.append((data, None))
+        if status != OK:
+            return response(status)
+
+        sort = args.get(CMD_KW_SORT, SORT_NAME)
+        if sort == SORT_NAME:
+            def key(entry):
+                return entry[0]
+        else:
+            column = RESPONSE_FILESIZE if sort == SORT_SIZE else RESPONSE_MTIME
+
+            def key(entry):
+                return entry[1][column], entry[0]
+        entries = sorted(((name, info, i) for i, (dbs, _) in
+                          enumerate(listings) for name, info in dbs.items()),
+                         key=key, reverse=args.get(CMD_KW_REVERSE, False))
+        limit = args.get(CMD_KW_LIMIT)
+        if limit is not None:
+            entries = entries[:limit]
+        result = {name: info for name, info, _ in entries}
+        if not paginated:
+            return response(OK, result)
+
+        cursor = None
+        if limit is not None:
+            starts = list(offsets)
+            for _, _, i in entries:
+                offsets[i] += 1
+            # more entries on a node (listed or not)
+            if any(node_cursor is not None or offsets[i] - starts[i] < len(dbs)
+                   for i, (dbs, node_cursor) in enumerate(listings)):
+                cursor = encode_cursor(offsets)
+        return response(OK, {
+            RESPONSE_DATABASES: result,
+            RESPONSE_CURSOR: cursor,
+        })
+
+    async def server_info(self, session):
+        """
+        Returns:
+            response with the server_info of each node (None if a node can't
+            be reached)
+        """
+        requests = [await self.request(session, node, CMD_SERVER_INFO, {})
+                    for node in self.nodes]
+        nodes = {}
+        for node, future in zip(self.nodes, requests):
+            try:
+                nodes[node] = unpack_message(await future).get(RESPONSE_DATA)
+            except ConnectionError:
+                nodes[node] = None
+        return response(OK, {RESPONSE_NODES: nodes})
+
+    def job_id(self, node, job_id):
+        return job_id * len(self.nodes) + self.nodes.index(node)
+
+    async def job_created(self, node, future):
+        """
+        Replace the job id in the response to a repack request
+        """
+        resp = await future
+        result = unpack_message(resp)
+        if result[CMD_KW_STATUS] != ACCEPTED:
+            return resp
+        data = dict(result[RESPONSE_DATA])
+        data[RESPONSE_JOB] = self.job_id(node, data[RESPONSE_JOB])
+        return response(ACCEPTED, data)
+
+    async def job_status(self, session, args):
+        """
+        Ask the node of a job for its status
+        """
+        loop = asyncio.get_event_loop()
+        job_id = args.get(CMD_KW_JOB)
+        if not isinstance(job_id, int) or job_id < 0:
+            node = self.nodes[0]
+        else:
+            node = self.nodes[job_id % len(self.nodes)]
+            args = dict(args)
+            args[CMD_KW_JOB] = job_id // len(self.nodes)
+        future = await self.request(session, node, CMD_JOB_STATUS, args)
+        return loop.create_task(self.job_updated(node, future))
+
+    async def job_updated(self, node, future):
+        """
+        Replace the job id in the response to a job_status request
+        """
+        resp = await future
+        result = unpack_message(resp)
+        if result[CMD_KW_STATUS] != OK:
+            return resp
+        data = dict(result[RESPONSE_DATA])
+        data[JOB_ID] = self.job_id(node, data[JOB_ID])
+        return response(OK, data)
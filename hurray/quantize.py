@@ -0,0 +1,205 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Lossy encodings that reduce the size of read results: conversion to another
+dtype, linear packing into integers (``unpacked = packed * scale_factor +
+add_offset``, as in the CF conventions) and rounding of the mantissa of
+floats to a number of bits (which makes the data much more compressible).
+
+The encoding parameters are returned along with the data; use decode() on
+the client side to restore (an approximation of) the original values.
+"""
+
+import numpy as np
+
+# keys of the encoding parameters
+ENCODING_DTYPE = 'dtype'
+ENCODING_SCALE_FACTOR = 'scale_factor'
+ENCODING_ADD_OFFSET = 'add_offset'
+ENCODING_FILLVALUE = 'fillvalue'
+ENCODING_KEEPBITS = 'keepbits'
+
+_MANTISSA_BITS = {
+    np.dtype('float16'): (10, np.uint16),
+    np.dtype('float32'): (23, np.uint32),
+    np.dtype('float64'): (52, np.uint64),
+}
+
+
+def bitround(arr, keepbits):
+    """
+    Round the mantissa of floats to ``keepbits`` bits (round to nearest,
+    ties to even). Non-finite values are preserved.
+
+    Args:
+        arr: NumPy array of floats
+        keepbits: number of mantissa bits to keep
+
+    Returns:
+        NumPy array of the same dtype
+
+    Raises:
+        TypeError if ``arr`` is not an array of floats
+        ValueError if ``keepbits`` is negative
+    """
+    if arr.dtype not in _MANTISSA_BITS:
+        raise TypeError("cannot round mantissa of dtype {}".format(arr.dtype))
+    if keepbits < 0:
+        raise ValueError("keepbits must be >= 0")
+    nbits, uint = _MANTISSA_BITS[arr.dtype]
+    if keepbits >= nbits:
+        return arr
+
+    maskbits = nbits - keepbits
+    bits = np.ascontiguousarray(arr).view(uint)
+    half = uint((1 << (maskbits - 1)) - 1)
+    mask = ~uint((1 << maskbits) - 1)
+    rounded = bits + half + ((bits >> uint(maskbits)) & uint(1))
+    rounded &= mask
+    result = rounded.view(arr.dtype)
+
+    return np.where(np.isfinite(arr), result, arr)
+
+
+def pack(arr, dtype, scale_factor=None, add_offset=None):
+    """
+    Pack floats linearly into integers. If ``scale_factor`` is omitted,
+    scale factor and offset are computed such that the range of the data
+    maps to the range of ``dtype``. NaNs are mapped to a fill value, which
+    is excluded from the range.
+
+    Args:
+        arr: NumPy array
+        dtype: integer dtype
+        scale_factor: optional scale factor (e.g., 0.01 for a precision of
+            0.01)
+        add_offset: optional offset (default: 0 if ``scale_factor`` is
+            given)
+
+    Returns:
+        tuple (packed array, encoding parameters)
+
+    Raises:
+        TypeError if ``dtype`` is not an integer type
+        ValueError if the data does not fit into ``dtype``
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iu':
+        raise TypeError("cannot pack data into dtype {}".format(dtype))
+    info = np.iinfo(dtype)
+    # reserve one value for NaNs
+    if dtype.kind == 'i':
+        fillvalue, lo, hi = info.min, info.min + 1, info.max
+    else:
+        fillvalue, lo, hi = info.max, info.min, info.max - 1
+
+    values = np.asarray(arr, dtype=np.float64)
+    finite = np.isfinite(values)
+    if scale_factor is None:
+        if finite.any():
+            vmin, vmax = values[finite].min(), values[finite].max()
+        else:
+            vmin, vmax = 0., 0.
+        scale_factor = (vmax - vmin) / (float(hi) - lo)
+        if scale_factor == 0:
+            scale_factor = 1.
+        add_offset = vmin - lo * scale_factor
+    elif add_offset is None:
+        add_offset = 0.
+    if scale_factor <= 0:
+        raise ValueError("scale_factor must be > 0")
+
+    packed = np.round((values - add_offset) / scale_factor)
+    if finite.any():
+        pmin, pmax = packed[finite].min(), packed[finite].max()
+        if pmin < lo or pmax > hi:
+            raise ValueError("data does not fit into {} with scale_factor {} "
+                             "and add_offset {}".format(dtype, scale_factor,
+                                                        add_offset))
+    packed[~finite] = fillvalue
+    packed = packed.astype(dtype)
+
+    encoding = {
+        ENCODING_SCALE_FACTOR: float(scale_factor),
+        ENCODING_ADD_OFFSET: float(add_offset),
+        ENCODING_FILLVALUE: int(fillvalue),
+    }
+    return packed, encoding
+
+
+def encode(arr, dtype=None, keepbits=None, pack_dtype=None,
+           scale_factor=None, add_offset=None):
+    """
+    Apply the requested encodings to an array read from a dataset (in this
+    order: dtype conversion, bit rounding, packing).
+
+    Args:
+        arr: NumPy array (or scalar)
+        dtype: convert to this dtype (e.g., 'float32')
+        keepbits: round the mantissa to this number of bits
+        pack_dtype: pack into this integer dtype
+        scale_factor, add_offset: packing parameters (see pack())
+
+    Returns:
+        tuple (encoded array, encoding parameters)
+    """
+    arr = np.asarray(arr)
+    encoding = {ENCODING_DTYPE: arr.dtype.str}
+    if dtype is not None:
+        arr = arr.astype(np.dtype(dtype))
+    if keepbits is not None:
+        arr = bitround(arr, keepbits)
+        encoding[ENCODING_KEEPBITS] = keepbits
+    if pack_dtype is not None:
+        arr, params = pack(arr, pack_dtype, scale_factor, add_offset)
+        encoding.update(params)
+
+    return arr, encoding
+
+
+def decode(arr, encoding):
+    """
+    Restore data encoded by encode(). Packed data is unpacked to the
+    original dtype (NaN for fill values if the dtype is a float type).
+    Rounded or converted values cannot be restored exactly; the result is
+    cast back to the original dtype.
+
+    Args:
+        arr: encoded NumPy array
+        encoding: encoding parameters as returned by encode()
+
+    Returns:
+        NumPy array
+    """
+    dtype = np.dtype(encoding[ENCODING_DTYPE])
+    if ENCODING_SCALE_FACTOR in encoding:
+        missing = arr == encoding[ENCODING_FILLVALUE]
+        values = (arr * encoding[ENCODING_SCALE_FACTOR] +
+                  encoding[ENCODING_ADD_OFFSET])
+        if dtype.kind == 'f':
+            values[missing] = np.nan
+        arr = values
+
+    return arr.astype(dtype)
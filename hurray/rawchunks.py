@@ -0,0 +1,118 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Reading the stored (compressed) chunks of a dataset. The server returns the
+chunks covering a selection as they are stored in the file (see
+hurray.swmr.direct.read_chunks()), and the client decompresses them and
+assembles the selection with assemble(). This moves the decompression from
+the server to the clients and reduces the size of responses.
+"""
+
+import zlib
+
+import numpy as np
+
+# hdf5 filter codes
+FILTER_DEFLATE = 1
+FILTER_SHUFFLE = 2
+FILTER_FLETCHER32 = 3
+
+# keys of the result
+CHUNKS_SHAPE = 'shape'
+CHUNKS_DTYPE = 'dtype'
+CHUNKS_CHUNKS = 'chunks'
+CHUNKS_FILTERS = 'filters'
+CHUNKS_FILLVALUE = 'fillvalue'
+CHUNKS_DATA = 'data'
+CHUNKS_ORIGIN = 'origin'  # offset of the box of chunks covering the selection
+CHUNKS_BOX = 'box'  # shape of that box
+CHUNKS_SELECTION = 'selection'  # selection relative to the box
+
+
+def decode_chunk(data, filter_mask, filters, dtype, chunks):
+    """
+    Undo the filter pipeline of a stored chunk
+
+    Args:
+        data: stored bytes
+        filter_mask: bit i is set if filter i was not applied to the chunk
+        filters: list of (filter code, parameters) in pipeline order
+        dtype: NumPy dtype of the dataset
+        chunks: chunk shape
+
+    Returns:
+        NumPy array of shape ``chunks``
+
+    Raises:
+        ValueError if a filter is not supported
+    """
+    dtype = np.dtype(dtype)
+    for i, (code, params) in reversed(list(enumerate(filters))):
+        if filter_mask & (1 << i):
+            continue
+        if code == FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif code == FILTER_SHUFFLE:
+            if dtype.itemsize > 1:
+                data = np.frombuffer(data, np.uint8) \
+                    .reshape(dtype.itemsize, -1).T.tobytes()
+        elif code == FILTER_FLETCHER32:
+            data = data[:-4]  # strip the checksum
+        else:
+            raise ValueError("unsupported filter {}".format(code))
+
+    return np.frombuffer(data, dtype=dtype).reshape(chunks)
+
+
+def assemble(result):
+    """
+    Assemble the requested selection from the stored chunks returned by the
+    server
+
+    Args:
+        result: response data of a read_chunks request
+
+    Returns:
+        NumPy array (same as reading the selection from the dataset)
+    """
+    dtype = np.lib.format.descr_to_dtype(result[CHUNKS_DTYPE])
+    chunks = tuple(result[CHUNKS_CHUNKS])
+    box_start = result[CHUNKS_ORIGIN]
+    box_stop = [a + n for a, n in zip(box_start, result[CHUNKS_BOX])]
+    box = np.empty(result[CHUNKS_BOX], dtype=dtype)
+    fillvalue = result[CHUNKS_FILLVALUE]
+    box[...] = 0 if fillvalue is None else fillvalue
+    for offset, filter_mask, data in result[CHUNKS_DATA]:
+        chunk = decode_chunk(data, filter_mask, result[CHUNKS_FILTERS],
+                             dtype, chunks)
+        dst_key = []
+        src_key = []
+        for o, c, a, b in zip(offset, chunks, box_start, box_stop):
+            n = min(o + c, b) - o
+            dst_key.append(slice(o - a, o - a + n))
+            src_key.append(slice(0, n))
+        box[tuple(dst_key)] = chunk[tuple(src_key)]
+
+    return box[tuple(result[CHUNKS_SELECTION])]
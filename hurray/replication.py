@@ -0,0 +1,270 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Read replicas (``hurray --primary=host:port``).
+
+A primary server (``hurray --changelog=N``) logs the journal entries of all
+writes with increasing sequence numbers (see hurray.swmr.changelog) and
+returns the sequence number of a write in its response. The replicator
+process of a replica polls the primary for the changes after the last
+applied one (get_changes), receives the current state of the modified
+nodes and regions (see hurray.swmr.replication) and applies them to its
+copies of the databases. If the primary does not hold these changes anymore
+(the replica fell too far behind or the primary was restarted), the replica
+copies all databases again.
+
+Replicas answer read requests and reject writes (READ_ONLY). A request
+with a ``min_seq`` argument (e.g., Client.last_seq of the client that
+wrote to the primary) waits until the replica has applied that change, so
+that clients can read their own writes (REPLICA_LAG if the replica does not
+catch up in time). server_info reports the replication state.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+from hurray.client import Client, HurrayError
+from hurray.protocol import (CMD_GET_CHANGES, CMD_LIST_DATABASES,
+                             CMD_KW_DB, CMD_KW_PATH, CMD_KW_KEY, CMD_KW_EPOCH,
+                             CMD_KW_SEQ, CMD_KW_LIMIT, CMD_KW_RECURSIVE,
+                             RESPONSE_EPOCH, RESPONSE_SEQ, RESPONSE_HEAD,
+                             RESPONSE_CHANGES, RESPONSE_IMAGE,
+                             RESPONSE_ITEMS, RESPONSE_DB)
+from hurray.proxy import parse_address
+from hurray.request_handler import db_path, HIDDEN_SUFFIXES, CHANGES_LIMIT
+from hurray.server.log import app_log
+from hurray.status_codes import CHANGES_EXPIRED
+from hurray.swmr import replication
+from hurray.swmr.lock import CATALOG, REPLICA
+
+# poll the primary every this many seconds (once the replica is up to date)
+POLL_INTERVAL = 0.2
+
+# timeout of the requests to the primary
+REQUEST_TIMEOUT = 60.0
+
+# after errors, the poll interval doubles up to this many seconds
+MAX_RETRY_INTERVAL = 30.0
+
+
+class Replicator(object):
+    """
+    Keeps the databases in the base directory of a replica up to date with
+    the primary server
+    """
+
+    def __init__(self, primary, base, interval=POLL_INTERVAL):
+        """
+        Args:
+            primary: address of the primary (host:port or Unix domain socket
+                path)
+            base: base directory of the replica
+            interval: poll interval in seconds
+        """
+        self.primary = primary
+        self.address = parse_address(primary)
+        self.base = os.path.abspath(os.path.expanduser(base))
+        self.interval = interval
+        self.state_file = os.path.join(self.base, replication.STATE_FILE)
+        self.epoch, self.seq = self.load()
+
+    def load(self):
+        """
+        Returns:
+            the saved tuple (epoch, sequence number of the last applied
+            change), (None, None) if the databases have to be copied
+        """
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            return state[RESPONSE_EPOCH], state[RESPONSE_SEQ]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def save(self, epoch, seq):
+        self.epoch, self.seq = epoch, seq
+        tmp = os.path.join(self.base, '.hurray.new' + replication.STATE_SUFFIX)
+        with open(tmp, 'w') as f:
+            json.dump({RESPONSE_EPOCH: epoch, RESPONSE_SEQ: seq}, f)
+        os.replace(tmp, self.state_file)
+
+    def start(self):
+        """
+        Run the replicator in a new process, which exits with the calling
+        process
+        """
+        proc = multiprocessing.Process(target=self.run,
+                                       name='hurray-replicator')
+        proc.daemon = True
+        proc.start()
+        return proc
+
+    def run(self):
+        """
+        Replicate until the parent process (the server) exits
+        """
+        parent = os.getppid()
+        client = None
+        error = None
+        interval = self.interval
+        while os.getppid() == parent:
+            head = None
+            try:
+                if client is None:
+                    client = Client(connections=1, **self.address)
+                head = self.poll(client)
+                error = None
+            except (OSError, HurrayError) as e:
+                if str(e) != error:  # log once while the primary is down
+                    app_log.warning("Replication from %s failed: %s",
+                                    self.primary, e)
+                error = str(e)
+            except Exception as e:
+                # e.g., a change that cannot be applied: copy all databases
+                app_log.exception("Replication from %s failed, copying all "
+                                  "databases", self.primary)
+                error = '{}: {}'.format(type(e).__name__, e)
+                self.epoch = None
+            if error is not None and client is not None:
+                client.close()
+                client = None
+            REPLICA.update(self.primary, self.epoch, self.seq, head, error)
+            if error is not None:
+                time.sleep(interval)
+                interval = min(2 * interval, MAX_RETRY_INTERVAL)
+                continue
+            interval = self.interval
+            if head is None or self.seq >= head:
+                time.sleep(self.interval)
+        if client is not None:
+            client.close()
+
+    def call(self, client, args):
+        return client.call(CMD_GET_CHANGES, args, timeout=REQUEST_TIMEOUT)
+
+    def poll(self, client):
+        """
+        Apply the next changes of the primary
+
+        Returns:
+            sequence number of the last change logged by the primary
+        """
+        if self.epoch is None:
+            return self.resync(client)
+        try:
+            data = self.call(client, {
+                CMD_KW_EPOCH: self.epoch,
+                CMD_KW_SEQ: self.seq,
+                CMD_KW_LIMIT: CHANGES_LIMIT,
+            })
+        except HurrayError as e:
+            if e.status != CHANGES_EXPIRED:
+                raise
+            app_log.info("Changes of %s expired, copying all databases",
+                         self.primary)
+            return self.resync(client)
+        for change in data[RESPONSE_CHANGES]:
+            self.apply(client, change[RESPONSE_DB], change[RESPONSE_IMAGE],
+                       change[RESPONSE_ITEMS])
+        self.save(data[RESPONSE_EPOCH], data[RESPONSE_SEQ])
+        return data[RESPONSE_HEAD]
+
+    def resync(self, client):
+        """
+        Copy all databases of the primary (and delete the others)
+
+        Returns:
+            sequence number of the last change logged by the primary
+        """
+        # changes logged while copying are applied (again) afterwards
+        try:
+            self.call(client, {CMD_KW_EPOCH: None, CMD_KW_SEQ: 0})
+        except HurrayError as e:
+            if e.status != CHANGES_EXPIRED:
+                raise
+            epoch, head = e.data[RESPONSE_EPOCH], e.data[RESPONSE_HEAD]
+
+        dbs = client.call(CMD_LIST_DATABASES, {CMD_KW_RECURSIVE: True},
+                          timeout=REQUEST_TIMEOUT)
+        for db in self.local_databases() - set(dbs):
+            self.apply(client, db, None, [])
+        for db in sorted(dbs):
+            self.copy(client, db)
+        self.save(epoch, head)
+        return head
+
+    def local_databases(self):
+        result = set()
+        for root, _, files in os.walk(self.base):
+            for name in files:
+                if not name.endswith(HIDDEN_SUFFIXES):
+                    path = os.path.join(root, name)
+                    result.add(os.path.relpath(path, self.base))
+        return result
+
+    def copy(self, client, db, path='/'):
+        """
+        Copy a node (by default, the whole database) from the primary. The
+        datasets the primary did not include are copied in regions (see
+        hurray.swmr.replication.snapshot).
+        """
+        data = self.call(client, {CMD_KW_DB: db, CMD_KW_PATH: path})
+        failed = self.apply(client, db, data[RESPONSE_IMAGE],
+                            data[RESPONSE_ITEMS], copy=False)
+        if failed:
+            app_log.warning("Could not copy %s of %s", failed, db)
+
+    def apply(self, client, db, image, items, copy=True):
+        """
+        Apply the changes of a database (see hurray.swmr.replication.apply),
+        copy the regions the primary did not include in the image and copy
+        the nodes that could not be updated
+
+        Returns:
+            list of paths of nodes that could not be updated
+        """
+        file = db_path(db)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        failed = replication.apply(file, image, items)
+        # e.g., a dataset and its parent may both have been modified
+        deferred = dict.fromkeys(tuple(entry) for item in items for entry in
+                                 item.get(replication.ITEM_DEFERRED, ()))
+        for dataset, start, stop, rows in deferred:
+            for a in range(start, stop, rows):
+                region = self.call(client, {
+                    CMD_KW_DB: db,
+                    CMD_KW_PATH: dataset,
+                    CMD_KW_KEY: slice(a, min(a + rows, stop)),
+                })
+                failed += replication.apply(file, region[RESPONSE_IMAGE],
+                                            region[RESPONSE_ITEMS])
+        CATALOG.refresh(file)
+        failed = list(dict.fromkeys(failed))
+        if copy:
+            for path in failed:
+                self.copy(client, db, path)
+        return failed
@@ -24,9 +24,12 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import time
 
 import msgpack
+import numpy as np
 
+from hurray import quantize, trace
 from hurray.msgpack_ext import encode as encode_msgpack
 from hurray.protocol import (CMD_CREATE_DATABASE, CMD_RENAME_DATABASE,
                              CMD_DELETE_DATABASE, CMD_USE_DATABASE,
@@ -36,16 +39,43 @@ from hurray.protocol import (CMD_CREATE_DATABASE, CMD_RENAME_DATABASE,
                              CMD_GET_NODE, CMD_CONTAINS, CMD_GET_KEYS,
                              CMD_GET_TREE,
                              CMD_SLICE_DATASET, CMD_BROADCAST_DATASET,
+                             CMD_GATHER, CMD_COPY_DATASET,
+                             CMD_CONCAT_DATASETS, CMD_APPEND_DATASET,
+                             CMD_CREATE_PYRAMID, CMD_DELETE_PYRAMID,
+                             CMD_UPDATE_PYRAMID, CMD_CHUNK_ADVICE,
+                             CMD_REPACK, CMD_JOB_STATUS, CMD_READ_CHUNKS,
                              CMD_ATTRIBUTES_GET, CMD_ATTRIBUTES_SET,
                              CMD_ATTRIBUTES_CONTAINS, CMD_ATTRIBUTES_KEYS,
+                             CMD_ATTRIBUTES_ITEMS, CMD_ATTRIBUTES_UPDATE,
+                             CMD_ATTRIBUTES_COLLECT, CMD_GET_CHANGES,
                              CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DB,
                              CMD_KW_DB_RENAMETO, CMD_KW_OVERWRITE, CMD_KW_PATH,
                              CMD_KW_DATA, CMD_KW_KEY, CMD_KW_STATUS,
                              CMD_KW_SHAPE, CMD_KW_DTYPE, CMD_KW_REQUIRE_EXACT,
-                             CMD_KW_CHUNKS, CMD_KW_FILLVALUE,
+                             CMD_KW_CHUNKS, CMD_KW_FILLVALUE, CMD_KW_MAXSHAPE,
                              CMD_KW_COMPRESSION, CMD_KW_COMPRESSION_OPTS,
+                             CMD_KW_TARGETS, CMD_KW_KEYS, CMD_KW_STACK,
+                             CMD_KW_SOURCES, CMD_KW_DEST_DB,
+                             CMD_KW_DEST_PATH, CMD_KW_AXIS,
+                             CMD_KW_OUT_DTYPE, CMD_KW_KEEPBITS, CMD_KW_PACK,
+                             CMD_KW_SCALE_FACTOR, CMD_KW_ADD_OFFSET,
+                             CMD_KW_FACTOR, CMD_KW_LEVELS, CMD_KW_AXES,
+                             CMD_KW_RESOLUTION, CMD_KW_JOB, CMD_KW_DEPTH,
+                             CMD_KW_ATTRS, CMD_KW_LIMIT, CMD_KW_CURSOR,
+                             CMD_KW_PREFIX, CMD_KW_RECURSIVE, CMD_KW_SORT,
+                             CMD_KW_REVERSE, CMD_KW_DATASETS,
+                             CMD_KW_EPOCH, CMD_KW_SEQ, CMD_KW_TRACE,
+                             RESPONSE_CURSOR, RESPONSE_DATABASES,
+                             RESPONSE_FILESIZE, RESPONSE_MTIME,
+                             RESPONSE_DATASETS,
                              RESPONSE_ATTRS_CONTAINS, RESPONSE_ATTRS_KEYS,
-                             RESPONSE_NODE_KEYS, RESPONSE_NODE_TREE)
+                             RESPONSE_NODE_KEYS, RESPONSE_NODE_TREE,
+                             RESPONSE_NODE_SHAPE, RESPONSE_LENGTH,
+                             RESPONSE_CHUNK_LENGTH, RESPONSE_DATA,
+                             RESPONSE_ENCODING, RESPONSE_RESOLUTION,
+                             RESPONSE_JOB, RESPONSE_SEQ, RESPONSE_EPOCH,
+                             RESPONSE_HEAD, RESPONSE_CHANGES, RESPONSE_IMAGE,
+                             RESPONSE_ITEMS, RESPONSE_DB, RESPONSE_TRACE)
 from hurray.server.log import app_log
 from hurray.server.options import define, options
 from hurray.status_codes import (FILE_EXISTS, OK, FILE_NOT_FOUND, GROUP_EXISTS,
@@ -53,8 +83,23 @@ from hurray.status_codes import (FILE_EXISTS, OK, FILE_NOT_FOUND, GROUP_EXISTS,
                                  TYPE_ERROR, CREATED, UNKNOWN_COMMAND,
                                  MISSING_ARGUMENT, MISSING_DATA,
                                  INCOMPATIBLE_DATA, KEY_ERROR,
-                                 INVALID_ARGUMENT, INTERNAL_SERVER_ERROR)
+                                 INVALID_ARGUMENT, INTERNAL_SERVER_ERROR,
+                                 ACCEPTED, FILE_BUSY, READ_ONLY,
+                                 CHANGES_EXPIRED, NOT_IMPLEMENTED)
 from .swmr import File, Group, Dataset
+from .swmr.advisor import advise
+from .swmr.api import INTERNAL_ATTR_PREFIX
+from .swmr.catalog import SORT_NAME
+from .swmr.jobs import (JOB_ARGS, JOB_STATE, JOB_RUNNING, JOB_PHASE,
+                        JOB_PROGRESS, JOB_BYTES_DONE, JOB_BYTES_TOTAL)
+from .swmr import replication
+from .swmr.journal import JOURNAL_SUFFIX
+from .swmr.listing import encode_cursor, decode_cursor
+from .swmr.lock import JOBS, CATALOG, CHANGES
+from .swmr.repack import repack, REPACK_SUFFIX
+from .swmr.stats import STATS_PATTERNS
+from .swmr.transfer import (copy_dataset, concat_datasets,
+                             DatasetExistsError)
 
 DATABASE_COMMANDS = (
     CMD_CREATE_DATABASE,
@@ -75,13 +120,79 @@ NODE_COMMANDS = (CMD_CREATE_GROUP,
                  CMD_GET_TREE,
                  CMD_SLICE_DATASET,
                  CMD_BROADCAST_DATASET,
+                 CMD_APPEND_DATASET,
+                 CMD_CREATE_PYRAMID,
+                 CMD_DELETE_PYRAMID,
+                 CMD_UPDATE_PYRAMID,
+                 CMD_CHUNK_ADVICE,
+                 CMD_READ_CHUNKS,
                  CMD_ATTRIBUTES_GET,
                  CMD_ATTRIBUTES_SET,
                  CMD_ATTRIBUTES_CONTAINS,
-                 CMD_ATTRIBUTES_KEYS)
+                 CMD_ATTRIBUTES_KEYS,
+                 CMD_ATTRIBUTES_ITEMS,
+                 CMD_ATTRIBUTES_UPDATE,
+                 CMD_ATTRIBUTES_COLLECT)
+
+TRANSFER_COMMANDS = (CMD_COPY_DATASET,
+                     CMD_CONCAT_DATASETS)
+
+# creation properties of copied datasets that may be overridden
+TRANSFER_KWARGS = (CMD_KW_CHUNKS, CMD_KW_COMPRESSION, CMD_KW_COMPRESSION_OPTS,
+                   CMD_KW_FILLVALUE)
+
+# arguments of paginated listings (get_keys, get_tree, list_dbs)
+PAGE_KWARGS = (CMD_KW_LIMIT, CMD_KW_CURSOR, CMD_KW_PREFIX)
+
+# temporary files of repack jobs and replicas (not listed by list_dbs)
+HIDDEN_SUFFIXES = (REPACK_SUFFIX, JOURNAL_SUFFIX, replication.STATE_SUFFIX)
+
+# commands that modify databases (rejected by replicas)
+WRITE_COMMANDS = (CMD_CREATE_DATABASE,
+                  CMD_RENAME_DATABASE,
+                  CMD_DELETE_DATABASE,
+                  CMD_CREATE_GROUP,
+                  CMD_REQUIRE_GROUP,
+                  CMD_CREATE_DATASET,
+                  CMD_REQUIRE_DATASET,
+                  CMD_BROADCAST_DATASET,
+                  CMD_APPEND_DATASET,
+                  CMD_COPY_DATASET,
+                  CMD_CONCAT_DATASETS,
+                  CMD_CREATE_PYRAMID,
+                  CMD_DELETE_PYRAMID,
+                  CMD_UPDATE_PYRAMID,
+                  CMD_REPACK,
+                  CMD_ATTRIBUTES_SET,
+                  CMD_ATTRIBUTES_UPDATE)
+
+# maximum number of changes per get_changes response
+CHANGES_LIMIT = 1000
+
+JOB_COMMANDS = (CMD_REPACK,
+                CMD_JOB_STATUS)
+
+# creation properties that can be changed by repacking
+REPACK_KWARGS = (CMD_KW_CHUNKS, CMD_KW_COMPRESSION, CMD_KW_COMPRESSION_OPTS)
+
+# read options and the corresponding arguments of quantize.encode()
+ENCODING_KWARGS = {
+    CMD_KW_OUT_DTYPE: 'dtype',
+    CMD_KW_KEEPBITS: 'keepbits',
+    CMD_KW_PACK: 'pack_dtype',
+    CMD_KW_SCALE_FACTOR: 'scale_factor',
+    CMD_KW_ADD_OFFSET: 'add_offset',
+}
 
 define('base', default='~/hurray_data/', group='application',
        help="Location of hdf5 files")
+define('repack_rate', default=50.0, group='application',
+       help="Maximum copy rate of repack jobs in MB/s (0 = unlimited)")
+define('changelog', default=0, group='application',
+       help="Number of changes logged for replicas (0 = do not log changes)")
+define('primary', default=None, type=str, group='application',
+       help="Run as a read-only replica of the primary server at this "
+            "address (host:port or Unix domain socket path)")
 
 
 def db_path(database):
@@ -99,6 +210,81 @@ def db_path(database):
     return absfilepath
 
 
+def open_catalog():
+    """
+    Make sure that the catalog of databases is built for the base directory
+    (see hurray.swmr.catalog)
+    """
+    absbase = os.path.abspath(os.path.expanduser(options.base))
+    CATALOG.open(absbase, HIDDEN_SUFFIXES)
+
+
+def count_datasets(filepath):
+    """
+    Number of top-level datasets of a database (None if it is not an hdf5
+    file)
+    """
+    try:
+        return sum(1 for _, node in File(filepath, "r").items()
+                   if isinstance(node, Dataset))
+    except OSError:
+        return None
+
+
+def list_databases(args):
+    """
+    Query the catalog of databases
+    :param args: arguments of a list_dbs request
+    :return: tuple (status, data)
+    """
+    try:
+        abspath = db_path(args.get(CMD_KW_PATH, None) or '')
+    except ValueError as ve:
+        return INVALID_ARGUMENT, str(ve)
+    if not os.path.isdir(abspath):
+        return FILE_NOT_FOUND, None
+    offset = 0
+    if args.get(CMD_KW_CURSOR, None) is not None:
+        try:
+            offset = int(decode_cursor(args[CMD_KW_CURSOR])[0])
+        except (TypeError, ValueError, IndexError):
+            return INVALID_ARGUMENT, "invalid cursor"
+    limit = args.get(CMD_KW_LIMIT, None)
+
+    open_catalog()
+    try:
+        files = CATALOG.query(abspath,
+                              recursive=args.get(CMD_KW_RECURSIVE, False),
+                              prefix=args.get(CMD_KW_PREFIX, None) or '',
+                              sort=args.get(CMD_KW_SORT, SORT_NAME),
+                              reverse=args.get(CMD_KW_REVERSE, False),
+                              offset=offset, limit=limit)
+    except ValueError as ve:
+        return INVALID_ARGUMENT, str(ve)
+
+    result = {}
+    for name, size, mtime, datasets in files:
+        info = {RESPONSE_FILESIZE: size, RESPONSE_MTIME: mtime}
+        if args.get(CMD_KW_DATASETS, False):
+            if datasets is None:
+                filepath = os.path.join(abspath, name)
+                datasets = count_datasets(filepath)
+                CATALOG.set_datasets(filepath, mtime, datasets)
+            info[RESPONSE_DATASETS] = datasets
+        result[name] = info
+
+    if any(kw in args for kw in PAGE_KWARGS):
+        cursor = None
+        if limit is not None and len(files) == limit:
+            cursor = encode_cursor([offset + limit])
+        result = {
+            RESPONSE_DATABASES: result,
+            RESPONSE_CURSOR: cursor,
+        }
+
+    return OK, result
+
+
 def db_exists(database):
     """
     Check if given database file exists
@@ -119,13 +305,240 @@ def response(status, data=None):
     resp = {
         CMD_KW_STATUS: status
     }
+    seq = replication.recorded()
+    if seq is not None:
+        # a write of a primary: replicas have applied it once they reach seq
+        resp[RESPONSE_SEQ] = seq
     if data is not None:
         resp["data"] = data
         # resp.update(data)
 
     # print("response (PID {}): {}".format(os.getpid(), resp))
 
-    return msgpack.packb(resp, default=encode_msgpack, use_bin_type=True)
+    if not trace.active():
+        return msgpack.packb(resp, default=encode_msgpack, use_bin_type=True)
+    start = time.monotonic()
+    packed = msgpack.packb(resp, default=encode_msgpack, use_bin_type=True)
+    events = trace.stop()
+    events.append((trace.ENCODE, start, time.monotonic()))
+    # append the trace to the packed map (a fixmap, i.e., < 15 entries)
+    return b''.join((bytes([packed[0] + 1]), memoryview(packed)[1:],
+                     msgpack.packb(RESPONSE_TRACE, use_bin_type=True),
+                     msgpack.packb(events, use_bin_type=True)))
+
+
+def encoding_kwargs(args):
+    """
+    Extract the read options (dtype conversion, quantization) of a request
+    :param args: request arguments
+    :return: keyword arguments for quantize.encode() (empty if none)
+    """
+    return {kw: args[arg] for arg, kw in ENCODING_KWARGS.items()
+            if arg in args}
+
+
+def encode_result(arr, kwargs):
+    """
+    Encode the result of a read request
+    :param arr: NumPy array
+    :param kwargs: keyword arguments for quantize.encode()
+    :return: dictionary with encoded data and encoding parameters
+    """
+    arr, encoding = quantize.encode(arr, **kwargs)
+    return {
+        RESPONSE_DATA: arr,
+        RESPONSE_ENCODING: encoding,
+    }
+
+
+def split_gather(args):
+    """
+    Group the targets of a gather request by database so that each file is
+    opened and locked only once.
+    :param args: arguments of a gather request
+    :return: tuple (status, parts) where parts is a list of
+        (database, [(index, path, key), ...]) tuples
+    """
+    targets = args.get(CMD_KW_TARGETS, None)
+    if not targets:
+        return MISSING_ARGUMENT, None
+    if CMD_KW_KEYS in args:
+        keys = args[CMD_KW_KEYS]
+        if len(keys) != len(targets):
+            return INVALID_ARGUMENT, None
+    elif CMD_KW_KEY in args:
+        keys = [args[CMD_KW_KEY]] * len(targets)
+    else:
+        return MISSING_ARGUMENT, None
+
+    parts = {}
+    for index, (target, key) in enumerate(zip(targets, keys)):
+        try:
+            db, path = target
+        except (TypeError, ValueError):
+            return INVALID_ARGUMENT, None
+        if len(db) < 1 or len(path) < 1:
+            return INVALID_ARGUMENT, None
+        parts.setdefault(db, []).append((index, path, key))
+
+    return OK, list(parts.items())
+
+
+def gather_partial(db_name, selections, encoding=None):
+    """
+    Read the selections of a gather request that belong to one database.
+    Runs in a worker process.
+    :param db_name: database name
+    :param selections: list of (index, path, key) tuples
+    :param encoding: optional keyword arguments for quantize.encode()
+    :return: tuple (status, data) where data is a dict mapping indices to
+        NumPy arrays (or (array, encoding) tuples if ``encoding`` is given)
+        or an error message
+    """
+    if not db_exists(db_name):
+        return FILE_NOT_FOUND, db_name
+
+    db = File(db_path(db_name), "r")
+    try:
+        arrays = db.gather([(path, key) for _, path, key in selections])
+    except KeyError as ke:
+        return NODE_NOT_FOUND, str(ke)
+    except TypeError as te:
+        return INVALID_ARGUMENT, str(te)
+    except (ValueError, IndexError) as e:
+        app_log.debug('Invalid slice: %s', e)
+        return VALUE_ERROR, str(e)
+
+    if encoding:
+        try:
+            arrays = [quantize.encode(arr, **encoding) for arr in arrays]
+        except TypeError as te:
+            return INVALID_ARGUMENT, str(te)
+        except ValueError as ve:
+            return VALUE_ERROR, str(ve)
+
+    return OK, {index: arr for (index, _, _), arr in zip(selections, arrays)}
+
+
+def merge_gather(args, results):
+    """
+    Combine the partial results of a gather request into a response.
+    :param args: arguments of the gather request
+    :param results: list of (status, data) tuples as returned by
+        gather_partial()
+    :return: Msgpacked response as bytes
+    """
+    arrays = {}
+    for status, data in results:
+        if status != OK:
+            return response(status, data)
+        arrays.update(data)
+
+    arrays = [arrays[i] for i in range(len(arrays))]
+    encoded = bool(encoding_kwargs(args))
+    if encoded:
+        encodings = [encoding for _, encoding in arrays]
+        arrays = [arr for arr, _ in arrays]
+    if args.get(CMD_KW_STACK, False):
+        if encoded and any(e != encodings[0] for e in encodings):
+            # e.g., packing without a fixed scale factor
+            return response(INCOMPATIBLE_DATA, "encodings differ")
+        try:
+            arrays = np.stack(arrays)
+        except ValueError as ve:
+            return response(INCOMPATIBLE_DATA, str(ve))
+        if encoded:
+            arrays = {RESPONSE_DATA: arrays, RESPONSE_ENCODING: encodings[0]}
+    elif encoded:
+        arrays = [{RESPONSE_DATA: arr, RESPONSE_ENCODING: encoding}
+                  for arr, encoding in zip(arrays, encodings)]
+
+    return response(OK, arrays)
+
+
+def get_changes(args):
+    """
+    Answer the get_changes request of a replica (see hurray.replication):
+    either a copy of a node (``db`` and ``path`` arguments, and ``key`` to
+    copy a region of a dataset, see hurray.swmr.replication.snapshot) or the
+    changes logged after sequence number ``seq`` (at most ``limit``).
+    """
+    if not options.changelog:
+        return response(NOT_IMPLEMENTED, "changes are not logged")
+    absbase = os.path.abspath(os.path.expanduser(options.base))
+    # read the state first, later changes are applied again by the replica
+    epoch, head = CHANGES.state()
+    data = {RESPONSE_EPOCH: epoch, RESPONSE_HEAD: head}
+
+    if CMD_KW_DB in args:
+        db = args[CMD_KW_DB]
+        if len(db) < 1:
+            return response(INVALID_ARGUMENT)
+        image, items = replication.snapshot(
+            db_path(db), args.get(CMD_KW_PATH, '/'), args.get(CMD_KW_KEY))
+        data.update({RESPONSE_IMAGE: image, RESPONSE_ITEMS: items})
+        return response(OK, data)
+
+    if CMD_KW_EPOCH not in args or CMD_KW_SEQ not in args:
+        return response(MISSING_ARGUMENT)
+    limit = min(args.get(CMD_KW_LIMIT, CHANGES_LIMIT), CHANGES_LIMIT)
+    entries = CHANGES.since(args[CMD_KW_EPOCH], args[CMD_KW_SEQ], limit)
+    if entries is None:
+        return response(CHANGES_EXPIRED, data)
+
+    # files in the order of their first change
+    files = {}
+    for seq, file, kind, path, key in entries:
+        files.setdefault(file, []).append((seq, kind, path, key))
+    seq = entries[-1][0] if entries else args[CMD_KW_SEQ]
+    changes = []
+    budget = replication.COPY_BLOCK_SIZE
+    for file, file_entries in files.items():
+        if budget <= 0:
+            # the rest is sent with the next response (changes of the files
+            # above that are logged later are applied again)
+            seq = file_entries[0][0] - 1
+            break
+        image, items = replication.changes(
+            file, [entry[1:] for entry in file_entries],
+            replication.COPY_BLOCK_SIZE, budget)
+        budget -= len(image or b'')
+        changes.append({
+            RESPONSE_DB: os.path.relpath(file, absbase),
+            RESPONSE_IMAGE: image,
+            RESPONSE_ITEMS: items,
+        })
+    data[RESPONSE_SEQ] = seq
+    data[RESPONSE_CHANGES] = changes
+    return response(OK, data)
+
+
+def run_job(job_id):
+    """
+    Run a background job registered by handle_request() (e.g., repack)
+    :param job_id: id of the job
+    """
+    args = JOBS.get(job_id)[JOB_ARGS]
+    JOBS.update(job_id, **{JOB_STATE: JOB_RUNNING})
+
+    def progress(phase, done, total):
+        JOBS.update(job_id, **{
+            JOB_PHASE: phase,
+            JOB_BYTES_DONE: done,
+            JOB_BYTES_TOTAL: total,
+            JOB_PROGRESS: done / total if total else 0.,
+        })
+
+    layout = {kw: args[kw] for kw in REPACK_KWARGS if kw in args}
+    rate = options.repack_rate * 1024 * 1024 or None
+    try:
+        result = repack(JOBS.resource(job_id), args[CMD_KW_PATH], layout,
+                        rate=rate, progress=progress)
+    except Exception as e:
+        app_log.exception('Job %d failed', job_id)
+        JOBS.finish(job_id, error=str(e))
+    else:
+        JOBS.finish(job_id, result=result)
 
 
 def handle_request(msg):
@@ -145,6 +558,16 @@ def handle_request(msg):
     status = OK
     data_response = None
 
+    replication.recorded(reset=True)
+    events = args.get(CMD_KW_TRACE)
+    if events:
+        # events of the server process (or True)
+        trace.start(events if isinstance(events, (list, tuple)) else ())
+    else:
+        trace.stop()
+    if options.primary and cmd in WRITE_COMMANDS:
+        return response(READ_ONLY)
+
     if cmd in DATABASE_COMMANDS:  # file related commands
 
         db = args.get(CMD_KW_DB, None)
@@ -165,6 +588,7 @@ def handle_request(msg):
                 # note that db_path() guarantees that this is safe
                 os.makedirs(os.path.split(filepath)[0], exist_ok=True)
                 File(filepath, flags)
+                CATALOG.refresh(filepath)
                 status = CREATED
         elif cmd == CMD_RENAME_DATABASE:
             if db is None:
@@ -179,6 +603,8 @@ def handle_request(msg):
                 except FileExistsError as e:
                     status = FILE_EXISTS
                 else:
+                    CATALOG.refresh(f.file)
+                    CATALOG.refresh(filepath_new)
                     # we cannot return f because rename() is not "in place"
                     f_renamed = File(filepath_new, "r")
                     data_response = f_renamed
@@ -190,6 +616,7 @@ def handle_request(msg):
             else:
                 f = File(db_path(db), "w")
                 f.delete()
+                CATALOG.refresh(f.file)
         elif cmd == CMD_USE_DATABASE:
             if db is None:
                 return response(MISSING_ARGUMENT)
@@ -198,19 +625,117 @@ def handle_request(msg):
         elif cmd == CMD_GET_FILESIZE:
             if db is None:
                 return response(MISSING_ARGUMENT)
+            if not db_exists(db):
+                return response(FILE_NOT_FOUND)
             data_response = File(db_path(db), "r").filesize
         elif cmd == CMD_LIST_DATABASES:
-            abspath = db_path(args[CMD_KW_PATH])
             # TODO check if a file is actually an hdf5 file by calling File()?
-            result = {}
-            for f in os.listdir(abspath):
-                f_path = os.path.join(abspath, f)
-                if not os.path.isfile(f_path):
-                    continue
-                stat = os.stat(f_path)
-                filesize = stat.st_size
-                result[f] = {"filesize": filesize}
-            data_response = result
+            status, data_response = list_databases(args)
+
+    elif cmd == CMD_GATHER:
+        status, parts = split_gather(args)
+        if status != OK:
+            return response(status)
+        encoding = encoding_kwargs(args)
+        results = [gather_partial(db, selections, encoding)
+                   for db, selections in parts]
+        return merge_gather(args, results)
+
+    elif cmd in JOB_COMMANDS:  # background jobs
+        if cmd == CMD_REPACK:
+            db_name = args.get(CMD_KW_DB, None)
+            if db_name is None:
+                return response(MISSING_ARGUMENT)
+            if len(db_name) < 1:
+                return response(INVALID_ARGUMENT)
+            if not db_exists(db_name):
+                return response(FILE_NOT_FOUND)
+            path = args.get(CMD_KW_PATH, None)
+            layout = {kw: args[kw] for kw in REPACK_KWARGS if kw in args}
+            if path is not None:
+                db = File(db_path(db_name), "r")
+                if path not in db:
+                    return response(NODE_NOT_FOUND)
+                node = db[path]
+                if not isinstance(node, Dataset):
+                    return response(INVALID_ARGUMENT)
+                path = node.path
+            elif CMD_KW_CHUNKS in layout:
+                return response(INVALID_ARGUMENT,
+                                "chunks can only be changed for a dataset")
+            job_args = {CMD_KW_DB: db_name, CMD_KW_PATH: path}
+            job_args.update(layout)
+            job_id = JOBS.create(CMD_REPACK, db_path(db_name), job_args)
+            if job_id is None:
+                return response(FILE_BUSY)
+            status = ACCEPTED
+            data_response = {RESPONSE_JOB: job_id}
+        elif cmd == CMD_JOB_STATUS:
+            if CMD_KW_JOB not in args:
+                return response(MISSING_ARGUMENT)
+            data_response = JOBS.get(args[CMD_KW_JOB])
+            if data_response is None:
+                return response(INVALID_ARGUMENT)
+
+    elif cmd in TRANSFER_COMMANDS:  # copy data between datasets
+        if CMD_KW_DEST_PATH not in args:
+            return response(MISSING_ARGUMENT)
+        if cmd == CMD_COPY_DATASET:
+            if CMD_KW_DB not in args or CMD_KW_PATH not in args:
+                return response(MISSING_ARGUMENT)
+            sources = [(args[CMD_KW_DB], args[CMD_KW_PATH])]
+            dest_db = args.get(CMD_KW_DEST_DB, args[CMD_KW_DB])
+        else:
+            if not args.get(CMD_KW_SOURCES) or CMD_KW_DEST_DB not in args:
+                return response(MISSING_ARGUMENT)
+            sources = args[CMD_KW_SOURCES]
+            dest_db = args[CMD_KW_DEST_DB]
+        dest_path = args[CMD_KW_DEST_PATH]
+
+        if not isinstance(sources, (list, tuple)):
+            return response(INVALID_ARGUMENT, "sources must be a list")
+        for source in sources:
+            if (not isinstance(source, (list, tuple)) or len(source) != 2 or
+                    not all(isinstance(s, str) and len(s) > 0
+                            for s in source)):
+                return response(INVALID_ARGUMENT,
+                                "sources must be (db, path) pairs")
+        for db_name, path in sources:
+            if not db_exists(db_name):
+                return response(FILE_NOT_FOUND, db_name)
+            if path not in File(db_path(db_name), "r"):
+                return response(NODE_NOT_FOUND, path)
+        if (not isinstance(dest_db, str) or not isinstance(dest_path, str) or
+                len(dest_db) < 1 or len(dest_path) < 1):
+            return response(INVALID_ARGUMENT)
+        if not db_exists(dest_db):
+            return response(FILE_NOT_FOUND, dest_db)
+        overwrite = args.get(CMD_KW_OVERWRITE, False)
+
+        kwargs = {kw: args[kw] for kw in TRANSFER_KWARGS if kw in args}
+        try:
+            if cmd == CMD_COPY_DATASET:
+                data_response = copy_dataset(
+                    db_path(sources[0][0]), sources[0][1], db_path(dest_db),
+                    dest_path, key=args.get(CMD_KW_KEY, None),
+                    overwrite=overwrite, **kwargs)
+            else:
+                data_response = concat_datasets(
+                    [(db_path(db_name), path) for db_name, path in sources],
+                    db_path(dest_db), dest_path,
+                    axis=args.get(CMD_KW_AXIS, 0), overwrite=overwrite,
+                    **kwargs)
+        except DatasetExistsError as e:
+            return response(DATASET_EXISTS, str(e))
+        except KeyError as ke:
+            return response(NODE_NOT_FOUND, str(ke))
+        except TypeError as te:
+            return response(INVALID_ARGUMENT, str(te))
+        except (ValueError, IndexError) as e:
+            app_log.debug('Invalid copy: %s', e)
+            status = (INCOMPATIBLE_DATA if cmd == CMD_CONCAT_DATASETS
+                      else VALUE_ERROR)
+            return response(status, str(e))
 
     elif cmd in NODE_COMMANDS:  # Node related commands
         # Database name and path have to be defined
@@ -243,7 +768,7 @@ def handle_request(msg):
             else:
                 avail_kwargs = [CMD_KW_SHAPE, CMD_KW_DTYPE, CMD_KW_CHUNKS,
                                 CMD_KW_COMPRESSION, CMD_KW_COMPRESSION_OPTS,
-                                CMD_KW_FILLVALUE]
+                                CMD_KW_FILLVALUE, CMD_KW_MAXSHAPE]
                 kwargs = {kw: args[kw] for kw in avail_kwargs if kw in args}
                 try:
                     dst = db.create_dataset(name=path, data=data, **kwargs)
@@ -259,7 +784,8 @@ def handle_request(msg):
 
             avail_kwargs = [CMD_KW_SHAPE, CMD_KW_DTYPE, CMD_KW_CHUNKS,
                             CMD_KW_COMPRESSION, CMD_KW_COMPRESSION_OPTS,
-                            CMD_KW_FILLVALUE, CMD_KW_REQUIRE_EXACT]
+                            CMD_KW_FILLVALUE, CMD_KW_MAXSHAPE,
+                            CMD_KW_REQUIRE_EXACT]
             kwargs = {kw: args[kw] for kw in avail_kwargs if kw in args}
             try:
                 dst = db.require_dataset(name=path, data=data, **kwargs)
@@ -280,31 +806,72 @@ def handle_request(msg):
                 data_response = args[CMD_KW_KEY] in db
             elif cmd == CMD_GET_KEYS:
                 node = db[path]
-                if isinstance(node, Group):
+                if not isinstance(node, Group):
+                    return response(INVALID_ARGUMENT)
+                if any(kw in args for kw in PAGE_KWARGS):
+                    try:
+                        keys, cursor = node.keys_page(
+                            limit=args.get(CMD_KW_LIMIT, None),
+                            cursor=args.get(CMD_KW_CURSOR, None),
+                            prefix=args.get(CMD_KW_PREFIX, None))
+                    except ValueError as ve:
+                        return response(INVALID_ARGUMENT, str(ve))
+                    data_response = {
+                        RESPONSE_NODE_KEYS: keys,
+                        RESPONSE_CURSOR: cursor,
+                    }
+                else:
                     data_response = {
                         # without list() it does not work with py3 (returns a
                         # view on a closed hdf5 file)
                         RESPONSE_NODE_KEYS: list(node.keys())
                     }
-                elif isinstance(node, Dataset):
-                    return response(INVALID_ARGUMENT)
             elif cmd == CMD_GET_TREE:
                 node = db[path]
                 if isinstance(node, Group):
-                    tree = node.tree()
+                    try:
+                        tree, cursor = node.columns(
+                            depth=args.get(CMD_KW_DEPTH, None),
+                            attrs=args.get(CMD_KW_ATTRS, False),
+                            limit=args.get(CMD_KW_LIMIT, None),
+                            cursor=args.get(CMD_KW_CURSOR, None))
+                    except ValueError as ve:
+                        return response(INVALID_ARGUMENT, str(ve))
                     data_response = {
-                        RESPONSE_NODE_TREE: tree
+                        RESPONSE_NODE_TREE: tree,
+                        RESPONSE_CURSOR: cursor,
                     }
                 elif isinstance(node, Dataset):
                     return response(INVALID_ARGUMENT)
             elif cmd == CMD_SLICE_DATASET:
                 if CMD_KW_KEY not in args:
                     return response(MISSING_ARGUMENT)
+                resolution = args.get(CMD_KW_RESOLUTION, None)
                 try:
-                    data_response = db[path][args[CMD_KW_KEY]]
-                except ValueError as ve:
+                    if resolution is None:
+                        data_response = db[path][args[CMD_KW_KEY]]
+                    else:
+                        data_response, factor = db[path].read_resolution(
+                            args[CMD_KW_KEY], resolution)
+                except (ValueError, IndexError) as ve:
                     status = VALUE_ERROR
                     app_log.debug('Invalid slice: %s', ve)
+                except TypeError as te:
+                    return response(INVALID_ARGUMENT, str(te))
+                else:
+                    encoding = encoding_kwargs(args)
+                    if encoding:
+                        try:
+                            data_response = encode_result(data_response,
+                                                          encoding)
+                        except TypeError as te:
+                            return response(INVALID_ARGUMENT, str(te))
+                        except ValueError as ve:
+                            return response(VALUE_ERROR, str(ve))
+                    if resolution is not None:
+                        if not encoding:
+                            data_response = {RESPONSE_DATA: data_response}
+                        data_response[RESPONSE_RESOLUTION] = factor
 
             elif cmd == CMD_BROADCAST_DATASET:
                 if data is None:
@@ -313,18 +880,79 @@ def handle_request(msg):
                     return response(MISSING_ARGUMENT)
                 try:
                     db[path][args[CMD_KW_KEY]] = data
-                except ValueError as ve:
+                except (ValueError, IndexError) as ve:
                     status = VALUE_ERROR
                     app_log.debug('Invalid slice: %s', ve)
                 except TypeError as te:
                     status = TYPE_ERROR
                     app_log.debug('Invalid broacdcast: %s', te)
 
+            elif cmd == CMD_APPEND_DATASET:
+                if data is None:
+                    return response(MISSING_DATA)
+                node = db[path]
+                if not isinstance(node, Dataset):
+                    return response(INVALID_ARGUMENT)
+                axis = args.get(CMD_KW_AXIS, 0)
+                try:
+                    shape, chunk_length = node.append(data, axis=axis)
+                except TypeError as te:
+                    return response(TYPE_ERROR, str(te))
+                except ValueError as ve:
+                    return response(INCOMPATIBLE_DATA, str(ve))
+                data_response = {
+                    RESPONSE_NODE_SHAPE: shape,
+                    RESPONSE_LENGTH: shape[axis],
+                    RESPONSE_CHUNK_LENGTH: chunk_length,
+                }
+
+            elif cmd in (CMD_CREATE_PYRAMID, CMD_DELETE_PYRAMID,
+                         CMD_UPDATE_PYRAMID):
+                node = db[path]
+                if not isinstance(node, Dataset):
+                    return response(INVALID_ARGUMENT)
+                if cmd == CMD_CREATE_PYRAMID:
+                    try:
+                        node.create_pyramid(
+                            factor=args.get(CMD_KW_FACTOR, 2),
+                            levels=args.get(CMD_KW_LEVELS, None),
+                            axes=args.get(CMD_KW_AXES, None))
+                    except ValueError as ve:
+                        return response(VALUE_ERROR, str(ve))
+                    status = CREATED
+                elif cmd == CMD_DELETE_PYRAMID:
+                    node.delete_pyramid()
+                # check with a read lock first, updates are usually no-ops
+                elif node.pyramid_dirty():
+                    node.update_pyramid()
+
+            elif cmd == CMD_READ_CHUNKS:
+                if CMD_KW_KEY not in args:
+                    return response(MISSING_ARGUMENT)
+                node = db[path]
+                if not isinstance(node, Dataset):
+                    return response(INVALID_ARGUMENT)
+                try:
+                    data_response = node.read_chunks(args[CMD_KW_KEY])
+                except TypeError as te:
+                    return response(INVALID_ARGUMENT, str(te))
+                except (ValueError, IndexError) as ve:
+                    return response(VALUE_ERROR, str(ve))
+
+            elif cmd == CMD_CHUNK_ADVICE:
+                node = db[path]
+                if not isinstance(node, Dataset):
+                    return response(INVALID_ARGUMENT)
+                histogram = node.access_stats()
+                if not histogram or not histogram[STATS_PATTERNS]:
+                    return response(MISSING_DATA)
+                data_response = advise(histogram)
+
             elif cmd == CMD_ATTRIBUTES_SET:
                 if CMD_KW_KEY not in args:
                     return response(MISSING_ARGUMENT)
                 key = args[CMD_KW_KEY]
-                if len(key) < 1:
+                if len(key) < 1 or key.startswith(INTERNAL_ATTR_PREFIX):
                     return response(INVALID_ARGUMENT)
                 if data is not None:
                     db[path].attrs[key] = data
@@ -349,6 +977,30 @@ def handle_request(msg):
                 data_response = {
                     RESPONSE_ATTRS_KEYS: db[path].attrs.keys()
                 }
+            elif cmd == CMD_ATTRIBUTES_ITEMS:
+                data_response = db[path].attrs.items()
+            elif cmd == CMD_ATTRIBUTES_UPDATE:
+                if data is None:
+                    return response(MISSING_DATA)
+                if not isinstance(data, dict) or \
+                        any(not isinstance(key, str) or len(key) < 1
+                            for key in data):
+                    return response(INVALID_ARGUMENT)
+                if any(key.startswith(INTERNAL_ATTR_PREFIX) for key in data):
+                    return response(INVALID_ARGUMENT)
+                try:
+                    db[path].attrs.update(data)
+                except (TypeError, ValueError) as te:
+                    return response(TYPE_ERROR, str(te))
+            elif cmd == CMD_ATTRIBUTES_COLLECT:
+                if CMD_KW_KEY not in args:
+                    return response(MISSING_ARGUMENT)
+                node = db[path]
+                if not isinstance(node, Group):
+                    return response(INVALID_ARGUMENT)
+                data_response = node.collect_attrs(args[CMD_KW_KEY])
+    elif cmd == CMD_GET_CHANGES:
+        return get_changes(args)
     else:
         status = UNKNOWN_COMMAND
 
@@ -29,6 +29,7 @@ from __future__ import absolute_import, division, print_function, with_statement
 
 import collections
 import errno
+import itertools
 import numbers
 import os
 import re
@@ -80,6 +81,10 @@ if sys.platform == 'darwin':
 # More non-portable errnos:
 _ERRNO_INPROGRESS = (errno.EINPROGRESS,)
 
+# Maximum number of buffers passed to a single sendmsg() call (must not
+# exceed IOV_MAX, which is 1024 on Linux)
+_SENDMSG_MAX_BUFFERS = 512
+
 if hasattr(errno, "WSAEINPROGRESS"):
     _ERRNO_INPROGRESS += (errno.WSAEINPROGRESS,)  # type: ignore
 
@@ -164,10 +169,17 @@ class BaseIOStream(object):
         self._read_buffer_size = 0
         self._write_buffer_size = 0
         self._write_buffer_frozen = False
+        # Whether write_buffers_to_fd() is supported. The write buffer then
+        # holds memoryviews of the written data instead of copies.
+        self._scatter_gather = False
         self._read_delimiter = None
         self._read_regex = None
         self._read_max_bytes = None
         self._read_bytes = None
+        # Preallocated buffer filled by read_bytes_into() and the number
+        # of bytes already in it.
+        self._read_target = None
+        self._read_target_pos = 0
         self._read_partial = False
         self._read_until_close = False
         self._read_callback = None
@@ -207,6 +219,15 @@ class BaseIOStream(object):
         """
         raise NotImplementedError()
 
+    def write_buffers_to_fd(self, buffers):
+        """Attempts to write a list of buffers to the underlying file
+        with a single (scatter-gather) call.
+
+        Only called if ``_scatter_gather`` is true. Returns the number of
+        bytes written.
+        """
+        raise NotImplementedError()
+
     def read_from_fd(self):
         """Attempts to read from the underlying file.
 
@@ -217,6 +238,17 @@ class BaseIOStream(object):
         """
         raise NotImplementedError()
 
+    def read_into_fd(self, buf):
+        """Attempts to read from the underlying file into the writable
+        buffer ``buf``.
+
+        Returns ``None`` if there was nothing to read (the socket
+        returned `~errno.EWOULDBLOCK` or equivalent), otherwise
+        returns the number of bytes read.  Never reads more than
+        ``len(buf)`` bytes.
+        """
+        raise NotImplementedError()
+
     def get_fd_error(self):
         """Returns information about any error on the underlying file.
 
@@ -322,6 +354,42 @@ class BaseIOStream(object):
             raise
         return future
 
+    def read_bytes_into(self, num_bytes, callback=None):
+        """Asynchronously read exactly ``num_bytes`` into a new buffer.
+
+        Unlike `read_bytes`, the data is not collected in chunks and
+        joined at the end: a single ``bytearray`` of ``num_bytes`` is
+        allocated up front and filled directly from the file (using
+        `read_into_fd`).  This avoids one allocation per received chunk
+        and the final copy for large reads of a known size.
+
+        The result is the ``bytearray``.  If a callback is given, it will
+        be run with the buffer as an argument; if not, this method returns
+        a `.Future`.
+        """
+        future = self._set_read_callback(callback)
+        assert isinstance(num_bytes, numbers.Integral)
+        if num_bytes > self.max_buffer_size:
+            # Fails the read with a StreamClosedError, like exceeding
+            # the buffer size in read_bytes().
+            gen_log.error("Reached maximum read buffer size")
+            self.close()
+            return future
+        target = bytearray(num_bytes)
+        # Take what has already been buffered by previous reads.
+        pos = min(num_bytes, self._read_buffer_size)
+        if pos:
+            target[:pos] = self._consume(pos)
+        self._read_target = target
+        self._read_target_pos = pos
+        try:
+            self._try_inline_read()
+        except:
+            if future is not None:
+                future.add_done_callback(lambda f: f.exception())
+            raise
+        return future
+
     def read_until_close(self, callback=None, streaming_callback=None):
         """Asynchronously reads all data from the socket until it is closed.
 
@@ -375,20 +443,44 @@ class BaseIOStream(object):
             Now returns a `.Future` if no callback is given.
         """
         assert isinstance(data, bytes)
+        return self.write_buffers([data], callback=callback)
+
+    def write_buffers(self, buffers, callback=None):
+        """Asynchronously write a sequence of buffers (``bytes``,
+        `memoryview` or other objects supporting the buffer protocol) to
+        this stream, like `write` does for a single string.
+
+        If the stream supports scatter-gather I/O (plain sockets), the
+        buffers are not copied or joined: they are kept (as memoryviews)
+        until they have been sent with ``sendmsg``. The caller must not
+        modify them before the write has completed. Other streams join
+        the buffers.
+        """
         self._check_closed()
+        if not self._scatter_gather:
+            buffers = [b''.join(buffers)]
+        else:
+            buffers = [memoryview(buf).cast('B') for buf in buffers]
+        size = sum(len(buf) for buf in buffers)
         # We use bool(_write_buffer) as a proxy for write_buffer_size>0,
         # so never put empty strings in the buffer.
-        if data:
+        if size:
             if (self.max_write_buffer_size is not None and
-                    self._write_buffer_size + len(data) > self.max_write_buffer_size):
+                    self._write_buffer_size + size > self.max_write_buffer_size):
                 raise StreamBufferFullError("Reached maximum write buffer size")
-            # Break up large contiguous strings before inserting them in the
-            # write buffer, so we don't have to recopy the entire thing
-            # as we slice off pieces to send to the socket.
-            WRITE_BUFFER_CHUNK_SIZE = 128 * 1024
-            for i in range(0, len(data), WRITE_BUFFER_CHUNK_SIZE):
-                self._write_buffer.append(data[i:i + WRITE_BUFFER_CHUNK_SIZE])
-            self._write_buffer_size += len(data)
+            for data in buffers:
+                if self._scatter_gather:
+                    if data:
+                        self._write_buffer.append(data)
+                    continue
+                # Break up large contiguous strings before inserting them in
+                # the write buffer, so we don't have to recopy the entire
+                # thing as we slice off pieces to send to the socket.
+                WRITE_BUFFER_CHUNK_SIZE = 128 * 1024
+                for i in range(0, len(data), WRITE_BUFFER_CHUNK_SIZE):
+                    self._write_buffer.append(
+                        data[i:i + WRITE_BUFFER_CHUNK_SIZE])
+            self._write_buffer_size += size
         if callback is not None:
             self._write_callback = stack_context.wrap(callback)
             future = None
@@ -677,10 +769,10 @@ class BaseIOStream(object):
                 assert callback is None
                 future = self._read_future
                 self._read_future = None
-                future.set_result(self._consume(size))
+                future.set_result(self._consume_read(size))
         if callback is not None:
             assert (self._read_future is None) or streaming
-            self._run_callback(callback, self._consume(size))
+            self._run_callback(callback, self._consume_read(size))
         else:
             # If we scheduled a callback, we will add the error listener
             # afterwards.  If we didn't, we have to do it now.
@@ -728,7 +820,11 @@ class BaseIOStream(object):
         """
         while True:
             try:
-                chunk = self.read_from_fd()
+                if self._read_target is not None:
+                    view = memoryview(self._read_target)
+                    chunk = self.read_into_fd(view[self._read_target_pos:])
+                else:
+                    chunk = self.read_from_fd()
             except (socket.error, IOError, OSError) as e:
                 if errno_from_exception(e) == errno.EINTR:
                     continue
@@ -744,6 +840,9 @@ class BaseIOStream(object):
             break
         if chunk is None:
             return 0
+        if self._read_target is not None:
+            self._read_target_pos += chunk
+            return chunk
         self._read_buffer.append(chunk)
         self._read_buffer_size += len(chunk)
         if self._read_buffer_size > self.max_buffer_size:
@@ -777,7 +876,11 @@ class BaseIOStream(object):
         Returns a position in the buffer if the current read can be satisfied,
         or None if it cannot.
         """
-        if (self._read_bytes is not None and
+        if self._read_target is not None:
+            if self._read_target_pos == len(self._read_target):
+                return 0
+            return None
+        elif (self._read_bytes is not None and
             (self._read_buffer_size >= self._read_bytes or
              (self._read_partial and self._read_buffer_size > 0))):
             num_bytes = min(self._read_bytes, self._read_buffer_size)
@@ -828,6 +931,14 @@ class BaseIOStream(object):
     def _handle_write(self):
         while self._write_buffer:
             try:
+                if self._scatter_gather:
+                    buffers = list(itertools.islice(self._write_buffer,
+                                                    _SENDMSG_MAX_BUFFERS))
+                    num_bytes = self.write_buffers_to_fd(buffers)
+                    if num_bytes == 0:
+                        break
+                    self._consume_write_buffer(num_bytes)
+                    continue
                 if not self._write_buffer_frozen:
                     # On windows, socket.send blows up if given a
                     # write buffer that's too large, instead of just
@@ -874,6 +985,31 @@ class BaseIOStream(object):
                 self._write_future = None
                 future.set_result(None)
 
+    def _consume_write_buffer(self, num_bytes):
+        """Remove ``num_bytes`` sent bytes from the (scatter-gather) write
+        buffer. Partially sent buffers are replaced by a memoryview of the
+        remainder.
+        """
+        self._write_buffer_size -= num_bytes
+        while num_bytes:
+            data = self._write_buffer[0]
+            if len(data) > num_bytes:
+                self._write_buffer[0] = data[num_bytes:]
+                return
+            self._write_buffer.popleft()
+            num_bytes -= len(data)
+
+    def _consume_read(self, loc):
+        # Completes a read: hands out the preallocated buffer of
+        # read_bytes_into() if there is one, otherwise the first ``loc``
+        # bytes of the read buffer.
+        if self._read_target is None:
+            return self._consume(loc)
+        target = self._read_target
+        self._read_target = None
+        self._read_target_pos = 0
+        return target
+
     def _consume(self, loc):
         if loc == 0:
             return b""
@@ -995,6 +1131,7 @@ class IOStream(BaseIOStream):
         self.socket = socket
         self.socket.setblocking(False)
         super(IOStream, self).__init__(*args, **kwargs)
+        self._scatter_gather = hasattr(self.socket, 'sendmsg')
 
     def fileno(self):
         return self.socket
@@ -1021,9 +1158,25 @@ class IOStream(BaseIOStream):
             return None
         return chunk
 
+    def read_into_fd(self, buf):
+        try:
+            num_bytes = self.socket.recv_into(buf)
+        except socket.error as e:
+            if e.args[0] in _ERRNO_WOULDBLOCK:
+                return None
+            else:
+                raise
+        if not num_bytes:
+            self.close()
+            return None
+        return num_bytes
+
     def write_to_fd(self, data):
         return self.socket.send(data)
 
+    def write_buffers_to_fd(self, buffers):
+        return self.socket.sendmsg(buffers)
+
     def connect(self, address, callback=None, server_hostname=None):
         """Connects the socket to a remote address without blocking.
 
@@ -1229,6 +1382,8 @@ class SSLIOStream(IOStream):
         """
         self._ssl_options = kwargs.pop('ssl_options', _client_ssl_defaults)
         super(SSLIOStream, self).__init__(*args, **kwargs)
+        # SSL sockets do not support sendmsg()
+        self._scatter_gather = False
         self._ssl_accepting = True
         self._handshake_reading = False
         self._handshake_writing = False
@@ -1452,6 +1607,27 @@ class SSLIOStream(IOStream):
             return None
         return chunk
 
+    def read_into_fd(self, buf):
+        if self._ssl_accepting:
+            return None
+        try:
+            # Like read(), but decrypts into the given buffer.
+            num_bytes = self.socket.read(len(buf), buf)
+        except ssl.SSLError as e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                return None
+            else:
+                raise
+        except socket.error as e:
+            if e.args[0] in _ERRNO_WOULDBLOCK:
+                return None
+            else:
+                raise
+        if not num_bytes:
+            self.close()
+            return None
+        return num_bytes
+
     def _is_connreset(self, e):
         if isinstance(e, ssl.SSLError) and e.args[0] == ssl.SSL_ERROR_EOF:
             return True
@@ -1498,6 +1674,22 @@ class PipeIOStream(BaseIOStream):
             return None
         return chunk
 
+    def read_into_fd(self, buf):
+        try:
+            num_bytes = os.readv(self.fd, [buf])
+        except (IOError, OSError) as e:
+            if errno_from_exception(e) in _ERRNO_WOULDBLOCK:
+                return None
+            elif errno_from_exception(e) == errno.EBADF:
+                self.close(exc_info=True)
+                return None
+            else:
+                raise
+        if not num_bytes:
+            self.close()
+            return None
+        return num_bytes
+
 
 def _double_prefix(deque):
     """Grow by doubling, but don't split the second chunk just because the
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# Copyright 2012 Facebook
+# Modifications copyright 2016 Meteotest
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Bridges between the `asyncio` module and the `.IOLoop`.
+
+`AsyncIOLoop` runs the `.IOLoop` interface on top of an asyncio event
+loop, so that code written for the `.IOLoop` (`.IOStream`, timeouts,
+`.PeriodicCallback`, `.gen.coroutine`) and native asyncio code (protocols,
+``async def`` coroutines) can be mixed in one process. `to_asyncio_future`
+and `to_hurray_future` convert futures between the two worlds.
+"""
+from __future__ import absolute_import, division, print_function, with_statement
+
+import asyncio
+import functools
+
+from hurray.server import stack_context
+from hurray.server.concurrent import Future, chain_future
+from hurray.server.gen import convert_yielded
+from hurray.server.ioloop import IOLoop
+
+
+class BaseAsyncIOLoop(IOLoop):
+    def initialize(self, asyncio_loop, close_loop=False, **kwargs):
+        super(BaseAsyncIOLoop, self).initialize(**kwargs)
+        self.asyncio_loop = asyncio_loop
+        self.close_loop = close_loop
+        # Maps fd to (fileobj, handler function) pair (as in
+        # IOLoop.add_handler)
+        self.handlers = {}
+        # Set of fds listening for reads/writes
+        self.readers = set()
+        self.writers = set()
+        self.closing = False
+
+    def close(self, all_fds=False):
+        self.closing = True
+        for fd in list(self.handlers):
+            fileobj, handler_func = self.handlers[fd]
+            self.remove_handler(fd)
+            if all_fds:
+                self.close_fd(fileobj)
+        if self.close_loop:
+            self.asyncio_loop.close()
+
+    def add_handler(self, fd, handler, events):
+        fd, fileobj = self.split_fd(fd)
+        if fd in self.handlers:
+            raise ValueError("fd %s added twice" % fd)
+        self.handlers[fd] = (fileobj, stack_context.wrap(handler))
+        if events & IOLoop.READ:
+            self.asyncio_loop.add_reader(
+                fd, self._handle_events, fd, IOLoop.READ)
+            self.readers.add(fd)
+        if events & IOLoop.WRITE:
+            self.asyncio_loop.add_writer(
+                fd, self._handle_events, fd, IOLoop.WRITE)
+            self.writers.add(fd)
+
+    def update_handler(self, fd, events):
+        fd, fileobj = self.split_fd(fd)
+        if events & IOLoop.READ:
+            if fd not in self.readers:
+                self.asyncio_loop.add_reader(
+                    fd, self._handle_events, fd, IOLoop.READ)
+                self.readers.add(fd)
+        else:
+            if fd in self.readers:
+                self.asyncio_loop.remove_reader(fd)
+                self.readers.remove(fd)
+        if events & IOLoop.WRITE:
+            if fd not in self.writers:
+                self.asyncio_loop.add_writer(
+                    fd, self._handle_events, fd, IOLoop.WRITE)
+                self.writers.add(fd)
+        else:
+            if fd in self.writers:
+                self.asyncio_loop.remove_writer(fd)
+                self.writers.remove(fd)
+
+    def remove_handler(self, fd):
+        fd, fileobj = self.split_fd(fd)
+        if fd not in self.handlers:
+            return
+        if fd in self.readers:
+            self.asyncio_loop.remove_reader(fd)
+            self.readers.remove(fd)
+        if fd in self.writers:
+            self.asyncio_loop.remove_writer(fd)
+            self.writers.remove(fd)
+        del self.handlers[fd]
+
+    def _handle_events(self, fd, events):
+        fileobj, handler_func = self.handlers[fd]
+        handler_func(fileobj, events)
+
+    def start(self):
+        old_current = IOLoop.current(instance=False)
+        try:
+            self._setup_logging()
+            self.make_current()
+            asyncio.set_event_loop(self.asyncio_loop)
+            self.asyncio_loop.run_forever()
+        finally:
+            if old_current is None:
+                IOLoop.clear_current()
+            else:
+                old_current.make_current()
+
+    def stop(self):
+        self.asyncio_loop.stop()
+
+    def call_at(self, when, callback, *args, **kwargs):
+        # asyncio.call_at supports *args but not **kwargs, so bind them here.
+        # We do not synchronize self.time and asyncio_loop.time, so
+        # convert from absolute to relative.
+        return self.asyncio_loop.call_later(
+            max(0, when - self.time()), self._run_callback,
+            functools.partial(stack_context.wrap(callback), *args, **kwargs))
+
+    def remove_timeout(self, timeout):
+        timeout.cancel()
+
+    def add_callback(self, callback, *args, **kwargs):
+        if self.closing:
+            # TODO: this is racy; we need a lock to ensure that the
+            # loop isn't closed during call_soon_threadsafe.
+            raise RuntimeError("IOLoop is closing")
+        self.asyncio_loop.call_soon_threadsafe(
+            self._run_callback,
+            functools.partial(stack_context.wrap(callback), *args, **kwargs))
+
+    add_callback_from_signal = add_callback
+
+
+class AsyncIOLoop(BaseAsyncIOLoop):
+    """`.IOLoop` running on a new asyncio event loop of its own.
+
+    The asyncio loop is available as ``asyncio_loop`` (e.g., to start
+    asyncio servers before `start` is called) and is closed together with
+    the `.IOLoop`. Install it with `.IOLoop.install` to use it as the
+    process's main loop.
+    """
+    def initialize(self, **kwargs):
+        loop = asyncio.new_event_loop()
+        try:
+            super(AsyncIOLoop, self).initialize(loop, close_loop=True,
+                                                **kwargs)
+        except Exception:
+            # If initialize() does not succeed (taking ownership of the loop),
+            # we have to close it.
+            loop.close()
+            raise
+
+
+def to_hurray_future(asyncio_future):
+    """Convert an `asyncio.Future` to a `hurray.server.concurrent.Future`."""
+    f = Future()
+    chain_future(asyncio_future, f)
+    return f
+
+
+def to_asyncio_future(hurray_future):
+    """Convert a `hurray.server.concurrent.Future` (or anything else
+    `.gen.coroutine` may yield) to an `asyncio.Future`.
+    """
+    hurray_future = convert_yielded(hurray_future)
+    af = asyncio.Future()
+    chain_future(hurray_future, af)
+    return af
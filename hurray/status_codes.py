@@ -27,6 +27,7 @@
 OK = 100
 CREATED = 101
 UPDATED = 102
+ACCEPTED = 103  # a background job was started
 
 # 2xx: Message error
 UNKNOWN_COMMAND = 200
@@ -38,6 +39,10 @@ INCOMPATIBLE_DATA = 204  # incompatible shape and/or dtype
 # 3xx: Database Error
 FILE_EXISTS = 300
 FILE_NOT_FOUND = 301
+FILE_BUSY = 302  # another job is working on the file
+READ_ONLY = 303  # writes are not accepted by a replica
+CHANGES_EXPIRED = 304  # the change log does not reach back far enough
+REPLICA_LAG = 305  # a replica did not catch up with the requested change
 
 # 4xx: Node Error
 GROUP_EXISTS = 400
@@ -50,3 +55,4 @@ KEY_ERROR = 405
 # 5xx: Server Error
 INTERNAL_SERVER_ERROR = 500
 NOT_IMPLEMENTED = 501
+NODE_UNAVAILABLE = 502  # a node of a proxy can't be reached
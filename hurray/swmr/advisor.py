@@ -0,0 +1,241 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Chunk layout advice based on the access statistics of a dataset (see
+hurray.swmr.stats).
+
+The cost of a request is modelled as the number of chunks it touches times
+the size of a chunk plus a fixed per-chunk overhead (lookup, I/O call,
+decompression). For a selection with extent ``e`` along an axis of chunk
+length ``c``, the expected number of chunks touched along that axis is
+``(e - 1) / c + 1`` (assuming selections are not aligned with chunks). The
+recommended chunk shape minimizes the total cost of the recorded requests by
+coordinate descent over candidate chunk lengths (powers of two and the
+extents of the recorded selections).
+"""
+
+import math
+
+from .stats import (STATS_SHAPE, STATS_CHUNKS, STATS_ITEMSIZE, STATS_PATTERNS,
+                    READ)
+
+# per-chunk overhead of a request (in bytes)
+CHUNK_OVERHEAD = 64 * 1024
+
+# bounds for the size of recommended chunks (in bytes)
+MIN_CHUNK_BYTES = 8 * 1024
+MAX_CHUNK_BYTES = 4 * 1024 * 1024
+
+# default size of the HDF5 chunk cache
+DEFAULT_CACHE_NBYTES = 1024 * 1024
+
+# patterns accounting for less than this fraction of the requests are
+# ignored when sizing the chunk cache
+CACHE_MIN_SHARE = 0.05
+
+# keys of the advice
+ADVICE_REQUESTS = 'requests'
+ADVICE_CHUNKS = 'chunks'
+ADVICE_CHUNKS_PER_REQUEST = 'chunks_per_request'
+ADVICE_READ_AMPLIFICATION = 'read_amplification'
+ADVICE_RECOMMENDED_CHUNKS = 'recommended_chunks'
+ADVICE_EXPECTED_CHUNKS_PER_REQUEST = 'expected_chunks_per_request'
+ADVICE_EXPECTED_READ_AMPLIFICATION = 'expected_read_amplification'
+ADVICE_CHUNK_REDUCTION = 'chunk_reduction'
+ADVICE_CACHE_NBYTES = 'cache_nbytes'
+ADVICE_CACHE_NSLOTS = 'cache_nslots'
+ADVICE_PATTERNS = 'patterns'
+
+
+def _prod(values):
+    result = 1
+    for v in values:
+        result *= v
+    return result
+
+
+def _next_prime(n):
+    n = max(2, n)
+    while any(n % d == 0 for d in range(2, int(math.sqrt(n)) + 1)):
+        n += 1
+    return n
+
+
+def _summary(histogram):
+    """
+    Summarize the patterns of a histogram as a list of tuples
+    (kind, count, chunks touched, elements, mean extents)
+    """
+    result = []
+    for pattern, counts in histogram[STATS_PATTERNS].items():
+        count, touched, elements = counts[:3]
+        extents = tuple(s / count for s in counts[3:])
+        result.append((pattern[0], count, touched, elements, extents))
+    return result
+
+
+def expected_chunks(extents, shape, chunks):
+    """
+    Expected number of chunks touched by a selection with the given extents
+    """
+    total = 1.
+    for e, n, c in zip(extents, shape, chunks):
+        if e <= 0:
+            return 0.
+        total *= min(math.ceil(n / c), (e - 1) / c + 1)
+    return total
+
+
+def _cost(summary, shape, chunks, chunk_bytes):
+    return sum(count * expected_chunks(extents, shape, chunks)
+               for _, count, _, _, extents in summary) * \
+        (chunk_bytes + CHUNK_OVERHEAD)
+
+
+def recommend_chunks(summary, shape, itemsize, start):
+    """
+    Chunk shape minimizing the modelled cost of the recorded requests
+
+    Args:
+        summary: see _summary()
+        shape: shape of the dataset
+        itemsize: size of an element in bytes
+        start: initial chunk shape
+    """
+    candidates = []
+    for axis, n in enumerate(shape):
+        n = max(n, 1)
+        lengths = {n}
+        length = 1
+        while length < n:
+            lengths.add(length)
+            length *= 2
+        for pattern in summary:
+            e = int(math.ceil(pattern[4][axis]))
+            if 0 < e <= n:
+                lengths.add(e)
+        candidates.append(sorted(lengths))
+
+    def cost(chunks):
+        chunk_bytes = _prod(chunks) * itemsize
+        penalty = 0
+        if chunk_bytes > MAX_CHUNK_BYTES:
+            penalty = float('inf')
+        elif chunk_bytes < MIN_CHUNK_BYTES and \
+                _prod(shape) * itemsize > MIN_CHUNK_BYTES:
+            penalty = float('inf')
+        return _cost(summary, shape, chunks, chunk_bytes) + penalty
+
+    best = [max(1, min(c, max(n, 1))) for c, n in zip(start, shape)]
+    # make sure that we start with a valid layout
+    while _prod(best) * itemsize > MAX_CHUNK_BYTES:
+        axis = best.index(max(best))
+        best[axis] = max(1, best[axis] // 2)
+    best_cost = cost(best)
+    for _ in range(10):
+        improved = False
+        for axis in range(len(shape)):
+            for length in candidates[axis]:
+                chunks = best[:axis] + [length] + best[axis + 1:]
+                c = cost(chunks)
+                if c < best_cost:
+                    best, best_cost, improved = chunks, c, True
+        if not improved:
+            break
+
+    return tuple(best)
+
+
+def advise(histogram):
+    """
+    Report the read amplification of the current chunk layout and recommend
+    a chunk shape and chunk cache size.
+
+    Args:
+        histogram: access statistics of a dataset (see hurray.swmr.stats)
+
+    Returns:
+        dict (see ADVICE_* for the keys)
+    """
+    shape = histogram[STATS_SHAPE]
+    chunks = histogram[STATS_CHUNKS]
+    itemsize = histogram[STATS_ITEMSIZE]
+    summary = _summary(histogram)
+    requests = sum(p[1] for p in summary)
+    reads = [p for p in summary if p[0] == READ] or summary
+    read_elements = max(1, sum(p[3] for p in reads)) * itemsize
+
+    # current layout (measured)
+    touched = sum(p[2] for p in summary)
+    if chunks is None:
+        amplification = 1.
+        start = tuple(max(1, int(math.ceil(e))) for e in
+                      max(summary, key=lambda p: p[1])[4])
+        current_cost = None
+    else:
+        chunk_bytes = _prod(chunks) * itemsize
+        amplification = sum(p[2] for p in reads) * chunk_bytes / read_elements
+        start = chunks
+        current_cost = _cost(summary, shape, chunks, chunk_bytes)
+
+    recommended = recommend_chunks(summary, shape, itemsize, start)
+    recommended_bytes = _prod(recommended) * itemsize
+    if current_cost is not None and \
+            _cost(summary, shape, recommended, recommended_bytes) >= \
+            current_cost:
+        recommended, recommended_bytes = tuple(chunks), chunk_bytes
+    expected = sum(p[1] * expected_chunks(p[4], shape, recommended)
+                   for p in summary)
+    expected_amplification = sum(
+        p[1] * expected_chunks(p[4], shape, recommended)
+        for p in reads) * recommended_bytes / read_elements
+
+    # the cache should hold the chunks of one request, so that subsequent
+    # requests for neighbouring selections find their chunks in the cache
+    cache_chunks = max([expected_chunks(p[4], shape, recommended)
+                        for p in summary
+                        if p[1] >= CACHE_MIN_SHARE * requests] or [1])
+    cache_nbytes = max(DEFAULT_CACHE_NBYTES,
+                       int(math.ceil(cache_chunks)) * recommended_bytes)
+    mb = 1024 * 1024
+    cache_nbytes = int(math.ceil(cache_nbytes / mb)) * mb
+    # HDF5 recommends about 100 hash slots per chunk in the cache
+    cache_nslots = _next_prime(100 * max(1, cache_nbytes // recommended_bytes))
+
+    return {
+        ADVICE_REQUESTS: requests,
+        ADVICE_CHUNKS: chunks,
+        ADVICE_CHUNKS_PER_REQUEST: touched / requests,
+        ADVICE_READ_AMPLIFICATION: amplification,
+        ADVICE_RECOMMENDED_CHUNKS: recommended,
+        ADVICE_EXPECTED_CHUNKS_PER_REQUEST: expected / requests,
+        ADVICE_EXPECTED_READ_AMPLIFICATION: expected_amplification,
+        ADVICE_CHUNK_REDUCTION: 1. - expected / max(touched, 1),
+        ADVICE_CACHE_NBYTES: cache_nbytes,
+        ADVICE_CACHE_NSLOTS: cache_nslots,
+        ADVICE_PATTERNS: [(kind, extents, count, touched / count)
+                          for kind, count, touched, _, extents in
+                          sorted(summary, key=lambda p: -p[1])],
+    }
@@ -32,17 +32,146 @@ method (decorated by @reader or @writer) must *not* call other synchronized
 methods, otherwise we get a deadlock!
 """
 
+import math
 import os
+import time
 
 import h5py
+import numpy as np
 
+from . import direct, journal, listing, mapped, pyramid
+from .lock import ACCESS_STATS
+from .selection import expand_key
+from .stats import WRITE
 from .sync import reader, writer
+from hurray import trace
 from hurray.server.log import app_log
 
+# attributes and nodes used internally by hurray start with this prefix (they
+# are not listed by AttributeManager.keys() and Group.keys(), and internal
+# attributes cannot be read through an AttributeManager)
+INTERNAL_ATTR_PREFIX = '__hurray'
+
+# attribute holding the append axis and the logical length of datasets that
+# are extended with Dataset.append()
+APPEND_ATTR = '__hurray_append__'
+
+# growth factor for the allocated size of appendable datasets
+APPEND_GROWTH = 2
+
+# columns of the tree returned by Group.columns()
+TREE_NAMES = 'names'
+TREE_PARENTS = 'parents'
+TREE_TYPES = 'types'
+TREE_SHAPES = 'shapes'
+TREE_DTYPES = 'dtypes'
+TREE_CHUNKS = 'chunks'
+TREE_ATTRS = 'attrs'
+
+# values of the TREE_TYPES column
+TREE_GROUP = 0
+TREE_DATASET = 1
+
 # TODO Note that self.file must never be (accidentally) modified because the
 # whole @reader/@writer synchronization relies on it!
 
 
+def open_file(name, mode='r'):
+    """
+    h5py.File(name, mode), timed if the request is traced (see hurray.trace)
+    """
+    if not trace.active():
+        return h5py.File(name, mode)
+    start = time.monotonic()
+    f = h5py.File(name, mode)
+    trace.add(trace.OPEN, start)
+    return f
+
+
+def _internal(key):
+    """
+    Whether ``key`` names an internal attribute
+    """
+    return isinstance(key, str) and key.startswith(INTERNAL_ATTR_PREFIX)
+
+
+def logical_shape(dst):
+    """
+    Shape of an h5py dataset as seen by clients. For datasets that are
+    extended with Dataset.append(), the allocated size along the append
+    axis may be larger than the number of appended elements.
+    """
+    shape = dst.shape
+    if APPEND_ATTR in dst.attrs:
+        axis, length = dst.attrs[APPEND_ATTR]
+        shape = shape[:axis] + (int(length),) + shape[axis + 1:]
+    return shape
+
+
+def logical_key(dst, key):
+    """
+    Resolve ``key`` against the logical shape of an h5py dataset (see
+    logical_shape()), so that negative indices and open slices do not
+    reach into the allocated but unused part of an appended dataset.
+
+    Raises:
+        IndexError if an index is out of range
+    """
+    if APPEND_ATTR not in dst.attrs:
+        return key
+    shape = logical_shape(dst)
+    try:
+        slices, squeeze = expand_key(key, shape)
+    except TypeError:  # e.g., fancy indexing
+        return _fancy_key(key, shape)
+    return tuple(s.start if axis in squeeze else s
+                 for axis, s in enumerate(slices))
+
+
+def _fancy_key(key, shape):
+    """
+    Resolve the slices and integer indices of a fancy selection against
+    ``shape`` and check the bounds of its index lists
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+    if ellipsis:
+        pos = ellipsis[0]
+        key = key[:pos] + (slice(None),) * (len(shape) - len(key) + 1) + \
+            key[pos + 1:]
+    if len(key) > len(shape):
+        raise IndexError("{} indexing arguments for {} dimensions"
+                         .format(len(key), len(shape)))
+    resolved = []
+    for axis, (k, n) in enumerate(zip(key, shape)):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(n)
+            resolved.append(slice(start, max(start, stop), step))
+            continue
+        indices = np.asarray(k)
+        if indices.dtype == bool:
+            if indices.shape != (n,):
+                raise IndexError("boolean index of length {} for axis {} "
+                                 "with size {}".format(len(indices), axis, n))
+        elif indices.dtype.kind in 'iu':
+            if indices.size and (indices.min() < -n or indices.max() >= n):
+                raise IndexError("index out of range for axis {} with size "
+                                 "{}".format(axis, n))
+            indices = indices % n if n else indices
+            k = int(indices) if indices.ndim == 0 else indices.tolist()
+        resolved.append(k)
+    return tuple(resolved)
+
+
+def read_slice(dst, key):
+    """
+    Read ``dst[key]``, where the key is resolved against the logical shape
+    of the dataset (see logical_key()).
+    """
+    return dst[logical_key(dst, key)]
+
+
 class Node(object):
     """
     Wrapper for h5py.Node
@@ -76,7 +205,7 @@ class Node(object):
         else:  # relative path
             path = os.path.join(self.path, key)
 
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             node = f[path]
             return self._wrap_class(node)
 
@@ -137,10 +266,11 @@ class Group(Node):
         """
         Wrapper around ``h5py.Group.create_group()``
         """
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
             created_group = group.create_group(name)
             path = created_group.name
+        journal.record(self.file, journal.NODE, path)
 
         return Group(self.file, path=path)
 
@@ -149,18 +279,48 @@ class Group(Node):
         """
         Wrapper around ``h5py.Group.require_group()``
         """
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
+            exists = name in group
             created_group = group.require_group(name)
             path = created_group.name
+        if not exists:
+            journal.record(self.file, journal.NODE, path)
 
         return Group(self.file, path=path)
 
-    @writer
     def create_dataset(self, **kwargs):
         """
         Wrapper around ``h5py.Group.create_dataset()``
         """
+        data = kwargs.get('data', None)
+        prepared = None
+        if isinstance(data, np.ndarray) and \
+                data.nbytes >= direct.DIRECT_WRITE_MIN_BYTES:
+            # determine the layout h5py chooses (using an in-memory file) and
+            # compress the data before the file is locked
+            probe_kwargs = {kw: v for kw, v in kwargs.items()
+                            if kw not in ('name', 'data', 'overwrite')}
+            probe_kwargs.setdefault('shape', data.shape)
+            probe_kwargs.setdefault('dtype', data.dtype)
+            try:
+                with h5py.File('hurray-probe', 'w', driver='core',
+                               backing_store=False) as probe:
+                    lay = direct.layout(probe.create_dataset('probe',
+                                                             **probe_kwargs))
+            except (TypeError, ValueError):
+                pass  # let h5py raise the error when creating the dataset
+            else:
+                prepared = direct.prepare(lay, Ellipsis, data)
+                if prepared is not None:
+                    shape, chunks, dtype, _ = lay
+                    kwargs.update(shape=shape, chunks=chunks, dtype=dtype)
+                    del kwargs['data']
+
+        return self._create_dataset(prepared, data, kwargs)
+
+    @writer
+    def _create_dataset(self, prepared, data, kwargs):
         overwrite = kwargs.get('overwrite', False)
         name = kwargs['name']
         # remove additional arguments because they are not supported by h5py
@@ -168,12 +328,22 @@ class Group(Node):
             del kwargs['overwrite']
         except Exception:
             pass
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
             if overwrite and name in group:
+                if isinstance(group[name], h5py.Dataset):
+                    pyramid.delete(group[name])
+                    journal.record(self.file, journal.TREE,
+                                   pyramid.overview_path(group[name].name))
                 del group[name]
             dst = group.create_dataset(**kwargs)
+            if prepared is not None:
+                if prepared.matches(dst):
+                    prepared.write(dst)
+                else:
+                    dst[...] = data
             path = dst.name
+        journal.record(self.file, journal.NODE, path)
 
         return Dataset(self.file, path=path)
 
@@ -182,20 +352,45 @@ class Group(Node):
         """
         Wrapper around ``h5py.Group.require_dataset()``
         """
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
+            exists = kwargs['name'] in group
             dst = group.require_dataset(**kwargs)
             path = dst.name
+        if not exists:
+            journal.record(self.file, journal.NODE, path)
         return Dataset(self.file, path=path)
 
     @reader
     def keys(self):
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             # w/o list() it does not work with py3 (returns a view on a closed
             # hdf5 file)
-            keys = list(f[self.path].keys())
+            keys = [key for key in f[self.path].keys()
+                    if not key.startswith(INTERNAL_ATTR_PREFIX)]
             return keys
 
+    @reader
+    def keys_page(self, limit=None, cursor=None, prefix=None):
+        """
+        List member names page by page (see hurray.swmr.listing)
+
+        Args:
+            limit: maximum number of names (None for no limit)
+            cursor: cursor returned by the previous call
+            prefix: only list names starting with ``prefix``
+
+        Returns:
+            tuple (names, cursor), where cursor is None if there are no more
+            names
+
+        Raises:
+            ValueError if the cursor is invalid
+        """
+        with open_file(self.file, 'r') as f:
+            return listing.keys(f[self.path], limit=limit, cursor=cursor,
+                                prefix=prefix, hidden=INTERNAL_ATTR_PREFIX)
+
     # TODO visit() and visititems() do not yet work because @reader methods
     # are not reentrant! => just wrap code into an inner function!
 
@@ -207,7 +402,7 @@ class Group(Node):
     #     Args:
     #         func: a unary function
     #     """
-    #     with h5py.File(self.file, 'r') as f:
+    #     with open_file(self.file, 'r') as f:
     #         return f[self.path].visit(func)
 
     # @reader
@@ -218,7 +413,7 @@ class Group(Node):
     #     Args:
     #         func: a 2-ary function
     #     """
-    #     with h5py.File(self.file, 'r') as f:
+    #     with open_file(self.file, 'r') as f:
     #         grp = f[self.path]
     #         def proxy(name):
     #             obj = self._wrap_class(grp[name])
@@ -247,18 +442,106 @@ class Group(Node):
                 # wrap h5py group object
                 treenode[0] = self._wrap_class(h5py_obj)
                 for name, childobj in h5py_obj.items():
+                    if name.startswith(INTERNAL_ATTR_PREFIX):
+                        continue
                     newnode = [childobj, []]
                     children.append(newnode)
                     buildtree(newnode)
 
         tree = None
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             root = f[self.path]
             tree = [root, []]  # [h5py object, children]
             buildtree(tree)
 
         return tree
 
+    @reader
+    def columns(self, depth=None, attrs=False, limit=None, cursor=None):
+        """
+        Collect the tree below this group (including the group itself) in a
+        single pass. Unlike tree(), nodes are not wrapped and no file is
+        opened per node; the tree is returned as parallel lists with one
+        entry per node (parents come before their children):
+
+            TREE_NAMES: node names (the full path for the root)
+            TREE_PARENTS: index of the parent node (-1 for the root)
+            TREE_TYPES: TREE_GROUP or TREE_DATASET
+            TREE_SHAPES, TREE_DTYPES, TREE_CHUNKS: None for groups
+            TREE_ATTRS: attribute names (only if ``attrs`` is True)
+
+        Large trees can be listed page by page (see hurray.swmr.listing);
+        parent indices refer to the position over all pages.
+
+        Args:
+            depth: maximum depth of returned nodes (children of this group
+                have depth 1), None for no limit
+            attrs: include attribute names
+            limit: maximum number of nodes (None for no limit)
+            cursor: cursor returned by the previous call
+
+        Returns:
+            tuple (columns, cursor), where cursor is None if the tree is
+            complete
+
+        Raises:
+            ValueError if the cursor is invalid
+        """
+        columns = {TREE_NAMES: [], TREE_PARENTS: [], TREE_TYPES: [],
+                   TREE_SHAPES: [], TREE_DTYPES: [], TREE_CHUNKS: []}
+        if attrs:
+            columns[TREE_ATTRS] = []
+
+        def add(name, parent, obj):
+            columns[TREE_NAMES].append(name)
+            columns[TREE_PARENTS].append(parent)
+            if isinstance(obj, h5py.Dataset):
+                columns[TREE_TYPES].append(TREE_DATASET)
+                columns[TREE_SHAPES].append(logical_shape(obj))
+                columns[TREE_DTYPES].append(obj.dtype.name)
+                columns[TREE_CHUNKS].append(obj.chunks)
+            else:
+                columns[TREE_TYPES].append(TREE_GROUP)
+                columns[TREE_SHAPES].append(None)
+                columns[TREE_DTYPES].append(None)
+                columns[TREE_CHUNKS].append(None)
+            if attrs:
+                columns[TREE_ATTRS].append(
+                    [key for key in obj.attrs.keys()
+                     if not key.startswith(INTERNAL_ATTR_PREFIX)])
+
+        with open_file(self.file, 'r') as f:
+            cursor = listing.walk(f[self.path], add, depth=depth, limit=limit,
+                                  cursor=cursor, hidden=INTERNAL_ATTR_PREFIX)
+
+        return columns, cursor
+
+    @reader
+    def collect_attrs(self, key):
+        """
+        Read an attribute of every dataset below this group in one pass
+
+        Args:
+            key: attribute name
+
+        Returns:
+            dict mapping dataset paths (relative to this group) to attribute
+            values. Datasets without the attribute are omitted.
+        """
+        result = {}
+        start = len(self.path.rstrip('/')) + 1
+
+        def add(name, parent, obj):
+            if isinstance(obj, h5py.Dataset) and key in obj.attrs:
+                result[obj.name[start:]] = obj.attrs[key]
+
+        if _internal(key):
+            return result
+        with open_file(self.file, 'r') as f:
+            listing.walk(f[self.path], add, hidden=INTERNAL_ATTR_PREFIX)
+
+        return result
+
     @reader
     def items(self):
         """
@@ -269,23 +552,31 @@ class Group(Node):
         "set-like object" (Py3) is returned.
         """
         result = []
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             for name, obj in f[self.path].items():
+                if name.startswith(INTERNAL_ATTR_PREFIX):
+                    continue
                 result.append((name, self._wrap_class(obj)))
 
         return result
 
     @reader
     def __contains__(self, key):
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             group = f[self.path]
             return key in group
 
     @writer
     def __delitem__(self, key):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             group = f[self.path]
+            path = group[key].name
+            if isinstance(group[key], h5py.Dataset):
+                pyramid.delete(group[key])
+                journal.record(self.file, journal.TREE,
+                               pyramid.overview_path(path))
             del group[key]
+        journal.record(self.file, journal.NODE, path)
 
 
 class File(Group):
@@ -307,6 +598,7 @@ class File(Group):
             def init(self):
                 with h5py.File(name=name, mode=mode, *args, **kwargs):
                     pass
+                journal.record(name, journal.TREE, '/')
 
             init(self)
 
@@ -326,10 +618,9 @@ class File(Group):
         return "<HDF5 File ({0})>".format(self.file)
 
     @property
-    @reader
     def filesize(self):
         """
-        Return size of the file in bytes
+        Return size of the file in bytes (does not lock the file)
         """
         stat = os.stat(self.file)
         return stat.st_size
@@ -348,6 +639,8 @@ class File(Group):
         if os.path.isfile(new):
             raise FileExistsError("file {} exists".format(new))
         os.rename(self.file, new)
+        journal.record(self.file, journal.TREE, '/')
+        journal.record(new, journal.TREE, '/')
 
     @writer
     def delete(self):
@@ -355,6 +648,37 @@ class File(Group):
         Remove hdf5 file
         """
         os.remove(self.file)
+        journal.record(self.file, journal.TREE, '/')
+
+    @reader
+    def gather(self, selections):
+        """
+        Read hyperslabs from several datasets of this file. The file is
+        opened (and locked) only once for all selections.
+
+        Args:
+            selections: list of (path, key) tuples, where ``path`` is the
+                full path to a dataset and ``key`` a slice/index
+
+        Returns:
+            list of NumPy arrays in the same order as ``selections``
+
+        Raises:
+            KeyError if a dataset does not exist
+            TypeError if a path refers to a group
+            ValueError if a key is invalid
+        """
+        result = []
+        with open_file(self.file, 'r') as f:
+            for path, key in selections:
+                if path not in f:
+                    raise KeyError("node {} does not exist".format(path))
+                node = f[path]
+                if not isinstance(node, h5py.Dataset):
+                    raise TypeError("node {} is not a dataset".format(path))
+                result.append(read_slice(node, key))
+
+        return result
 
 
 class Dataset(Node):
@@ -368,34 +692,242 @@ class Dataset(Node):
     @reader
     def __getitem__(self, slice):
         """
-        implement multidimensional slicing for datasets
+        implement multidimensional slicing for datasets. Contiguous
+        datasets are read through a memory map (see hurray.swmr.mapped).
         """
-        with h5py.File(self.file, 'r') as f:
-            return f[self.path][slice]
+        mapping = mapped.get(self.file, self.path)
+        if mapping is not None:
+            try:
+                data = mapping.read(slice)
+            except TypeError:  # e.g., fancy indexing
+                pass
+            else:
+                ACCESS_STATS.record(self.file, self.path, mapping, slice)
+                return data
+        with open_file(self.file, 'r') as f:
+            dst = f[self.path]
+            mapped.register(self.file, self.path, dst)
+            key = logical_key(dst, slice)
+            data = dst[key]
+            ACCESS_STATS.record(self.file, self.path, dst, key,
+                                shape=logical_shape(dst))
+            return data
 
-    @writer
     def __setitem__(self, slice, value):
         """
         Broadcasting for datasets. Example: mydataset[0,:] = np.arange(100)
+        Large writes to compressed datasets are compressed in parallel before
+        the file is locked (see hurray.swmr.direct).
         """
-        with h5py.File(self.file, 'r+') as f:
-            f[self.path][slice] = value
+        prepared = None
+        if isinstance(value, np.ndarray) and \
+                value.nbytes >= direct.DIRECT_WRITE_MIN_BYTES:
+            prepared = direct.prepare(self._layout(), slice, value)
+        self._setitem(slice, value, prepared)
+
+    @reader
+    def _layout(self):
+        with open_file(self.file, 'r') as f:
+            dst = f[self.path]
+            return direct.layout(dst, logical_shape(dst))
+
+    @writer
+    def _setitem(self, slice, value, prepared=None):
+        with open_file(self.file, 'r+') as f:
+            dst = f[self.path]
+            slice = logical_key(dst, slice)
+            if prepared is not None and \
+                    prepared.matches(dst, logical_shape(dst)):
+                prepared.write(dst)
+            else:
+                dst[slice] = value
+            if pyramid.mark_dirty(dst, logical_shape(dst), slice):
+                journal.record(self.file, journal.ATTRS,
+                               pyramid.overview_path(self.path))
+            ACCESS_STATS.record(self.file, self.path, dst, slice, WRITE,
+                                logical_shape(dst))
+        journal.record(self.file, journal.DATA, self.path, slice)
 
     @writer
     def resize(self, size, axis=None):
-        with h5py.File(self.file, 'r+') as f:
-            f[self.path].resize(size, axis)
+        """
+        Resize the dataset. The new shape is the logical shape, i.e., the
+        spare size allocated by append() is given up.
+        """
+        with open_file(self.file, 'r+') as f:
+            dst = f[self.path]
+            spare = None
+            if APPEND_ATTR in dst.attrs:
+                append_axis, length = (int(v) for v in dst.attrs[APPEND_ATTR])
+                spare = (append_axis, length, dst.shape[append_axis])
+                del dst.attrs[APPEND_ATTR]
+            dst.resize(size, axis)
+            if spare is not None:
+                # clear the spare part of the allocation that becomes visible
+                append_axis, length, allocated = spare
+                end = min(allocated, dst.shape[append_axis])
+                if end > length:
+                    dst[(slice(None),) * append_axis +
+                        (slice(length, end),)] = dst.fillvalue
+        journal.record(self.file, journal.DATA, self.path)
+
+    @writer
+    def append(self, data, axis=0):
+        """
+        Append data along an (unlimited) axis. The allocated size of the
+        dataset grows geometrically and is rounded up to whole chunks so
+        that metadata updates are amortized. The number of appended elements
+        (the logical length) is stored in an attribute.
+
+        Args:
+            data: NumPy array with the same number of dimensions as the
+                dataset (or one less, to append a single element)
+            axis: axis to extend
+
+        Returns:
+            tuple (shape, chunk length), i.e., the logical shape of the
+            dataset after appending and the chunk size along ``axis``
+
+        Raises:
+            TypeError if the dataset cannot be extended along ``axis``
+            ValueError if the shape of ``data`` does not match
+        """
+        with open_file(self.file, 'r+') as f:
+            dst = f[self.path]
+            if not -dst.ndim <= axis < dst.ndim:
+                raise ValueError("axis {} is out of bounds".format(axis))
+            axis %= dst.ndim
+            if dst.chunks is None:
+                raise TypeError("only chunked datasets can be extended")
+            data = np.asarray(data)
+            if data.ndim == dst.ndim - 1:
+                data = np.expand_dims(data, axis)
+            shape = logical_shape(dst)
+            if (data.ndim != dst.ndim or
+                    data.shape[:axis] != shape[:axis] or
+                    data.shape[axis + 1:] != shape[axis + 1:]):
+                raise ValueError("cannot append data of shape {} to dataset "
+                                 "of shape {}".format(data.shape, shape))
+
+            length = shape[axis]
+            new_length = length + data.shape[axis]
+            size = dst.shape[axis]
+            maxsize = dst.maxshape[axis]
+            if new_length > size:
+                if maxsize is not None and new_length > maxsize:
+                    raise TypeError("dataset cannot be extended beyond {} "
+                                    "along axis {}".format(maxsize, axis))
+                chunk = dst.chunks[axis]
+                size = max(new_length, size * APPEND_GROWTH)
+                size = int(math.ceil(size / chunk)) * chunk
+                if maxsize is not None:
+                    size = min(size, maxsize)
+                dst.resize(size, axis)
+
+            key = ((slice(None),) * axis + (slice(length, new_length),))
+            dst[key] = data
+            dst.attrs[APPEND_ATTR] = np.array([axis, new_length])
+            if pyramid.mark_dirty(dst, logical_shape(dst), key):
+                journal.record(self.file, journal.ATTRS,
+                               pyramid.overview_path(self.path))
+            journal.record(self.file, journal.DATA, self.path, key)
+
+            return logical_shape(dst), dst.chunks[axis]
+
+    @writer
+    def create_pyramid(self, factor=2, levels=None, axes=None):
+        """
+        Create (or rebuild) a multi-resolution pyramid of the dataset (see
+        hurray.swmr.pyramid). Subsequent writes mark the affected tiles as
+        dirty; they are recomputed by update_pyramid().
+
+        Raises:
+            ValueError for invalid parameters
+        """
+        with open_file(self.file, 'r+') as f:
+            dst = f[self.path]
+            pyramid.create(dst, logical_shape(dst), factor, levels, axes)
+        self._journal_pyramid()
+
+    @writer
+    def delete_pyramid(self):
+        with open_file(self.file, 'r+') as f:
+            pyramid.delete(f[self.path])
+        self._journal_pyramid()
+
+    def _journal_pyramid(self):
+        journal.record(self.file, journal.ATTRS, self.path)
+        journal.record(self.file, journal.TREE,
+                       pyramid.overview_path(self.path))
+
+    @reader
+    def pyramid_dirty(self):
+        """
+        Check if the pyramid of the dataset has tiles that need to be updated
+        """
+        with open_file(self.file, 'r') as f:
+            return pyramid.is_dirty(f[self.path])
+
+    @writer
+    def update_pyramid(self):
+        """
+        Recompute all dirty tiles of the pyramid
+        """
+        with open_file(self.file, 'r+') as f:
+            dst = f[self.path]
+            pyramid.update(dst, logical_shape(dst))
+        journal.record(self.file, journal.TREE,
+                       pyramid.overview_path(self.path))
+
+    @reader
+    def read_resolution(self, key, resolution):
+        """
+        Read ``self[key]`` from the coarsest pyramid level whose reduction
+        factor does not exceed ``resolution``. Falls back to the full
+        resolution data if the dataset has no pyramid.
+
+        Returns:
+            tuple (array, reduction factor of the level read)
+        """
+        with open_file(self.file, 'r') as f:
+            dst = f[self.path]
+            data, factor = pyramid.read(dst, logical_shape(dst), key,
+                                        resolution)
+            if data is None:
+                data = read_slice(dst, key)
+            return data, factor
+
+    @reader
+    def read_chunks(self, key):
+        """
+        Stored (compressed) chunks covering ``self[key]``, see
+        hurray.swmr.direct.read_chunks()
+        """
+        with open_file(self.file, 'r') as f:
+            dst = f[self.path]
+            shape = logical_shape(dst)
+            result = direct.read_chunks(dst, shape, key)
+            ACCESS_STATS.record(self.file, self.path, dst,
+                                logical_key(dst, key), shape=shape)
+            return result
+
+    def access_stats(self):
+        """
+        Histogram of the selections read from and written to this dataset
+        (see hurray.swmr.stats), or None if no accesses have been recorded
+        """
+        return ACCESS_STATS.get(self.file, self.path)
 
     @property
     @reader
     def shape(self):
-        with h5py.File(self.file, 'r') as f:
-            return f[self.path].shape
+        with open_file(self.file, 'r') as f:
+            return logical_shape(f[self.path])
 
     @property
     @reader
     def dtype(self):
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             return f[self.path].dtype
 
 
@@ -418,9 +950,10 @@ class AttributeManager(object):
         # In order to be compatible with h5py, we return a generator.
         # However, to preserve thread-safety, we must make sure that the hdf5
         # file is closed while the generator is being traversed.
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             node = f[self.path]
-            keys = [key for key in node.attrs]
+            keys = [key for key in node.attrs
+                    if not key.startswith(INTERNAL_ATTR_PREFIX)]
 
         return (key for key in keys)
 
@@ -429,33 +962,85 @@ class AttributeManager(object):
         """
         Returns attribute keys (list)
         """
-        with h5py.File(self.file, 'r') as f:
+        with open_file(self.file, 'r') as f:
             node = f[self.path]
-            return list(node.attrs.keys())
+            return [key for key in node.attrs.keys()
+                    if not key.startswith(INTERNAL_ATTR_PREFIX)]
 
     @reader
     def __contains__(self, key):
-        with h5py.File(self.file, 'r') as f:
+        if _internal(key):
+            return False
+        with open_file(self.file, 'r') as f:
             node = f[self.path]
             return key in node.attrs
 
     @reader
     def __getitem__(self, key):
-        with h5py.File(self.file, 'r') as f:
+        if _internal(key):
+            raise KeyError(key)
+        with open_file(self.file, 'r') as f:
             node = f[self.path]
             return node.attrs[key]
 
+    @reader
+    def items(self):
+        """
+        Returns all attributes as a dict
+        """
+        with open_file(self.file, 'r') as f:
+            node = f[self.path]
+            return {key: value for key, value in node.attrs.items()
+                    if not key.startswith(INTERNAL_ATTR_PREFIX)}
+
     @writer
     def __setitem__(self, key, value):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             node = f[self.path]
             node.attrs[key] = value
+        journal.record(self.file, journal.ATTRS, self.path)
+
+    @writer
+    def update(self, attrs):
+        """
+        Set several attributes at once. If a value cannot be stored, the
+        attributes that have already been written are restored, i.e., either
+        all or none of the attributes are set.
+
+        Args:
+            attrs: dict of attribute values
+
+        Raises:
+            ValueError if a key is reserved for internal attributes
+            TypeError, ValueError if a value cannot be stored
+        """
+        for key in attrs:
+            if key.startswith(INTERNAL_ATTR_PREFIX):
+                raise ValueError("attribute names starting with {} are "
+                                 "reserved".format(INTERNAL_ATTR_PREFIX))
+        with open_file(self.file, 'r+') as f:
+            node = f[self.path]
+            previous = {}
+            try:
+                for key, value in attrs.items():
+                    previous[key] = node.attrs[key] if key in node.attrs \
+                        else None
+                    node.attrs[key] = value
+            except Exception:
+                for key, value in previous.items():
+                    if value is not None:
+                        node.attrs[key] = value
+                    elif key in node.attrs:
+                        del node.attrs[key]
+                raise
+        journal.record(self.file, journal.ATTRS, self.path)
 
     @writer
     def __delitem__(self, key):
-        with h5py.File(self.file, 'r+') as f:
+        with open_file(self.file, 'r+') as f:
             node = f[self.path]
             del node.attrs[key]
+        journal.record(self.file, journal.ATTRS, self.path)
 
     @reader
     def get(self, key, defaultvalue):
@@ -465,6 +1050,8 @@ class AttributeManager(object):
             key: attribute key
             defaultvalue: default value to be returned if key is missing
         """
-        with h5py.File(self.file, 'r') as f:
+        if _internal(key):
+            return defaultvalue
+        with open_file(self.file, 'r') as f:
             node = f[self.path]
-            return node.get(key, defaultvalue)
+            return node.attrs.get(key, defaultvalue)
@@ -0,0 +1,478 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+In-memory catalog of the databases (files) under the base directory. The
+catalog lives in a manager process of its own (see hurray.swmr.lock) and is
+shared by all processes. It is built once by scanning the directory tree on a
+thread pool and then kept current:
+
+* hurray's own commands (create, rename, delete, ...) call refresh() for the
+  files they touch,
+* on Linux, external changes are picked up with inotify.
+
+Without inotify, size and modification time of returned entries are checked
+when the catalog is queried, but files that are created or removed by other
+programs are not noticed.
+
+Files are kept in sorted lists (by name, size and modification time) for
+the whole tree and for every directory, so queries for a page of a listing
+do not look at the whole catalog.
+"""
+
+import ctypes
+import ctypes.util
+import heapq
+import os
+import select
+import struct
+import threading
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from hurray.server.log import app_log
+
+# number of threads scanning the directory tree
+SCAN_THREADS = 8
+
+# index of a directory without files
+EMPTY = ([], [], [])
+
+# sort orders
+SORT_NAME = 'name'
+SORT_SIZE = 'size'
+SORT_MTIME = 'mtime'
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+# the last character (upper bound for names starting with a prefix)
+MAX_CHAR = chr(0x10FFFF)
+
+
+class Watcher(object):
+    """
+    Report changes of directories with inotify (Linux only)
+    """
+
+    def __init__(self, callback):
+        """
+        Args:
+            callback: function callback(path, mask) that is called from the
+                watcher thread for every event. path is None if events were
+                lost (queue overflow).
+
+        Raises:
+            OSError if inotify is not available
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        except AttributeError:
+            raise OSError("inotify is not available")
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+        self._callback = callback
+        self._directories = {}  # watch descriptor -> directory
+        self._stopped = False
+        self._warned = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, directory):
+        wd = self._add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            if not self._warned:  # e.g., fs.inotify.max_user_watches
+                app_log.warning("Cannot watch %s: %s", directory,
+                                os.strerror(ctypes.get_errno()))
+                self._warned = True
+            return
+        self._directories[wd] = directory
+
+    def stop(self):
+        self._stopped = True
+
+    def _run(self):
+        poll = select.poll()
+        poll.register(self._fd, select.POLLIN)
+        try:
+            while not self._stopped:
+                if not poll.poll(1000):
+                    continue
+                self._dispatch(os.read(self._fd, 256 * 1024))
+        except Exception:
+            app_log.exception('Error in catalog watcher')
+        finally:
+            os.close(self._fd)
+
+    def _dispatch(self, buf):
+        pos = 0
+        while pos < len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, pos)
+            pos += EVENT_HEADER.size
+            name = buf[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                self._callback(None, mask)
+                continue
+            directory = self._directories.get(wd)
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+            if directory is None or not name:
+                continue
+            self._callback(os.path.join(directory, os.fsdecode(name)), mask)
+
+
+class Catalog(object):
+    """
+    Catalog of the files under a base directory. Entries are identified by
+    their path relative to the base directory.
+    """
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__ready = threading.Event()
+        self.__base = None
+        self.__ignore = ()
+        self.__watcher = None
+        self.__pending = None  # events received while building
+        self.__clear()
+
+    def __clear(self):
+        self.__entries = {}  # name -> [size, mtime, number of datasets]
+        # sorted lists of names, (size, name) and (mtime, name) tuples for
+        # all files and for the files of every directory
+        self.__index = ([], [], [])
+        self.__dirs = {}
+
+    def open(self, base, ignore=(), watch=True):
+        """
+        Start building the catalog of ``base`` (unless it is already open)
+
+        Args:
+            base: absolute path of the base directory
+            ignore: suffixes of files that are not listed
+            watch: watch the directory tree with inotify
+        """
+        with self.__lock:
+            if base == self.__base:
+                return
+            if self.__watcher is not None:
+                self.__watcher.stop()
+                self.__watcher = None
+            self.__clear()
+            self.__base = base
+            self.__ignore = tuple(ignore)
+            self.__pending = []
+            self.__ready.clear()
+            if watch:
+                try:
+                    self.__watcher = Watcher(self.__event)
+                except OSError as e:
+                    app_log.info("Not watching %s (%s)", base, e)
+        threading.Thread(target=self.__build, args=(base,),
+                         daemon=True).start()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the catalog is built. Returns False on timeout.
+        """
+        return self.__ready.wait(timeout)
+
+    def refresh(self, path):
+        """
+        Update the entry of a file (absolute path) after it was created,
+        modified, renamed or removed. Directories are (re-)scanned.
+        """
+        with self.__lock:
+            if self.__base is None:
+                return
+            if self.__pending is not None:
+                self.__pending.append(path)
+                return
+            self.__refresh(path)
+
+    def set_datasets(self, path, mtime, count):
+        """
+        Store the number of top-level datasets of a file (absolute path)
+        that was counted at modification time ``mtime``
+        """
+        with self.__lock:
+            if self.__base is None:
+                return
+            entry = self.__entries.get(self.__relative(path))
+            if entry is not None and entry[1] == mtime:
+                entry[2] = count
+
+    def query(self, directory, recursive=False, prefix='', sort=SORT_NAME,
+              reverse=False, offset=0, limit=None):
+        """
+        List the files in a directory
+
+        Args:
+            directory: absolute path of the directory
+            recursive: include files in sub-directories
+            prefix: only list files whose name (relative to ``directory``)
+                starts with ``prefix``
+            sort: SORT_NAME, SORT_SIZE or SORT_MTIME
+            reverse: sort in descending order
+            offset: number of files to skip
+            limit: maximum number of files (None for no limit)
+
+        Returns:
+            list of (name, size, mtime, number of datasets or None) tuples,
+            where name is relative to ``directory``
+
+        Raises:
+            ValueError if the sort order is unknown
+        """
+        if sort not in (SORT_NAME, SORT_SIZE, SORT_MTIME):
+            raise ValueError("unknown sort order {}".format(sort))
+        self.__ready.wait()
+        with self.__lock:
+            start = self.__relative(directory)
+            if recursive:
+                names, by_size, by_mtime = self.__index
+            else:
+                names, by_size, by_mtime = self.__dirs.get(start, EMPTY)
+            start = start + '/' if start else ''
+            lo = bisect_left(names, start + prefix)
+            hi = bisect_left(names, start + prefix + MAX_CHAR, lo)
+            stop = None if limit is None else offset + limit
+
+            if sort == SORT_NAME:
+                if not reverse:
+                    end = hi if stop is None else min(hi, lo + stop)
+                    selected = names[lo + offset:end]
+                else:
+                    end = lo if stop is None else max(lo, hi - stop)
+                    selected = names[end:max(end, hi - offset)][::-1]
+            elif (hi - lo) * 4 >= len(names):
+                # most files match: filter the sorted index
+                index = by_size if sort == SORT_SIZE else by_mtime
+                if reverse:
+                    index = reversed(index)
+                if hi - lo == len(names):
+                    selected = (name for _, name in index)
+                else:
+                    selected = (name for _, name in index
+                                if name.startswith(start + prefix))
+                selected = list(islice(selected, offset, stop))
+            else:
+                column = 0 if sort == SORT_SIZE else 1
+                entries = self.__entries
+
+                def key(name):
+                    return entries[name][column], name
+
+                candidates = names[lo:hi]
+                if stop is None:
+                    selected = sorted(candidates, key=key, reverse=reverse)
+                elif reverse:
+                    selected = heapq.nlargest(stop, candidates, key=key)
+                else:
+                    selected = heapq.nsmallest(stop, candidates, key=key)
+                selected = selected[offset:]
+
+            result = [(name,) + tuple(self.__entries[name])
+                      for name in selected]
+
+        if self.__watcher is None:
+            result = [self.__restat(entry) for entry in result]
+        return [(entry[0][len(start):],) + entry[1:] for entry in result]
+
+    def __restat(self, entry):
+        try:
+            st = os.stat(os.path.join(self.__base, entry[0]))
+        except OSError:
+            return entry
+        if st.st_mtime != entry[2]:
+            entry = (entry[0], st.st_size, st.st_mtime, None)
+        return entry
+
+    def __relative(self, path):
+        base = self.__base
+        if path.startswith(base + os.sep):
+            return path[len(base) + 1:]
+        rel = os.path.relpath(path, base)
+        return '' if rel == '.' else rel
+
+    def __ignored(self, name):
+        return name.endswith(self.__ignore) if self.__ignore else False
+
+    def __scan(self, directory):
+        """
+        List a directory (and start watching it)
+
+        Returns:
+            tuple (files, sub-directories), where files is a list of
+            (name, size, mtime) tuples
+        """
+        if self.__watcher is not None:
+            self.__watcher.add(directory)
+        files, directories = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files.append((self.__relative(entry.path),
+                                          st.st_size, st.st_mtime))
+                    except OSError:
+                        continue
+        except OSError:
+            pass  # removed in the meantime
+        files = [f for f in files if not self.__ignored(f[0])]
+        return files, directories
+
+    def __scan_tree(self, directory):
+        """
+        Scan a directory tree on a thread pool. Returns a list of
+        (name, size, mtime) tuples.
+        """
+        files = []
+        with ThreadPoolExecutor(SCAN_THREADS) as pool:
+            pending = {pool.submit(self.__scan, directory)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found, directories = future.result()
+                    files.extend(found)
+                    pending.update(pool.submit(self.__scan, d)
+                                   for d in directories)
+        return files
+
+    def __build(self, base):
+        files = self.__scan_tree(base)
+        with self.__lock:
+            if base != self.__base:
+                return  # another base was opened in the meantime
+            self.__entries = {name: [size, mtime, None]
+                              for name, size, mtime in files}
+            self.__index = sort_index(files)
+            directories = {}
+            for f in files:
+                directories.setdefault(dirname(f[0]), []).append(f)
+            self.__dirs = {d: sort_index(found)
+                           for d, found in directories.items()}
+            # apply the changes that happened while scanning
+            pending, self.__pending = self.__pending, None
+            for path in pending:
+                self.__refresh(path)
+            app_log.info("Catalog of %s: %d files", base, len(files))
+        self.__ready.set()
+
+    def __event(self, path, mask):
+        if path is None:  # events were lost
+            base = self.__base
+            with self.__lock:
+                self.__base = None
+            self.open(base, self.__ignore)
+            return
+        self.refresh(path)
+
+    def __refresh(self, path):
+        name = self.__relative(path)
+        if name.startswith('..') or not name:
+            return
+        if os.path.isdir(path):
+            for f in self.__scan_tree(path):
+                self.__add(*f)
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is None:
+            self.__remove(name)
+            # the path may have been a directory
+            names = self.__index[0]
+            lo = bisect_left(names, name + '/')
+            hi = bisect_left(names, name + '/' + MAX_CHAR, lo)
+            for child in names[lo:hi]:
+                self.__remove(child)
+        elif not self.__ignored(name):
+            self.__add(name, st.st_size, st.st_mtime)
+
+    def __add(self, name, size, mtime):
+        entry = self.__entries.get(name)
+        if entry is not None:
+            if entry[0] == size and entry[1] == mtime:
+                return
+            self.__remove(name)
+        self.__entries[name] = [size, mtime, None]
+        directory = dirname(name)
+        if directory not in self.__dirs:
+            self.__dirs[directory] = ([], [], [])
+        for names, by_size, by_mtime in (self.__index,
+                                         self.__dirs[directory]):
+            insort(names, name)
+            insort(by_size, (size, name))
+            insort(by_mtime, (mtime, name))
+
+    def __remove(self, name):
+        entry = self.__entries.pop(name, None)
+        if entry is None:
+            return
+        size, mtime, _ = entry
+        directory = dirname(name)
+        for names, by_size, by_mtime in (self.__index,
+                                         self.__dirs[directory]):
+            del names[bisect_left(names, name)]
+            del by_size[bisect_left(by_size, (size, name))]
+            del by_mtime[bisect_left(by_mtime, (mtime, name))]
+        if not self.__dirs[directory][0]:
+            del self.__dirs[directory]
+
+
+def dirname(name):
+    return name.rpartition('/')[0]
+
+
+def sort_index(files):
+    """
+    Sorted lists of names, (size, name) and (mtime, name) tuples of a list
+    of (name, size, mtime) tuples
+    """
+    return (sorted(name for name, _, _ in files),
+            sorted((size, name) for name, size, _ in files),
+            sorted((mtime, name) for name, _, mtime in files))
@@ -0,0 +1,146 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Change log of a primary server and replication state of a replica (see
+hurray.replication). Both live in the manager process (see
+hurray.swmr.lock).
+
+The change log holds the journal entries (see hurray.swmr.journal) of all
+writes with increasing sequence numbers. Entries are appended by writers
+(i.e., under the write lock of the file), so the entries of a file are in
+the order of the writes. Only the most recent entries are kept; a replica
+that falls further behind has to copy the databases again. The epoch
+identifies the log: sequence numbers start over when the primary restarts.
+"""
+
+import collections
+import threading
+import time
+import uuid
+
+# keys of the replication state of a replica
+REPLICA_PRIMARY = 'primary'  # address of the primary
+REPLICA_EPOCH = 'epoch'  # epoch of the change log of the primary
+REPLICA_SEQ = 'seq'  # last applied change
+REPLICA_PRIMARY_SEQ = 'primary_seq'  # last change logged by the primary
+REPLICA_LAG = 'lag'  # seconds since the replica was up to date
+REPLICA_ERROR = 'error'  # last replication error (None if it succeeded)
+REPLICA_UPDATED = 'updated'  # time of the last poll of the primary
+
+
+class ChangeLog(object):
+    def __init__(self):
+        self.__epoch = uuid.uuid4().hex
+        self.__entries = collections.deque()
+        self.__size = 0
+        self.__seq = 0
+        self.__lock = threading.Lock()
+
+    def configure(self, size):
+        """
+        Keep the last ``size`` entries (0 = do not log changes)
+        """
+        with self.__lock:
+            self.__size = size
+            while len(self.__entries) > size:
+                self.__entries.popleft()
+
+    def append(self, file, kind, path, key=None):
+        """
+        Log a change (see journal.record)
+
+        Returns:
+            sequence number of the change (None if changes are not logged)
+        """
+        with self.__lock:
+            if not self.__size:
+                return None
+            self.__seq += 1
+            self.__entries.append((self.__seq, file, kind, path, key))
+            if len(self.__entries) > self.__size:
+                self.__entries.popleft()
+            return self.__seq
+
+    def state(self):
+        """
+        Returns:
+            tuple (epoch, sequence number of the last change)
+        """
+        return self.__epoch, self.__seq
+
+    def since(self, epoch, seq, limit=None):
+        """
+        Get the changes after ``seq``
+
+        Returns:
+            list of (seq, file, kind, path, key) tuples or None if the log
+            does not hold all changes after ``seq`` of ``epoch`` anymore
+        """
+        with self.__lock:
+            if epoch != self.__epoch or seq > self.__seq:
+                return None
+            if seq == self.__seq:
+                return []
+            if not self.__entries or self.__entries[0][0] > seq + 1:
+                return None
+            # sequence numbers are consecutive
+            start = seq + 1 - self.__entries[0][0]
+            stop = None if limit is None else start + limit
+            return list(self.__entries)[start:stop]
+
+
+class ReplicaState(object):
+    """
+    Replication state of a replica, published by the replicator process
+    """
+
+    def __init__(self):
+        self.__state = None
+        self.__synced = None
+
+    def update(self, primary, epoch, seq, primary_seq, error=None):
+        now = time.time()
+        if seq is not None and seq == primary_seq:
+            self.__synced = now
+        self.__state = {
+            REPLICA_PRIMARY: primary,
+            REPLICA_EPOCH: epoch,
+            REPLICA_SEQ: seq,
+            REPLICA_PRIMARY_SEQ: primary_seq,
+            REPLICA_ERROR: error,
+            REPLICA_UPDATED: now,
+        }
+
+    def get(self):
+        """
+        Returns:
+            dict (see REPLICA_*) or None if no replicator runs
+        """
+        if self.__state is None:
+            return None
+        state = dict(self.__state)
+        state[REPLICA_LAG] = None if self.__synced is None else \
+            max(0., time.time() - self.__synced)
+        return state
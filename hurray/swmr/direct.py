@@ -0,0 +1,287 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Writing compressed datasets with parallel compression. hdf5 applies filters
+(e.g., gzip) in a single thread while the dataset is written, i.e., while
+the file is write-locked. For large writes, the chunks that are completely
+covered by the written region are instead compressed on a thread pool
+*before* the write lock is acquired (zlib releases the GIL), and the
+compressed bytes are then written with direct chunk writes, bypassing the
+hdf5 filter pipeline. Partially covered chunks at the border of the region
+are written as usual.
+
+Only the deflate (gzip) and shuffle filters are supported; writes to
+datasets with other filters use the regular code path.
+
+read_chunks() is the counterpart for reading: it returns the stored bytes of
+the chunks covering a selection (see hurray.rawchunks).
+"""
+
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+from hurray.rawchunks import (CHUNKS_SHAPE, CHUNKS_DTYPE, CHUNKS_CHUNKS,
+                              CHUNKS_FILTERS, CHUNKS_FILLVALUE, CHUNKS_DATA,
+                              CHUNKS_ORIGIN, CHUNKS_BOX, CHUNKS_SELECTION)
+from .selection import expand_key, selection_shape
+
+SUPPORTED_FILTERS = (h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE)
+
+# smaller writes are not worth the overhead
+DIRECT_WRITE_MIN_BYTES = 4 * 1024 * 1024
+
+COMPRESSION_THREADS = os.cpu_count() or 1
+
+# zlib compression level used by hdf5 if none is given
+DEFAULT_DEFLATE_LEVEL = 6
+
+_executor = None
+
+
+def _pool():
+    # created lazily, i.e., after worker processes are forked
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=COMPRESSION_THREADS)
+    return _executor
+
+
+def layout(dst, shape=None):
+    """
+    Properties of an h5py dataset that determine how chunks are encoded:
+    (shape, chunks, dtype, filters), where filters is a tuple of (filter
+    code, parameters) tuples in pipeline order and shape is the (logical)
+    shape that keys are resolved against (default: dst.shape)
+    """
+    dcpl = dst.id.get_create_plist()
+    filters = []
+    for i in range(dcpl.get_nfilters()):
+        code, _, params, _ = dcpl.get_filter(i)
+        filters.append((code, tuple(params)))
+    return (dst.shape if shape is None else tuple(shape), dst.chunks,
+            dst.dtype, tuple(filters))
+
+
+def supported(lay):
+    """
+    Check if chunks of a dataset with the given layout can be compressed by
+    compress()
+    """
+    _, chunks, dtype, filters = lay
+    return (chunks is not None and not dtype.hasobject and
+            any(code == h5py.h5z.FILTER_DEFLATE for code, _ in filters) and
+            all(code in SUPPORTED_FILTERS for code, _ in filters))
+
+
+def compress(arr, filters):
+    """
+    Encode a chunk like the hdf5 filter pipeline
+
+    Args:
+        arr: chunk (NumPy array with the dtype of the dataset)
+        filters: see layout()
+
+    Returns:
+        bytes
+    """
+    data = np.ascontiguousarray(arr).tobytes()
+    for code, params in filters:
+        if code == h5py.h5z.FILTER_SHUFFLE:
+            itemsize = arr.dtype.itemsize
+            if itemsize > 1:
+                data = np.frombuffer(data, np.uint8) \
+                    .reshape(-1, itemsize).T.tobytes()
+        elif code == h5py.h5z.FILTER_DEFLATE:
+            level = params[0] if params else DEFAULT_DEFLATE_LEVEL
+            data = zlib.compress(data, level)
+    return data
+
+
+class DirectWrite(object):
+    """
+    A write prepared by prepare(): compressed chunks and the remaining
+    (partially covered) parts of the region
+    """
+
+    def __init__(self, lay, chunks, remainder):
+        self.layout = lay
+        self.chunks = chunks  # list of (offset, compressed bytes)
+        self.remainder = remainder  # list of (key, array)
+
+    def matches(self, dst, shape=None):
+        """
+        Check if the layout of the dataset is still the same (see layout())
+        """
+        return layout(dst, shape) == self.layout
+
+    def write(self, dst):
+        """
+        Write to the h5py dataset ``dst`` (must be called while the file is
+        write-locked)
+        """
+        for offset, data in self.chunks:
+            dst.id.write_direct_chunk(offset, data)
+        for key, arr in self.remainder:
+            dst[key] = arr
+
+
+def prepare(lay, key, value):
+    """
+    Prepare writing ``value`` to the region ``key`` of a dataset with the
+    given layout: chunks completely covered by the region are compressed in
+    parallel.
+
+    Args:
+        lay: layout of the dataset (see layout())
+        key: basic selection with step 1
+        value: data (broadcastable to the selection)
+
+    Returns:
+        DirectWrite or None if the write is not suited for direct chunk
+        writes (in this case, it should be written as usual)
+    """
+    if not supported(lay):
+        return None
+    shape, chunks, dtype, filters = lay
+    try:
+        slices, squeeze = expand_key(key, shape)
+        arr = np.asarray(value, dtype=dtype)
+        arr = np.broadcast_to(arr, selection_shape(slices, squeeze))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if any(s.step != 1 for s in slices) or arr.nbytes < \
+            DIRECT_WRITE_MIN_BYTES:
+        return None
+    arr = arr.reshape(selection_shape(slices))
+    start = [s.start for s in slices]
+    stop = [s.stop for s in slices]
+
+    # box of the chunks that are completely covered (chunks at the end of
+    # the dataset are covered if the region extends to the end)
+    inner_start = [-(-a // c) * c for a, c in zip(start, chunks)]
+    inner_stop = [b if b == n else b // c * c
+                  for b, c, n in zip(stop, chunks, shape)]
+    if any(a >= b for a, b in zip(inner_start, inner_stop)):
+        return None
+
+    def local(axis, a, b):
+        return slice(a - start[axis], b - start[axis])
+
+    compressed = []
+    grid = [range(a, b, c) for a, b, c in zip(inner_start, inner_stop,
+                                                chunks)]
+    for offset in np.ndindex(*[len(g) for g in grid]):
+        offset = tuple(g[i] for g, i in zip(grid, offset))
+        block = arr[tuple(local(axis, o, min(o + c, b))
+                          for axis, (o, c, b) in
+                          enumerate(zip(offset, chunks, inner_stop)))]
+        if block.shape != tuple(chunks):  # edge chunk
+            padded = np.zeros(chunks, dtype=dtype)
+            padded[tuple(slice(0, n) for n in block.shape)] = block
+            block = padded
+        compressed.append((offset, _pool().submit(compress, block, filters)))
+
+    # the rest of the region is covered by at most 2 * ndim slabs
+    remainder = []
+    for axis in range(len(shape)):
+        outer = [slice(a, b) for a, b in zip(inner_start[:axis],
+                                             inner_stop[:axis])]
+        rest = [slice(a, b) for a, b in zip(start[axis + 1:],
+                                            stop[axis + 1:])]
+        for a, b in ((start[axis], inner_start[axis]),
+                     (inner_stop[axis], stop[axis])):
+            if a < b:
+                region = outer + [slice(a, b)] + rest
+                remainder.append((tuple(region), arr[tuple(
+                    local(i, s.start, s.stop) for i, s in
+                    enumerate(region))]))
+
+    # wait for the compression here, i.e., before the file is locked
+    compressed = [(offset, future.result()) for offset, future in compressed]
+
+    return DirectWrite(lay, compressed, remainder)
+
+
+def read_chunks(dst, shape, key):
+    """
+    Read the stored chunks covering a selection of an h5py dataset, without
+    applying the filter pipeline. Chunks that have not been written yet are
+    omitted.
+
+    Args:
+        dst: h5py dataset
+        shape: (logical) shape of the dataset
+        key: basic selection
+
+    Returns:
+        dict (see hurray.rawchunks for the keys)
+
+    Raises:
+        TypeError if the dataset is not chunked or the key is not supported
+        ValueError, IndexError if the key is invalid
+    """
+    _, chunks, dtype, filters = layout(dst)
+    if chunks is None:
+        raise TypeError("dataset is not chunked")
+    slices, squeeze = expand_key(key, shape)
+
+    # box of the chunks covering the selection
+    origin = tuple(s.start // c * c for s, c in zip(slices, chunks))
+    box = tuple(max(0, min(n, -(-s.stop // c) * c) - o)
+                for s, c, n, o in zip(slices, chunks, shape, origin))
+    selection = tuple(s.start - o if axis in squeeze else
+                      slice(s.start - o, s.stop - o, s.step)
+                      for axis, (s, o) in enumerate(zip(slices, origin)))
+
+    data = []
+    if all(n > 0 for n in box):
+        grid = [range(o, o + n, c) for o, n, c in zip(origin, box, chunks)]
+        for index in np.ndindex(*[len(g) for g in grid]):
+            offset = tuple(g[i] for g, i in zip(grid, index))
+            info = dst.id.get_chunk_info_by_coord(offset)
+            if info.byte_offset is None:  # not allocated
+                continue
+            filter_mask, chunk = dst.id.read_direct_chunk(offset)
+            data.append((offset, filter_mask, chunk))
+
+    fillvalue = dst.fillvalue
+    if isinstance(fillvalue, np.generic):
+        fillvalue = fillvalue.item()
+
+    return {
+        CHUNKS_SHAPE: shape,
+        CHUNKS_DTYPE: np.lib.format.dtype_to_descr(dtype),
+        CHUNKS_CHUNKS: chunks,
+        CHUNKS_FILTERS: filters,
+        CHUNKS_FILLVALUE: fillvalue,
+        CHUNKS_DATA: data,
+        CHUNKS_ORIGIN: origin,
+        CHUNKS_BOX: box,
+        CHUNKS_SELECTION: selection,
+    }
@@ -0,0 +1,129 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Registry of background jobs (e.g., repacking a database). Lives in the
+manager process (see hurray.swmr.lock), so the state of a job can be updated
+by the process running it and queried by any other process.
+"""
+
+import time
+
+# job states
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# keys of a job
+JOB_ID = 'id'
+JOB_KIND = 'kind'
+JOB_ARGS = 'args'
+JOB_STATE = 'state'
+JOB_PHASE = 'phase'
+JOB_PROGRESS = 'progress'
+JOB_BYTES_DONE = 'bytes_done'
+JOB_BYTES_TOTAL = 'bytes_total'
+JOB_RESULT = 'result'
+JOB_ERROR = 'error'
+JOB_CREATED = 'created'
+JOB_FINISHED = 'finished'
+
+# finished jobs are forgotten after this many seconds
+JOB_RETENTION = 24 * 3600
+
+
+class JobRegistry(object):
+    def __init__(self):
+        self.__jobs = {}
+        self.__next_id = 1
+        self.__busy = {}  # resource (e.g., file name) -> job id
+
+    def create(self, kind, resource, args):
+        """
+        Register a new job working on ``resource``
+
+        Returns:
+            job id or None if another job is working on ``resource``
+        """
+        self.__expire()
+        if resource in self.__busy:
+            return None
+        job_id = self.__next_id
+        self.__next_id += 1
+        self.__jobs[job_id] = {
+            JOB_ID: job_id,
+            JOB_KIND: kind,
+            JOB_ARGS: args,
+            JOB_STATE: JOB_PENDING,
+            JOB_PHASE: None,
+            JOB_PROGRESS: 0.,
+            JOB_BYTES_DONE: 0,
+            JOB_BYTES_TOTAL: 0,
+            JOB_RESULT: None,
+            JOB_ERROR: None,
+            JOB_CREATED: time.time(),
+            JOB_FINISHED: None,
+            '_resource': resource,
+        }
+        self.__busy[resource] = job_id
+        return job_id
+
+    def update(self, job_id, **fields):
+        self.__jobs[job_id].update(fields)
+
+    def finish(self, job_id, result=None, error=None):
+        """
+        Mark a job as done (or failed if ``error`` is given) and release its
+        resource
+        """
+        job = self.__jobs[job_id]
+        job.update({
+            JOB_STATE: JOB_FAILED if error else JOB_DONE,
+            JOB_RESULT: result,
+            JOB_ERROR: error,
+            JOB_FINISHED: time.time(),
+        })
+        if not error:
+            job[JOB_PROGRESS] = 1.
+        self.__busy.pop(job['_resource'], None)
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict describing the job (see JOB_*) or None
+        """
+        job = self.__jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if not k.startswith('_')}
+
+    def resource(self, job_id):
+        return self.__jobs[job_id]['_resource']
+
+    def __expire(self):
+        now = time.time()
+        for job_id, job in list(self.__jobs.items()):
+            if job[JOB_FINISHED] and now - job[JOB_FINISHED] > JOB_RETENTION:
+                del self.__jobs[job_id]
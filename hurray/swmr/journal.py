@@ -0,0 +1,111 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Write journal of a database that is being rewritten (see
+hurray.swmr.repack). While the journal file exists, every write operation
+appends an entry describing the modified node, so that the modifications can
+be replayed on the rewritten copy. Entries are appended by writers, i.e.,
+while the file is write-locked, and read while it is (at least) read-locked.
+
+Every entry is also passed to the functions in LISTENERS, whether or not the
+file is being journaled (e.g., to feed the change log of a primary server,
+see hurray.replication).
+"""
+
+import os
+import pickle
+
+JOURNAL_SUFFIX = '.journal'
+
+# entry kinds
+NODE = 'node'  # a node was created, replaced or deleted
+TREE = 'tree'  # a node and all of its descendants may have changed
+ATTRS = 'attrs'  # attributes of a node were modified
+DATA = 'data'  # a region of a dataset (and possibly its shape) was modified
+
+
+# functions called with the arguments of every record() call
+LISTENERS = []
+
+
+def journal_path(file):
+    return file + JOURNAL_SUFFIX
+
+
+def start(file):
+    """
+    Start journaling writes to ``file`` (truncates a stale journal)
+    """
+    open(journal_path(file), 'wb').close()
+
+
+def stop(file):
+    """
+    Stop journaling writes to ``file``
+    """
+    try:
+        os.remove(journal_path(file))
+    except FileNotFoundError:
+        pass
+
+
+def record(file, kind, path, key=None):
+    """
+    Append an entry to the journal of ``file`` (if it is being journaled)
+
+    Args:
+        file: file name
+        kind: NODE, TREE, ATTRS or DATA
+        path: path of the modified node
+        key: modified region (for DATA entries, None: shape and attributes
+            only)
+    """
+    for listener in LISTENERS:
+        listener(file, kind, path, key)
+    name = journal_path(file)
+    if not os.path.exists(name):
+        return
+    with open(name, 'ab') as f:
+        pickle.dump((kind, path, key), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read(file, offset=0):
+    """
+    Read the entries that were appended after ``offset``
+
+    Returns:
+        tuple (entries, new offset)
+    """
+    entries = []
+    with open(journal_path(file), 'rb') as f:
+        f.seek(offset)
+        while True:
+            try:
+                entries.append(pickle.load(f))
+            except EOFError:
+                break
+        offset = f.tell()
+
+    return entries, offset
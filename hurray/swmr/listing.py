@@ -0,0 +1,251 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Listing the members of (huge) groups page by page. Links are iterated in
+the order of the hdf5 name index, i.e., sorted by name, which allows
+resuming an iteration and searching for a prefix without looking at the
+preceding links.
+
+A page ends with an opaque cursor (a string) that is passed to the next
+call. Cursors contain the link iteration index together with the last
+listed name; if links were inserted or removed in the meantime, the
+iteration continues after that name.
+"""
+
+import base64
+import json
+
+import h5py
+
+
+def encode_cursor(state):
+    """
+    Encode the state of an iteration (JSON serializable) as a cursor
+    """
+    data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor()
+
+    Raises:
+        ValueError if the cursor is invalid
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor: {}".format(e))
+
+
+def link_name(gid, idx):
+    """
+    Name of the ``idx``-th link of a group (in name order)
+    """
+    name = gid.get_objname_by_idx(idx)
+    return name.decode('utf-8') if isinstance(name, bytes) else name
+
+
+def bisect_links(gid, name):
+    """
+    Index of the first link of a group whose name is not smaller than
+    ``name`` (binary search on the name index)
+    """
+    lo, hi = 0, gid.get_num_objs()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if link_name(gid, mid) < name:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def resume(gid, idx, last):
+    """
+    Index of the link following ``last``, which was the ``idx - 1``-th link
+    when the cursor was created
+    """
+    if last is None:
+        return idx
+    if 0 < idx <= gid.get_num_objs() and link_name(gid, idx - 1) == last:
+        return idx
+    idx = bisect_links(gid, last)
+    if idx < gid.get_num_objs() and link_name(gid, idx) == last:
+        idx += 1
+    return idx
+
+
+def iterate(gid, start, func):
+    """
+    Call ``func(name)`` for the links of a group, starting at index
+    ``start``, until it returns True.
+
+    Returns:
+        tuple (stopped, index of the next link)
+    """
+    if start >= gid.get_num_objs():
+        return False, start
+
+    def visit(name):
+        return func(name.decode('utf-8')) or None
+
+    stopped, idx = gid.links.iterate(visit, idx=start)
+    return bool(stopped), idx
+
+
+def keys(group, limit=None, cursor=None, prefix=None, hidden=None):
+    """
+    List the member names of an h5py group
+
+    Args:
+        group: h5py group
+        limit: maximum number of names (None for no limit)
+        cursor: cursor returned by the previous call
+        prefix: only list names starting with ``prefix``
+        hidden: skip names starting with this prefix
+
+    Returns:
+        tuple (names, cursor), where cursor is None if there are no more
+        names
+
+    Raises:
+        ValueError if the cursor is invalid
+    """
+    gid = group.id
+    start = 0
+    if cursor is not None:
+        try:
+            idx, last = decode_cursor(cursor)
+            start = resume(gid, int(idx), last)
+        except (TypeError, ValueError) as e:
+            raise ValueError("invalid cursor: {}".format(e))
+    if prefix:
+        start = max(start, bisect_links(gid, prefix))
+
+    names = []
+    state = {'done': False}
+
+    def visit(name):
+        if prefix and not name.startswith(prefix):
+            state['done'] = True  # names are sorted
+            return True
+        if hidden is None or not name.startswith(hidden):
+            names.append(name)
+        return limit is not None and len(names) >= limit
+
+    stopped, idx = iterate(gid, start, visit)
+    if not stopped or state['done'] or idx >= gid.get_num_objs():
+        return names, None
+    return names, encode_cursor([idx, names[-1]])
+
+
+def walk(root, add, depth=None, limit=None, cursor=None, hidden=None):
+    """
+    Walk the tree below an h5py group. Groups are listed before their
+    members. Groups that are reachable through several hard links are
+    listed under every path, except for links back to an ancestor.
+
+    Args:
+        root: h5py group
+        add: function add(name, parent, obj) that is called for every node
+            (including ``root``, which has parent -1). ``parent`` is the
+            position of the parent's add() call over all pages.
+        depth: maximum depth of listed nodes (None for no limit)
+        limit: maximum number of nodes per page (None for no limit)
+        cursor: cursor returned by the previous call
+        hidden: skip names starting with this prefix
+
+    Returns:
+        cursor for the next page or None if the walk is complete
+
+    Raises:
+        ValueError if the cursor is invalid
+    """
+    if cursor is None:
+        add(root.name, -1, root)
+        count = 1
+        # (index, path, level, link index, last name, ancestor addresses)
+        stack = []
+        if depth is None or depth > 0:
+            stack.append((0, root.name, 0, 0, None, [address(root)]))
+        if stack and limit is not None and limit <= 1:
+            return encode_cursor([count, stack])
+        first = 0
+    else:
+        try:
+            count, stack = decode_cursor(cursor)
+            count = int(count)
+        except (TypeError, ValueError) as e:
+            raise ValueError("invalid cursor: {}".format(e))
+        first = count
+
+    while stack:
+        index, path, level, start, last, ancestors = stack.pop()
+        group = root.file.get(path)
+        if not isinstance(group, h5py.Group):
+            continue  # removed in the meantime
+        gid = group.id
+        children = []
+        state = {'count': count, 'last': last}
+
+        def visit(name):
+            state['last'] = name
+            if hidden is not None and name.startswith(hidden):
+                return False
+            obj = group.get(name)
+            if obj is None:  # broken link
+                return False
+            add(name, index, obj)
+            if isinstance(obj, h5py.Group) and \
+                    (depth is None or level + 1 < depth):
+                addr = address(obj)
+                if addr not in ancestors:
+                    children.append((state['count'], obj.name, level + 1, 0,
+                                     None, ancestors + [addr]))
+            state['count'] += 1
+            return limit is not None and state['count'] - first >= limit
+
+        stopped, idx = iterate(gid, resume(gid, start, last), visit)
+        count = state['count']
+        if stopped:
+            if idx < gid.get_num_objs():
+                stack.append((index, path, level, idx, state['last'],
+                              ancestors))
+            stack.extend(reversed(children))
+            if stack:
+                return encode_cursor([count, stack])
+            return None
+        stack.extend(reversed(children))
+
+    return None
+
+
+def address(obj):
+    """
+    Address of an hdf5 object (identifies hard links to the same object)
+    """
+    return h5py.h5o.get_info(obj.id).addr
@@ -25,10 +25,19 @@
 """
 A server process manager providing different locking strategies to processes
 accessing a shared resource.  See strategies for concrete implementations.
+
+The catalog of databases runs in a manager process of its own, so scanning
+the base directory and watching it with inotify does not slow down lock
+requests.
 """
 
 from multiprocessing.managers import BaseManager
 
+from .catalog import Catalog
+from .changelog import ChangeLog, ReplicaState
+from .jobs import JobRegistry
+from .processes import ProcessRegistry
+from .stats import AccessStats, Recorder
 from .strategies import (no_starve, writer_preference, LOCK_STRATEGY_NO_STARVE,
                          LOCK_STRATEGY_WRITER_PREFERENCE)
 
@@ -64,21 +73,52 @@ class SWMRSyncManager(BaseManager):
 
 
 SWMRSyncManager.register('SWMRSync', SWMRSync)
+SWMRSyncManager.register('AccessStats', AccessStats)
+SWMRSyncManager.register('JobRegistry', JobRegistry)
+SWMRSyncManager.register('ProcessRegistry', ProcessRegistry)
+SWMRSyncManager.register('ChangeLog', ChangeLog)
+SWMRSyncManager.register('ReplicaState', ReplicaState)
+
+
+class CatalogManager(BaseManager):
+    pass
+
+
+CatalogManager.register('Catalog', Catalog)
 
 
 def start_sync_manager():
     """
-    Start a server process which holds the SWMRSync object.
+    Start a server process which holds the SWMRSync object (and other objects
+    shared by all processes, e.g., access statistics).
     Other processes can manipulate (mainly acquire and release locks) it using
     a proxy
-    :return: A SWMRSync proxy
+    :return: The started manager
     """
     manager = SWMRSyncManager()
     manager.start()
-    return manager.SWMRSync()
+    return manager
+
+
+def start_catalog_manager():
+    """
+    Start a server process which holds the Catalog object
+    :return: The started manager
+    """
+    manager = CatalogManager()
+    manager.start()
+    return manager
 
 
 # All forked children have to access SWMRSync object using the SWMR_SYNC proxy.
 # It is important that this module is imported before the child processes are
 # forked to ensure that the manager is started by the parent process.
-SWMR_SYNC = start_sync_manager()
+_MANAGER = start_sync_manager()
+_CATALOG_MANAGER = start_catalog_manager()
+SWMR_SYNC = _MANAGER.SWMRSync()
+ACCESS_STATS = Recorder(_MANAGER.AccessStats())
+JOBS = _MANAGER.JobRegistry()
+CATALOG = _CATALOG_MANAGER.Catalog()
+PROCESSES = _MANAGER.ProcessRegistry()
+CHANGES = _MANAGER.ChangeLog()
+REPLICA = _MANAGER.ReplicaState()
@@ -0,0 +1,157 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Reading contiguous datasets through memory maps. Datasets that are stored
+contiguously and without filters are laid out in the file exactly like a
+NumPy array, so their data can be read with np.memmap straight from the page
+cache. This avoids opening the file with h5py and the hdf5 read machinery
+for every read.
+
+The file offset of a dataset is looked up once per process and cached
+together with the device, inode, size and modification time of the file.
+Every write to the file (including writes that change the layout of the
+dataset, e.g., overwriting it with a chunked dataset) modifies at least the
+modification time, in which case the mapping is discarded and the layout
+is looked up again. Callers must hold the reader lock of the file.
+"""
+
+import os
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+from .selection import expand_key
+
+# maximum number of cached layouts per process (every mapping holds a file
+# descriptor)
+MAX_MAPPINGS = 64
+
+# dtypes that are stored like their NumPy counterparts
+MAPPABLE_KINDS = 'iufc'
+
+
+class MappedDataset(object):
+    """
+    Memory-mapped contiguous dataset. Like h5py datasets, it has a shape, a
+    dtype and chunks (None) attribute.
+    """
+    chunks = None
+
+    def __init__(self, file, offset, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+        self.array = np.memmap(file, mode='r', dtype=dtype, offset=offset,
+                               shape=shape)
+
+    def read(self, key):
+        """
+        Read a basic selection. The result is copied from the mapping and
+        has the same type as the result of an h5py dataset.
+
+        Raises:
+            TypeError if the key is not a basic selection
+            ValueError, IndexError if the key is invalid
+        """
+        slices, squeeze = expand_key(key, self.shape)
+        key = tuple(s.start if axis in squeeze else s
+                    for axis, s in enumerate(slices))
+        data = self.array[key]
+        if isinstance(data, np.ndarray):
+            return np.array(data)
+        return data
+
+
+# (file, path) -> (signature, MappedDataset or None if not mappable)
+_CACHE = OrderedDict()
+
+
+def signature(file):
+    """
+    Identify the version of a file, or None if the file does not exist
+    """
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+
+def mappable(dst):
+    """
+    File offset of an h5py dataset if it can be memory-mapped, else None
+    """
+    if dst.chunks is not None or dst.ndim == 0 or \
+            dst.dtype.kind not in MAPPABLE_KINDS:
+        return None
+    dcpl = dst.id.get_create_plist()
+    if dcpl.get_layout() != h5py.h5d.CONTIGUOUS or \
+            dcpl.get_external_count() > 0 or dcpl.get_nfilters() > 0:
+        return None
+    return dst.id.get_offset()  # None if storage is not allocated
+
+
+def get(file, path):
+    """
+    Cached mapping of a dataset, or None if the dataset is not mappable or
+    its layout has to be looked up (see register())
+    """
+    entry = _CACHE.get((file, path))
+    if entry is None:
+        return None
+    if entry[0] != signature(file):
+        del _CACHE[(file, path)]
+        return None
+    _CACHE.move_to_end((file, path))
+    return entry[1]
+
+
+def register(file, path, dst):
+    """
+    Look up the layout of an open h5py dataset and cache its mapping (or
+    the fact that it cannot be mapped) unless the cache is up to date.
+    """
+    sig = signature(file)
+    if sig is None:
+        return
+    entry = _CACHE.get((file, path))
+    if entry is not None and entry[0] == sig:
+        return
+    mapped = None
+    offset = mappable(dst)
+    if offset is not None and \
+            offset + dst.size * dst.dtype.itemsize <= sig[2]:
+        mapped = MappedDataset(file, offset, dst.shape, dst.dtype)
+    _CACHE[(file, path)] = (sig, mapped)
+    _CACHE.move_to_end((file, path))
+    while len(_CACHE) > MAX_MAPPINGS:
+        _CACHE.popitem(last=False)
+
+
+def clear():
+    """
+    Discard all cached mappings
+    """
+    _CACHE.clear()
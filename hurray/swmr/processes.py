@@ -0,0 +1,67 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Registry of the server processes. Lives in the manager process (see
+hurray.swmr.lock); every forked server process periodically publishes its
+connection and request counters, so that any process can report them for
+all processes (e.g., to check how evenly connections are balanced).
+"""
+
+import time
+
+# keys of a process entry
+PROCESS_TASK = 'task'
+PROCESS_PID = 'pid'
+PROCESS_CONNECTIONS = 'connections'  # accepted since the start
+PROCESS_OPEN = 'open'  # currently open connections
+PROCESS_REQUESTS = 'requests'  # handled since the start
+PROCESS_UPDATED = 'updated'  # time of the last update
+
+
+class ProcessRegistry(object):
+    def __init__(self):
+        self.__processes = {}
+
+    def update(self, task, pid, connections, open, requests):
+        """
+        Publish the counters of a server process. A restarted process
+        replaces the entry of its predecessor (same task id).
+        """
+        self.__processes[task] = {
+            PROCESS_TASK: task,
+            PROCESS_PID: pid,
+            PROCESS_CONNECTIONS: connections,
+            PROCESS_OPEN: open,
+            PROCESS_REQUESTS: requests,
+            PROCESS_UPDATED: time.time(),
+        }
+
+    def get(self):
+        """
+        Returns:
+            list of dicts (see PROCESS_*) ordered by task id
+        """
+        return [dict(self.__processes[task])
+                for task in sorted(self.__processes)]
@@ -0,0 +1,326 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Multi-resolution pyramids ("overviews") of datasets.
+
+Level ``k`` of a pyramid is the dataset reduced by ``factor**k`` along the
+pyramid axes (by default the last two axes, i.e., the spatial axes of 2D/3D
+grids) by averaging blocks of ``factor`` elements of level ``k - 1``. The
+levels are stored beside the dataset in the group
+``<parent>/__hurray_overviews__/<name>``.
+
+Writes to a dataset with a pyramid only record the modified region (a
+"dirty" bounding box) in an attribute of the overview group. The affected
+tiles of all levels are recomputed later, in batches, by update().
+
+The functions in this module operate on open h5py objects; locking is the
+responsibility of the caller (see hurray.swmr.api).
+"""
+
+import math
+import posixpath
+
+import numpy as np
+
+from .selection import expand_key, block_shape, iter_blocks
+
+OVERVIEWS_GROUP = '__hurray_overviews__'
+
+# attribute of a dataset with a pyramid: [factor, levels, axis_1, ...]
+PYRAMID_ATTR = '__hurray_pyramid__'
+
+# attribute of the overview group: dirty boxes, one row of
+# [start_1, ..., start_n, stop_1, ..., stop_n] per box
+DIRTY_ATTR = '__hurray_dirty__'
+
+# dirty boxes are merged into one bounding box beyond this number
+MAX_DIRTY_BOXES = 64
+
+# levels are added until the pyramid axes are smaller than this
+MIN_SIZE = 256
+
+
+def overview_path(path):
+    """
+    Path of the group holding the levels of the dataset at ``path``
+    """
+    parent, name = posixpath.split(path)
+    return posixpath.join(parent, OVERVIEWS_GROUP, name)
+
+
+def info(dst):
+    """
+    Pyramid parameters of an h5py dataset
+
+    Returns:
+        tuple (factor, levels, axes) or None if the dataset has no pyramid
+    """
+    if PYRAMID_ATTR not in dst.attrs:
+        return None
+    params = [int(p) for p in dst.attrs[PYRAMID_ATTR]]
+    return params[0], params[1], tuple(params[2:])
+
+
+def level_shape(shape, factor, axes):
+    """
+    Shape of the next coarser level
+    """
+    return tuple(int(math.ceil(n / factor)) if axis in axes else n
+                 for axis, n in enumerate(shape))
+
+
+def downsample(arr, factor, axes):
+    """
+    Reduce an array by averaging blocks of ``factor`` elements along
+    ``axes``. Blocks at the edges may be smaller.
+    """
+    dtype = arr.dtype
+    result = arr.astype(np.float64)
+    for axis in axes:
+        n = result.shape[axis]
+        m = int(math.ceil(n / factor))
+        if m * factor != n:
+            pad = [(0, 0)] * result.ndim
+            pad[axis] = (0, m * factor - n)
+            result = np.pad(result, pad, mode='constant',
+                            constant_values=np.nan)
+        shape = result.shape[:axis] + (m, factor) + result.shape[axis + 1:]
+        with np.errstate(invalid='ignore'):
+            result = np.nanmean(result.reshape(shape), axis=axis + 1)
+    if dtype.kind in 'iub':
+        result = np.round(result)
+
+    return result.astype(dtype)
+
+
+def _update_box(src, dst, start, stop, factor, axes, src_shape):
+    """
+    Recompute the region ``[start, stop)`` (in coordinates of ``src``) of
+    the next coarser level ``dst``.
+
+    Returns:
+        tuple (start, stop) of the updated region in coordinates of ``dst``
+    """
+    lstart = tuple(s // factor if axis in axes else s
+                   for axis, s in enumerate(start))
+    lstop = tuple(int(math.ceil(s / factor)) if axis in axes else s
+                  for axis, s in enumerate(stop))
+    region = tuple(b - a for a, b in zip(lstart, lstop))
+    block = block_shape(region, dst.chunks, 8 * factor ** len(axes))
+    for blk in iter_blocks(region, block):
+        dst_key = tuple(slice(a + b.start, a + b.stop)
+                        for a, b in zip(lstart, blk))
+        src_key = tuple(slice(k.start * factor, min(k.stop * factor, n))
+                        if axis in axes else k
+                        for axis, (k, n) in enumerate(zip(dst_key,
+                                                          src_shape)))
+        dst[dst_key] = downsample(src[src_key], factor, axes)
+
+    return lstart, lstop
+
+
+def create(dst, shape, factor=2, levels=None, axes=None):
+    """
+    Create (or rebuild) the pyramid of an h5py dataset.
+
+    Args:
+        dst: h5py dataset (opened for writing)
+        shape: (logical) shape of the dataset
+        factor: reduction factor between levels (>= 2)
+        levels: number of levels (default: reduce until the pyramid axes are
+            smaller than MIN_SIZE)
+        axes: pyramid axes (default: the last two axes)
+
+    Raises:
+        ValueError for invalid parameters
+    """
+    ndim = len(shape)
+    if factor < 2:
+        raise ValueError("factor must be >= 2")
+    if axes is None:
+        axes = tuple(range(max(0, ndim - 2), ndim))
+    axes = tuple(sorted(set(axis % ndim for axis in axes))) if ndim else ()
+    if not axes:
+        raise ValueError("pyramids need at least one axis")
+    if levels is None:
+        levels = 0
+        size = max(shape[axis] for axis in axes)
+        while size > MIN_SIZE:
+            size = int(math.ceil(size / factor))
+            levels += 1
+        levels = max(levels, 1)
+    if levels < 1:
+        raise ValueError("levels must be >= 1")
+
+    delete(dst)
+    group = dst.file.require_group(overview_path(dst.name))
+    level_shp = shape
+    for level in range(1, levels + 1):
+        level_shp = level_shape(level_shp, factor, axes)
+        chunks = tuple(min(max(n, 1), 256) if axis in axes else 1
+                       for axis, n in enumerate(level_shp))
+        group.create_dataset(str(level), shape=level_shp, dtype=dst.dtype,
+                             chunks=chunks, maxshape=(None,) * ndim)
+    dst.attrs[PYRAMID_ATTR] = np.array((factor, levels) + axes)
+
+    # compute all levels
+    mark_dirty(dst, shape, Ellipsis)
+    update(dst, shape)
+
+
+def delete(dst):
+    """
+    Remove the pyramid of an h5py dataset (if any)
+    """
+    path = overview_path(dst.name)
+    if path in dst.file:
+        del dst.file[path]
+        parent = posixpath.dirname(path)
+        if len(dst.file[parent]) == 0:
+            del dst.file[parent]
+    if PYRAMID_ATTR in dst.attrs:
+        del dst.attrs[PYRAMID_ATTR]
+
+
+def mark_dirty(dst, shape, key):
+    """
+    Record that the region ``key`` of an h5py dataset has been written.
+    Does nothing if the dataset has no pyramid.
+
+    Returns:
+        True if a dirty region was recorded
+    """
+    if PYRAMID_ATTR not in dst.attrs:
+        return False
+    try:
+        slices, _ = expand_key(key, shape)
+        start = [s.start for s in slices]
+        stop = [s.start + max(0, (s.stop - s.start - 1) // s.step) * s.step +
+                1 for s in slices]
+    except (TypeError, ValueError, IndexError):  # fancy indexing etc.
+        start = [0] * len(shape)
+        stop = list(shape)
+    if any(a >= b for a, b in zip(start, stop)):
+        return False
+
+    group = dst.file[overview_path(dst.name)]
+    box = np.array([start + stop], dtype=np.int64)
+    if DIRTY_ATTR in group.attrs:
+        boxes = np.concatenate([group.attrs[DIRTY_ATTR], box])
+        if len(boxes) > MAX_DIRTY_BOXES:
+            ndim = len(shape)
+            box = np.concatenate([boxes[:, :ndim].min(axis=0),
+                                  boxes[:, ndim:].max(axis=0)])
+            boxes = box.reshape(1, -1)
+    else:
+        boxes = box
+    group.attrs[DIRTY_ATTR] = boxes
+
+    return True
+
+
+def is_dirty(dst):
+    """
+    Check if the pyramid of an h5py dataset needs to be updated
+    """
+    if PYRAMID_ATTR not in dst.attrs:
+        return False
+    group = dst.file[overview_path(dst.name)]
+    return DIRTY_ATTR in group.attrs
+
+
+def update(dst, shape):
+    """
+    Recompute the dirty regions of all levels of the pyramid of an h5py
+    dataset. Levels are resized if the dataset has been extended.
+    """
+    if not is_dirty(dst):
+        return
+    factor, levels, axes = info(dst)
+    group = dst.file[overview_path(dst.name)]
+    boxes = group.attrs[DIRTY_ATTR]
+    ndim = len(shape)
+
+    shapes = [shape]
+    for level in range(1, levels + 1):
+        shapes.append(level_shape(shapes[-1], factor, axes))
+        if group[str(level)].shape != shapes[-1]:
+            group[str(level)].resize(shapes[-1])
+
+    for box in boxes:
+        start, stop = tuple(box[:ndim]), tuple(box[ndim:])
+        stop = tuple(min(s, n) for s, n in zip(stop, shape))
+        src = dst
+        for level in range(1, levels + 1):
+            level_dst = group[str(level)]
+            start, stop = _update_box(src, level_dst, start, stop, factor,
+                                      axes, shapes[level - 1])
+            src = level_dst
+
+    del group.attrs[DIRTY_ATTR]
+
+
+def read(dst, shape, key, resolution):
+    """
+    Read a selection from the coarsest level whose reduction factor does
+    not exceed ``resolution``.
+
+    Args:
+        dst: h5py dataset
+        shape: (logical) shape of the dataset
+        key: basic selection in coordinates of the dataset
+        resolution: maximum acceptable reduction factor
+
+    Returns:
+        tuple (array, reduction factor of the level read)
+
+    Raises:
+        TypeError if the key is not a basic selection
+        ValueError, IndexError if the key is invalid
+    """
+    pyramid = info(dst)
+    if pyramid is None or resolution < 2:
+        return None, 1
+    factor, levels, axes = pyramid
+    level = min(levels, int(math.floor(math.log(resolution, factor) + 1e-9)))
+    if level < 1:
+        return None, 1
+    scale = factor ** level
+
+    slices, squeeze = expand_key(key, shape)
+    level_key = []
+    for axis, s in enumerate(slices):
+        if axis in axes:
+            if axis in squeeze:
+                level_key.append(s.start // scale)
+            else:
+                step = max(1, s.step // scale)
+                level_key.append(slice(s.start // scale,
+                                       int(math.ceil(s.stop / scale)), step))
+        else:
+            level_key.append(s.start if axis in squeeze else s)
+    group = dst.file[overview_path(dst.name)]
+
+    return group[str(level)][tuple(level_key)], scale
@@ -0,0 +1,347 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Rewriting ("repacking") databases. hdf5 does not reclaim the space of
+deleted or overwritten objects, and the chunk layout of a dataset cannot be
+changed in place. repack() copies a database into a temporary file, possibly
+with a new chunk layout and compression, and replaces the original file by
+the copy:
+
+1. Writes to the database are journaled (see hurray.swmr.journal).
+2. All objects are copied block by block. Every block is read under a short
+   read lock, so reads and writes are served from the original file in the
+   meantime. The copy can be throttled.
+3. The journaled writes are replayed on the copy (under a read lock) until
+   few writes remain.
+4. Under a write lock, the remaining writes are replayed and the copy
+   atomically replaces the original file.
+
+Replaying a journal entry copies the current state of the modified node or
+region from the original file, hence the order of the entries does not
+matter.
+"""
+
+import os
+import posixpath
+import time
+
+import h5py
+
+from . import journal
+from .api import logical_shape
+from .selection import expand_key, slice_length, block_shape, iter_blocks
+from .sync import locked
+from .transfer import _layout, _merge_layout, _create
+
+REPACK_SUFFIX = '.repack'
+
+# size of the blocks copied under a single read lock (in bytes)
+REPACK_BLOCK_SIZE = 8 * 1024 * 1024
+
+# the journal is replayed without blocking readers at most this many times,
+# until fewer than CATCHUP_ENTRIES writes were journaled in the meantime
+CATCHUP_ROUNDS = 10
+CATCHUP_ENTRIES = 100
+
+# phases of a repack job
+PHASE_COPY = 'copy'
+PHASE_CATCHUP = 'catchup'
+PHASE_SWAP = 'swap'
+
+# keys of the result of repack()
+REPACK_SIZE_BEFORE = 'size_before'
+REPACK_SIZE_AFTER = 'size_after'
+
+
+def _nbytes(shape, itemsize):
+    n = itemsize
+    for s in shape:
+        n *= s
+    return n
+
+
+def _exists(f, path):
+    return path == '/' or f.get(path, getlink=True) is not None
+
+
+def _copy_attrs(src, dst):
+    for key in list(dst.attrs):
+        del dst.attrs[key]
+    for key in src.attrs:
+        dst.attrs.create(key, src.attrs[key],
+                         dtype=src.attrs.get_id(key).dtype)
+
+
+def _copy_box(src, dst, start, stop):
+    """
+    Copy the region ``[start, stop)`` of ``src`` to ``dst``
+    """
+    region = tuple(b - a for a, b in zip(start, stop))
+    block = block_shape(region, dst.chunks, dst.dtype.itemsize,
+                        REPACK_BLOCK_SIZE)
+    for blk in iter_blocks(region, block):
+        key = tuple(slice(a + b.start, a + b.stop)
+                    for a, b in zip(start, blk))
+        dst[key] = src[key]
+
+
+def _copy_tree(src, new, path, target, overrides, data=True):
+    """
+    Copy the node ``src`` (recursively) to ``path`` in the file ``new``.
+    Creation properties are overridden for the dataset ``target`` (or all
+    datasets if ``target`` is None).
+
+    Returns:
+        list of paths of the copied datasets
+    """
+    parent = posixpath.dirname(path)
+    if parent != '/':
+        new.require_group(parent)
+    if isinstance(src, h5py.Dataset):
+        layout = _layout(src)
+        layout['maxshape'] = src.maxshape
+        if target is None or target == src.name:
+            layout = _merge_layout(layout, dict(overrides))
+        shape = logical_shape(src)
+        dst = _create(new.filename, new, path, shape, src.dtype, layout,
+                      False)
+        _copy_attrs(src, dst)
+        if data:
+            _copy_box(src, dst, (0,) * len(shape), shape)
+        return [path]
+
+    datasets = []
+    group = new['/'] if path == '/' else new.create_group(path)
+    _copy_attrs(src, group)
+    for name in src:
+        child = posixpath.join(path, name)
+        link = src.get(name, getlink=True)
+        if isinstance(link, h5py.SoftLink):
+            new[child] = h5py.SoftLink(link.path)
+        elif isinstance(link, h5py.ExternalLink):
+            new[child] = h5py.ExternalLink(link.filename, link.path)
+        else:
+            datasets += _copy_tree(src[name], new, child, target, overrides,
+                                   data)
+    return datasets
+
+
+def _replace(old, new, path, target, overrides):
+    """
+    Replace the node ``path`` (and its descendants) in ``new`` by the
+    current state in ``old``
+    """
+    if path == '/':
+        for name in list(new['/']):
+            del new[name]
+    elif _exists(new, path):
+        del new[path]
+    if not _exists(old, path):
+        return
+    link = old.get(path, getlink=True)
+    if isinstance(link, (h5py.SoftLink, h5py.ExternalLink)):
+        new[path] = link
+    else:
+        _copy_tree(old[path], new, path, target, overrides)
+
+
+def _replay_node(old, new, path, target, overrides):
+    if (not _exists(old, path) or not _exists(new, path) or
+            not isinstance(old.get(path, getlink=True), h5py.HardLink) or
+            not isinstance(old[path], h5py.Group) or
+            not isinstance(new[path], h5py.Group)):
+        _replace(old, new, path, target, overrides)
+        return
+    # only synchronize the members of groups (modifications of existing
+    # members are journaled separately)
+    src, dst = old[path], new[path]
+    _copy_attrs(src, dst)
+    for name in list(dst):
+        if name not in src:
+            del dst[name]
+    for name in src:
+        if name not in dst:
+            _replace(old, new, posixpath.join(path, name), target, overrides)
+
+
+def _replay_data(old, new, path, key, target, overrides):
+    src = old.get(path)
+    dst = new.get(path)
+    if not isinstance(src, h5py.Dataset) or not isinstance(dst, h5py.Dataset):
+        _replay_node(old, new, path, target, overrides)
+        return
+    shape = logical_shape(src)
+    if dst.shape != shape:
+        try:
+            dst.resize(shape)
+        except (TypeError, ValueError):
+            _replace(old, new, path, target, overrides)
+            return
+    _copy_attrs(src, dst)
+    if key is None:
+        return
+    try:
+        slices, _ = expand_key(key, shape)
+    except TypeError:  # fancy indexing
+        start, stop = (0,) * len(shape), shape
+    except (ValueError, IndexError):
+        return
+    else:
+        start = tuple(s.start for s in slices)
+        stop = tuple(s.start + max(0, slice_length(s) - 1) * s.step + 1
+                     if slice_length(s) else s.start for s in slices)
+    _copy_box(src, dst, start, stop)
+
+
+def replay(old, new, entries, target=None, overrides=None):
+    """
+    Replay journal entries, i.e., copy the current state of the modified
+    nodes from the h5py file ``old`` to ``new``
+    """
+    overrides = overrides or {}
+    # only the last of identical entries needs to be replayed
+    seen = set()
+    unique = []
+    for entry in reversed(entries):
+        ident = (entry[0], entry[1], repr(entry[2]))
+        if ident not in seen:
+            seen.add(ident)
+            unique.append(entry)
+
+    for kind, path, key in reversed(unique):
+        if kind == journal.ATTRS:
+            if _exists(old, path) and _exists(new, path):
+                _copy_attrs(old[path], new[path])
+        elif kind == journal.DATA:
+            _replay_data(old, new, path, key, target, overrides)
+        elif kind == journal.NODE:
+            _replay_node(old, new, path, target, overrides)
+        else:
+            _replace(old, new, path, target, overrides)
+
+
+def repack(file, path=None, overrides=None, rate=None, progress=None):
+    """
+    Rewrite a database (see module documentation).
+
+    Args:
+        file: full path to the hdf5 file
+        path: dataset whose creation properties are changed (None: apply
+            ``overrides`` to all datasets)
+        overrides: creation properties (chunks, compression, ...)
+        rate: maximum copy rate in bytes per second (None: unlimited)
+        progress: callable(phase, bytes copied, total bytes)
+
+    Returns:
+        dict with the size of the file before and after repacking
+
+    Raises:
+        KeyError if ``path`` does not exist
+        TypeError if ``path`` is not a dataset
+        ValueError if chunks are given without ``path``
+        OSError if the file disappears (e.g., it is deleted or renamed)
+    """
+    overrides = dict(overrides or {})
+    if overrides.get('chunks') is not None and path is None:
+        raise ValueError("chunks can only be changed for a single dataset")
+    progress = progress or (lambda phase, done, total: None)
+    tmp = file + REPACK_SUFFIX
+
+    with locked(write=[file]):
+        target = None
+        if path is not None:
+            with h5py.File(file, 'r') as f:
+                if path not in f:
+                    raise KeyError("node {} does not exist".format(path))
+                if not isinstance(f[path], h5py.Dataset):
+                    raise TypeError("node {} is not a dataset".format(path))
+                target = f[path].name
+        size_before = os.path.getsize(file)
+        journal.start(file)
+
+    new = None
+    try:
+        new = h5py.File(tmp, 'w')
+        with locked(read=[file]), h5py.File(file, 'r') as old:
+            datasets = _copy_tree(old['/'], new, '/', target, overrides,
+                                  data=False)
+        total = sum(_nbytes(new[p].shape, new[p].dtype.itemsize)
+                    for p in datasets)
+        done = 0
+        started = time.time()
+        for p in datasets:
+            dst = new[p]
+            block = block_shape(dst.shape, dst.chunks, dst.dtype.itemsize,
+                                REPACK_BLOCK_SIZE)
+            for blk in iter_blocks(dst.shape, block):
+                with locked(read=[file]), h5py.File(file, 'r') as old:
+                    src = old.get(p)
+                    # changes of the shape are replayed from the journal
+                    if isinstance(src, h5py.Dataset) and \
+                            src.ndim == dst.ndim:
+                        key = tuple(slice(b.start, min(b.stop, n))
+                                    for b, n in zip(blk, logical_shape(src)))
+                        if all(k.start < k.stop for k in key):
+                            dst[key] = src[key]
+                done += _nbytes([b.stop - b.start for b in blk],
+                                dst.dtype.itemsize)
+                progress(PHASE_COPY, done, total)
+                if rate:
+                    delay = done / rate - (time.time() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+        offset = 0
+        for _ in range(CATCHUP_ROUNDS):
+            with locked(read=[file]), h5py.File(file, 'r') as old:
+                entries, offset = journal.read(file, offset)
+                replay(old, new, entries, target, overrides)
+            progress(PHASE_CATCHUP, done, total)
+            if len(entries) < CATCHUP_ENTRIES:
+                break
+
+        progress(PHASE_SWAP, done, total)
+        with locked(write=[file]):
+            with h5py.File(file, 'r') as old:
+                entries, offset = journal.read(file, offset)
+                replay(old, new, entries, target, overrides)
+            new.close()
+            os.replace(tmp, file)
+            journal.stop(file)
+            size_after = os.path.getsize(file)
+    except BaseException:
+        if new is not None:
+            new.close()
+        # writers must not see a journal that is being removed
+        with locked(write=[file]):
+            journal.stop(file)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    return {
+        REPACK_SIZE_BEFORE: size_before,
+        REPACK_SIZE_AFTER: size_after,
+    }
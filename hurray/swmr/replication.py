@@ -0,0 +1,403 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Replication of changes at the hdf5 level (see hurray.replication).
+
+A primary logs the journal entries of all writes (see hurray.swmr.journal
+and hurray.swmr.changelog). The changes of a file are shipped as an
+in-memory hdf5 file (image) that holds the current state of every modified
+node or region:
+
+* NODE and TREE entries: a copy of the node and its descendants (nothing if
+  the node was deleted, no image at all if the file was deleted)
+* ATTRS entries: a group with the attributes of the node
+* DATA entries: the modified region of the dataset with the attributes of
+  the dataset, and the (allocated) shape of the dataset
+
+A replica copies a database with snapshot(), which copies the datasets
+that would make the image larger than COPY_BLOCK_SIZE without their data.
+Likewise, the values of modified regions are only copied up to a total of
+COPY_BLOCK_SIZE bytes. The replica then copies the remaining datasets and
+regions in pieces (as DATA changes), so no image or response holds a large
+database or a large write.
+
+As for replaying the journal of a repack, a change carries the current state
+and not the operation, so applying changes again or out of order does not
+matter. A change that cannot be applied (e.g., a region of a dataset the
+replica does not have) is reported, so that the replica can copy the node.
+"""
+
+import io
+import os
+import posixpath
+import threading
+
+import h5py
+
+from . import journal
+from .api import logical_shape
+from .lock import CHANGES
+from .repack import _copy_attrs, _copy_box, _copy_tree, _exists, _nbytes
+from .selection import expand_key, slice_length
+from .sync import locked
+
+# keys of the description of a change
+ITEM_KIND = 'kind'
+ITEM_PATH = 'path'
+ITEM_EXISTS = 'exists'  # False if the node does not exist (anymore)
+ITEM_SHAPE = 'shape'  # DATA: allocated shape of the dataset
+ITEM_START = 'start'  # DATA: offset of the region (None: shape only)
+# TREE, DATA: regions of datasets whose values are not in the image, list of
+# (path, start, stop, rows): the rows [start, stop) along the first axis, to
+# be copied in regions of ``rows`` rows (see snapshot)
+ITEM_DEFERRED = 'deferred'
+
+# maximum size of the dataset values of an image of snapshot() (except for
+# a single row of a dataset that is larger)
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+
+# replication state of a replica (in its base directory, not listed)
+STATE_SUFFIX = '.replica'
+STATE_FILE = '.hurray' + STATE_SUFFIX
+
+# sequence number of the last change logged by the request of the current
+# thread (see record)
+_recorded = threading.local()
+
+
+def record(file, kind, path, key=None):
+    """
+    Journal listener of a primary: log a change
+    """
+    seq = CHANGES.append(file, kind, path, key)
+    if seq is not None:
+        _recorded.seq = seq
+
+
+def enable(size):
+    """
+    Log the changes of this process and its (forked) children, keeping the
+    last ``size`` changes
+    """
+    CHANGES.configure(size)
+    if record not in journal.LISTENERS:
+        journal.LISTENERS.append(record)
+
+
+def recorded(reset=False):
+    """
+    Returns:
+        the sequence number of the last change logged by this thread (None
+        if no change was logged since the last reset)
+    """
+    seq = getattr(_recorded, 'seq', None)
+    if reset:
+        _recorded.seq = None
+    return seq
+
+
+def _region(key, shape):
+    """
+    Returns:
+        tuple (start, stop) of the bounding box of a selection
+    """
+    try:
+        slices, _ = expand_key(key, shape)
+    except TypeError:  # fancy indexing
+        return (0,) * len(shape), shape
+    start = tuple(s.start for s in slices)
+    stop = tuple(s.start + max(0, slice_length(s) - 1) * s.step + 1
+                 if slice_length(s) else s.start for s in slices)
+    return start, stop
+
+
+def _image_path(name, path, copied):
+    """
+    Returns:
+        path in the group ``name`` of an image of the node ``copied``, a
+        descendant of the node ``path`` (or the node itself)
+    """
+    return posixpath.normpath(posixpath.join(
+        '/' + name, posixpath.relpath(copied, path)))
+
+
+def _copy_node(image, name, dst, path, deferred=()):
+    """
+    Copy the node (or link) ``name`` of ``image`` to ``path`` in ``dst``
+    (only the shape and the attributes of the ``deferred`` datasets)
+    """
+    link = image.get(name, getlink=True)
+    if isinstance(link, (h5py.SoftLink, h5py.ExternalLink)):
+        dst[path] = link
+        return
+    skip = set(entry[0] for entry in deferred)
+    for copied in _copy_tree(image[name], dst, path, None, {}, data=False):
+        if copied not in skip:
+            node = dst[copied]
+            _copy_box(image[_image_path(name, path, copied)], node,
+                      (0,) * node.ndim, node.shape)
+
+
+class _Budget(object):
+    """
+    Number of bytes of dataset values that may still be copied to an image
+    """
+
+    def __init__(self, block_size=None, limit=None):
+        """
+        Args:
+            block_size: see snapshot() (None: unlimited)
+            limit: number of bytes (default: block_size)
+        """
+        self.block_size = block_size
+        self.left = block_size if limit is None else limit
+
+    def take(self, shape, itemsize):
+        """
+        Returns:
+            True if the values of a region of ``shape`` may be copied (the
+            values of scalar datasets are always copied)
+        """
+        if self.block_size is None or not shape:
+            return True
+        nbytes = _nbytes(shape, itemsize)
+        if nbytes > self.left:
+            return False
+        self.left -= nbytes
+        return True
+
+    def deferred(self, path, shape, itemsize, start, stop):
+        """
+        Returns:
+            ITEM_DEFERRED entry of the rows [start, stop) of a dataset
+        """
+        row = max(1, _nbytes(shape[1:], itemsize))
+        return path, start, stop, max(1, self.block_size // row)
+
+
+def _snapshot(node, image, name, path, budget):
+    """
+    Copy a node to the group ``name`` of ``image``, but only the shape and
+    the attributes of the datasets whose values exceed the budget
+
+    Returns:
+        list of ITEM_DEFERRED entries of these datasets
+    """
+    deferred = []
+    for copied in _copy_tree(node, image, '/' + name, None, {}, data=False):
+        rel = posixpath.relpath(copied, '/' + name)
+        src = node if rel == '.' else node[rel]
+        shape = logical_shape(src)
+        if budget.take(shape, src.dtype.itemsize):
+            _copy_box(src, image[copied], (0,) * len(shape), shape)
+        else:
+            deferred.append(budget.deferred(
+                path if rel == '.' else posixpath.join(path, rel), shape,
+                src.dtype.itemsize, 0, shape[0]))
+    return deferred
+
+
+def _describe(src, image, name, kind, path, key, budget):
+    """
+    Copy the current state of a modified node to the group ``name`` of
+    ``image`` (within the _Budget ``budget``)
+
+    Returns:
+        dict describing the change (see ITEM_*)
+    """
+    if kind not in (journal.DATA, journal.ATTRS):
+        kind = journal.TREE
+    item = {ITEM_KIND: kind, ITEM_PATH: path, ITEM_EXISTS: _exists(src, path)}
+    if not item[ITEM_EXISTS]:
+        return item
+    link = None if path == '/' else src.get(path, getlink=True)
+    if isinstance(link, (h5py.SoftLink, h5py.ExternalLink)):
+        item[ITEM_KIND] = journal.TREE
+        image[name] = link
+        return item
+    node = src[path]
+    if kind == journal.DATA and isinstance(node, h5py.Dataset):
+        item[ITEM_SHAPE] = node.shape
+        item[ITEM_START] = None
+        region = image.create_group(name)
+        _copy_attrs(node, region)
+        if key is not None:
+            shape = logical_shape(node)
+            try:
+                start, stop = _region(key, shape)
+            except (ValueError, IndexError):
+                return item
+            itemsize = node.dtype.itemsize
+            if not budget.take([b - a for a, b in zip(start, stop)],
+                               itemsize):
+                item[ITEM_DEFERRED] = [budget.deferred(
+                    path, shape, itemsize, start[0], stop[0])]
+                return item
+            box = tuple(slice(a, b) for a, b in zip(start, stop))
+            region.create_dataset('data', data=node[box])
+            item[ITEM_START] = start
+    elif kind == journal.ATTRS:
+        _copy_attrs(node, image.create_group(name))
+    elif budget.block_size is None:
+        item[ITEM_KIND] = journal.TREE
+        _copy_tree(node, image, '/' + name, None, {})
+    else:
+        item[ITEM_KIND] = journal.TREE
+        item[ITEM_DEFERRED] = _snapshot(node, image, name, path, budget)
+    return item
+
+
+def changes(file, entries, block_size=None, limit=None):
+    """
+    Read the current state of the nodes modified by journal entries
+
+    Args:
+        file: file name
+        entries: list of (kind, path, key) tuples
+        block_size: maximum number of bytes of dataset values in the image,
+            the remaining datasets and regions are listed in the items
+            (ITEM_DEFERRED, see snapshot(); None: unlimited)
+        limit: maximum number of bytes of dataset values in the image if
+            less than block_size (e.g., the rest of the size of a response)
+
+    Returns:
+        tuple (image, items) where image holds the state of the modified
+        nodes (bytes, None if the file does not exist) and items is a list
+        of dicts describing the changes (see ITEM_*)
+    """
+    # only the last of identical entries is needed
+    seen = set()
+    unique = []
+    for entry in reversed(entries):
+        ident = (entry[0], entry[1], repr(entry[2]))
+        if ident not in seen:
+            seen.add(ident)
+            unique.append(entry)
+    unique.reverse()
+
+    with locked(read=[file]):
+        if not os.path.isfile(file):
+            return None, []
+        with h5py.File(file, 'r') as src, \
+                h5py.File('hurray-changes', 'w', driver='core',
+                          backing_store=False) as image:
+            budget = _Budget(block_size, limit)
+            items = [_describe(src, image, str(i), kind, path, key, budget)
+                     for i, (kind, path, key) in enumerate(unique)]
+            image.flush()
+            return image.id.get_file_image(), items
+
+
+def snapshot(file, path='/', key=None, block_size=COPY_BLOCK_SIZE):
+    """
+    Copy a node of a file (see changes()). Datasets are copied until their
+    values exceed ``block_size`` bytes; the remaining datasets are copied
+    without their data and listed in the item (ITEM_DEFERRED), so that the
+    replica can copy them in regions of about ``block_size`` bytes (i.e.,
+    with ``key``, a region of the dataset ``path``).
+    """
+    if key is not None:
+        return changes(file, [(journal.DATA, path, key)])
+    return changes(file, [(journal.TREE, path, None)], block_size)
+
+
+def _remove(dst, path):
+    if path == '/':
+        for name in list(dst):
+            del dst[name]
+        for key in list(dst.attrs):
+            del dst.attrs[key]
+    elif _exists(dst, path):
+        del dst[path]
+
+
+def _apply(image, dst, name, item):
+    """
+    Apply a change to the h5py file ``dst``
+
+    Returns:
+        False if the node has to be copied
+    """
+    path = item[ITEM_PATH]
+    kind = item[ITEM_KIND]
+    if kind == journal.TREE:
+        _remove(dst, path)
+        if item[ITEM_EXISTS]:
+            _copy_node(image, name, dst, path, item.get(ITEM_DEFERRED, ()))
+        return True
+    if not item[ITEM_EXISTS]:
+        # deleted in the meantime (a later TREE change removes it)
+        return True
+    if not _exists(dst, path):
+        return False
+    node = dst[path]
+    if kind == journal.ATTRS:
+        _copy_attrs(image[name], node)
+        return True
+
+    if not isinstance(node, h5py.Dataset):
+        return False
+    region = image[name]
+    shape = tuple(item[ITEM_SHAPE])
+    if node.shape != shape:
+        try:
+            node.resize(shape)
+        except (TypeError, ValueError):
+            return False
+    _copy_attrs(region, node)
+    if item[ITEM_START] is not None:
+        data = region['data']
+        if data.dtype != node.dtype:
+            return False
+        box = tuple(slice(a, a + n)
+                    for a, n in zip(item[ITEM_START], data.shape))
+        node[box] = data[()]
+    return True
+
+
+def apply(file, image, items):
+    """
+    Apply the changes read by changes() to a (replica) file
+
+    Returns:
+        list of paths of nodes that could not be updated and have to be
+        copied (['/'] if the file has to be copied)
+    """
+    with locked(write=[file]):
+        if image is None:
+            if os.path.isfile(file):
+                os.remove(file)
+            return []
+        copy = not os.path.isfile(file)
+        if copy and not any(item[ITEM_KIND] == journal.TREE and
+                            item[ITEM_PATH] == '/' for item in items):
+            return ['/']
+        failed = []
+        with h5py.File(io.BytesIO(image), 'r') as src, \
+                h5py.File(file, 'a') as dst:
+            for i, item in enumerate(items):
+                if not _apply(src, dst, str(i), item):
+                    failed.append(item[ITEM_PATH])
+        return failed
@@ -0,0 +1,161 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Helpers for basic NumPy-style selections (integers, slices and Ellipsis) on
+datasets, and for splitting datasets into blocks that can be processed one
+after another.
+"""
+
+import numbers
+from functools import reduce
+from operator import mul
+
+# default upper bound for the size of a block (in bytes)
+BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def expand_key(key, shape):
+    """
+    Expand a basic index into one slice per dimension.
+
+    Args:
+        key: integer, slice, Ellipsis or a tuple thereof
+        shape: shape of the dataset
+
+    Returns:
+        tuple (slices, squeeze), where ``slices`` is a tuple of slices with
+        non-negative start, stop and step for every dimension and
+        ``squeeze`` is a tuple of the axes that were indexed by an integer
+        (these axes are dropped from the result).
+
+    Raises:
+        TypeError if the key contains unsupported objects (e.g., lists)
+        IndexError if an integer index is out of range
+        ValueError if there are too many indices or a step is not positive
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    n_ellipsis = sum(1 for k in key if k is Ellipsis)
+    if n_ellipsis > 1:
+        raise ValueError("only one Ellipsis is allowed")
+    n_indices = len(key) - n_ellipsis
+    if n_indices > len(shape):
+        raise ValueError("{} indexing arguments for {} dimensions"
+                         .format(n_indices, len(shape)))
+    if n_ellipsis:
+        pos = key.index(Ellipsis)
+        fill = (slice(None),) * (len(shape) - n_indices)
+        key = key[:pos] + fill + key[pos + 1:]
+    else:
+        key = key + (slice(None),) * (len(shape) - n_indices)
+
+    slices = []
+    squeeze = []
+    for axis, (k, n) in enumerate(zip(key, shape)):
+        if isinstance(k, slice):
+            if k.step is not None and k.step < 1:
+                raise ValueError("step must be >= 1")
+            start, stop, step = k.indices(n)
+            stop = max(start, stop)
+            slices.append(slice(start, stop, step))
+        elif isinstance(k, numbers.Integral) and not isinstance(k, bool):
+            i = k + n if k < 0 else k
+            if not 0 <= i < n:
+                raise IndexError("index ({}) out of range for axis {} "
+                                 "with size {}".format(k, axis, n))
+            slices.append(slice(i, i + 1, 1))
+            squeeze.append(axis)
+        else:
+            raise TypeError("unsupported index {!r}".format(k))
+
+    return tuple(slices), tuple(squeeze)
+
+
+def slice_length(s):
+    """
+    Number of elements selected by a slice with non-negative start and stop
+    (as returned by expand_key() or iter_blocks())
+    """
+    step = s.step or 1
+    return max(0, (s.stop - s.start + step - 1) // step)
+
+
+def selection_shape(slices, squeeze=()):
+    """
+    Shape of the array selected by ``slices`` (without the squeezed axes)
+    """
+    return tuple(slice_length(s) for axis, s in enumerate(slices)
+                 if axis not in squeeze)
+
+
+def block_shape(shape, chunks, itemsize, max_bytes=BLOCK_SIZE):
+    """
+    Compute the shape of blocks that tile a dataset. Blocks are multiples
+    of the chunk shape (so that no chunk is written twice) and grow along
+    the trailing axes first, which keeps reads and writes contiguous.
+
+    Args:
+        shape: shape of the dataset
+        chunks: chunk shape (or None for contiguous datasets)
+        itemsize: size of an element in bytes
+        max_bytes: upper bound for the size of a block
+
+    Returns:
+        block shape (tuple)
+    """
+    if chunks is None:
+        chunks = (1,) * len(shape)
+    block = [max(1, min(c, n)) for c, n in zip(chunks, shape)]
+    for axis in reversed(range(len(shape))):
+        others = reduce(mul, block[:axis] + block[axis + 1:], itemsize)
+        multiples = max(1, max_bytes // (others * block[axis]))
+        block[axis] = min(max(shape[axis], 1), block[axis] * multiples)
+        if block[axis] < shape[axis]:
+            break
+
+    return tuple(block)
+
+
+def iter_blocks(shape, block):
+    """
+    Generate tuples of slices that tile an array of the given shape
+    """
+    if any(n == 0 for n in shape):
+        return
+    if not shape:
+        yield ()
+        return
+
+    def _iter(axis):
+        n, b = shape[axis], block[axis]
+        for start in range(0, n, b):
+            s = slice(start, min(start + b, n))
+            if axis == len(shape) - 1:
+                yield (s,)
+            else:
+                for rest in _iter(axis + 1):
+                    yield (s,) + rest
+
+    yield from _iter(0)
@@ -0,0 +1,243 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Access statistics of datasets. Every read and write of a dataset records the
+shape of the selection in a compact histogram: selections are grouped by the
+extent along every axis (rounded up to a power of two, 0 for axes indexed by
+an integer), and for each group the number of requests, the number of chunks
+touched, the number of elements selected and the sum of the extents are
+kept. See hurray.swmr.advisor for the analysis of these histograms.
+
+Worker processes collect statistics locally and merge them into the shared
+AccessStats object (hosted by the SWMRSyncManager) in batches, so recording
+does not add a round trip to the manager process to every request.
+"""
+
+import threading
+
+from .selection import expand_key, slice_length
+
+# local statistics are merged into the shared object after this many records
+# or seconds after the first unmerged record (whichever comes first)
+FLUSH_COUNT = 100
+FLUSH_INTERVAL = 1.0
+
+# maximum number of selection patterns per dataset (the least frequent
+# patterns are discarded)
+MAX_PATTERNS = 256
+
+# keys of a histogram
+STATS_SHAPE = 'shape'
+STATS_CHUNKS = 'chunks'
+STATS_ITEMSIZE = 'itemsize'
+STATS_PATTERNS = 'patterns'
+
+# pattern kinds
+READ = 'r'
+WRITE = 'w'
+
+
+def _bucket(n):
+    """
+    Round up to the next power of two
+    """
+    return 1 << max(0, n - 1).bit_length()
+
+
+def chunks_touched(slices, chunks):
+    """
+    Number of chunks that contain elements of a selection
+
+    Args:
+        slices: one slice (with non-negative start, stop and step) per axis
+        chunks: chunk shape (None for contiguous datasets)
+    """
+    if chunks is None:
+        return 1
+    total = 1
+    for s, c in zip(slices, chunks):
+        n = slice_length(s)
+        if n == 0:
+            return 0
+        last = s.start + (n - 1) * s.step
+        total *= min(n, last // c - s.start // c + 1)
+    return total
+
+
+def new_histogram(shape, chunks, itemsize):
+    return {
+        STATS_SHAPE: tuple(shape),
+        STATS_CHUNKS: None if chunks is None else tuple(chunks),
+        STATS_ITEMSIZE: itemsize,
+        STATS_PATTERNS: {},
+    }
+
+
+def merge(histogram, other):
+    """
+    Merge histogram ``other`` into ``histogram``. Statistics recorded for a
+    different chunk layout are discarded.
+
+    Returns:
+        the merged histogram
+    """
+    if histogram is None or histogram[STATS_CHUNKS] != other[STATS_CHUNKS]:
+        histogram = new_histogram(other[STATS_SHAPE], other[STATS_CHUNKS],
+                                  other[STATS_ITEMSIZE])
+    histogram[STATS_SHAPE] = other[STATS_SHAPE]
+    patterns = histogram[STATS_PATTERNS]
+    for pattern, counts in other[STATS_PATTERNS].items():
+        if pattern in patterns:
+            patterns[pattern] = [a + b for a, b in zip(patterns[pattern],
+                                                       counts)]
+        else:
+            patterns[pattern] = list(counts)
+    if len(patterns) > MAX_PATTERNS:
+        ranked = sorted(patterns, key=lambda p: patterns[p][0], reverse=True)
+        for pattern in ranked[MAX_PATTERNS:]:
+            del patterns[pattern]
+
+    return histogram
+
+
+class AccessStats(object):
+    """
+    Access statistics of all datasets. Lives in the manager process, see
+    hurray.swmr.lock.
+    """
+
+    def __init__(self):
+        self.__histograms = {}
+
+    def add(self, histograms):
+        """
+        Merge a dict {(file, path): histogram}
+        """
+        for key, histogram in histograms.items():
+            self.__histograms[key] = merge(self.__histograms.get(key),
+                                           histogram)
+
+    def get(self, file, path):
+        return self.__histograms.get((file, path))
+
+    def reset(self, file, path):
+        self.__histograms.pop((file, path), None)
+
+
+class Recorder(object):
+    """
+    Collects access statistics in a worker process
+    """
+
+    def __init__(self, shared):
+        """
+        Args:
+            shared: (proxy of an) AccessStats object
+        """
+        self._shared = shared
+        self._histograms = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def record(self, file, path, dst, key, kind=READ, shape=None):
+        """
+        Record an access of an h5py dataset
+
+        Args:
+            file: file name
+            path: path of the dataset
+            dst: h5py dataset
+            key: selection (only basic selections are recorded), resolved
+                against ``shape``
+            kind: READ or WRITE
+            shape: logical shape of the dataset (default: dst.shape, see
+                hurray.swmr.api.logical_shape)
+        """
+        shape = dst.shape if shape is None else tuple(shape)
+        try:
+            slices, squeeze = expand_key(key, shape)
+        except (TypeError, ValueError, IndexError):
+            return
+        with self._lock:
+            self._record(file, path, dst, shape, slices, squeeze, kind)
+            self._count += 1
+            count = self._count
+            if self._timer is None:
+                # make sure that idle processes merge their statistics, too
+                self._timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if count >= FLUSH_COUNT:
+            self.flush()
+
+    def _record(self, file, path, dst, shape, slices, squeeze, kind):
+        chunks = dst.chunks
+        histogram = self._histograms.get((file, path))
+        if histogram is None or histogram[STATS_CHUNKS] != chunks:
+            histogram = new_histogram(shape, chunks, dst.dtype.itemsize)
+            self._histograms[(file, path)] = histogram
+        histogram[STATS_SHAPE] = shape
+
+        spans = [0 if slice_length(s) == 0 else
+                 (slice_length(s) - 1) * s.step + 1 for s in slices]
+        pattern = (kind,) + tuple(0 if axis in squeeze else _bucket(span)
+                                  for axis, span in enumerate(spans))
+        elements = 1
+        for s in slices:
+            elements *= slice_length(s)
+        counts = [1, chunks_touched(slices, chunks), elements] + spans
+        patterns = histogram[STATS_PATTERNS]
+        if pattern in patterns:
+            patterns[pattern] = [a + b for a, b in zip(patterns[pattern],
+                                                       counts)]
+        else:
+            patterns[pattern] = counts
+
+    def flush(self):
+        """
+        Merge the local statistics into the shared object
+        """
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            self._count = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if histograms:
+            self._shared.add(histograms)
+
+    def get(self, file, path):
+        """
+        Histogram of a dataset (including the statistics of this process
+        that have not been flushed yet)
+        """
+        self.flush()
+        return self._shared.get(file, path)
+
+    def reset(self, file, path):
+        with self._lock:
+            self._histograms.pop((file, path), None)
+        self._shared.reset(file, path)
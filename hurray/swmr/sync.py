@@ -32,12 +32,28 @@ decremented/released if program execution ends, e.g., while performing a read
 or write operation (because of a SIGTERM signal, for example).
 """
 
+import contextlib
+import time
 from functools import wraps
 
+from hurray import metrics, trace
+
 from .exithandler import handle_exit
 from .lock import SWMR_SYNC
 
 
+def _timed(kind, start, acquired):
+    """
+    Record the time spent waiting for and holding a lock (see hurray.metrics
+    and hurray.trace)
+    """
+    end = time.monotonic()
+    metrics.lock(kind, acquired - start, end - acquired)
+    if trace.active():
+        trace.add(trace.LOCK_WAIT, start, acquired)
+        trace.add(trace.LOCKED, acquired, end)
+
+
 def reader(f):
     """
     Decorates methods reading a shared resource
@@ -49,12 +65,17 @@ def reader(f):
         Wraps reading functions.
         """
         with handle_exit(append=True):
+            start = time.monotonic()
+            acquired = None
             try:
                 SWMR_SYNC.start_read(self.file)
+                acquired = time.monotonic()
                 result = f(self, *args, **kwargs)  # critical section
                 return result
             finally:
                 SWMR_SYNC.end_read(self.file)
+                if acquired is not None:
+                    _timed('read', start, acquired)
 
     return func_wrapper
 
@@ -70,11 +91,50 @@ def writer(f):
         Wraps writing functions.
         """
         with handle_exit(append=True):
+            start = time.monotonic()
+            acquired = None
             try:
                 SWMR_SYNC.start_write(self.file)
+                acquired = time.monotonic()
                 return_val = f(self, *args, **kwargs)
                 return return_val
             finally:
                 SWMR_SYNC.end_write(self.file)
+                if acquired is not None:
+                    _timed('write', start, acquired)
 
     return func_wrapper
+
+
+@contextlib.contextmanager
+def locked(read=(), write=()):
+    """
+    Context manager acquiring read locks on the files in ``read`` and write
+    locks on the files in ``write``, e.g., to copy data from one file to
+    another. Locks are acquired in a fixed (sorted) order so that requests
+    locking several files cannot deadlock each other. A file that is read
+    and written is only write-locked.
+    """
+    write = set(write)
+    files = sorted(set(read) | write)
+    acquired = []
+    with handle_exit(append=True):
+        start = time.monotonic()
+        locked_at = None
+        try:
+            for name in files:
+                if name in write:
+                    SWMR_SYNC.start_write(name)
+                else:
+                    SWMR_SYNC.start_read(name)
+                acquired.append(name)
+            locked_at = time.monotonic()
+            yield
+        finally:
+            for name in reversed(acquired):
+                if name in write:
+                    SWMR_SYNC.end_write(name)
+                else:
+                    SWMR_SYNC.end_read(name)
+            if locked_at is not None:
+                _timed('write' if write else 'read', start, locked_at)
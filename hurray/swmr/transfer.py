@@ -0,0 +1,245 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Server-side copying and concatenation of datasets. Data is streamed block by
+block (blocks are aligned to the chunks of the destination dataset), so
+arbitrarily large datasets can be copied with bounded memory.
+"""
+
+from contextlib import ExitStack
+
+import h5py
+import numpy as np
+
+from . import journal, pyramid
+from .api import Dataset, logical_shape
+from .selection import expand_key, selection_shape, block_shape, iter_blocks
+from .sync import locked
+
+# dataset creation properties that are preserved unless overridden
+LAYOUT_KWARGS = ('chunks', 'compression', 'compression_opts', 'shuffle',
+                 'fletcher32', 'scaleoffset', 'fillvalue')
+
+
+class DatasetExistsError(Exception):
+    """
+    The destination dataset exists and may not be overwritten
+    """
+
+
+def _layout(dst, squeeze=()):
+    """
+    Creation properties of the h5py dataset ``dst`` (chunk shape without
+    the squeezed axes)
+    """
+    layout = {kw: getattr(dst, kw) for kw in LAYOUT_KWARGS}
+    if layout['chunks'] is not None:
+        layout['chunks'] = tuple(c for axis, c in enumerate(layout['chunks'])
+                                 if axis not in squeeze)
+    return layout
+
+
+def _merge_layout(layout, overrides):
+    """
+    Apply overridden creation properties. Compression options of the
+    source are dropped if another compression filter is requested.
+    """
+    if 'compression' in overrides and 'compression_opts' not in overrides:
+        layout['compression_opts'] = None
+    layout.update(overrides)
+    return layout
+
+
+def _create(file, group, name, shape, dtype, layout, overwrite):
+    """
+    Create the destination dataset in the hdf5 file ``file``. Chunks are
+    clipped to the shape of the new dataset (hdf5 does not allow chunks
+    larger than fixed dimensions).
+    """
+    layout = {kw: v for kw, v in layout.items()
+              if v is not None and v is not False}
+    chunks = layout.get('chunks', None)
+    if chunks not in (None, True):
+        if any(n == 0 for n in shape):
+            layout['chunks'] = True
+        else:
+            layout['chunks'] = tuple(min(c, n) for c, n in zip(chunks, shape))
+    if name in group:
+        if not overwrite:
+            raise DatasetExistsError("node {} exists".format(name))
+        if isinstance(group[name], h5py.Dataset):
+            pyramid.delete(group[name])
+            journal.record(file, journal.TREE,
+                           pyramid.overview_path(group[name].name))
+        del group[name]
+
+    return group.create_dataset(name, shape=shape, dtype=dtype, **layout)
+
+
+def _open(stack, files, name, mode):
+    if name not in files:
+        files[name] = stack.enter_context(h5py.File(name, mode))
+    return files[name]
+
+
+def _source(f, path):
+    if path not in f:
+        raise KeyError("node {} does not exist".format(path))
+    src = f[path]
+    if not isinstance(src, h5py.Dataset):
+        raise TypeError("node {} is not a dataset".format(path))
+    return src
+
+
+def copy_dataset(src_file, src_path, dst_file, dst_path, key=None,
+                 overwrite=False, **kwargs):
+    """
+    Copy a dataset, or a hyperslab of it, to a new dataset (possibly in
+    another file).
+
+    Args:
+        src_file: full path to the source hdf5 file
+        src_path: path to the source dataset
+        dst_file: full path to the destination hdf5 file (may be the same
+            as ``src_file``)
+        dst_path: path of the new dataset
+        key: optional basic selection (integers, slices, Ellipsis)
+        overwrite: replace ``dst_path`` if it exists
+        kwargs: creation properties (chunks, compression, ...) overriding
+            those of the source dataset
+
+    Returns:
+        Dataset
+
+    Raises:
+        KeyError if the source dataset does not exist
+        TypeError if the source is a group or the key is not supported
+        ValueError, IndexError if the key is invalid
+        DatasetExistsError if ``dst_path`` exists and ``overwrite`` is
+            False
+    """
+    with locked(read=[src_file], write=[dst_file]), ExitStack() as stack:
+        files = {}
+        fdst = _open(stack, files, dst_file, 'r+')
+        fsrc = _open(stack, files, src_file, 'r')
+        src = _source(fsrc, src_path)
+
+        slices, squeeze = expand_key(() if key is None else key,
+                                     logical_shape(src))
+        shape = selection_shape(slices, squeeze)
+        layout = _merge_layout(_layout(src, squeeze), kwargs)
+        dst = _create(dst_file, fdst, dst_path, shape, src.dtype, layout,
+                      overwrite)
+
+        # iterate in the coordinates of the selection (including squeezed
+        # axes, which have length 1)
+        full_shape = selection_shape(slices)
+        chunks = dst.chunks
+        if chunks is not None:
+            chunks = list(chunks)
+            for axis in squeeze:
+                chunks.insert(axis, 1)
+        block = block_shape(full_shape, chunks, src.dtype.itemsize)
+        for blk in iter_blocks(full_shape, block):
+            src_key = tuple(slice(s.start + b.start * s.step,
+                                  s.start + (b.stop - 1) * s.step + 1,
+                                  s.step)
+                            for s, b in zip(slices, blk))
+            dst_key = tuple(b for axis, b in enumerate(blk)
+                            if axis not in squeeze)
+            arr = src[src_key]
+            dst[dst_key] = arr.reshape(selection_shape(dst_key))
+        path = dst.name
+        journal.record(dst_file, journal.NODE, path)
+
+    return Dataset(dst_file, path)
+
+
+def concat_datasets(sources, dst_file, dst_path, axis=0, overwrite=False,
+                    **kwargs):
+    """
+    Concatenate datasets along an axis into a new dataset. The creation
+    properties of the first source are used for the new dataset unless
+    overridden.
+
+    Args:
+        sources: list of (file, path) tuples
+        dst_file: full path to the destination hdf5 file
+        dst_path: path of the new dataset
+        axis: axis along which the datasets are joined
+        overwrite: replace ``dst_path`` if it exists
+        kwargs: creation properties overriding those of the first source
+
+    Returns:
+        Dataset
+
+    Raises:
+        KeyError if a source dataset does not exist
+        TypeError if a source is a group
+        ValueError if the shapes of the datasets do not match
+        DatasetExistsError if ``dst_path`` exists and ``overwrite`` is
+            False
+    """
+    if not sources:
+        raise ValueError("nothing to concatenate")
+    src_files = [f for f, _ in sources]
+    with locked(read=src_files, write=[dst_file]), ExitStack() as stack:
+        files = {}
+        fdst = _open(stack, files, dst_file, 'r+')
+        srcs = [_source(_open(stack, files, f, 'r'), path)
+                for f, path in sources]
+
+        shapes = [logical_shape(src) for src in srcs]
+        ndim = len(shapes[0])
+        if not -ndim <= axis < ndim:
+            raise ValueError("axis {} is out of bounds".format(axis))
+        axis = axis % ndim
+        for src, src_shape in zip(srcs, shapes):
+            if (len(src_shape) != ndim or
+                    src_shape[:axis] != shapes[0][:axis] or
+                    src_shape[axis + 1:] != shapes[0][axis + 1:]):
+                raise ValueError("shape {} of {} does not match shape {}"
+                                 .format(src_shape, src.name, shapes[0]))
+
+        shape = list(shapes[0])
+        shape[axis] = sum(src_shape[axis] for src_shape in shapes)
+        dtype = np.result_type(*[src.dtype for src in srcs])
+        layout = _merge_layout(_layout(srcs[0]), kwargs)
+        dst = _create(dst_file, fdst, dst_path, tuple(shape), dtype, layout,
+                      overwrite)
+
+        offset = 0
+        for src, src_shape in zip(srcs, shapes):
+            block = block_shape(src_shape, dst.chunks, dtype.itemsize)
+            for blk in iter_blocks(src_shape, block):
+                dst_key = list(blk)
+                dst_key[axis] = slice(blk[axis].start + offset,
+                                      blk[axis].stop + offset)
+                dst[tuple(dst_key)] = src[blk]
+            offset += src_shape[axis]
+        path = dst.name
+        journal.record(dst_file, journal.NODE, path)
+
+    return Dataset(dst_file, path)
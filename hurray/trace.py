@@ -0,0 +1,263 @@
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Per-request phase timing. A request is traced if it has a true ``trace``
+argument or if it is sampled (``--trace_sample``). The server process and
+the worker that handles the request record (phase, start, end) events with
+time.monotonic() timestamps (comparable across processes):
+
+* read: receiving the request body
+* decode: unpacking the request
+* queue: from the end of the decoding to the start in a worker (includes
+  waiting for buffered appends, replicas and a free worker)
+* lock_wait: waiting for a read or write lock
+* open: opening an hdf5 file (hurray.swmr.api)
+* locked: holding a lock (includes open; the rest is hdf5 I/O)
+* encode: packing the response
+* result: returning the response to the server process
+* write: sending the response
+
+The events recorded up to ``encode`` are returned in the response (key
+``trace``). The complete trace is appended to ``--trace_file`` (one JSON
+object per line). Requests that take longer than ``--slow_request``
+seconds are logged with their command, database, path and key (and their
+phases, if traced).
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+
+import msgpack
+
+from hurray.protocol import (CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DB, CMD_KW_PATH,
+                             CMD_KW_KEY, CMD_KW_TRACE, RESPONSE_TRACE)
+from hurray.server.log import app_log
+from hurray.server.options import define, options
+
+READ = 'read'
+DECODE = 'decode'
+QUEUE = 'queue'
+LOCK_WAIT = 'lock_wait'
+OPEN = 'open'
+LOCKED = 'locked'
+ENCODE = 'encode'
+RESULT = 'result'
+WRITE = 'write'
+IO = 'io'  # locked - open (see phases)
+
+# packed key of the trace entry of a response
+_TRACE_KEY = msgpack.packb(RESPONSE_TRACE, use_bin_type=True)
+
+trace_log = logging.getLogger('hurray.trace')
+
+define('trace_sample', default=0.0, group='application',
+       help="Fraction of the requests that are traced (see hurray.trace)")
+define('trace_file', default=None, group='application',
+       help="Append the traces of requests to this file (JSON lines)")
+define('slow_request', default=0.0, group='application',
+       help="Log requests that take longer than this many seconds "
+            "(0 = do not log slow requests)")
+
+# events of the request handled by the current thread (None: not traced)
+_current = threading.local()
+
+
+def start(events=()):
+    """
+    Start tracing the request of the current thread
+
+    Args:
+        events: events recorded by the server process (the queue phase
+            starts at the end of the last one)
+    """
+    now = time.monotonic()
+    events = [tuple(event) for event in events]
+    if events:
+        events.append((QUEUE, events[-1][2], now))
+    _current.events = events
+
+
+def active():
+    return getattr(_current, 'events', None) is not None
+
+
+def add(phase, start, end=None):
+    """
+    Record an event of the traced request of the current thread
+    """
+    events = getattr(_current, 'events', None)
+    if events is not None:
+        events.append((phase, start, time.monotonic() if end is None
+                       else end))
+
+
+def stop():
+    """
+    Returns:
+        the events of the request of the current thread (None if it is not
+        traced)
+    """
+    events = getattr(_current, 'events', None)
+    _current.events = None
+    return events
+
+
+def traced(msg):
+    """
+    True if a request should be traced (see ``--trace_sample``)
+    """
+    return bool(msg.get(CMD_KW_ARGS, {}).get(CMD_KW_TRACE)) or (
+        options.trace_sample > 0 and random.random() < options.trace_sample)
+
+
+def begin(msg, received, read, decoded):
+    """
+    Pass the events of the server process to the worker (see start)
+
+    Args:
+        msg: request (modified)
+        received, read, decoded: time the request started to arrive, was
+            received and was unpacked
+
+    Returns:
+        list of the events
+    """
+    events = [(READ, received, read), (DECODE, read, decoded)]
+    args = dict(msg.get(CMD_KW_ARGS, {}))
+    args[CMD_KW_TRACE] = events
+    msg[CMD_KW_ARGS] = args
+    return events
+
+
+def _trace(resp):
+    """
+    Returns:
+        the events of the trace of a packed response or None. The trace is
+        the last entry of the map (see request_handler.response), so only
+        the bytes after its key are unpacked.
+    """
+    end = len(resp)
+    while True:
+        pos = resp.rfind(_TRACE_KEY, 0, end)
+        if pos < 0:
+            return None
+        try:
+            # fails unless the rest of the response is a single object
+            events = msgpack.unpackb(resp[pos + len(_TRACE_KEY):],
+                                     raw=False)
+        except (ValueError, TypeError):
+            events = None
+        if isinstance(events, (list, tuple)) and all(
+                isinstance(event, (list, tuple)) and len(event) == 3
+                for event in events):
+            return events
+        # the key bytes are part of another value
+        end = pos + len(_TRACE_KEY) - 1
+
+
+def merge(resp, events, returned):
+    """
+    Returns:
+        the events of a request: the events of the worker (returned in the
+        response, they start with ``events``) and the result phase, or
+        ``events`` if the request was not handled by a worker
+    """
+    worker = _trace(resp)
+    if not worker:
+        return list(events)
+    events = [tuple(event) for event in worker]
+    events.append((RESULT, events[-1][2], returned))
+    return events
+
+
+def phases(events):
+    """
+    Returns:
+        dict {phase: seconds} (the durations of events of the same phase
+        are added)
+    """
+    result = {}
+    for phase, start, end in events:
+        result[phase] = result.get(phase, 0.) + end - start
+    if LOCKED in result:
+        result[IO] = max(0., result[LOCKED] - result.get(OPEN, 0.))
+    return result
+
+
+def configure():
+    """
+    Write traces to ``--trace_file``
+    """
+    if options.trace_file:
+        handler = logging.FileHandler(options.trace_file)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        trace_log.addHandler(handler)
+        trace_log.setLevel(logging.INFO)
+        trace_log.propagate = False
+
+
+def finish(msg, received, events=None, returned=None):
+    """
+    Log a request once the response was sent (to the trace file if it was
+    traced and as slow request if it took too long)
+
+    Args:
+        msg: request
+        received: time the request started to arrive
+        events: events of the request (see merge, None if it was not traced)
+        returned: time the response was ready to be sent
+    """
+    now = time.monotonic()
+    total = now - received
+    slow = options.slow_request > 0 and total >= options.slow_request
+    if events is None and not slow:
+        return
+    if events is not None and returned is not None:
+        events.append((WRITE, returned, now))
+    args = msg.get(CMD_KW_ARGS, {})
+    cmd = msg.get(CMD_KW_CMD)
+    summary = None if events is None else phases(events)
+    if events is not None and trace_log.handlers:
+        trace_log.info(json.dumps({
+            'time': time.time(),
+            'cmd': cmd,
+            'db': args.get(CMD_KW_DB),
+            'path': args.get(CMD_KW_PATH),
+            'key': repr(args.get(CMD_KW_KEY)),
+            'total': total,
+            'phases': summary,
+            'events': [[phase, start - received, end - received]
+                       for phase, start, end in events],
+        }))
+    if slow:
+        app_log.warning(
+            'Slow request %s (db=%s, path=%s, key=%r): %.3f s%s', cmd,
+            args.get(CMD_KW_DB), args.get(CMD_KW_PATH),
+            args.get(CMD_KW_KEY), total,
+            '' if summary is None else ' (%s)' % ', '.join(
+                '%s %.3f' % item for item in sorted(summary.items())))
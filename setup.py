@@ -24,8 +24,6 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-import sys
-
 import io
 
 from hurray import __version__
@@ -46,9 +44,9 @@ with io.open('README.rst', encoding='utf-8') as f:
 if setuptools is not None:
     # If setuptools is not available, you're on your own for dependencies.
     install_requires = [
-        'numpy==1.12.0',
-        'msgpack-python==0.4.8',
-        'h5py==2.7.0'
+        'numpy==1.17.0',
+        'msgpack==0.6.2',
+        'h5py==3.0.0'
     ]
     extras_require = {
         "dev": [
@@ -56,8 +54,6 @@ if setuptools is not None:
             "sphinx-rtd-theme==0.2.4",
         ],
     }
-    if sys.version_info < (3, 5):
-        install_requires.append('backports_abc>=0.4')
     kwargs['install_requires'] = install_requires
     kwargs['extras_require'] = extras_require
 
@@ -78,10 +74,9 @@ setup(
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: BSD License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
+    python_requires='>=3.7',
     test_suite='tests.get_tests',
     entry_points={
         'console_scripts': [
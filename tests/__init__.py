@@ -1,8 +1,26 @@
 import unittest
 from unittest import defaultTestLoader
 
+from .advisor import AdvisorTestCase
+from .aioserver import AsyncioFrontendTestCase
+from .append_buffer import AppendBufferTestCase
+from .catalog import CatalogTestCase
+from .client import ClientTestCase
+from .direct import DirectWriteTestCase
 from .handler import RequestHandlerTestCase
+from .iostream import ReadBytesIntoTestCase, WriteBuffersTestCase
+from .listing import ListingTestCase
+from .mapped import MappedTestCase
+from .metrics import MetricsTestCase
 from .msgpack_ext import MsgPackTestCase
+from .processes import ProcessRegistryTestCase
+from .proxy import HashRingTestCase, ProxyTestCase
+from .pyramid import PyramidTestCase
+from .quantize import QuantizeTestCase
+from .rawchunks import RawChunksTestCase
+from .repack import RepackTestCase
+from .replication import ChangeLogTestCase, ReplicationTestCase
+from .trace import TraceTestCase
 
 
 def get_tests():
@@ -13,7 +31,15 @@ def full_suite():
 
     suite = unittest.TestSuite()
 
-    testcases = [RequestHandlerTestCase, MsgPackTestCase]
+    testcases = [RequestHandlerTestCase, MsgPackTestCase,
+                 AppendBufferTestCase, QuantizeTestCase, PyramidTestCase,
+                 AdvisorTestCase, RepackTestCase, DirectWriteTestCase,
+                 RawChunksTestCase, MappedTestCase, ListingTestCase,
+                 CatalogTestCase, WriteBuffersTestCase,
+                 ReadBytesIntoTestCase, ProcessRegistryTestCase,
+                 AsyncioFrontendTestCase, ClientTestCase, HashRingTestCase,
+                 ProxyTestCase, ChangeLogTestCase, ReplicationTestCase,
+                 MetricsTestCase, TraceTestCase]
 
     for testcase in testcases:
         suite.addTests(defaultTestLoader.loadTestsFromTestCase(testcase))
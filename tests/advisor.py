@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.swmr.advisor import (advise, expected_chunks,
+                                 ADVICE_REQUESTS, ADVICE_CHUNKS_PER_REQUEST,
+                                 ADVICE_READ_AMPLIFICATION,
+                                 ADVICE_RECOMMENDED_CHUNKS,
+                                 ADVICE_EXPECTED_CHUNKS_PER_REQUEST,
+                                 ADVICE_CHUNK_REDUCTION, ADVICE_CACHE_NBYTES,
+                                 MAX_CHUNK_BYTES)
+from hurray.swmr import File
+from hurray.swmr.stats import (AccessStats, Recorder, chunks_touched,
+                               STATS_PATTERNS, STATS_SHAPE, WRITE)
+
+
+class AdvisorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.h5file = h5py.File(os.path.join(self.test_dir, 'test.h5'), 'w')
+        self.recorder = Recorder(AccessStats())
+
+    def tearDown(self):
+        self.h5file.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_chunks_touched(self):
+        s = slice
+        self.assertEqual(chunks_touched((s(0, 10, 1), s(5, 6, 1)),
+                                        (10, 10)), 1)
+        self.assertEqual(chunks_touched((s(5, 15, 1), s(0, 100, 1)),
+                                        (10, 10)), 20)
+        self.assertEqual(chunks_touched((s(0, 100, 50),), (10,)), 2)
+        self.assertEqual(chunks_touched((s(0, 100, 1),), None), 1)
+        self.assertEqual(expected_chunks((1, 100), (1000, 1000), (10, 10)),
+                         1 * 10.9)
+
+    def test_record(self):
+        dst = self.h5file.create_dataset('ds', shape=(100, 100),
+                                         chunks=(10, 10))
+        for i in range(3):
+            self.recorder.record('test.h5', '/ds', dst, (i, slice(0, 30)))
+        self.recorder.record('test.h5', '/ds', dst, slice(0, 5), WRITE)
+        self.recorder.record('test.h5', '/ds', dst, [1, 2])  # ignored
+        patterns = self.recorder.get('test.h5', '/ds')[STATS_PATTERNS]
+        self.assertEqual(patterns[('r', 0, 32)], [3, 9, 90, 3, 90])
+        self.assertEqual(patterns[('w', 8, 128)], [1, 10, 500, 5, 100])
+        self.assertEqual(len(patterns), 2)
+
+        # statistics of a different layout are discarded
+        self.h5file.create_dataset('other', shape=(100, 100),
+                                   chunks=(5, 5))
+        self.recorder.record('test.h5', '/ds', self.h5file['other'], 0)
+        self.recorder.flush()
+        patterns = self.recorder.get('test.h5', '/ds')[STATS_PATTERNS]
+        self.assertEqual(list(patterns), [('r', 0, 128)])
+
+        self.recorder.reset('test.h5', '/ds')
+        self.assertIsNone(self.recorder.get('test.h5', '/ds'))
+
+    def test_record_appended(self):
+        ds = File(os.path.join(self.test_dir, 'appended.h5'), 'w') \
+            .create_dataset(name='ds', shape=(0,), dtype='float64',
+                            chunks=(10,), maxshape=(None,))
+        for i in range(11):
+            ds.append(np.arange(10.))
+        ds[-5:]
+        ds[0:20] = 1.
+        # the logical shape, not the allocated one
+        histogram = ds.access_stats()
+        self.assertEqual(histogram[STATS_SHAPE], (110,))
+        patterns = histogram[STATS_PATTERNS]
+        self.assertEqual(patterns[('r', 8)], [1, 1, 5, 5])
+        self.assertEqual(patterns[('w', 32)], [1, 2, 20, 20])
+
+    def test_advise(self):
+        # column chunks, but rows are read
+        dst = self.h5file.create_dataset('ds', shape=(1000, 1000),
+                                         chunks=(1000, 1))
+        for i in range(50):
+            self.recorder.record('test.h5', '/ds', dst, i * 20)
+        advice = advise(self.recorder.get('test.h5', '/ds'))
+        self.assertEqual(advice[ADVICE_REQUESTS], 50)
+        self.assertEqual(advice[ADVICE_CHUNKS_PER_REQUEST], 1000)
+        self.assertEqual(advice[ADVICE_READ_AMPLIFICATION], 1000)
+        chunks = advice[ADVICE_RECOMMENDED_CHUNKS]
+        self.assertLessEqual(np.prod(chunks) * 8, MAX_CHUNK_BYTES)
+        self.assertLessEqual(advice[ADVICE_EXPECTED_CHUNKS_PER_REQUEST], 2)
+        self.assertGreater(advice[ADVICE_CHUNK_REDUCTION], 0.99)
+        self.assertGreaterEqual(advice[ADVICE_CACHE_NBYTES], 1024 * 1024)
+
+        # the layout is kept if it is already a good fit
+        dst = self.h5file.create_dataset('good', shape=(1000, 1000),
+                                         chunks=(1, 1000))
+        for i in range(50):
+            self.recorder.record('test.h5', '/good', dst, i * 20)
+        advice = advise(self.recorder.get('test.h5', '/good'))
+        self.assertEqual(advice[ADVICE_RECOMMENDED_CHUNKS], (1, 1000))
+        self.assertEqual(advice[ADVICE_CHUNK_REDUCTION], 0)
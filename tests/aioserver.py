@@ -0,0 +1,144 @@
+import asyncio
+import shutil
+import struct
+import tempfile
+import unittest
+
+import msgpack
+import numpy as np
+from hurray.__main__ import HurrayServer
+from hurray.aioserver import AsyncioFrontend
+from hurray.frames import FrameReader, READ_BUFFER_SIZE
+from hurray.msgpack_ext import decode, encode
+from hurray.protocol import (PROTOCOL_VER, CMD_KW_CMD, CMD_KW_ARGS,
+                             CMD_KW_DATA, CMD_KW_DB, CMD_KW_OVERWRITE,
+                             CMD_KW_PATH, CMD_KW_KEY, CMD_KW_STATUS,
+                             CMD_KW_STREAM, CMD_KW_LIMIT, CMD_CREATE_DATABASE,
+                             CMD_CREATE_GROUP, CMD_CREATE_DATASET,
+                             CMD_SLICE_DATASET, CMD_GET_KEYS, CMD_SERVER_INFO,
+                             RESPONSE_DATA, RESPONSE_NODE_KEYS,
+                             RESPONSE_CURSOR, RESPONSE_PROCESSES)
+from hurray.server.ioloop import IOLoop
+from hurray.server.netutil import bind_sockets
+from hurray.server.options import options
+from hurray.server.platform.asyncio import AsyncIOLoop
+from hurray.status_codes import OK, CREATED
+from hurray.swmr.processes import PROCESS_REQUESTS
+from numpy.testing import assert_array_equal
+
+
+def frame(cmd, args, data=None):
+    msg = msgpack.packb({CMD_KW_CMD: cmd, CMD_KW_ARGS: args,
+                         CMD_KW_DATA: data}, default=encode,
+                        use_bin_type=True)
+    return struct.pack('>II', PROTOCOL_VER, len(msg)) + msg
+
+
+class AsyncioFrontendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        options.base = self.test_dir
+        self.io_loop = AsyncIOLoop()
+        self.io_loop.make_current()
+        self.server = HurrayServer()
+        # start the worker before the client connects; a worker forked later
+        # would inherit the client's socket (so that closing it has no
+        # effect)
+        self.server.pool.submit(int).result()
+        self.frontend = AsyncioFrontend(self.server)
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        self.frontend.add_sockets(sockets)
+
+    def tearDown(self):
+        self.frontend.stop()
+        self.frontend.shutdown_pool()
+        self.io_loop.close(all_fds=True)
+        IOLoop.clear_current()
+        shutil.rmtree(self.test_dir)
+
+    def run_client(self, client):
+        loop = self.io_loop.asyncio_loop
+        return loop.run_until_complete(asyncio.wait_for(client(), 30))
+
+    async def receive(self, reader):
+        _, length = struct.unpack('>II', await reader.readexactly(8))
+        return msgpack.unpackb(await reader.readexactly(length),
+                               object_hook=decode, use_list=False,
+                               encoding='utf-8')
+
+    def test_requests(self):
+        data = np.random.random((300, 200))  # > READ_BUFFER_SIZE
+
+        async def client():
+            reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                           self.port)
+            writer.write(frame(CMD_CREATE_DATABASE, {
+                CMD_KW_DB: 'test.h5', CMD_KW_OVERWRITE: True}))
+            self.assertEqual((await self.receive(reader))[CMD_KW_STATUS],
+                             CREATED)
+            # pipelined requests, some of them split across reads
+            requests = frame(CMD_CREATE_DATASET, {
+                CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'ds'}, data)
+            self.assertGreater(len(requests), READ_BUFFER_SIZE)
+            for i in range(20):
+                requests += frame(CMD_CREATE_GROUP, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'g%02d' % i})
+            requests += frame(CMD_SLICE_DATASET, {
+                CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'ds',
+                CMD_KW_KEY: slice(None)})
+            for pos in range(0, len(requests), 50000):
+                writer.write(requests[pos:pos + 50000])
+                await writer.drain()
+            for i in range(21):
+                response = await self.receive(reader)
+                self.assertIn(response[CMD_KW_STATUS], (OK, CREATED))
+            response = await self.receive(reader)
+            assert_array_equal(response[RESPONSE_DATA], data)
+
+            # streamed listings are delegated to HurrayServer
+            writer.write(frame(CMD_GET_KEYS, {
+                CMD_KW_DB: 'test.h5', CMD_KW_PATH: '/', CMD_KW_STREAM: True,
+                CMD_KW_LIMIT: 8}))
+            keys = []
+            while True:
+                response = await self.receive(reader)
+                keys.extend(response[RESPONSE_DATA][RESPONSE_NODE_KEYS])
+                if response[RESPONSE_DATA][RESPONSE_CURSOR] is None:
+                    break
+            self.assertEqual(len(keys), 21)
+
+            writer.write(frame(CMD_SERVER_INFO, {}))
+            response = await self.receive(reader)
+            process, = response[RESPONSE_DATA][RESPONSE_PROCESSES]
+            self.assertEqual(process[PROCESS_REQUESTS], 25)
+            writer.close()
+            while self.server.open_connections:
+                await asyncio.sleep(0.01)
+
+        self.run_client(client)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_max_size(self):
+        self.frontend.max_buffer_size = 1000
+
+        async def client():
+            reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                           self.port)
+            writer.write(frame(CMD_SERVER_INFO, {}))
+            response = await self.receive(reader)
+            self.assertIn(RESPONSE_PROCESSES, response[RESPONSE_DATA])
+            # the connection is closed before the message is received
+            writer.write(struct.pack('>II', PROTOCOL_VER, 1001))
+            self.assertEqual(await reader.read(), b'')
+            writer.close()
+
+        with self.assertLogs('hurray.application', 'ERROR'):
+            self.run_client(client)
+
+        reader = FrameReader(max_size=1000)
+        msg = frame(CMD_SERVER_INFO, {})
+        reader.get_buffer()[:len(msg)] = msg
+        self.assertEqual(reader.buffer_updated(len(msg)), [msg[8:]])
+        reader.get_buffer()[:8] = struct.pack('>II', PROTOCOL_VER, 1001)
+        self.assertRaises(ValueError, reader.buffer_updated, 8)
@@ -0,0 +1,137 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from hurray.append_buffer import AppendBuffer
+from hurray.protocol import (CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DATA, CMD_KW_DB,
+                             CMD_KW_PATH, CMD_KW_STATUS, CMD_KW_BUFFER,
+                             CMD_APPEND_DATASET, RESPONSE_DATA,
+                             RESPONSE_LENGTH, RESPONSE_PENDING)
+from hurray.request_handler import handle_request
+from hurray.server import gen
+from hurray.server.concurrent import Future
+from hurray.server.ioloop import IOLoop
+from hurray.server.options import options
+from hurray.status_codes import OK, INCOMPATIBLE_DATA, NODE_NOT_FOUND
+from hurray.swmr import File
+from numpy.testing import assert_array_equal
+
+from .handler import unpack
+
+
+class AppendBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        options.base = self.test_dir
+        self.file = File(self.test_dir + '/test.h5', 'w')
+        self.file.create_dataset(name='ds', shape=(0, 2), dtype='int64',
+                                 chunks=(4, 2), maxshape=(None, 2))
+        self.submitted = []
+        self.io_loop = IOLoop()
+
+    def tearDown(self):
+        self.io_loop.close()
+        shutil.rmtree(self.test_dir)
+
+    def submit(self, msg):
+        self.submitted.append(msg)
+        future = Future()
+        future.set_result(handle_request(msg))
+        return future
+
+    def append(self, buffers, data):
+        msg = {
+            CMD_KW_CMD: CMD_APPEND_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+                CMD_KW_BUFFER: True,
+            },
+            CMD_KW_DATA: data
+        }
+        return unpack(self.io_loop.run_sync(lambda: buffers.append(msg)))
+
+    def test_chunk_aligned_writes(self):
+        buffers = AppendBuffer(self.submit)
+        rows = np.arange(20).reshape(10, 2)
+
+        # the first append is written directly
+        response = self.append(buffers, rows[0])
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(len(self.submitted), 1)
+
+        # buffered until the first chunk (4 rows) is complete
+        response = self.append(buffers, rows[1])
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_LENGTH], 2)
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_PENDING], 1)
+        self.append(buffers, rows[2])
+        self.assertEqual(len(self.submitted), 1)
+        self.assertEqual(self.file['ds'].shape, (1, 2))
+        response = self.append(buffers, rows[3])
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_PENDING], 0)
+        self.assertEqual(len(self.submitted), 2)
+        self.assertEqual(self.file['ds'].shape, (4, 2))
+
+        # only complete chunks are written, the rest stays buffered
+        response = self.append(buffers, rows[4:9])
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_LENGTH], 9)
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_PENDING], 1)
+        self.assertEqual(self.file['ds'].shape, (8, 2))
+        self.append(buffers, rows[9])
+        self.assertEqual(self.file['ds'].shape, (8, 2))
+
+        response = self.append(buffers, np.zeros(3))
+        self.assertEqual(response[CMD_KW_STATUS], INCOMPATIBLE_DATA)
+
+        self.io_loop.run_sync(buffers.flush_all)
+        assert_array_equal(self.file['ds'][:], rows)
+
+    def test_flush_interval(self):
+        buffers = AppendBuffer(self.submit, flush_interval=0.01)
+        self.append(buffers, np.array([1, 2]))
+        self.append(buffers, np.array([3, 4]))
+        self.assertEqual(self.file['ds'].shape, (1, 2))
+
+        @gen.coroutine
+        def wait():
+            yield gen.sleep(0.1)
+
+        self.io_loop.run_sync(wait)
+        assert_array_equal(self.file['ds'][:], [[1, 2], [3, 4]])
+
+    def test_flushed_lengths(self):
+        buffers = AppendBuffer(self.submit)
+        rows = np.arange(60).reshape(30, 2)
+        self.append(buffers, rows[0])
+        for start, stop in ((1, 3), (3, 10), (10, 11), (11, 25)):
+            self.append(buffers, rows[start:stop])
+        lengths = [len(msg[CMD_KW_DATA]) for msg in self.submitted[1:]]
+        self.assertEqual(lengths, [7, 16])
+        for length in np.cumsum([1] + lengths)[1:]:
+            self.assertEqual(length % 4, 0)
+        self.assertEqual(self.file['ds'].shape, (24, 2))
+
+        self.io_loop.run_sync(buffers.flush_all)
+        assert_array_equal(self.file['ds'][:], rows[:25])
+
+    def test_failed_flush(self):
+        buffers = AppendBuffer(self.submit, flush_interval=0.01)
+        self.append(buffers, np.array([1, 2]))
+        response = self.append(buffers, np.array([3, 4]))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        del self.file['ds']
+
+        @gen.coroutine
+        def wait():
+            yield gen.sleep(0.1)
+
+        # the acknowledged append is lost and reported by the next append
+        self.io_loop.run_sync(wait)
+        self.file.create_dataset(name='ds', shape=(0, 2), dtype='int64',
+                                 chunks=(4, 2), maxshape=(None, 2))
+        response = self.append(buffers, np.array([5, 6]))
+        self.assertEqual(response[CMD_KW_STATUS], NODE_NOT_FOUND)
+        response = self.append(buffers, np.array([5, 6]))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        assert_array_equal(self.file['ds'][:], [[5, 6]])
@@ -0,0 +1,107 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from hurray.swmr.catalog import Catalog, SORT_SIZE, SORT_MTIME
+
+
+class CatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.files = {}
+        for i, name in enumerate(['b.h5', 'a.h5', 'c.h5', 'sub/x.h5',
+                                  'sub/deep/y.h5', 'sub2/z.h5',
+                                  'a.h5.repack']):
+            self.write(name, size=(i * 7) % 5, mtime=1000 + i)
+        self.catalog = Catalog()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write(self, name, size, mtime=None):
+        path = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def names(self, directory='', **kwargs):
+        return [entry[0] for entry in self.catalog.query(
+            os.path.join(self.test_dir, directory), **kwargs)]
+
+    def test_query(self):
+        self.catalog.open(self.test_dir, ignore=('.repack',), watch=False)
+        self.assertTrue(self.catalog.wait(10))
+        self.assertEqual(self.names(), ['a.h5', 'b.h5', 'c.h5'])
+        self.assertEqual(self.names(recursive=True),
+                         ['a.h5', 'b.h5', 'c.h5', 'sub/deep/y.h5',
+                          'sub/x.h5', 'sub2/z.h5'])
+        self.assertEqual(self.names(recursive=True, reverse=True),
+                         ['sub2/z.h5', 'sub/x.h5', 'sub/deep/y.h5',
+                          'c.h5', 'b.h5', 'a.h5'])
+        self.assertEqual(self.names(reverse=True), ['c.h5', 'b.h5', 'a.h5'])
+        self.assertEqual(self.names('sub'), ['x.h5'])
+        self.assertEqual(self.names('sub', recursive=True),
+                         ['deep/y.h5', 'x.h5'])
+        self.assertEqual(self.names(prefix='su', recursive=True),
+                         ['sub/deep/y.h5', 'sub/x.h5', 'sub2/z.h5'])
+        self.assertEqual(self.names(offset=1, limit=1), ['b.h5'])
+
+        # sizes: b 0, a 2, c 4, x 1, y 3, z 0
+        self.assertEqual(self.names(sort=SORT_SIZE), ['b.h5', 'a.h5', 'c.h5'])
+        self.assertEqual(self.names(sort=SORT_SIZE, recursive=True,
+                                    reverse=True, limit=2),
+                         ['c.h5', 'sub/deep/y.h5'])
+        self.assertEqual(self.names('sub', sort=SORT_SIZE, recursive=True),
+                         ['x.h5', 'deep/y.h5'])
+        self.assertEqual(self.names(sort=SORT_MTIME, reverse=True,
+                                    recursive=True, offset=1, limit=2),
+                         ['sub/deep/y.h5', 'sub/x.h5'])
+        self.assertRaises(ValueError, self.catalog.query, self.test_dir,
+                          sort='color')
+
+        entry = self.catalog.query(self.test_dir, limit=1)[0]
+        self.assertEqual(entry, ('a.h5', 2, 1001, None))
+        self.catalog.set_datasets(os.path.join(self.test_dir, 'a.h5'),
+                                  1001, 3)
+        self.assertEqual(self.catalog.query(self.test_dir, limit=1)[0][3], 3)
+
+        # changes reported by hurray
+        path = self.write('sub/new.h5', 10)
+        self.catalog.refresh(path)
+        os.remove(os.path.join(self.test_dir, 'a.h5'))
+        self.catalog.refresh(os.path.join(self.test_dir, 'a.h5'))
+        self.assertEqual(self.names(recursive=True, sort=SORT_SIZE,
+                                    reverse=True, limit=1), ['sub/new.h5'])
+        self.assertEqual(self.names(), ['b.h5', 'c.h5'])
+        shutil.rmtree(os.path.join(self.test_dir, 'sub'))
+        self.catalog.refresh(os.path.join(self.test_dir, 'sub'))
+        self.assertEqual(self.names(recursive=True),
+                         ['b.h5', 'c.h5', 'sub2/z.h5'])
+
+        # without inotify, entries are checked when they are listed
+        self.write('b.h5', 8, mtime=5000)
+        self.assertEqual(self.catalog.query(self.test_dir, limit=1)[0],
+                         ('b.h5', 8, 5000, None))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+    def test_watch(self):
+        self.catalog.open(self.test_dir, ignore=('.repack',))
+        self.assertTrue(self.catalog.wait(10))
+        self.write('d.h5', 1)
+        self.write('new/deep/e.h5', 1)
+        os.rename(os.path.join(self.test_dir, 'sub'),
+                  os.path.join(self.test_dir, 'moved'))
+        os.remove(os.path.join(self.test_dir, 'b.h5'))
+        expected = ['a.h5', 'c.h5', 'd.h5', 'moved/deep/y.h5', 'moved/x.h5',
+                    'new/deep/e.h5', 'sub2/z.h5']
+        for _ in range(100):
+            if self.names(recursive=True) == expected:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.names(recursive=True), expected)
@@ -0,0 +1,137 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from hurray.__main__ import HurrayServer
+from hurray.aioclient import AsyncClient
+from hurray.aioserver import AsyncioFrontend
+from hurray.client import Client, HurrayError
+from hurray.protocol import (CMD_KW_DB, CMD_KW_OVERWRITE, CMD_KW_PATH,
+                             CMD_KW_KEY, CMD_KW_LIMIT, CMD_CREATE_DATABASE,
+                             CMD_CREATE_GROUP, CMD_CREATE_DATASET,
+                             CMD_SLICE_DATASET, CMD_GET_KEYS,
+                             RESPONSE_NODE_KEYS)
+from hurray.server.ioloop import IOLoop
+from hurray.server.netutil import bind_sockets
+from hurray.server.options import options
+from hurray.server.platform.asyncio import AsyncIOLoop
+from hurray.status_codes import FILE_NOT_FOUND
+from numpy.testing import assert_array_equal
+
+
+class ClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        options.base = self.test_dir
+        self.io_loop = AsyncIOLoop()
+        self.io_loop.make_current()
+        self.server = HurrayServer()
+        # see AsyncioFrontendTestCase
+        self.server.pool.submit(int).result()
+        self.frontend = AsyncioFrontend(self.server)
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        self.frontend.add_sockets(sockets)
+
+    def tearDown(self):
+        self.frontend.stop()
+        self.frontend.shutdown_pool()
+        self.io_loop.close(all_fds=True)
+        IOLoop.clear_current()
+        shutil.rmtree(self.test_dir)
+
+    def run_client(self, client):
+        async def run():
+            await client()
+            while self.server.open_connections:
+                await asyncio.sleep(0.01)
+
+        loop = self.io_loop.asyncio_loop
+        return loop.run_until_complete(asyncio.wait_for(run(), 30))
+
+    def test_client(self):
+        data = np.random.random((300, 200))
+
+        def client():
+            with Client('127.0.0.1', self.port, connections=2) as client:
+                client.call(CMD_CREATE_DATABASE, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_OVERWRITE: True})
+                client.call(CMD_CREATE_DATASET, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'ds'}, data)
+                futures = [client.submit(CMD_CREATE_GROUP, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'g%02d' % i})
+                    for i in range(20)]
+                for future in futures:
+                    future.result()
+
+                # concurrent calls from several threads
+                results = []
+
+                def read():
+                    results.append(client.call(CMD_SLICE_DATASET, {
+                        CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'ds',
+                        CMD_KW_KEY: slice(10, 20)}))
+
+                threads = [threading.Thread(target=read) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(results), 8)
+                for arr in results:
+                    assert_array_equal(arr, data[10:20])
+                    self.assertFalse(arr.flags.writeable)
+
+                keys = []
+                for page in client.stream(CMD_GET_KEYS, {
+                        CMD_KW_DB: 'test.h5', CMD_KW_PATH: '/',
+                        CMD_KW_LIMIT: 8}):
+                    keys.extend(page[RESPONSE_NODE_KEYS])
+                self.assertEqual(len(keys), 21)
+
+                with self.assertRaises(HurrayError) as cm:
+                    client.call(CMD_GET_KEYS, {
+                        CMD_KW_DB: 'missing.h5', CMD_KW_PATH: '/'})
+                self.assertEqual(cm.exception.status, FILE_NOT_FOUND)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, client)
+
+        self.run_client(run)
+
+    def test_async_client(self):
+        data = np.arange(1000, dtype=np.int32)
+
+        async def client():
+            async with AsyncClient('127.0.0.1', self.port,
+                                   connections=2) as client:
+                await client.call(CMD_CREATE_DATABASE, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_OVERWRITE: True})
+                await client.call(CMD_CREATE_DATASET, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'ds'}, data)
+                await asyncio.gather(*[client.call(CMD_CREATE_GROUP, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'g%02d' % i})
+                    for i in range(20)])
+                arrs = await asyncio.gather(*[client.call(CMD_SLICE_DATASET, {
+                    CMD_KW_DB: 'test.h5', CMD_KW_PATH: 'ds',
+                    CMD_KW_KEY: slice(i, i + 10)}) for i in range(10)])
+                for i, arr in enumerate(arrs):
+                    assert_array_equal(arr, data[i:i + 10])
+
+                keys = []
+                async for page in client.stream(CMD_GET_KEYS, {
+                        CMD_KW_DB: 'test.h5', CMD_KW_PATH: '/',
+                        CMD_KW_LIMIT: 8}):
+                    keys.extend(page[RESPONSE_NODE_KEYS])
+                self.assertEqual(len(keys), 21)
+
+                with self.assertRaises(HurrayError) as cm:
+                    await client.call(CMD_GET_KEYS, {
+                        CMD_KW_DB: 'missing.h5', CMD_KW_PATH: '/'})
+                self.assertEqual(cm.exception.status, FILE_NOT_FOUND)
+
+        self.run_client(client)
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.swmr import File, direct
+from numpy.testing import assert_array_equal
+
+
+class DirectWriteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'test.h5')
+        self.min_bytes = direct.DIRECT_WRITE_MIN_BYTES
+        direct.DIRECT_WRITE_MIN_BYTES = 0
+
+    def tearDown(self):
+        direct.DIRECT_WRITE_MIN_BYTES = self.min_bytes
+        shutil.rmtree(self.test_dir)
+
+    def test_compress(self):
+        data = np.random.random((20, 30)).round(2)
+        with h5py.File(self.filename, 'w') as f:
+            for shuffle in (False, True):
+                dst = f.create_dataset('ds{}'.format(shuffle), data=data,
+                                       chunks=(20, 30), compression='gzip',
+                                       compression_opts=5, shuffle=shuffle)
+                lay = direct.layout(dst)
+                self.assertTrue(direct.supported(lay))
+                _, chunk = dst.id.read_direct_chunk((0, 0))
+                self.assertEqual(direct.compress(data, lay[3]), chunk)
+
+            dst = f.create_dataset('lzf', data=data, chunks=(10, 10),
+                                   compression='lzf')
+            self.assertFalse(direct.supported(direct.layout(dst)))
+            self.assertIsNone(direct.prepare(direct.layout(dst), Ellipsis,
+                                             data))
+
+    def test_prepare(self):
+        with h5py.File(self.filename, 'w') as f:
+            dst = f.create_dataset('ds', shape=(25, 33), dtype='int32',
+                                   chunks=(10, 10), compression='gzip')
+            lay = direct.layout(dst)
+            # no chunk is completely covered
+            self.assertIsNone(direct.prepare(lay, (slice(1, 9), 5), 1))
+            self.assertIsNone(direct.prepare(lay, slice(0, 20, 2), 1))
+
+            value = np.arange(23 * 30).reshape(23, 30)
+            prepared = direct.prepare(lay, (slice(2, 25), slice(3, 33)),
+                                      value)
+            # rows 10-24 and columns 10-32 (including the edge chunks)
+            self.assertEqual([offset for offset, _ in prepared.chunks],
+                             [(10, 10), (10, 20), (10, 30),
+                              (20, 10), (20, 20), (20, 30)])
+            self.assertEqual(len(prepared.remainder), 2)
+            self.assertTrue(prepared.matches(dst))
+            prepared.write(dst)
+            expected = np.zeros((25, 33), dtype='int32')
+            expected[2:, 3:] = value
+            assert_array_equal(dst[()], expected)
+
+    def test_api(self):
+        db = File(self.filename, 'w')
+        data = np.random.random((40, 50))
+        ds = db.create_dataset(name='ds', data=data, compression='gzip')
+        assert_array_equal(ds[()], data)
+        ds[5:, :] = np.ones((35, 50))
+        data[5:, :] = 1.
+        assert_array_equal(ds[()], data)
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['ds'].compression, 'gzip')
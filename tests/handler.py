@@ -3,6 +3,7 @@ import shutil
 import tempfile
 import unittest
 
+import h5py
 import msgpack
 import numpy as np
 from hurray.msgpack_ext import decode
@@ -16,14 +17,48 @@ from hurray.protocol import (CMD_CREATE_DATABASE, CMD_KW_OVERWRITE,
                              CMD_KW_KEY, RESPONSE_DATA, CMD_BROADCAST_DATASET,
                              CMD_ATTRIBUTES_SET, CMD_ATTRIBUTES_GET,
                              CMD_ATTRIBUTES_CONTAINS, RESPONSE_ATTRS_CONTAINS,
-                             CMD_ATTRIBUTES_KEYS, RESPONSE_ATTRS_KEYS)
-from hurray.request_handler import handle_request
+                             CMD_ATTRIBUTES_KEYS, RESPONSE_ATTRS_KEYS,
+                             CMD_GATHER, CMD_KW_TARGETS, CMD_KW_KEYS,
+                             CMD_KW_STACK, CMD_COPY_DATASET,
+                             CMD_CONCAT_DATASETS, CMD_KW_SOURCES,
+                             CMD_KW_DEST_DB, CMD_KW_DEST_PATH, CMD_KW_AXIS,
+                             CMD_KW_CHUNKS, CMD_KW_COMPRESSION,
+                             CMD_APPEND_DATASET, RESPONSE_LENGTH,
+                             CMD_KW_SHAPE, CMD_KW_DTYPE, CMD_KW_MAXSHAPE,
+                             CMD_KW_OUT_DTYPE, CMD_KW_PACK,
+                             CMD_KW_SCALE_FACTOR, RESPONSE_ENCODING,
+                             CMD_CREATE_PYRAMID, CMD_UPDATE_PYRAMID,
+                             CMD_KW_FACTOR, CMD_KW_RESOLUTION,
+                             RESPONSE_RESOLUTION, CMD_GET_KEYS,
+                             RESPONSE_NODE_KEYS, CMD_CHUNK_ADVICE,
+                             CMD_REPACK, CMD_JOB_STATUS, CMD_KW_JOB,
+                             RESPONSE_JOB, CMD_READ_CHUNKS, CMD_GET_TREE,
+                             RESPONSE_NODE_TREE, CMD_KW_DEPTH, CMD_KW_ATTRS,
+                             CMD_KW_LIMIT, CMD_KW_CURSOR, CMD_KW_PREFIX,
+                             RESPONSE_CURSOR, CMD_LIST_DATABASES,
+                             CMD_DELETE_DATABASE,
+                             CMD_KW_RECURSIVE, CMD_KW_SORT, CMD_KW_DATASETS,
+                             RESPONSE_DATABASES, RESPONSE_FILESIZE,
+                             RESPONSE_DATASETS, CMD_ATTRIBUTES_ITEMS,
+                             CMD_ATTRIBUTES_UPDATE, CMD_ATTRIBUTES_COLLECT)
+from hurray.rawchunks import assemble
+from hurray.quantize import decode as decode_array
+from hurray.request_handler import handle_request, run_job
 from hurray.server.options import options
+from hurray.swmr.advisor import (ADVICE_REQUESTS, ADVICE_CHUNKS,
+                                 ADVICE_RECOMMENDED_CHUNKS)
+from hurray.swmr import File
+from hurray.swmr.api import (TREE_NAMES, TREE_PARENTS, TREE_TYPES,
+                             TREE_SHAPES, TREE_DTYPES, TREE_CHUNKS,
+                             TREE_ATTRS, TREE_GROUP, TREE_DATASET)
+from hurray.swmr.jobs import JOB_STATE, JOB_DONE, JOB_PROGRESS, JOB_PENDING
+from hurray.swmr.pyramid import OVERVIEWS_GROUP
 from hurray.status_codes import (UNKNOWN_COMMAND, MISSING_ARGUMENT, CREATED,
                                  FILE_NOT_FOUND, OK, GROUP_EXISTS,
                                  MISSING_DATA, DATASET_EXISTS, NODE_NOT_FOUND,
                                  VALUE_ERROR, TYPE_ERROR, KEY_ERROR,
-                                 INVALID_ARGUMENT)
+                                 INVALID_ARGUMENT, INCOMPATIBLE_DATA,
+                                 ACCEPTED, FILE_BUSY)
 from numpy.testing import assert_array_equal
 
 
@@ -68,7 +103,7 @@ class RequestHandlerTestCase(unittest.TestCase):
         }
         return unpack(handle_request(cmd))
 
-    def create_ds(self, db, path, data):
+    def create_ds(self, db, path, data, **kwargs):
         cmd = {
             CMD_KW_CMD: CMD_CREATE_DATASET,
             CMD_KW_ARGS: {
@@ -77,6 +112,18 @@ class RequestHandlerTestCase(unittest.TestCase):
             },
             CMD_KW_DATA: data
         }
+        cmd[CMD_KW_ARGS].update(kwargs)
+        return unpack(handle_request(cmd))
+
+    def slice_ds(self, db, path, key):
+        cmd = {
+            CMD_KW_CMD: CMD_SLICE_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: db,
+                CMD_KW_PATH: path,
+                CMD_KW_KEY: key
+            }
+        }
         return unpack(handle_request(cmd))
 
     def test_no_cmd(self):
@@ -117,6 +164,62 @@ class RequestHandlerTestCase(unittest.TestCase):
         response = unpack(handle_request(cmd))
         self.assertEqual(response[CMD_KW_STATUS], OK)
 
+    def test_list_databases(self):
+        self.create_db('b.h5')
+        self.create_db('sub/a.h5')
+        self.create_ds('b.h5', 'ds', np.zeros(100))
+        self.create_ds('b.h5', 'ds2', np.zeros(10))
+        self.create_grp('b.h5', 'grp')
+        cmd = {
+            CMD_KW_CMD: CMD_LIST_DATABASES,
+            CMD_KW_ARGS: {
+                CMD_KW_PATH: '',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(list(response[RESPONSE_DATA]), ['b.h5'])
+        self.assertEqual(response[RESPONSE_DATA]['b.h5'][RESPONSE_FILESIZE],
+                         os.path.getsize(os.path.join(self.test_dir,
+                                                      'b.h5')))
+
+        cmd[CMD_KW_ARGS] = {
+            CMD_KW_RECURSIVE: True,
+            CMD_KW_SORT: 'size',
+            CMD_KW_DATASETS: True,
+            CMD_KW_LIMIT: 1,
+        }
+        response = unpack(handle_request(cmd))
+        dbs = response[RESPONSE_DATA][RESPONSE_DATABASES]
+        self.assertEqual(list(dbs), ['sub/a.h5'])
+        self.assertEqual(dbs['sub/a.h5'][RESPONSE_DATASETS], 0)
+        cmd[CMD_KW_ARGS][CMD_KW_CURSOR] = \
+            response[RESPONSE_DATA][RESPONSE_CURSOR]
+        response = unpack(handle_request(cmd))
+        dbs = response[RESPONSE_DATA][RESPONSE_DATABASES]
+        self.assertEqual(list(dbs), ['b.h5'])
+        self.assertEqual(dbs['b.h5'][RESPONSE_DATASETS], 2)
+
+        cmd = {
+            CMD_KW_CMD: CMD_DELETE_DATABASE,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'b.h5',
+            }
+        }
+        self.assertEqual(unpack(handle_request(cmd))[CMD_KW_STATUS], OK)
+        cmd = {
+            CMD_KW_CMD: CMD_LIST_DATABASES,
+            CMD_KW_ARGS: {
+                CMD_KW_PATH: 'sub',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(list(response[RESPONSE_DATA]), ['a.h5'])
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'missing'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], FILE_NOT_FOUND)
+
     def test_create_group(self):
         db_name = 'test.h5'
         self.create_db(db_name)
@@ -214,6 +317,108 @@ class RequestHandlerTestCase(unittest.TestCase):
         self.assertEqual(response[CMD_KW_DATA][RESPONSE_NODE_DTYPE],
                          data.dtype)
 
+    def test_get_tree(self):
+        self.create_db('test.h5')
+        self.create_grp('test.h5', 'grp')
+        self.create_grp('test.h5', 'grp/sub')
+        self.create_ds('test.h5', 'grp/sub/ds', np.zeros((3, 4), 'int8'),
+                       **{CMD_KW_CHUNKS: (1, 4)})
+        self.create_ds('test.h5', 'ds', np.zeros(5))
+        cmd = {
+            CMD_KW_CMD: CMD_ATTRIBUTES_SET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+                CMD_KW_KEY: 'units',
+            },
+            CMD_KW_DATA: 'm',
+        }
+        self.assertEqual(unpack(handle_request(cmd))[CMD_KW_STATUS], OK)
+
+        cmd = {
+            CMD_KW_CMD: CMD_GET_TREE,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: '/',
+                CMD_KW_ATTRS: True,
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        tree = response[RESPONSE_DATA][RESPONSE_NODE_TREE]
+        self.assertEqual(list(tree[TREE_NAMES]),
+                         ['/', 'ds', 'grp', 'sub', 'ds'])
+        self.assertEqual(list(tree[TREE_PARENTS]), [-1, 0, 0, 2, 3])
+        self.assertEqual(list(tree[TREE_TYPES]),
+                         [TREE_GROUP, TREE_DATASET, TREE_GROUP, TREE_GROUP,
+                          TREE_DATASET])
+        self.assertEqual(list(tree[TREE_SHAPES]),
+                         [None, (5,), None, None, (3, 4)])
+        self.assertEqual(list(tree[TREE_DTYPES]),
+                         [None, 'float64', None, None, 'int8'])
+        self.assertEqual(tree[TREE_CHUNKS][4], (1, 4))
+        self.assertEqual(list(tree[TREE_ATTRS]),
+                         [(), ('units',), (), (), ()])
+        self.assertIsNone(response[RESPONSE_DATA][RESPONSE_CURSOR])
+
+        cmd[CMD_KW_ARGS][CMD_KW_LIMIT] = 3
+        response = unpack(handle_request(cmd))
+        self.assertEqual(len(response[RESPONSE_DATA][RESPONSE_NODE_TREE]
+                             [TREE_NAMES]), 3)
+        cmd[CMD_KW_ARGS][CMD_KW_CURSOR] = \
+            response[RESPONSE_DATA][RESPONSE_CURSOR]
+        response = unpack(handle_request(cmd))
+        tree = response[RESPONSE_DATA][RESPONSE_NODE_TREE]
+        self.assertEqual(list(tree[TREE_NAMES]), ['sub', 'ds'])
+        self.assertEqual(list(tree[TREE_PARENTS]), [2, 3])
+        self.assertIsNone(response[RESPONSE_DATA][RESPONSE_CURSOR])
+
+        cmd[CMD_KW_ARGS][CMD_KW_CURSOR] = 'invalid'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+        cmd[CMD_KW_ARGS] = {
+            CMD_KW_DB: 'test.h5',
+            CMD_KW_PATH: 'grp',
+            CMD_KW_DEPTH: 1,
+        }
+        response = unpack(handle_request(cmd))
+        tree = response[RESPONSE_DATA][RESPONSE_NODE_TREE]
+        self.assertEqual(list(tree[TREE_NAMES]), ['/grp', 'sub'])
+        self.assertNotIn(TREE_ATTRS, tree)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'ds'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+    def test_get_keys(self):
+        self.create_db('test.h5')
+        for name in ('a1', 'a2', 'b1', 'b2', 'b3'):
+            self.create_grp('test.h5', name)
+        cmd = {
+            CMD_KW_CMD: CMD_GET_KEYS,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: '/',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(list(response[RESPONSE_DATA][RESPONSE_NODE_KEYS]),
+                         ['a1', 'a2', 'b1', 'b2', 'b3'])
+        self.assertNotIn(RESPONSE_CURSOR, response[RESPONSE_DATA])
+
+        cmd[CMD_KW_ARGS][CMD_KW_PREFIX] = 'b'
+        cmd[CMD_KW_ARGS][CMD_KW_LIMIT] = 2
+        response = unpack(handle_request(cmd))
+        self.assertEqual(list(response[RESPONSE_DATA][RESPONSE_NODE_KEYS]),
+                         ['b1', 'b2'])
+        cmd[CMD_KW_ARGS][CMD_KW_CURSOR] = \
+            response[RESPONSE_DATA][RESPONSE_CURSOR]
+        response = unpack(handle_request(cmd))
+        self.assertEqual(list(response[RESPONSE_DATA][RESPONSE_NODE_KEYS]),
+                         ['b3'])
+        self.assertIsNone(response[RESPONSE_DATA][RESPONSE_CURSOR])
+
     def test_slice(self):
         db_name = 'test.h5'
         ds_name = 'testds'
@@ -368,3 +573,672 @@ class RequestHandlerTestCase(unittest.TestCase):
         response = unpack(handle_request(cmd))
         self.assertEqual(response[CMD_KW_DATA][RESPONSE_ATTRS_KEYS],
                          (attr_key,))
+
+    def test_attrs_bulk(self):
+        self.create_db('test.h5')
+        self.create_grp('test.h5', 'grp')
+        self.create_ds('test.h5', 'grp/a', np.zeros(3))
+        self.create_ds('test.h5', 'grp/b', np.zeros(3))
+        self.create_ds('test.h5', 'c', np.zeros(3))
+        cmd = {
+            CMD_KW_CMD: CMD_ATTRIBUTES_UPDATE,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'grp/a',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_DATA)
+        cmd[CMD_KW_DATA] = {'units': 'm', 'scale': np.arange(3)}
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'c'
+        cmd[CMD_KW_DATA] = {'units': 'K'}
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        cmd[CMD_KW_DATA] = {'': 1}
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+        cmd[CMD_KW_DATA] = {'__hurray_append__': (0, 1)}
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+        # a failing update does not change any attribute
+        cmd[CMD_KW_DATA] = {'a': 1, 'units': 'mm', 'b': None, 'c': 2}
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], TYPE_ERROR)
+        cmd[CMD_KW_CMD] = CMD_ATTRIBUTES_ITEMS
+        del cmd[CMD_KW_DATA]
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[RESPONSE_DATA], {'units': 'K'})
+
+        cmd = {
+            CMD_KW_CMD: CMD_ATTRIBUTES_ITEMS,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'grp/a',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        attrs = response[RESPONSE_DATA]
+        self.assertEqual(sorted(attrs), ['scale', 'units'])
+        self.assertEqual(attrs['units'], 'm')
+        np.testing.assert_array_equal(attrs['scale'], np.arange(3))
+
+        cmd = {
+            CMD_KW_CMD: CMD_ATTRIBUTES_COLLECT,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: '/',
+                CMD_KW_KEY: 'units',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(response[RESPONSE_DATA], {'grp/a': 'm', 'c': 'K'})
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'grp'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[RESPONSE_DATA], {'a': 'm'})
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'c'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+        # internal attributes cannot be read
+        with h5py.File(os.path.join(self.test_dir, 'test.h5'), 'r+') as f:
+            f['c'].attrs['__hurray_append__'] = (0, 1)
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = '/'
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = '__hurray_append__'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(response[RESPONSE_DATA], {})
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'c'
+        cmd[CMD_KW_CMD] = CMD_ATTRIBUTES_GET
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], KEY_ERROR)
+        cmd[CMD_KW_CMD] = CMD_ATTRIBUTES_CONTAINS
+        response = unpack(handle_request(cmd))
+        self.assertFalse(response[RESPONSE_DATA][RESPONSE_ATTRS_CONTAINS])
+        attrs = File(os.path.join(self.test_dir, 'test.h5'), 'r')['c'].attrs
+        self.assertIsNone(attrs.get('__hurray_append__', None))
+        self.assertEqual(attrs.get('units', None), 'K')
+
+    def test_gather(self):
+        data1 = np.random.random((4, 5))
+        data2 = np.random.random((4, 5))
+        data3 = np.random.random((3, 5))
+
+        self.create_db('a.h5')
+        self.create_db('b.h5')
+        self.create_ds('a.h5', 'ds1', data1)
+        self.create_ds('a.h5', 'ds2', data2)
+        self.create_ds('b.h5', 'ds1', data3)
+
+        cmd = {
+            CMD_KW_CMD: CMD_GATHER,
+            CMD_KW_ARGS: {}
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_ARGUMENT)
+
+        targets = (('a.h5', 'ds1'), ('a.h5', 'ds2'), ('b.h5', 'ds1'))
+        cmd[CMD_KW_ARGS][CMD_KW_TARGETS] = targets
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_ARGUMENT)
+
+        # one shared key
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = (1, slice(None, None, None))
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(len(response[RESPONSE_DATA]), 3)
+        assert_array_equal(response[RESPONSE_DATA][0], data1[1])
+        assert_array_equal(response[RESPONSE_DATA][1], data2[1])
+        assert_array_equal(response[RESPONSE_DATA][2], data3[1])
+
+        cmd[CMD_KW_ARGS][CMD_KW_STACK] = True
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        assert_array_equal(response[RESPONSE_DATA],
+                           np.stack([data1[1], data2[1], data3[1]]))
+
+        # one key per target
+        cmd[CMD_KW_ARGS][CMD_KW_KEYS] = (slice(0, 2, None),
+                                         slice(None, None, None), 0)
+        cmd[CMD_KW_ARGS][CMD_KW_STACK] = False
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        assert_array_equal(response[RESPONSE_DATA][0], data1[:2])
+        assert_array_equal(response[RESPONSE_DATA][1], data2)
+        assert_array_equal(response[RESPONSE_DATA][2], data3[0])
+
+        cmd[CMD_KW_ARGS][CMD_KW_STACK] = True
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INCOMPATIBLE_DATA)
+
+        cmd[CMD_KW_ARGS][CMD_KW_KEYS] = (0, 0)
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+        del cmd[CMD_KW_ARGS][CMD_KW_KEYS]
+        cmd[CMD_KW_ARGS][CMD_KW_TARGETS] = targets + (('c.h5', 'ds1'),)
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], FILE_NOT_FOUND)
+
+        cmd[CMD_KW_ARGS][CMD_KW_TARGETS] = targets + (('b.h5', 'ds2'),)
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], NODE_NOT_FOUND)
+
+        cmd[CMD_KW_ARGS][CMD_KW_TARGETS] = targets
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = 10
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+    def test_copy_dataset(self):
+        data = np.random.random((20, 30))
+
+        self.create_db('a.h5')
+        self.create_db('b.h5')
+        self.create_ds('a.h5', 'ds', data)
+
+        cmd = {
+            CMD_KW_CMD: CMD_COPY_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'a.h5',
+                CMD_KW_PATH: 'ds',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_ARGUMENT)
+
+        # copy within the same file
+        cmd[CMD_KW_ARGS][CMD_KW_DEST_PATH] = 'copy'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_NODE_SHAPE],
+                         data.shape)
+
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], DATASET_EXISTS)
+
+        # copy a hyperslab into another file with a different layout
+        cmd[CMD_KW_ARGS][CMD_KW_DEST_DB] = 'b.h5'
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = (3, slice(2, 25, 3))
+        cmd[CMD_KW_ARGS][CMD_KW_CHUNKS] = (4,)
+        cmd[CMD_KW_ARGS][CMD_KW_COMPRESSION] = 'gzip'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_NODE_SHAPE], (8,))
+
+        cmd = {
+            CMD_KW_CMD: CMD_SLICE_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'b.h5',
+                CMD_KW_PATH: 'copy',
+                CMD_KW_KEY: slice(None, None, None)
+            }
+        }
+        response = unpack(handle_request(cmd))
+        assert_array_equal(response[RESPONSE_DATA], data[3, 2:25:3])
+
+        cmd = {
+            CMD_KW_CMD: CMD_COPY_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'a.h5',
+                CMD_KW_PATH: 'ds',
+                CMD_KW_DEST_PATH: 'copy2',
+                CMD_KW_KEY: 20,
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'invalid'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], NODE_NOT_FOUND)
+
+    def test_concat_datasets(self):
+        data1 = np.random.random((3, 4))
+        data2 = np.random.random((5, 4))
+
+        self.create_db('a.h5')
+        self.create_db('b.h5')
+        self.create_ds('a.h5', 'ds', data1)
+        self.create_ds('b.h5', 'ds', data2)
+
+        cmd = {
+            CMD_KW_CMD: CMD_CONCAT_DATASETS,
+            CMD_KW_ARGS: {
+                CMD_KW_SOURCES: (('a.h5', 'ds'), ('b.h5', 'ds')),
+                CMD_KW_DEST_PATH: 'concat',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_ARGUMENT)
+
+        cmd[CMD_KW_ARGS][CMD_KW_DEST_DB] = 'a.h5'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+
+        cmd_slice = {
+            CMD_KW_CMD: CMD_SLICE_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'a.h5',
+                CMD_KW_PATH: 'concat',
+                CMD_KW_KEY: slice(None, None, None)
+            }
+        }
+        response = unpack(handle_request(cmd_slice))
+        assert_array_equal(response[RESPONSE_DATA],
+                           np.concatenate([data1, data2]))
+
+        cmd[CMD_KW_ARGS][CMD_KW_AXIS] = 1
+        cmd[CMD_KW_ARGS][CMD_KW_OVERWRITE] = True
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INCOMPATIBLE_DATA)
+
+        cmd[CMD_KW_ARGS][CMD_KW_SOURCES] = (('a.h5', 'ds'), ('a.h5', 'ds'))
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        response = unpack(handle_request(cmd_slice))
+        assert_array_equal(response[RESPONSE_DATA],
+                           np.concatenate([data1, data1], axis=1))
+
+        cmd[CMD_KW_ARGS][CMD_KW_OVERWRITE] = False
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], DATASET_EXISTS)
+
+        for sources in ('a.h5', (('a.h5', 'ds', 'b.h5'),), (('a.h5', 1),)):
+            cmd[CMD_KW_ARGS][CMD_KW_SOURCES] = sources
+            response = unpack(handle_request(cmd))
+            self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+    def test_append(self):
+        self.create_db('test.h5')
+        self.create_ds('test.h5', 'fixed', np.zeros((2, 3)))
+        self.create_ds('test.h5', 'ds', None, **{
+            CMD_KW_SHAPE: (0, 3),
+            CMD_KW_DTYPE: 'float64',
+            CMD_KW_CHUNKS: (4, 3),
+            CMD_KW_MAXSHAPE: (None, 3),
+        })
+
+        cmd = {
+            CMD_KW_CMD: CMD_APPEND_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_DATA)
+
+        rows = np.arange(15.).reshape(5, 3)
+        cmd[CMD_KW_DATA] = rows[0]  # single row
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_LENGTH], 1)
+
+        cmd[CMD_KW_DATA] = rows[1:]
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_LENGTH], 5)
+
+        # the allocated size is larger than the logical length
+        cmd_node = {
+            CMD_KW_CMD: CMD_GET_NODE,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+            }
+        }
+        response = unpack(handle_request(cmd_node))
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_NODE_SHAPE], (5, 3))
+        response = self.slice_ds('test.h5', 'ds', slice(None, None, None))
+        assert_array_equal(response[RESPONSE_DATA], rows)
+        response = self.slice_ds('test.h5', 'ds', -1)
+        assert_array_equal(response[RESPONSE_DATA], rows[-1])
+        response = self.slice_ds('test.h5', 'ds', 5)
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+        cmd[CMD_KW_DATA] = np.zeros((2, 4))
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INCOMPATIBLE_DATA)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'fixed'
+        cmd[CMD_KW_DATA] = rows
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], TYPE_ERROR)
+
+    def test_append_keys(self):
+        self.create_db('test.h5')
+        self.create_ds('test.h5', 'ds', None, **{
+            CMD_KW_SHAPE: (0,),
+            CMD_KW_DTYPE: 'float64',
+            CMD_KW_CHUNKS: (10,),
+            CMD_KW_MAXSHAPE: (None,),
+        })
+        cmd = {
+            CMD_KW_CMD: CMD_APPEND_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+            },
+            CMD_KW_DATA: np.arange(1., 4.),
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_LENGTH], 3)
+
+        # write keys are resolved against the logical length
+        cmd = {
+            CMD_KW_CMD: CMD_BROADCAST_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+                CMD_KW_KEY: slice(None, None, None),
+            },
+            CMD_KW_DATA: np.zeros(3),
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        response = self.slice_ds('test.h5', 'ds', slice(None, None, None))
+        assert_array_equal(response[RESPONSE_DATA], np.zeros(3))
+
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = -1
+        cmd[CMD_KW_DATA] = np.array(7.)
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        response = self.slice_ds('test.h5', 'ds', slice(None, None, None))
+        assert_array_equal(response[RESPONSE_DATA], [0., 0., 7.])
+
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = 3
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+        # fancy reads are checked against the logical length
+        response = self.slice_ds('test.h5', 'ds', np.array([0, 2]))
+        assert_array_equal(response[RESPONSE_DATA], [0., 7.])
+        response = self.slice_ds('test.h5', 'ds', np.array([0, 5]))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+        response = self.slice_ds('test.h5', 'ds', np.ones(10, dtype=bool))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+        # resizing gives up the spare allocation
+        ds = File(os.path.join(self.test_dir, 'test.h5'), 'r+')['ds']
+        ds.resize((5,))
+        self.assertEqual(ds.shape, (5,))
+        assert_array_equal(ds[:], [0., 0., 7., 0., 0.])
+        cmd = {
+            CMD_KW_CMD: CMD_APPEND_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+            },
+            CMD_KW_DATA: np.array([8.]),
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_LENGTH], 6)
+        assert_array_equal(ds[:], [0., 0., 7., 0., 0., 8.])
+
+    def test_slice_encoding(self):
+        data = np.random.random((10, 20)) * 100
+
+        self.create_db('test.h5')
+        self.create_ds('test.h5', 'ds', data)
+
+        cmd = {
+            CMD_KW_CMD: CMD_SLICE_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+                CMD_KW_KEY: slice(2, 5, None),
+                CMD_KW_OUT_DTYPE: 'float32',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        result = response[RESPONSE_DATA]
+        self.assertEqual(result[RESPONSE_DATA].dtype, np.float32)
+        assert_array_equal(result[RESPONSE_DATA], data[2:5].astype('f4'))
+
+        cmd[CMD_KW_ARGS][CMD_KW_PACK] = 'uint16'
+        cmd[CMD_KW_ARGS][CMD_KW_SCALE_FACTOR] = 0.01
+        response = unpack(handle_request(cmd))
+        result = response[RESPONSE_DATA]
+        self.assertEqual(result[RESPONSE_DATA].dtype, np.uint16)
+        restored = decode_array(result[RESPONSE_DATA],
+                                result[RESPONSE_ENCODING])
+        self.assertEqual(restored.dtype, np.float64)
+        np.testing.assert_allclose(restored, data[2:5], atol=0.006)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PACK] = 'int8'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PACK] = 'float32'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+        # gather
+        self.create_ds('test.h5', 'ds2', data * 2)
+        cmd = {
+            CMD_KW_CMD: CMD_GATHER,
+            CMD_KW_ARGS: {
+                CMD_KW_TARGETS: (('test.h5', 'ds'), ('test.h5', 'ds2')),
+                CMD_KW_KEY: 0,
+                CMD_KW_PACK: 'int16',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        for result, expected in zip(response[RESPONSE_DATA],
+                                    (data[0], data[0] * 2)):
+            np.testing.assert_allclose(
+                decode_array(result[RESPONSE_DATA],
+                             result[RESPONSE_ENCODING]),
+                expected, atol=0.01)
+
+        cmd[CMD_KW_ARGS][CMD_KW_STACK] = True
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INCOMPATIBLE_DATA)
+
+        cmd[CMD_KW_ARGS][CMD_KW_SCALE_FACTOR] = 0.01
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        result = response[RESPONSE_DATA]
+        np.testing.assert_allclose(
+            decode_array(result[RESPONSE_DATA], result[RESPONSE_ENCODING]),
+            np.stack([data[0], data[0] * 2]), atol=0.006)
+
+    def test_pyramid(self):
+        self.create_db('test.h5')
+        data = np.arange(64 * 64, dtype='float64').reshape(64, 64)
+        self.create_ds('test.h5', 'grid', data)
+
+        cmd = {
+            CMD_KW_CMD: CMD_CREATE_PYRAMID,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'grid',
+                CMD_KW_FACTOR: 4,
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], CREATED)
+        cmd[CMD_KW_ARGS][CMD_KW_FACTOR] = 1
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], VALUE_ERROR)
+
+        # overviews are not listed
+        cmd = {
+            CMD_KW_CMD: CMD_GET_KEYS,
+            CMD_KW_ARGS: {CMD_KW_DB: 'test.h5', CMD_KW_PATH: '/'}
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[RESPONSE_DATA][RESPONSE_NODE_KEYS],
+                         ('grid',))
+
+        cmd = {
+            CMD_KW_CMD: CMD_SLICE_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'grid',
+                CMD_KW_KEY: (slice(0, 32), slice(None)),
+                CMD_KW_RESOLUTION: 5,
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        result = response[RESPONSE_DATA]
+        self.assertEqual(result[RESPONSE_RESOLUTION], 4)
+        self.assertEqual(result[RESPONSE_DATA].shape, (8, 16))
+        self.assertEqual(result[RESPONSE_DATA][0, 0], data[:4, :4].mean())
+
+        # broadcasts are applied to the pyramid by an update
+        cmd = {
+            CMD_KW_CMD: CMD_BROADCAST_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'grid',
+                CMD_KW_KEY: (slice(0, 4), slice(0, 4)),
+            },
+            CMD_KW_DATA: np.zeros((4, 4)),
+        }
+        unpack(handle_request(cmd))
+        cmd[CMD_KW_CMD] = CMD_UPDATE_PYRAMID
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        cmd = {
+            CMD_KW_CMD: CMD_SLICE_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'grid',
+                CMD_KW_KEY: 0,
+                CMD_KW_RESOLUTION: 4,
+            }
+        }
+        response = unpack(handle_request(cmd))
+        result = response[RESPONSE_DATA]
+        self.assertEqual(result[RESPONSE_DATA][0], 0)
+        self.assertEqual(result[RESPONSE_DATA][1], data[:4, 4:8].mean())
+
+        # datasets without pyramid are read at full resolution
+        self.create_ds('test.h5', 'plain', data)
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'plain'
+        response = unpack(handle_request(cmd))
+        result = response[RESPONSE_DATA]
+        self.assertEqual(result[RESPONSE_RESOLUTION], 1)
+        assert_array_equal(result[RESPONSE_DATA], data[0])
+
+        # datasets replaced by a copy lose their pyramid
+        cmd = {
+            CMD_KW_CMD: CMD_COPY_DATASET,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'plain',
+                CMD_KW_DEST_PATH: 'grid',
+                CMD_KW_OVERWRITE: True,
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        with h5py.File(os.path.join(self.test_dir, 'test.h5'), 'r') as f:
+            self.assertNotIn(OVERVIEWS_GROUP, f)
+
+    def test_chunk_advice(self):
+        self.create_db('test.h5')
+        self.create_ds('test.h5', 'ds', np.zeros((200, 300)),
+                       **{CMD_KW_CHUNKS: (200, 1)})
+        cmd = {
+            CMD_KW_CMD: CMD_CHUNK_ADVICE,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_DATA)
+
+        for i in range(10):
+            self.slice_ds('test.h5', 'ds', (i, slice(None)))
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        advice = response[RESPONSE_DATA]
+        self.assertEqual(advice[ADVICE_REQUESTS], 10)
+        self.assertEqual(advice[ADVICE_CHUNKS], (200, 1))
+        self.assertEqual(advice[ADVICE_RECOMMENDED_CHUNKS][1], 300)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = '/'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+    def test_read_chunks(self):
+        self.create_db('test.h5')
+        data = np.random.random((50, 30))
+        self.create_ds('test.h5', 'ds', data,
+                       **{CMD_KW_CHUNKS: (10, 10),
+                          CMD_KW_COMPRESSION: 'gzip'})
+        cmd = {
+            CMD_KW_CMD: CMD_READ_CHUNKS,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_PATH: 'ds',
+                CMD_KW_KEY: (slice(5, 25), 3),
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], OK)
+        np.testing.assert_array_equal(assemble(response[RESPONSE_DATA]),
+                                      data[5:25, 3])
+
+        del cmd[CMD_KW_ARGS][CMD_KW_KEY]
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], MISSING_ARGUMENT)
+
+        self.create_ds('test.h5', 'contiguous', data)
+        cmd[CMD_KW_ARGS][CMD_KW_KEY] = 0
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'contiguous'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+    def test_repack(self):
+        self.create_db('test.h5')
+        data = np.random.random((100, 20))
+        self.create_ds('test.h5', 'ds', data, **{CMD_KW_CHUNKS: (100, 1)})
+
+        cmd = {
+            CMD_KW_CMD: CMD_REPACK,
+            CMD_KW_ARGS: {
+                CMD_KW_DB: 'test.h5',
+                CMD_KW_CHUNKS: (10, 20),
+            }
+        }
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'missing'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], NODE_NOT_FOUND)
+
+        cmd[CMD_KW_ARGS][CMD_KW_PATH] = 'ds'
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], ACCEPTED)
+        job_id = response[RESPONSE_DATA][RESPONSE_JOB]
+        response = unpack(handle_request(cmd))
+        self.assertEqual(response[CMD_KW_STATUS], FILE_BUSY)
+
+        status_cmd = {
+            CMD_KW_CMD: CMD_JOB_STATUS,
+            CMD_KW_ARGS: {CMD_KW_JOB: job_id}
+        }
+        response = unpack(handle_request(status_cmd))
+        self.assertEqual(response[RESPONSE_DATA][JOB_STATE], JOB_PENDING)
+        run_job(job_id)
+        response = unpack(handle_request(status_cmd))
+        self.assertEqual(response[RESPONSE_DATA][JOB_STATE], JOB_DONE)
+        self.assertEqual(response[RESPONSE_DATA][JOB_PROGRESS], 1)
+        assert_array_equal(self.slice_ds('test.h5', 'ds',
+                                         slice(None))[RESPONSE_DATA], data)
+
+        status_cmd[CMD_KW_ARGS][CMD_KW_JOB] = -1
+        response = unpack(handle_request(status_cmd))
+        self.assertEqual(response[CMD_KW_STATUS], INVALID_ARGUMENT)
@@ -0,0 +1,112 @@
+import socket
+import threading
+import unittest
+
+import numpy as np
+from hurray.server import gen
+from hurray.server.ioloop import IOLoop
+from hurray.server.iostream import IOStream, StreamClosedError
+
+
+class WriteBuffersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.left, self.right = socket.socketpair()
+        # a small send buffer enforces partial writes
+        self.left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+
+    def tearDown(self):
+        self.right.close()
+        self.io_loop.close(all_fds=True)
+
+    def receive(self, result):
+        data = bytearray()
+        while True:
+            chunk = self.right.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        result.append(bytes(data))
+
+    def test_write_buffers(self):
+        arr = np.random.randint(0, 255, (300, 1000), dtype='uint8')
+        buffers = [b'header', arr, memoryview(b'x' * 100000)[10:], b'',
+                   b'tail']
+        expected = b''.join(bytes(memoryview(buf)) for buf in buffers)
+        result = []
+        reader = threading.Thread(target=self.receive, args=(result,))
+        reader.start()
+        stream = IOStream(self.left, io_loop=self.io_loop)
+        self.assertTrue(stream._scatter_gather)
+
+        @gen.coroutine
+        def write():
+            yield stream.write_buffers(buffers)
+            yield stream.write(b'end')
+            self.assertEqual(stream._write_buffer_size, 0)
+
+        self.io_loop.run_sync(write, timeout=10)
+        stream.close()
+        reader.join()
+        self.assertEqual(result[0], expected + b'end')
+
+
+class ReadBytesIntoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.left, self.right = socket.socketpair()
+
+    def tearDown(self):
+        self.right.close()
+        self.io_loop.close(all_fds=True)
+
+    def send(self, data):
+        self.right.sendall(data)
+
+    def test_read_bytes_into(self):
+        body = np.random.randint(0, 255, 3000000, dtype='uint8').tobytes()
+        data = b'head' + body + b'tail'
+        sender = threading.Thread(target=self.send, args=(data,))
+        stream = IOStream(self.left, io_loop=self.io_loop)
+
+        @gen.coroutine
+        def read():
+            # buffered data of a previous read is taken over
+            head = yield stream.read_bytes(2)
+            self.assertEqual(head, b'he')
+            buf = yield stream.read_bytes_into(len(body) + 2)
+            self.assertIsInstance(buf, bytearray)
+            self.assertEqual(buf, b'ad' + body)
+            empty = yield stream.read_bytes_into(0)
+            self.assertEqual(empty, bytearray())
+            tail = yield stream.read_bytes(4)
+            self.assertEqual(tail, b'tail')
+
+        sender.start()
+        self.io_loop.run_sync(read, timeout=10)
+        sender.join()
+        stream.close()
+
+    def test_closed(self):
+        stream = IOStream(self.left, io_loop=self.io_loop)
+        self.right.sendall(b'abc')
+        self.right.shutdown(socket.SHUT_WR)
+
+        @gen.coroutine
+        def read():
+            with self.assertRaises(StreamClosedError):
+                yield stream.read_bytes_into(10)
+
+        self.io_loop.run_sync(read, timeout=10)
+
+    def test_max_buffer_size(self):
+        stream = IOStream(self.left, io_loop=self.io_loop,
+                          max_buffer_size=1024)
+
+        @gen.coroutine
+        def read():
+            with self.assertRaises(StreamClosedError):
+                yield stream.read_bytes_into(2048)
+            self.assertTrue(stream.closed())
+
+        self.io_loop.run_sync(read, timeout=10)
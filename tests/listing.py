@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.swmr import File
+from hurray.swmr.api import TREE_NAMES, TREE_PARENTS
+
+
+class ListingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'test.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_keys_page(self):
+        with File(self.filename, 'w') as f:
+            grp = f.create_group('grp')
+            names = ['a{:03d}'.format(i) for i in range(50)] + \
+                    ['b{:03d}'.format(i) for i in range(30)]
+            for name in names:
+                grp.create_group(name)
+
+            keys, cursor = [], None
+            while True:
+                page, cursor = grp.keys_page(limit=7, cursor=cursor)
+                self.assertLessEqual(len(page), 7)
+                keys.extend(page)
+                if cursor is None:
+                    break
+            self.assertEqual(keys, sorted(names))
+            self.assertEqual(grp.keys_page()[0], grp.keys())
+
+            keys, cursor = grp.keys_page(prefix='b01')
+            self.assertEqual(keys, ['b01{}'.format(i) for i in range(10)])
+            self.assertIsNone(cursor)
+            self.assertEqual(grp.keys_page(prefix='c'), ([], None))
+
+            # links created or removed between pages
+            page, cursor = grp.keys_page(limit=10, prefix='a')
+            self.assertEqual(page[-1], 'a009')
+            del grp['a003']
+            grp.create_group('a0095')
+            page, cursor = grp.keys_page(limit=3, cursor=cursor, prefix='a')
+            self.assertEqual(page, ['a0095', 'a010', 'a011'])
+            del grp['a012']
+            grp.create_group('a000x')
+            page, cursor = grp.keys_page(limit=2, cursor=cursor, prefix='a')
+            self.assertEqual(page, ['a013', 'a014'])
+
+            self.assertRaises(ValueError, grp.keys_page, cursor='invalid')
+
+    def test_columns_page(self):
+        with File(self.filename, 'w') as f:
+            for i in range(5):
+                grp = f.create_group('g{}'.format(i))
+                for j in range(i * 3):
+                    grp.create_dataset(name='ds{}'.format(j), data=np.zeros(2))
+                grp.create_group('sub').create_group('subsub')
+            # link back to an ancestor
+            with h5py.File(self.filename, 'r+') as h5file:
+                h5file['g1/sub/up'] = h5file['g1']
+
+            full, cursor = f.columns()
+            self.assertIsNone(cursor)
+
+            for limit in (1, 4, 100):
+                names, parents, cursor = [], [], None
+                while True:
+                    page, cursor = f.columns(limit=limit, cursor=cursor)
+                    self.assertLessEqual(len(page[TREE_NAMES]), limit)
+                    names.extend(page[TREE_NAMES])
+                    parents.extend(page[TREE_PARENTS])
+                    if cursor is None:
+                        break
+                self.assertEqual(len(names), len(full[TREE_NAMES]))
+                # same nodes (identified by their full paths)
+                self.assertEqual(sorted(paths(names, parents)),
+                                 sorted(paths(full[TREE_NAMES],
+                                              full[TREE_PARENTS])))
+            self.assertIn('/g1/sub/up', paths(names, parents))
+            self.assertNotIn('/g1/sub/up/sub', paths(names, parents))
+
+            page, cursor = f.columns(depth=1, limit=3)
+            self.assertEqual(page[TREE_NAMES], ['/', 'g0', 'g1'])
+            page, cursor = f.columns(depth=1, limit=3, cursor=cursor)
+            self.assertEqual(page[TREE_NAMES], ['g2', 'g3', 'g4'])
+            self.assertIsNone(cursor)
+
+
+def paths(names, parents):
+    result = []
+    for name, parent in zip(names, parents):
+        result.append(name if parent < 0 else
+                      result[parent].rstrip('/') + '/' + name)
+    return result
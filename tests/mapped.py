@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.swmr import File, mapped
+from numpy.testing import assert_array_equal
+
+
+class MappedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'test.h5')
+        mapped.clear()
+
+    def tearDown(self):
+        mapped.clear()
+        shutil.rmtree(self.test_dir)
+
+    def test_read(self):
+        data = np.random.random((40, 30, 5))
+        with File(self.filename, 'w') as f:
+            dst = f.create_dataset(name='ds', data=data)
+            big_endian = f.create_dataset(name='be',
+                                          data=data[0].astype('>i4'))
+            chunked = f.create_dataset(name='chunked', data=data,
+                                       chunks=(10, 10, 5))
+            empty = f.create_dataset(name='empty', shape=(10,), dtype='f4')
+
+            for key in (Ellipsis, (), 3, (slice(2, 30, 3), -1),
+                        (slice(5, 10), Ellipsis, 2), (1, 2, 3),
+                        slice(50, 60)):
+                expected = data[key]
+                result = dst[key]
+                self.assertIsNotNone(mapped.get(self.filename, '/ds'))
+                self.assertEqual(type(result), type(expected))
+                assert_array_equal(result, expected)
+            assert_array_equal(dst[[1, 5]], data[[1, 5]])  # not mapped
+            self.assertRaises(IndexError, dst.__getitem__, 40)
+
+            assert_array_equal(big_endian[2:4], data[0, 2:4].astype('i4'))
+            self.assertIsNotNone(mapped.get(self.filename, '/be'))
+
+            assert_array_equal(chunked[1:3], data[1:3])
+            self.assertIsNone(mapped.get(self.filename, '/chunked'))
+            # storage is not allocated before the dataset is written
+            assert_array_equal(empty[...], np.zeros(10))
+            self.assertIsNone(mapped.get(self.filename, '/empty'))
+
+    def test_invalidation(self):
+        data = np.arange(100.).reshape(10, 10)
+        with File(self.filename, 'w') as f:
+            dst = f.create_dataset(name='ds', data=data)
+            assert_array_equal(dst[...], data)
+            self.assertIsNotNone(mapped.get(self.filename, '/ds'))
+
+            dst[0] = -1
+            self.assertIsNone(mapped.get(self.filename, '/ds'))
+            data[0] = -1
+            assert_array_equal(dst[...], data)
+
+            dst = f.create_dataset(name='ds', data=data[:5], chunks=(5, 5),
+                                   compression='gzip', overwrite=True)
+            assert_array_equal(dst[...], data[:5])
+            self.assertIsNone(mapped.get(self.filename, '/ds'))
+
+            dst = f.create_dataset(name='ds', data=data.T.copy(),
+                                   overwrite=True)
+            assert_array_equal(dst[...], data.T)
+            self.assertIsNotNone(mapped.get(self.filename, '/ds'))
+
+        # the file is replaced behind our back
+        with h5py.File(self.filename + '.new', 'w') as f:
+            f.create_dataset('ds', data=data * 2)
+        os.rename(self.filename + '.new', self.filename)
+        self.assertIsNone(mapped.get(self.filename, '/ds'))
+        assert_array_equal(File(self.filename)['ds'][...], data * 2)
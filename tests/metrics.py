@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import msgpack
+from hurray import metrics
+from hurray.protocol import CMD_SLICE_DATASET, CMD_GET_NODE
+from hurray.status_codes import OK, FILE_NOT_FOUND, INTERNAL_SERVER_ERROR
+
+
+def parse(text):
+    """
+    Returns:
+        dict {'name{labels}': value} of the samples of a metrics page
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def record():
+    metrics.request(CMD_SLICE_DATASET, 0.002, 100, 1000, OK)
+    metrics.lock('write', 0.5, 0.001)
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        if not metrics.enabled():
+            metrics.enable('w')
+
+    def test_processes(self):
+        before = parse(metrics.render())
+        metrics.request(CMD_GET_NODE, 20.0, 10, 20, FILE_NOT_FOUND)
+        metrics.request('unknown', 0.01, 10, 20, None)
+        metrics.submitted()
+        # forked processes record in their own slots
+        procs = [multiprocessing.Process(target=record) for _ in range(3)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        after = parse(metrics.render())
+
+        def delta(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        cmd = '{cmd="%s"}' % CMD_SLICE_DATASET
+        self.assertEqual(delta('hurray_requests_total' + cmd), 3)
+        self.assertEqual(delta('hurray_request_bytes_total' + cmd), 300)
+        self.assertEqual(delta('hurray_response_bytes_total' + cmd), 3000)
+        self.assertEqual(delta('hurray_request_duration_seconds_bucket'
+                               '{cmd="%s",le="0.001"}' % CMD_SLICE_DATASET),
+                         0)
+        self.assertEqual(delta('hurray_request_duration_seconds_bucket'
+                               '{cmd="%s",le="0.0025"}' % CMD_SLICE_DATASET),
+                         3)
+        self.assertEqual(delta('hurray_request_duration_seconds_bucket'
+                               '{cmd="%s",le="+Inf"}' % CMD_GET_NODE), 1)
+        self.assertEqual(delta('hurray_request_duration_seconds_bucket'
+                               '{cmd="%s",le="10.0"}' % CMD_GET_NODE), 0)
+        self.assertEqual(delta('hurray_requests_total{cmd="other"}'), 1)
+        self.assertEqual(delta('hurray_responses_total{status="%d"}' % OK),
+                         3)
+        self.assertEqual(delta('hurray_responses_total{status="%d"}'
+                               % FILE_NOT_FOUND), 1)
+        self.assertEqual(delta('hurray_lock_wait_seconds_count'
+                               '{strategy="w",kind="write"}'), 3)
+        self.assertEqual(after['hurray_pool_queue_depth'] -
+                         before['hurray_pool_queue_depth'], 1)
+        metrics.completed()
+
+    def test_response_status(self):
+        for status in (OK, FILE_NOT_FOUND, INTERNAL_SERVER_ERROR):
+            resp = msgpack.packb({'status': status, 'data': b'x' * 100},
+                                 use_bin_type=True)
+            self.assertEqual(metrics.response_status(resp), status)
+        self.assertIsNone(metrics.response_status(b''))
+        self.assertIsNone(metrics.response_status(msgpack.packb({'a': 1})))
+
+    def test_exporter(self):
+        test_dir = tempfile.mkdtemp()
+        path = os.path.join(test_dir, 'metrics.sock')
+        proc, = metrics.start_exporter(unix_socket=path)
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            deadline = time.time() + 10
+            while True:
+                try:
+                    sock.connect(path)
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.05)
+            sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            data = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            sock.close()
+            head, body = data.split(b'\r\n\r\n', 1)
+            self.assertIn(b'200', head.split(b'\r\n')[0])
+            self.assertIn('hurray_pool_queue_depth', parse(body.decode()))
+        finally:
+            proc.terminate()
+            proc.join()
+            shutil.rmtree(test_dir)
@@ -0,0 +1,43 @@
+import os
+import unittest
+
+import msgpack
+from hurray.__main__ import HurrayServer
+from hurray.msgpack_ext import decode
+from hurray.protocol import (CMD_KW_STATUS, RESPONSE_DATA, RESPONSE_TASK,
+                             RESPONSE_PROCESSES)
+from hurray.status_codes import OK
+from hurray.swmr.processes import (ProcessRegistry, PROCESS_TASK, PROCESS_PID,
+                                   PROCESS_CONNECTIONS, PROCESS_OPEN,
+                                   PROCESS_REQUESTS)
+
+
+class ProcessRegistryTestCase(unittest.TestCase):
+    def test_registry(self):
+        registry = ProcessRegistry()
+        self.assertEqual(registry.get(), [])
+        registry.update(1, 101, 5, 2, 50)
+        registry.update(0, 100, 3, 3, 7)
+        registry.update(1, 102, 1, 1, 1)  # restarted process
+        processes = registry.get()
+        self.assertEqual([p[PROCESS_TASK] for p in processes], [0, 1])
+        self.assertEqual(processes[1][PROCESS_PID], 102)
+        self.assertEqual(processes[1][PROCESS_CONNECTIONS], 1)
+        self.assertEqual(processes[0][PROCESS_REQUESTS], 7)
+
+    def test_server_info(self):
+        server = HurrayServer()
+        server.connections = 4
+        server.open_connections = 1
+        server.requests = 9
+        result = msgpack.unpackb(server.server_info(), object_hook=decode,
+                                 encoding='utf-8')
+        self.assertEqual(result[CMD_KW_STATUS], OK)
+        data = result[RESPONSE_DATA]
+        self.assertEqual(data[RESPONSE_TASK], 0)
+        process, = [p for p in data[RESPONSE_PROCESSES]
+                    if p[PROCESS_TASK] == 0]
+        self.assertEqual(process[PROCESS_PID], os.getpid())
+        self.assertEqual(process[PROCESS_CONNECTIONS], 4)
+        self.assertEqual(process[PROCESS_OPEN], 1)
+        self.assertEqual(process[PROCESS_REQUESTS], 9)
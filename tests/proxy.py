@@ -0,0 +1,214 @@
+import asyncio
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from hurray.client import Client, HurrayError
+from hurray.protocol import (CMD_KW_DB, CMD_KW_OVERWRITE, CMD_KW_PATH,
+                             CMD_KW_KEY, CMD_KW_LIMIT, CMD_KW_CURSOR,
+                             CMD_KW_TARGETS, CMD_KW_STACK,
+                             CMD_KW_DB_RENAMETO, CMD_CREATE_DATABASE,
+                             CMD_CREATE_DATASET, CMD_SLICE_DATASET,
+                             CMD_LIST_DATABASES, CMD_GATHER,
+                             CMD_RENAME_DATABASE, CMD_GET_KEYS,
+                             CMD_SERVER_INFO, RESPONSE_DATABASES,
+                             RESPONSE_CURSOR, RESPONSE_NODE_KEYS,
+                             RESPONSE_NODES)
+from hurray.proxy import HashRing, ProxyServer, parse_address, parse_routes
+from hurray.server.ioloop import IOLoop
+from hurray.server.netutil import bind_sockets
+from hurray.server.platform.asyncio import AsyncIOLoop
+from hurray.status_codes import NOT_IMPLEMENTED, NODE_UNAVAILABLE
+from numpy.testing import assert_array_equal
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class HashRingTestCase(unittest.TestCase):
+    def test_ring(self):
+        names = ['db%04d.h5' % i for i in range(2000)]
+        ring = HashRing(['a:1', 'b:1', 'c:1'])
+        nodes = [ring.node(name) for name in names]
+        for node in ring.nodes:
+            self.assertGreater(nodes.count(node), 400)
+        # a new node only takes over databases
+        ring = HashRing(['a:1', 'b:1', 'c:1', 'd:1'])
+        for name, node in zip(names, nodes):
+            self.assertIn(ring.node(name), (node, 'd:1'))
+
+    def test_routes(self):
+        routes = parse_routes(['archive/*=b:1', 'x.h5=a:1'])
+        ring = HashRing(['a:1', 'b:1'], routes)
+        for i in range(20):
+            self.assertEqual(ring.node('archive/%d.h5' % i), 'b:1')
+        self.assertEqual(ring.node('x.h5'), 'a:1')
+        with self.assertRaises(ValueError):
+            HashRing(['a:1'], routes)
+        with self.assertRaises(ValueError):
+            parse_routes(['archive/*'])
+
+    def test_address(self):
+        self.assertEqual(parse_address('localhost:2222'),
+                         {'host': 'localhost', 'port': 2222})
+        self.assertEqual(parse_address('/tmp/hurray.sock'),
+                         {'unix_socket': '/tmp/hurray.sock'})
+
+
+class ProxyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dirs = []
+        self.servers = []
+        nodes = []
+        for _ in range(2):
+            base = tempfile.mkdtemp()
+            port = free_port()
+            self.test_dirs.append(base)
+            self.servers.append(subprocess.Popen(
+                [sys.executable, '-m', 'hurray', '--base=' + base,
+                 '--port=%d' % port, '--processes=1',
+                 '--pyramid_interval=0', '--logging=warning'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                start_new_session=True))
+            nodes.append('127.0.0.1:%d' % port)
+        for node in nodes:
+            self.wait_for(node)
+        self.nodes = nodes
+
+        self.io_loop = AsyncIOLoop()
+        self.io_loop.make_current()
+        self.proxy = ProxyServer(nodes, [('pinned/*', nodes[1])])
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        self.proxy.add_sockets(sockets)
+
+    def wait_for(self, node):
+        host, port = node.split(':')
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection((host, int(port))).close()
+                return
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def stop_server(self, server):
+        if server.poll() is None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+        # the lock manager and the workers of the server
+        try:
+            os.killpg(server.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def tearDown(self):
+        self.proxy.stop()
+        self.proxy.shutdown_pool()
+        self.io_loop.close(all_fds=True)
+        IOLoop.clear_current()
+        for server in self.servers:
+            self.stop_server(server)
+        for test_dir in self.test_dirs:
+            shutil.rmtree(test_dir)
+
+    def run_client(self, client):
+        async def run():
+            await asyncio.get_running_loop().run_in_executor(None, client)
+            while self.proxy.open_connections:
+                await asyncio.sleep(0.01)
+
+        loop = self.io_loop.asyncio_loop
+        return loop.run_until_complete(asyncio.wait_for(run(), 60))
+
+    def test_proxy(self):
+        names = ['db%02d.h5' % i for i in range(10)] + ['pinned/a.h5']
+
+        def client():
+            with Client('127.0.0.1', self.port) as client:
+                for i, name in enumerate(names):
+                    client.call(CMD_CREATE_DATABASE, {
+                        CMD_KW_DB: name, CMD_KW_OVERWRITE: True})
+                    client.call(CMD_CREATE_DATASET, {
+                        CMD_KW_DB: name, CMD_KW_PATH: 'ds'},
+                        np.arange(10) + i)
+                stored = [sorted(os.listdir(test_dir))
+                          for test_dir in self.test_dirs]
+                self.assertEqual(len(stored[0]) + len(stored[1]), 11)
+                self.assertNotIn('pinned', stored[0])
+                self.assertIn('pinned', stored[1])
+
+                # pipelined requests to both nodes
+                futures = [client.submit(CMD_SLICE_DATASET, {
+                    CMD_KW_DB: name, CMD_KW_PATH: 'ds',
+                    CMD_KW_KEY: slice(0, 1)}) for name in names * 5]
+                self.assertEqual([f.result()[0] for f in futures],
+                                 list(range(11)) * 5)
+
+                # listings of all nodes
+                self.assertEqual(sorted(client.call(CMD_LIST_DATABASES)),
+                                 names[:10])
+                listed = []
+                cursor = None
+                while True:
+                    args = {CMD_KW_LIMIT: 4, 'recursive': True}
+                    if cursor is not None:
+                        args[CMD_KW_CURSOR] = cursor
+                    page = client.call(CMD_LIST_DATABASES, args)
+                    listed.extend(page[RESPONSE_DATABASES])
+                    cursor = page[RESPONSE_CURSOR]
+                    if cursor is None:
+                        break
+                self.assertEqual(listed, sorted(names))
+
+                arr = client.call(CMD_GATHER, {
+                    CMD_KW_TARGETS: [(name, 'ds') for name in names],
+                    CMD_KW_KEY: slice(0, 3), CMD_KW_STACK: True})
+                assert_array_equal(arr, np.arange(3) + np.arange(11)[:, None])
+
+                keys = []
+                for page in client.stream(CMD_GET_KEYS, {
+                        CMD_KW_DB: 'pinned/a.h5', CMD_KW_PATH: '/'}):
+                    keys.extend(page[RESPONSE_NODE_KEYS])
+                self.assertEqual(keys, ['ds'])
+
+                # pinned/* is stored on the second node
+                first = [name for name in names
+                         if self.proxy.ring.node(name) == self.nodes[0]]
+                with self.assertRaises(HurrayError) as cm:
+                    client.call(CMD_RENAME_DATABASE, {
+                        CMD_KW_DB: first[0],
+                        CMD_KW_DB_RENAMETO: 'pinned/b.h5'})
+                self.assertEqual(cm.exception.status, NOT_IMPLEMENTED)
+
+                info = client.call(CMD_SERVER_INFO)
+                self.assertEqual(sorted(info[RESPONSE_NODES]),
+                                 sorted(self.nodes))
+
+                # a node fails
+                self.stop_server(self.servers[1])
+                for name in names:
+                    args = {CMD_KW_DB: name, CMD_KW_PATH: '/'}
+                    if self.proxy.ring.node(name) == self.nodes[0]:
+                        client.call(CMD_GET_KEYS, args)
+                    else:
+                        with self.assertRaises(HurrayError) as cm:
+                            client.call(CMD_GET_KEYS, args)
+                        self.assertEqual(cm.exception.status,
+                                         NODE_UNAVAILABLE)
+
+        self.run_client(client)
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.swmr import pyramid
+from numpy.testing import assert_array_equal, assert_allclose
+
+
+class PyramidTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.h5file = h5py.File(os.path.join(self.test_dir, 'test.h5'), 'w')
+
+    def tearDown(self):
+        self.h5file.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_downsample(self):
+        arr = np.arange(20, dtype='float64').reshape(4, 5)
+        result = pyramid.downsample(arr, 2, (0, 1))
+        assert_array_equal(result, [[3., 5., 6.5],
+                                    [13., 15., 16.5]])
+        result = pyramid.downsample(arr, 2, (1,))
+        assert_array_equal(result[0], [0.5, 2.5, 4.])
+
+        result = pyramid.downsample(np.array([1, 2, 4], dtype='int32'), 2,
+                                    (0,))
+        self.assertEqual(result.dtype, np.int32)
+        assert_array_equal(result, [2, 4])
+
+    def test_create_update_read(self):
+        data = np.random.random((3, 40, 50))
+        dst = self.h5file.create_dataset('grid', data=data)
+        pyramid.create(dst, dst.shape, factor=2, levels=2)
+        self.assertEqual(pyramid.info(dst), (2, 2, (1, 2)))
+        self.assertIn(pyramid.OVERVIEWS_GROUP, self.h5file)
+        group = self.h5file[pyramid.overview_path('/grid')]
+        self.assertEqual(group['1'].shape, (3, 20, 25))
+        self.assertEqual(group['2'].shape, (3, 10, 13))
+        level1 = pyramid.downsample(data, 2, (1, 2))
+        assert_allclose(group['1'][()], level1)
+        assert_allclose(group['2'][()], pyramid.downsample(level1, 2, (1, 2)))
+        self.assertFalse(pyramid.is_dirty(dst))
+
+        # writes only mark regions as dirty
+        dst[1, 5:9, 10:20] = 1
+        pyramid.mark_dirty(dst, dst.shape, (1, slice(5, 9), slice(10, 20)))
+        self.assertTrue(pyramid.is_dirty(dst))
+        assert_allclose(group['1'][()], level1)
+        data[1, 5:9, 10:20] = 1
+        pyramid.update(dst, dst.shape)
+        self.assertFalse(pyramid.is_dirty(dst))
+        level1 = pyramid.downsample(data, 2, (1, 2))
+        assert_allclose(group['1'][()], level1)
+        assert_allclose(group['2'][()], pyramid.downsample(level1, 2, (1, 2)))
+
+        # coarsest level that satisfies the resolution
+        arr, factor = pyramid.read(dst, dst.shape, (0, slice(8, 40)), 3)
+        self.assertEqual(factor, 2)
+        assert_allclose(arr, level1[0, 4:20])
+        arr, factor = pyramid.read(dst, dst.shape, Ellipsis, 100)
+        self.assertEqual(factor, 4)
+        self.assertEqual(arr.shape, (3, 10, 13))
+        self.assertEqual(pyramid.read(dst, dst.shape, Ellipsis, 1),
+                         (None, 1))
+
+        pyramid.delete(dst)
+        self.assertIsNone(pyramid.info(dst))
+        self.assertNotIn(pyramid.OVERVIEWS_GROUP, self.h5file)
+
+    def test_dirty_boxes(self):
+        dst = self.h5file.create_dataset('grid', data=np.zeros((64, 64)))
+        pyramid.create(dst, dst.shape, factor=4)
+        group = self.h5file[pyramid.overview_path('/grid')]
+        for i in range(pyramid.MAX_DIRTY_BOXES + 1):
+            pyramid.mark_dirty(dst, dst.shape, (i % 64, slice(0, 2)))
+        boxes = group.attrs[pyramid.DIRTY_ATTR]
+        assert_array_equal(boxes, [[0, 0, pyramid.MAX_DIRTY_BOXES, 2]])
+        pyramid.mark_dirty(dst, dst.shape, [1, 2])
+        dst[...] = 1
+        pyramid.update(dst, dst.shape)
+        assert_array_equal(group['1'][()], np.ones((16, 16)))
@@ -0,0 +1,47 @@
+import unittest
+
+import numpy as np
+from hurray.quantize import (encode, decode, bitround, pack,
+                             ENCODING_SCALE_FACTOR, ENCODING_FILLVALUE)
+from numpy.testing import assert_array_equal, assert_allclose
+
+
+class QuantizeTestCase(unittest.TestCase):
+    def test_dtype(self):
+        data = np.random.random((5, 10))
+        arr, encoding = encode(data, dtype='float32')
+        self.assertEqual(arr.dtype, np.float32)
+        restored = decode(arr, encoding)
+        self.assertEqual(restored.dtype, np.float64)
+        assert_allclose(restored, data, rtol=1e-6)
+
+    def test_bitround(self):
+        data = np.array([1., 3.14159, -2.71828, np.inf, np.nan])
+        rounded = bitround(data, 2)
+        assert_array_equal(rounded, [1., 3., -2.5, np.inf, np.nan])
+        assert_array_equal(bitround(data, 52), data)
+
+        data = np.random.random(1000).astype('float32')
+        rounded = bitround(data, 10)
+        assert_allclose(rounded, data, rtol=2 ** -11)
+
+        self.assertRaises(TypeError, bitround, np.arange(3), 2)
+
+    def test_pack(self):
+        data = np.random.random((20, 30)) * 50 - 10
+        data[0, 0] = np.nan
+
+        arr, encoding = encode(data, pack_dtype='int16')
+        self.assertEqual(arr.dtype, np.int16)
+        self.assertEqual(arr[0, 0], encoding[ENCODING_FILLVALUE])
+        restored = decode(arr, encoding)
+        self.assertTrue(np.isnan(restored[0, 0]))
+        assert_allclose(restored, data,
+                        atol=encoding[ENCODING_SCALE_FACTOR] / 2)
+
+        arr, encoding = encode(data, pack_dtype='uint16', scale_factor=0.01,
+                               add_offset=-10)
+        assert_allclose(decode(arr, encoding), data, atol=0.005)
+
+        self.assertRaises(ValueError, pack, data, 'int8', 0.01)
+        self.assertRaises(TypeError, pack, data, 'float32')
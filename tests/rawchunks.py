@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.rawchunks import assemble, decode_chunk, CHUNKS_DATA
+from hurray.swmr.direct import read_chunks, layout
+from numpy.testing import assert_array_equal
+
+
+class RawChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.h5file = h5py.File(os.path.join(self.test_dir, 'test.h5'), 'w')
+
+    def tearDown(self):
+        self.h5file.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_decode_chunk(self):
+        data = np.random.random((10, 10)).astype('float32')
+        for kwargs in ({}, {'compression': 'gzip'},
+                       {'compression': 'gzip', 'shuffle': True},
+                       {'shuffle': True, 'fletcher32': True}):
+            dst = self.h5file.create_dataset(str(len(self.h5file)),
+                                             data=data, chunks=(10, 10),
+                                             **kwargs)
+            filter_mask, chunk = dst.id.read_direct_chunk((0, 0))
+            filters = layout(dst)[3]
+            assert_array_equal(decode_chunk(chunk, filter_mask, filters,
+                                            data.dtype, (10, 10)), data)
+        dst = self.h5file.create_dataset('lzf', data=data, chunks=(10, 10),
+                                         compression='lzf')
+        _, chunk = dst.id.read_direct_chunk((0, 0))
+        self.assertRaises(ValueError, decode_chunk, chunk, 0,
+                          layout(dst)[3], data.dtype, (10, 10))
+
+    def test_assemble(self):
+        data = np.arange(37 * 23, dtype='int16').reshape(37, 23)
+        dst = self.h5file.create_dataset('ds', shape=data.shape,
+                                         dtype=data.dtype, chunks=(8, 5),
+                                         compression='gzip', shuffle=True,
+                                         fillvalue=-1)
+        dst[:30] = data[:30]
+        data[30:] = -1
+        for key in (Ellipsis, (slice(3, 31), slice(4, 23, 3)), (5, 7),
+                    (slice(None), 22), slice(36, 36)):
+            result = read_chunks(dst, dst.shape, key)
+            assert_array_equal(assemble(result), data[key])
+        # unallocated chunks are omitted
+        result = read_chunks(dst, dst.shape, slice(32, 37))
+        self.assertEqual(result[CHUNKS_DATA], [])
+        assert_array_equal(assemble(result), data[32:])
+
+        dst = self.h5file.create_dataset('contiguous', data=data)
+        self.assertRaises(TypeError, read_chunks, dst, dst.shape, 0)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from hurray.swmr import File
+from hurray.swmr.journal import journal_path
+from hurray.swmr.repack import (repack, PHASE_COPY, REPACK_SUFFIX,
+                                REPACK_SIZE_BEFORE, REPACK_SIZE_AFTER)
+from numpy.testing import assert_array_equal
+
+
+class RepackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'test.h5')
+        self.db = File(self.filename, 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_reclaim_space(self):
+        data = np.random.random((200, 300))
+        self.db.create_dataset(name='keep', data=data, chunks=(10, 300))
+        self.db['keep'].attrs['units'] = 'm'
+        self.db.create_group('grp/sub')
+        self.db.create_dataset(name='big', data=np.zeros((1000, 1000)),
+                               chunks=(100, 100))
+        self.db.create_dataset(name='small', data=np.ones(10))
+        del self.db['big']
+
+        result = repack(self.filename)
+        self.assertLess(result[REPACK_SIZE_AFTER],
+                        result[REPACK_SIZE_BEFORE] / 2)
+        self.assertEqual(os.path.getsize(self.filename),
+                         result[REPACK_SIZE_AFTER])
+        self.assertFalse(os.path.exists(self.filename + REPACK_SUFFIX))
+        self.assertFalse(os.path.exists(journal_path(self.filename)))
+        with h5py.File(self.filename, 'r') as f:
+            assert_array_equal(f['keep'][()], data)
+            self.assertEqual(f['keep'].chunks, (10, 300))
+            self.assertEqual(f['keep'].attrs['units'], 'm')
+            self.assertIn('grp/sub', f)
+            self.assertNotIn('big', f)
+
+    def test_rechunk_with_concurrent_writes(self):
+        data = np.arange(400 * 50, dtype='int64').reshape(400, 50)
+        ds = self.db.create_dataset(name='ds', data=data, chunks=(400, 1),
+                                    maxshape=(None, 50))
+        self.db.create_dataset(name='other', data=np.ones(10))
+
+        writes = []
+
+        def progress(phase, done, total):
+            # simulate writes of other clients while the file is copied
+            if phase == PHASE_COPY and not writes:
+                ds[0:2] = -1
+                ds.append(np.full((3, 50), -2))
+                self.db['ds'].attrs['written'] = 1
+                self.db.create_dataset(name='new', data=np.arange(5))
+                del self.db['other']
+                writes.append(True)
+
+        repack(self.filename, '/ds', {'chunks': (8, 50),
+                                      'compression': 'gzip'},
+               progress=progress)
+
+        data[0:2] = -1
+        data = np.concatenate([data, np.full((3, 50), -2)])
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['ds'].chunks, (8, 50))
+            self.assertEqual(f['ds'].compression, 'gzip')
+            self.assertEqual(f['ds'].maxshape, (None, 50))
+            self.assertEqual(f['ds'].attrs['written'], 1)
+            assert_array_equal(f['new'][()], np.arange(5))
+            self.assertNotIn('other', f)
+        assert_array_equal(self.db['ds'][()], data)
+        self.assertEqual(self.db['ds'].shape, data.shape)
+
+    def test_errors(self):
+        self.db.create_group('grp')
+        self.assertRaises(KeyError, repack, self.filename, '/missing')
+        self.assertRaises(TypeError, repack, self.filename, '/grp')
+        self.assertRaises(ValueError, repack, self.filename, None,
+                          {'chunks': (1, 1)})
+
+        def progress(phase, done, total):
+            os.remove(self.filename)
+
+        self.db.create_dataset(name='ds', data=np.ones(10))
+        self.assertRaises(OSError, repack, self.filename, progress=progress)
+        self.assertFalse(os.path.exists(self.filename + REPACK_SUFFIX))
+        self.assertFalse(os.path.exists(journal_path(self.filename)))
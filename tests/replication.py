@@ -0,0 +1,248 @@
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import h5py
+import numpy as np
+from hurray.client import Client, HurrayError
+from hurray.protocol import (CMD_KW_DB, CMD_KW_OVERWRITE, CMD_KW_PATH,
+                             CMD_KW_KEY, CMD_KW_SHAPE, CMD_KW_DTYPE,
+                             CMD_KW_MAXSHAPE, CMD_KW_MIN_SEQ,
+                             CMD_KW_RECURSIVE, CMD_KW_DB_RENAMETO,
+                             CMD_CREATE_DATABASE,
+                             CMD_CREATE_DATASET, CMD_BROADCAST_DATASET,
+                             CMD_APPEND_DATASET, CMD_SLICE_DATASET,
+                             CMD_CREATE_GROUP, CMD_RENAME_DATABASE,
+                             CMD_LIST_DATABASES, CMD_SERVER_INFO,
+                             RESPONSE_REPLICATION)
+from hurray.status_codes import READ_ONLY, REPLICA_LAG
+from hurray.swmr import journal
+from hurray.swmr.changelog import ChangeLog, REPLICA_PRIMARY
+from hurray.swmr.replication import (changes, apply, snapshot,
+                                     ITEM_DEFERRED)
+from numpy.testing import assert_array_equal
+
+from .proxy import free_port
+
+
+class ChangeLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_since(self):
+        log = ChangeLog()
+        self.assertIsNone(log.append('a.h5', journal.NODE, '/x'))
+        log.configure(3)
+        epoch, seq = log.state()
+        self.assertEqual(seq, 0)
+        self.assertEqual(log.since(epoch, 0), [])
+        for i in range(5):
+            self.assertEqual(log.append('a.h5', journal.NODE, '/%d' % i),
+                             i + 1)
+        self.assertEqual([entry[0] for entry in log.since(epoch, 2)],
+                         [3, 4, 5])
+        self.assertEqual([entry[3] for entry in log.since(epoch, 3, 1)],
+                         ['/3'])
+        # expired or from another epoch
+        self.assertIsNone(log.since(epoch, 1))
+        self.assertIsNone(log.since('x', 4))
+
+    def test_changes(self):
+        src = os.path.join(self.test_dir, 'a.h5')
+        dst = os.path.join(self.test_dir, 'b.h5')
+        with h5py.File(src, 'w') as f:
+            f.create_dataset('g/x', data=np.arange(10), maxshape=(None,))
+            f['g'].attrs['a'] = 1
+            f['link'] = h5py.SoftLink('/g/x')
+        # a missing file has to be copied
+        image, items = changes(src, [(journal.DATA, '/g/x', slice(0, 2))])
+        self.assertEqual(apply(dst, image, items), ['/'])
+        self.assertEqual(apply(dst, *changes(src, [(journal.TREE, '/',
+                                                    None)])), [])
+
+        with h5py.File(src, 'a') as f:
+            x = f['g/x']
+            x.resize((12,))
+            x[8:12] = 7
+            f['g'].attrs['b'] = 2
+            del f['link']
+            f.create_group('h')
+        entries = [(journal.DATA, '/g/x', slice(8, 12)),
+                   (journal.ATTRS, '/g', None),
+                   (journal.NODE, '/link', None),
+                   (journal.NODE, '/h', None),
+                   (journal.DATA, '/g/x', slice(8, 12))]
+        self.assertEqual(apply(dst, *changes(src, entries)), [])
+        with h5py.File(dst, 'r') as f:
+            assert_array_equal(f['g/x'][()],
+                               [0, 1, 2, 3, 4, 5, 6, 7, 7, 7, 7, 7])
+            self.assertEqual(dict(f['g'].attrs), {'a': 1, 'b': 2})
+            self.assertNotIn('link', f)
+            self.assertIn('h', f)
+
+        # a node the replica does not have
+        with h5py.File(dst, 'a') as f:
+            del f['g/x']
+        self.assertEqual(apply(dst, *changes(src, entries[:1])), ['/g/x'])
+
+        os.remove(src)
+        self.assertEqual(apply(dst, *changes(src, entries)), [])
+        self.assertFalse(os.path.exists(dst))
+
+
+    def test_snapshot(self):
+        src = os.path.join(self.test_dir, 'a.h5')
+        dst = os.path.join(self.test_dir, 'b.h5')
+        with h5py.File(src, 'w') as f:
+            f.create_dataset('small', data=np.arange(4))
+            f.create_dataset('g/large', data=np.arange(100.).reshape(50, 2),
+                             chunks=(8, 2), maxshape=(None, 2))
+            f['g/large'].attrs['a'] = 1
+            f.create_dataset('g/scalar', data=1.5)
+        # datasets are copied until their values exceed the block size
+        image, items = snapshot(src, block_size=200)
+        item, = items
+        self.assertEqual(item[ITEM_DEFERRED], [('/g/large', 0, 50, 12)])
+        self.assertEqual(apply(dst, image, items), [])
+        with h5py.File(dst, 'r') as f:
+            assert_array_equal(f['small'][()], np.arange(4))
+            self.assertEqual(f['g/scalar'][()], 1.5)
+            self.assertEqual(f['g/large'].shape, (50, 2))
+            self.assertEqual(f['g/large'].attrs['a'], 1)
+            self.assertEqual(f['g/large'].id.get_num_chunks(), 0)
+
+        # the replica copies the remaining datasets in regions
+        for start in range(0, 50, 12):
+            self.assertEqual(apply(dst, *snapshot(
+                src, '/g/large', slice(start, min(start + 12, 50)))), [])
+        with h5py.File(dst, 'r') as f:
+            assert_array_equal(f['g/large'][()],
+                               np.arange(100.).reshape(50, 2))
+
+        image, items = snapshot(src, '/g')
+        self.assertEqual(items[0][ITEM_DEFERRED], [])
+
+        # large regions of changes are copied in regions, too
+        with h5py.File(src, 'a') as f:
+            f['g/large'][10:40] = -1
+            f['small'][:] = -1
+        entries = [(journal.DATA, '/g/large', slice(10, 40)),
+                   (journal.DATA, '/small', slice(None))]
+        image, items = changes(src, entries, block_size=200)
+        self.assertEqual(items[0][ITEM_DEFERRED], [('/g/large', 10, 40, 12)])
+        self.assertNotIn(ITEM_DEFERRED, items[1])
+        self.assertEqual(apply(dst, image, items), [])
+        for start in range(10, 40, 12):
+            self.assertEqual(apply(dst, *snapshot(
+                src, '/g/large', slice(start, min(start + 12, 40)))), [])
+        with h5py.File(src, 'r') as f, h5py.File(dst, 'r') as g:
+            assert_array_equal(g['g/large'][()], f['g/large'][()])
+            assert_array_equal(g['small'][()], [-1] * 4)
+
+
+class ReplicationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dirs = []
+        self.servers = []
+        self.primary = self.start_server('--changelog=1000')
+        self.replica = self.start_server('--primary=' + self.primary)
+
+    def start_server(self, *args):
+        base = tempfile.mkdtemp()
+        port = free_port()
+        self.test_dirs.append(base)
+        self.servers.append(subprocess.Popen(
+            [sys.executable, '-m', 'hurray', '--base=' + base,
+             '--port=%d' % port, '--processes=1', '--pyramid_interval=0',
+             '--replica_wait=2', '--logging=warning'] + list(args),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True))
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                return '127.0.0.1:%d' % port
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def tearDown(self):
+        for server in self.servers:
+            if server.poll() is None:
+                server.send_signal(signal.SIGTERM)
+                server.wait(30)
+            # the lock manager, the workers and the replicator
+            try:
+                os.killpg(server.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for test_dir in self.test_dirs:
+            shutil.rmtree(test_dir)
+
+    def connect(self, address):
+        return Client('127.0.0.1', int(address.split(':')[1]))
+
+    def test_replication(self):
+        with self.connect(self.primary) as primary, \
+                self.connect(self.replica) as replica:
+            self.assertIsNone(primary.last_seq)
+            primary.call(CMD_CREATE_DATABASE,
+                         {CMD_KW_DB: 'a.h5', CMD_KW_OVERWRITE: False})
+            primary.call(CMD_CREATE_DATASET, {
+                CMD_KW_DB: 'a.h5', CMD_KW_PATH: '/x', CMD_KW_SHAPE: (4,),
+                CMD_KW_DTYPE: 'int32', CMD_KW_MAXSHAPE: (None,)})
+            primary.call(CMD_BROADCAST_DATASET, {
+                CMD_KW_DB: 'a.h5', CMD_KW_PATH: '/x',
+                CMD_KW_KEY: slice(1, 3)}, data=np.array([1, 2]))
+            primary.call(CMD_APPEND_DATASET, {
+                CMD_KW_DB: 'a.h5', CMD_KW_PATH: '/x'},
+                data=np.array([3, 4], dtype=np.int32))
+            seq = primary.last_seq
+            self.assertGreater(seq, 0)
+
+            # read your writes
+            result = replica.call(CMD_SLICE_DATASET, {
+                CMD_KW_DB: 'a.h5', CMD_KW_PATH: '/x', CMD_KW_KEY: slice(None),
+                CMD_KW_MIN_SEQ: seq})
+            assert_array_equal(result, [0, 1, 2, 0, 3, 4])
+
+            primary.call(CMD_CREATE_DATABASE,
+                         {CMD_KW_DB: 'sub/b.h5', CMD_KW_OVERWRITE: False})
+            primary.call(CMD_RENAME_DATABASE,
+                         {CMD_KW_DB: 'a.h5', CMD_KW_DB_RENAMETO: 'c.h5'})
+            result = replica.call(CMD_SLICE_DATASET, {
+                CMD_KW_DB: 'c.h5', CMD_KW_PATH: '/x', CMD_KW_KEY: slice(4, 6),
+                CMD_KW_MIN_SEQ: primary.last_seq})
+            assert_array_equal(result, [3, 4])
+            self.assertEqual(
+                sorted(replica.call(CMD_LIST_DATABASES,
+                                    {CMD_KW_RECURSIVE: True})),
+                ['c.h5', 'sub/b.h5'])
+
+            # replicas are read-only
+            with self.assertRaises(HurrayError) as cm:
+                replica.call(CMD_CREATE_GROUP,
+                             {CMD_KW_DB: 'c.h5', CMD_KW_PATH: '/g'})
+            self.assertEqual(cm.exception.status, READ_ONLY)
+
+            with self.assertRaises(HurrayError) as cm:
+                replica.call(CMD_SLICE_DATASET, {
+                    CMD_KW_DB: 'c.h5', CMD_KW_PATH: '/x',
+                    CMD_KW_KEY: slice(None),
+                    CMD_KW_MIN_SEQ: primary.last_seq + 1})
+            self.assertEqual(cm.exception.status, REPLICA_LAG)
+
+            info = replica.call(CMD_SERVER_INFO)[RESPONSE_REPLICATION]
+            self.assertEqual(info[REPLICA_PRIMARY], self.primary)
+            self.assertIsNone(
+                primary.call(CMD_SERVER_INFO)[RESPONSE_REPLICATION])
@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import msgpack
+import numpy as np
+from hurray import trace
+from hurray.msgpack_ext import decode
+from hurray.protocol import (CMD_CREATE_DATABASE, CMD_CREATE_DATASET,
+                             CMD_SLICE_DATASET, CMD_KW_CMD, CMD_KW_ARGS,
+                             CMD_KW_DATA, CMD_KW_STATUS, CMD_KW_TRACE,
+                             RESPONSE_DATA, RESPONSE_TRACE)
+from hurray.request_handler import handle_request
+from hurray.server.options import options
+from hurray.status_codes import CREATED, OK
+from numpy.testing import assert_array_equal
+
+
+def unpack(data):
+    return msgpack.unpackb(data, object_hook=decode, use_list=False,
+                           encoding='utf-8')
+
+
+class TraceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        options.base = self.test_dir
+        self.trace_file = os.path.join(self.test_dir, 'trace.log')
+
+    def tearDown(self):
+        options.slow_request = 0.0
+        for handler in list(trace.trace_log.handlers):
+            trace.trace_log.removeHandler(handler)
+            handler.close()
+        options.trace_file = None
+        shutil.rmtree(self.test_dir)
+
+    def request(self, cmd, data=None, **args):
+        msg = {CMD_KW_CMD: cmd, CMD_KW_ARGS: args}
+        if data is not None:
+            msg[CMD_KW_DATA] = data
+        return msg
+
+    def create(self):
+        msg = self.request(CMD_CREATE_DATABASE, db='test.h5',
+                           overwrite=False)
+        self.assertEqual(unpack(handle_request(msg))[CMD_KW_STATUS], CREATED)
+        msg = self.request(CMD_CREATE_DATASET, np.arange(10), db='test.h5',
+                           path='/ds')
+        self.assertEqual(unpack(handle_request(msg))[CMD_KW_STATUS], OK)
+
+    def test_handler(self):
+        self.create()
+        # untraced responses do not contain a trace
+        msg = self.request(CMD_SLICE_DATASET, db='test.h5', path='/ds',
+                           key=slice(2, 5))
+        self.assertNotIn(RESPONSE_TRACE, unpack(handle_request(msg)))
+        self.assertFalse(trace.active())
+
+        msg[CMD_KW_ARGS][CMD_KW_TRACE] = True
+        resp = unpack(handle_request(msg))
+        self.assertEqual(resp[CMD_KW_STATUS], OK)
+        assert_array_equal(resp[RESPONSE_DATA], np.arange(2, 5))
+        self.assertFalse(trace.active())
+        events = resp[RESPONSE_TRACE]
+        names = [event[0] for event in events]
+        for phase in (trace.LOCK_WAIT, trace.OPEN, trace.LOCKED,
+                      trace.ENCODE):
+            self.assertIn(phase, names)
+        self.assertEqual(names[-1], trace.ENCODE)
+        for _, start, end in events:
+            self.assertLessEqual(start, end)
+
+        # events of the server process are continued by the worker
+        received = time.monotonic()
+        trace.begin(msg, received, received + 0.001, received + 0.002)
+        resp = handle_request(msg)
+        events = trace.merge(resp, [], received + 1)
+        self.assertEqual([event[0] for event in events[:3]],
+                         [trace.READ, trace.DECODE, trace.QUEUE])
+        self.assertEqual(events[2][1], received + 0.002)
+        self.assertEqual(events[-1], (trace.RESULT, events[-2][2],
+                                      received + 1))
+
+    def test_merge(self):
+        events = [(trace.READ, 0., 1.)]
+        # responses without a trace (e.g., answered by the server process)
+        resp = msgpack.packb({CMD_KW_STATUS: OK})
+        self.assertEqual(trace.merge(resp, events, 2.), events)
+        resp = msgpack.packb({CMD_KW_STATUS: OK,
+                              RESPONSE_DATA: {RESPONSE_TRACE: 1}},
+                             use_bin_type=True)
+        self.assertEqual(trace.merge(resp, events, 2.), events)
+
+        # only the trace is unpacked (the key may occur in the data)
+        worker = [(trace.READ, 0., 1.), (trace.ENCODE, 1., 1.5)]
+        data = msgpack.packb(RESPONSE_TRACE, use_bin_type=True) * 1000
+        packed = msgpack.packb({CMD_KW_STATUS: OK, RESPONSE_DATA: data},
+                               use_bin_type=True)
+        resp = b''.join((bytes([packed[0] + 1]), packed[1:],
+                         msgpack.packb(RESPONSE_TRACE, use_bin_type=True),
+                         msgpack.packb(worker, use_bin_type=True)))
+        self.assertEqual(trace.merge(resp, events, 2.),
+                         worker + [(trace.RESULT, 1.5, 2.)])
+
+    def test_phases(self):
+        events = [(trace.READ, 0., 1.), (trace.LOCK_WAIT, 1., 1.5),
+                  (trace.LOCKED, 1.5, 4.), (trace.OPEN, 1.5, 2.),
+                  (trace.LOCK_WAIT, 4., 4.5)]
+        phases = trace.phases(events)
+        self.assertEqual(phases[trace.READ], 1.)
+        self.assertEqual(phases[trace.LOCK_WAIT], 1.)
+        self.assertEqual(phases[trace.IO], 2.)
+
+    def test_finish(self):
+        options.trace_file = self.trace_file
+        trace.configure()
+        msg = self.request(CMD_SLICE_DATASET, db='test.h5', path='/ds',
+                           key=slice(2, 5))
+        received = time.monotonic()
+        events = [(trace.READ, received, received + 0.001)]
+        trace.finish(msg, received, events, received + 0.001)
+        # untraced requests that are not slow are not logged
+        trace.finish(msg, received)
+        with open(self.trace_file) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record['cmd'], CMD_SLICE_DATASET)
+        self.assertEqual(record['db'], 'test.h5')
+        self.assertEqual([event[0] for event in record['events']],
+                         [trace.READ, trace.WRITE])
+
+        options.slow_request = 0.01
+        with self.assertLogs('hurray.application', 'WARNING') as logs:
+            trace.finish(msg, received - 1)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Slow request %s' % CMD_SLICE_DATASET, logs.output[0])
+        self.assertIn('/ds', logs.output[0])
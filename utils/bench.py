@@ -0,0 +1,614 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Benchmark suite of the server (runs locally, no network needed).
+
+Suites:
+
+  msgpack   msgpack_ext.encode/decode of arrays of several dtypes and sizes
+  handler   handle_request per command on a temporary base directory
+  locks     both locking strategies with reader and writer processes
+            contending for the same file
+  e2e       throughput of a server over a Unix socket and TCP loopback
+
+Each benchmark reports one or more values, e.g., seconds per call
+(best of several repeats) or requests per second. The results are
+printed and can be written to a JSON file (--json). They are compared
+with a baseline (--baseline, by default bench_baseline.json next to this
+script) and values that are worse than the baseline by more than the
+tolerance (--tolerance, a fraction; --short-tolerance for timings below
+100 us) are flagged as regressions (exit status 1). Timings are compared
+with the worst repeat of the baseline, i.e., a timing is only flagged if
+its best repeat is slower than all repeats of the baseline by more than
+the tolerance. --save writes the results as new baseline.
+
+Baselines only compare runs on the same (otherwise idle) machine, so they
+are not part of the repository: record one on your machine before
+changing the code. The tolerance must exceed the noise of the machine
+(compare two runs of the unchanged tree):
+
+  python utils/bench.py --save            # on the unchanged tree
+  python utils/bench.py --json new.json   # after the change
+
+Usage: python bench.py [--suites ...] [--quick] [--json file]
+                       [--baseline file] [--save] [--tolerance fraction]
+                       [--short-tolerance fraction]
+"""
+
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import h5py
+import msgpack
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hurray.msgpack_ext import decode, encode  # noqa: E402
+from hurray.protocol import (CMD_CREATE_DATABASE, CMD_CREATE_GROUP,  # noqa
+                             CMD_CREATE_DATASET, CMD_GET_NODE, CMD_CONTAINS,
+                             CMD_GET_KEYS, CMD_GET_TREE, CMD_GET_FILESIZE,
+                             CMD_LIST_DATABASES, CMD_SLICE_DATASET,
+                             CMD_BROADCAST_DATASET, CMD_ATTRIBUTES_SET,
+                             CMD_ATTRIBUTES_GET, CMD_SERVER_INFO, CMD_KW_CMD,
+                             CMD_KW_ARGS, CMD_KW_DATA, CMD_KW_DB,
+                             CMD_KW_OVERWRITE, CMD_KW_PATH, CMD_KW_KEY,
+                             CMD_KW_STATUS, PROTOCOL_VER)
+from hurray.swmr.strategies import (LOCK_STRATEGY_WRITER_PREFERENCE,  # noqa
+                                    LOCK_STRATEGY_NO_STARVE)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SUITES = ('msgpack', 'handler', 'locks', 'e2e')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'bench_baseline.json')
+TOLERANCE = 0.25
+# timings shorter than SHORT_TIME are noisier (timer resolution, cache and
+# scheduler effects) and are compared with SHORT_TOLERANCE instead
+SHORT_TIME = 100e-6
+SHORT_TOLERANCE = 0.6
+
+DTYPES = ('bool', 'int8', 'int32', 'int64', 'float32', 'float64')
+SIZES = (16, 16384, 1048576)  # elements
+QUICK_SIZES = (16, 16384)
+DB = 'bench.h5'
+ROWS = 1024  # rows of the large dataset (of COLUMNS float64 values)
+COLUMNS = 128
+
+
+class Config(object):
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.repeat = 7 if quick else 9
+        self.min_time = 0.05 if quick else 0.2  # per repeat
+        self.duration = 1.0 if quick else 3.0  # of contention/throughput
+        self.processes = 4  # lock contention and e2e clients
+
+
+def result(value, unit, higher=False, worst=None):
+    """
+    Returns:
+        a benchmark value (``higher``: higher values are better; ``worst``:
+        the worst of several repeats of the measurement)
+    """
+    res = {'value': value, 'unit': unit, 'higher': higher}
+    if worst is not None:
+        res['worst'] = worst
+    return res
+
+
+def measure(fn, config):
+    """
+    Time ``fn()`` with the garbage collector disabled (like timeit.autorange:
+    calls are repeated until a repeat takes config.min_time)
+
+    Returns:
+        seconds per call (the minimum of config.repeat repeats, the least
+        disturbed by other processes, and the maximum as worst value)
+    """
+    fn()  # warm up
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = _repeat(fn, config)
+        return result(min(times), 's', worst=max(times))
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _repeat(fn, config):
+    """
+    Returns:
+        list of the seconds per call of config.repeat repeats
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= config.min_time:
+            break
+        loops *= 2 if elapsed <= 0 else \
+            max(2, min(10, int(config.min_time / elapsed) + 1))
+    times = [elapsed / loops]
+    for _ in range(config.repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    return times
+
+
+# msgpack
+
+def bench_msgpack(config):
+    results = {}
+    for dtype in DTYPES:
+        for size in QUICK_SIZES if config.quick else SIZES:
+            arr = (np.random.random(size) * 100).astype(dtype)
+            packed = msgpack.packb(arr, default=encode, use_bin_type=True)
+            name = 'msgpack.{}.{}'.format(dtype, size)
+            results[name + '.encode'] = measure(
+                lambda: msgpack.packb(arr, default=encode, use_bin_type=True),
+                config)
+            results[name + '.decode'] = measure(
+                lambda: msgpack.unpackb(packed, object_hook=decode,
+                                        use_list=False, raw=False),
+                config)
+    return results
+
+
+# handle_request
+
+def handler_requests():
+    """
+    Returns:
+        dict {name: request} of the benchmarked requests
+    """
+    large = (slice(0, ROWS),)
+    return {
+        CMD_GET_NODE: (CMD_GET_NODE, {CMD_KW_PATH: '/large'}, None),
+        CMD_CONTAINS: (CMD_CONTAINS, {CMD_KW_PATH: '/', CMD_KW_KEY: 'large'},
+                       None),
+        CMD_GET_KEYS: (CMD_GET_KEYS, {CMD_KW_PATH: '/group'}, None),
+        CMD_GET_TREE: (CMD_GET_TREE, {CMD_KW_PATH: '/'}, None),
+        CMD_GET_FILESIZE: (CMD_GET_FILESIZE, {}, None),
+        CMD_LIST_DATABASES: (CMD_LIST_DATABASES, {}, None),
+        CMD_ATTRIBUTES_GET: (CMD_ATTRIBUTES_GET,
+                             {CMD_KW_PATH: '/large', CMD_KW_KEY: 'units'},
+                             None),
+        CMD_SLICE_DATASET + '.small': (
+            CMD_SLICE_DATASET, {CMD_KW_PATH: '/small',
+                                CMD_KW_KEY: (slice(0, 16),)}, None),
+        CMD_SLICE_DATASET + '.large': (
+            CMD_SLICE_DATASET, {CMD_KW_PATH: '/large', CMD_KW_KEY: large},
+            None),
+        CMD_BROADCAST_DATASET + '.small': (
+            CMD_BROADCAST_DATASET, {CMD_KW_PATH: '/small',
+                                    CMD_KW_KEY: (slice(0, 16),)},
+            np.arange(16.)),
+        CMD_BROADCAST_DATASET + '.large': (
+            CMD_BROADCAST_DATASET, {CMD_KW_PATH: '/large', CMD_KW_KEY: large},
+            np.random.random((ROWS, COLUMNS))),
+    }
+
+
+def message(cmd, args, data=None):
+    args = dict(args)
+    if cmd != CMD_LIST_DATABASES:
+        args.setdefault(CMD_KW_DB, DB)
+    return {CMD_KW_CMD: cmd, CMD_KW_ARGS: args, CMD_KW_DATA: data}
+
+
+def bench_handler(config):
+    from hurray.request_handler import handle_request
+    from hurray.server.options import options
+
+    def call(msg):
+        resp = msgpack.unpackb(handle_request(msg), raw=False)
+        if resp[CMD_KW_STATUS] >= 200:
+            raise RuntimeError('{} failed with status {}'.format(
+                msg[CMD_KW_CMD], resp[CMD_KW_STATUS]))
+
+    base = tempfile.mkdtemp()
+    options.base = base
+    try:
+        call(message(CMD_CREATE_DATABASE, {CMD_KW_OVERWRITE: True}))
+        call(message(CMD_CREATE_GROUP, {CMD_KW_PATH: '/group'}))
+        for i in range(10):
+            call(message(CMD_CREATE_GROUP,
+                         {CMD_KW_PATH: '/group/{}'.format(i)}))
+        call(message(CMD_CREATE_DATASET, {CMD_KW_PATH: '/small'},
+                     np.arange(1024.)))
+        call(message(CMD_CREATE_DATASET, {CMD_KW_PATH: '/large'},
+                     np.random.random((ROWS, COLUMNS))))
+        call(message(CMD_ATTRIBUTES_SET,
+                     {CMD_KW_PATH: '/large', CMD_KW_KEY: 'units'}, 'mm'))
+        results = {}
+        for name, (cmd, args, data) in sorted(handler_requests().items()):
+            msg = message(cmd, args, data)
+            results['handler.' + name] = measure(lambda: call(msg), config)
+        return results
+    finally:
+        shutil.rmtree(base)
+
+
+# locks
+
+def lock_client(strategy, write, hold, start, duration, results):
+    """
+    Acquire and release a lock (holding it for ``hold`` seconds) until the
+    end of the run
+
+    Puts the lock waits (seconds) on ``results``
+    """
+    from hurray.swmr.lock import SWMR_SYNC
+
+    acquire = SWMR_SYNC.start_write if write else SWMR_SYNC.start_read
+    release = SWMR_SYNC.end_write if write else SWMR_SYNC.end_read
+    waits = []
+    try:
+        while time.time() < start:
+            time.sleep(0.001)
+        end = start + duration
+        while time.time() < end:
+            t0 = time.perf_counter()
+            acquire(DB)
+            waits.append(time.perf_counter() - t0)
+            try:
+                # busy (hold the lock like a short hdf5 operation)
+                deadline = time.perf_counter() + hold
+                while time.perf_counter() < deadline:
+                    pass
+            finally:
+                release(DB)
+        results.put((write, waits))
+    except Exception as e:
+        results.put(e)
+
+
+def bench_locks(config):
+    from hurray.swmr.lock import SWMR_SYNC
+
+    results = {}
+    writers = max(1, config.processes // 4)
+    readers = max(1, config.processes - writers)
+    for strategy, label in ((LOCK_STRATEGY_WRITER_PREFERENCE, 'writer'),
+                            (LOCK_STRATEGY_NO_STARVE, 'no_starve')):
+        SWMR_SYNC.set_strategy(strategy)
+        queue = multiprocessing.Queue()
+        start = time.time() + 0.5
+        procs = [multiprocessing.Process(
+            target=lock_client,
+            args=(strategy, i < writers, 0.0002, start, config.duration,
+                  queue))
+            for i in range(readers + writers)]
+        for proc in procs:
+            proc.start()
+        outcomes = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        waits = {False: [], True: []}
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                raise outcome
+            waits[outcome[0]].extend(outcome[1])
+        name = 'locks.{}.{}r{}w'.format(label, readers, writers)
+        total = len(waits[False]) + len(waits[True])
+        results[name + '.ops'] = result(total / config.duration, 'op/s',
+                                        higher=True)
+        for write, kind in ((False, 'read'), (True, 'write')):
+            if waits[write]:
+                for q in (50, 99):
+                    results['{}.{}_wait.p{}'.format(name, kind, q)] = result(
+                        float(np.percentile(waits[write], q)), 's')
+    SWMR_SYNC.set_strategy(LOCK_STRATEGY_WRITER_PREFERENCE)
+    return results
+
+
+# end-to-end
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if not n:
+            raise EOFError('connection closed')
+        pos += n
+    return buf
+
+
+def connect(address):
+    """
+    Args:
+        address: (host, port) or path of a Unix socket
+    """
+    for _ in range(100):
+        try:
+            if isinstance(address, str):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(address)
+            else:
+                sock = socket.create_connection(address)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except (ConnectionRefusedError, FileNotFoundError):
+            time.sleep(0.1)
+    raise RuntimeError('server at {} did not start'.format(address))
+
+
+def remote(sock, cmd, args, data=None):
+    msg = msgpack.packb(message(cmd, args, data), default=encode,
+                        use_bin_type=True)
+    sock.sendall(struct.pack('>II', PROTOCOL_VER, len(msg)) + msg)
+    _, length = struct.unpack('>II', recv_exactly(sock, 8))
+    resp = msgpack.unpackb(recv_exactly(sock, length), object_hook=decode,
+                           use_list=False, raw=False)
+    if resp[CMD_KW_STATUS] >= 200:
+        raise RuntimeError('{} failed with status {}'.format(
+            cmd, resp[CMD_KW_STATUS]))
+    return resp
+
+
+def e2e_requests():
+    requests = handler_requests()
+    return {
+        'info': (CMD_SERVER_INFO, {}, None),
+        'contains': requests[CMD_CONTAINS],
+        'read': requests[CMD_SLICE_DATASET + '.large'],
+        'write': requests[CMD_BROADCAST_DATASET + '.large'],
+    }
+
+
+def e2e_client(address, workload, start, duration, results):
+    try:
+        sock = connect(address)
+        cmd, args, data = e2e_requests()[workload]
+        while time.time() < start:
+            time.sleep(0.001)
+        count = 0
+        end = start + duration
+        while time.time() < end:
+            remote(sock, cmd, args, data)
+            count += 1
+        sock.close()
+        results.put(count)
+    except Exception as e:
+        results.put(e)
+
+
+def bench_e2e(config):
+    base = tempfile.mkdtemp()
+    port = free_port()
+    unix_socket = os.path.join(base, 'hurray.sock')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'hurray', '--base=' + base,
+         '--port={}'.format(port), '--socket=' + unix_socket,
+         '--processes=1', '--workers=2', '--pyramid_interval=0',
+         '--logging=warning'], cwd=ROOT, start_new_session=True)
+    try:
+        sock = connect(('127.0.0.1', port))
+        remote(sock, CMD_CREATE_DATABASE, {CMD_KW_OVERWRITE: True})
+        remote(sock, CMD_CREATE_DATASET, {CMD_KW_PATH: '/large'},
+               np.random.random((ROWS, COLUMNS)))
+        sock.close()
+        results = {}
+        for transport, address in (('unix', unix_socket),
+                                   ('tcp', ('127.0.0.1', port))):
+            for workload in sorted(e2e_requests()):
+                queue = multiprocessing.Queue()
+                start = time.time() + 0.5
+                procs = [multiprocessing.Process(
+                    target=e2e_client,
+                    args=(address, workload, start, config.duration, queue))
+                    for _ in range(config.processes)]
+                for proc in procs:
+                    proc.start()
+                counts = [queue.get() for _ in procs]
+                for proc in procs:
+                    proc.join()
+                for count in counts:
+                    if isinstance(count, Exception):
+                        raise count
+                results['e2e.{}.{}'.format(transport, workload)] = result(
+                    sum(counts) / config.duration, 'req/s', higher=True)
+        return results
+    finally:
+        stop_server(server)
+        shutil.rmtree(base)
+
+
+def stop_server(server):
+    """
+    Stop a server started in a session of its own and the processes it
+    leaves behind (they would keep stdout open, e.g., of a pipe)
+    """
+    if server.poll() is None:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+    # the lock manager and the workers
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# results
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'h5py': h5py.__version__,
+        'msgpack': '.'.join(str(v) for v in msgpack.version),
+    }
+
+
+def compare(results, baseline, tolerance, short_tolerance=SHORT_TOLERANCE):
+    """
+    Returns:
+        list of (name, value, baseline value, change) of the values that
+        are worse than the worst repeat of the baseline (its value if it
+        was measured once) by more than ``tolerance`` (``short_tolerance``
+        for timings below SHORT_TIME; change: relative, positive = worse)
+    """
+    regressions = []
+    for name, res in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or not base['value'] or not res['value']:
+            continue
+        worst = base.get('worst', base['value'])
+        if res['higher']:
+            change = worst / res['value'] - 1
+        else:
+            change = res['value'] / worst - 1
+        short = res['unit'] == 's' and base['value'] < SHORT_TIME
+        if change > (max(tolerance, short_tolerance) if short else
+                     tolerance):
+            regressions.append((name, res['value'], worst, change))
+    return regressions
+
+
+def fmt(res):
+    if res['unit'] == 's':
+        return '{:12.3f} us'.format(res['value'] * 1e6)
+    return '{:12.1f} {}'.format(res['value'], res['unit'])
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark suite (compares the results with a baseline)')
+    parser.add_argument('--suites', nargs='+', choices=SUITES,
+                        default=SUITES)
+    parser.add_argument('--quick', action='store_true',
+                        help='Fewer sizes, repeats and shorter runs')
+    parser.add_argument('--json', metavar='file',
+                        help='Write the results to this file')
+    parser.add_argument('--baseline', metavar='file', default=BASELINE,
+                        help='Compare the results with this file '
+                             '(default: %(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='Write the results to the baseline file')
+    parser.add_argument('--tolerance', metavar='fraction', type=float,
+                        default=TOLERANCE,
+                        help='Flag values worse than the baseline by more '
+                             'than this fraction (default: %(default)s)')
+    parser.add_argument('--short-tolerance', metavar='fraction', type=float,
+                        default=SHORT_TOLERANCE,
+                        help='Tolerance of timings below {:g} us (default: '
+                             '%(default)s)'.format(SHORT_TIME * 1e6))
+    args = parser.parse_args()
+
+    config = Config(args.quick)
+    benches = {'msgpack': bench_msgpack, 'handler': bench_handler,
+               'locks': bench_locks, 'e2e': bench_e2e}
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        env = environment()
+        for key in ('platform', 'cpus', 'python'):
+            if stored['environment'].get(key) != env[key]:
+                print('Warning: the baseline was recorded with {} {} '
+                      '(now {})'.format(key, stored['environment'].get(key),
+                                        env[key]))
+    elif not args.save:
+        print('No baseline {} (record one with --save)'.format(args.baseline))
+
+    results = {}
+    for suite in SUITES:
+        if suite not in args.suites:
+            continue
+        for name, res in sorted(benches[suite](config).items()):
+            results[name] = res
+            base = baseline.get(name)
+            print('{:50s} {}{}'.format(
+                name, fmt(res), '' if base is None else ' ({:+.1%})'.format(
+                    res['value'] / base['value'] - 1 if base['value']
+                    else 0.)), flush=True)
+
+    output = {'environment': environment(), 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.save:
+        if os.path.exists(args.baseline):
+            # keep the values of suites that were not run
+            with open(args.baseline) as f:
+                stored = json.load(f)['results']
+            stored.update(results)
+            output['results'] = stored
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print('Saved the baseline to {}'.format(args.baseline))
+        return
+
+    regressions = compare(results, baseline, args.tolerance,
+                          args.short_tolerance)
+    for name, value, base, change in regressions:
+        print('REGRESSION {}: {:.4g} (baseline worst {:.4g}, {:+.1%} '
+              'worse)'.format(
+            name, value, base, change))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,31 +23,81 @@
 # ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
-import concurrent.futures
-import random
+"""
+Hurray server load generator.
+
+Requests are sent open-loop: every client process sends requests at the
+times of an arrival schedule (a constant rate or a Poisson process) no
+matter how long earlier requests take. A process has several connections
+(one outstanding request each). A request that is due while all
+connections of its process are busy waits for a free connection.
+
+Latencies are reported twice:
+
+  corrected    from the scheduled time of a request to its response.
+               This includes the time a request waited for a free
+               connection or for its client process (coordinated
+               omission correction).
+  service      from sending the request to its response
+
+Requests that are sent more than 1 ms after their scheduled time are
+counted as late; many late requests mean that the client processes or
+connections do not keep up with the rate. Requests without a response
+within --timeout seconds after the end are counted as incomplete. Only
+1xx responses are included in the latencies.
+
+Each request is drawn from the workload mix:
+
+- a file (--files databases); --skew concentrates requests on the first
+  files.
+- a kind: metadata (--metadata), write (--write, broadcast) or read
+  (slice).
+- a slice of --slice MIN MAX rows; --skew also concentrates the slices
+  on the first rows.
+
+--skew is the exponent s of a Zipf-like distribution (weight of the i-th
+file or row: 1 / i^s); 0 is uniform.
+
+Usage: python hb.py [options] hostname port
+Example: python hb.py -r 200 -d 30 -p 4 -c 8 --write 0.1 --files 4 \\
+             --skew 1.1 --json run.json --csv runs.csv --label v1 \\
+             localhost 2222
+"""
+
+import collections
+import csv
+import json
+import math
+import multiprocessing
+import os
+import selectors
 import socket
-import string
 import struct
 import time
 
 import msgpack
 import numpy as np
 
-from buffer import Buffer
-from proto import encode, decode, PROTOCOL_VER, CMD_KW_DB, CMD_KW_OVERWRITE, CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DATA, \
-    MSG_LEN, \
-    CMD_CREATE_DATABASE, CMD_KW_PATH, CMD_CREATE_DATASET, CMD_KW_KEY, CMD_SLICE_DATASET, CMD_KW_STATUS, \
-    CMD_BROADCAST_DATASET
+from proto import (encode, decode, PROTOCOL_VER, MSG_LEN, CMD_KW_DB,
+                   CMD_KW_OVERWRITE, CMD_KW_CMD, CMD_KW_ARGS, CMD_KW_DATA,
+                   CMD_KW_PATH, CMD_KW_KEY, CMD_KW_STATUS,
+                   CMD_CREATE_DATABASE, CMD_CREATE_DATASET, CMD_GET_NODE,
+                   CMD_CONTAINS, CMD_GET_KEYS, CMD_SLICE_DATASET,
+                   CMD_BROADCAST_DATASET)
 
-MAX_SHAPE_SIZE = 850
 DS_PATH = '/myds'
+FILE_NAME = 'hb-{}.h5'
 
-STATS = {'errors': 0, 'failed': 0, 'time': [], 'read': 0, 'write': 0, 'data': 0}
+READ, WRITE, METADATA = range(3)
+KINDS = ('read', 'write', 'metadata')
+METADATA_COMMANDS = (CMD_GET_NODE, CMD_CONTAINS, CMD_GET_KEYS)
 
+PERCENTILES = (50, 90, 99, 99.9)
+# histogram buckets: 4 per power of two from 1 us to ~100 s
+BUCKETS = 1e-6 * 2 ** (np.arange(108) / 4)
 
-def random_name(l):
-    return ''.join(random.SystemRandom().choice(string.ascii_lowercase)
-                   for _ in range(l))
+# columns of the records of the requests
+INTENDED, SENT, DONE, KIND, STATUS, SIZE = range(6)
 
 
 def sizeof_fmt(num, suffix='B'):
@@ -58,171 +108,527 @@ def sizeof_fmt(num, suffix='B'):
     return '%.1f %s%s' % (num, 'Y', suffix)
 
 
-def connect(host, port):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    s.connect((host, port))
-    v_print(1, 'Connected to %s:%d' % (host, port))
-    return Buffer(s)
+def connect(args):
+    if args.socket:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(args.socket)
+    else:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.connect((args.host, args.port))
+    return s
 
 
-def send_recv(buffer, cmd, arguments, data=None):
+def pack(cmd, arguments, data=None):
     msg = msgpack.packb({
         CMD_KW_CMD: cmd,
         CMD_KW_ARGS: arguments,
         CMD_KW_DATA: data
     }, default=encode, use_bin_type=True)
-
-    payload = struct.pack('>I', PROTOCOL_VER)
-    payload += struct.pack('>I', len(msg))
-    payload += msg
-    buffer.write(payload)
-    buffer.read_bytes(MSG_LEN)
-    msg_data = buffer.read_bytes(struct.unpack('>I', buffer.read_bytes(MSG_LEN))[0])
-    resp = msgpack.unpackb(msg_data, object_hook=decode, use_list=False, encoding='utf-8')
-    v_print(3, 'Response Status: %s' % resp[CMD_KW_STATUS])
+    return struct.pack('>II', PROTOCOL_VER, len(msg)) + msg
+
+
+def recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if not n:
+            raise EOFError('connection closed')
+        pos += n
+    return buf
+
+
+def send_recv(sock, cmd, arguments, data=None):
+    sock.sendall(pack(cmd, arguments, data))
+    _, length = struct.unpack('>II', recv_exactly(sock, 2 * MSG_LEN))
+    resp = msgpack.unpackb(recv_exactly(sock, length), object_hook=decode,
+                           use_list=False, raw=False)
+    if resp[CMD_KW_STATUS] >= 200:
+        raise RuntimeError('{} failed with status {}'.format(
+            cmd, resp[CMD_KW_STATUS]))
     return resp
 
 
-def create_file(buffer):
-    file_name = 'htest-' + random_name(5) + '.h5'
-    send_recv(buffer, CMD_CREATE_DATABASE, {
-        CMD_KW_DB: file_name,
-        CMD_KW_OVERWRITE: True,
-    })
-    v_print(3, 'Created file %s' % file_name)
-    return file_name
-
-
-def create_dataset(buffer, db, data):
-    send_recv(buffer, CMD_CREATE_DATASET, {
-        CMD_KW_PATH: DS_PATH,
-        CMD_KW_DB: db
-    }, data)
-    v_print(3, "Created dataset at '%s'" % DS_PATH)
+def initialize_files(args):
+    """
+    Create the files (each with a dataset of shape args.shape)
 
+    Returns:
+        list of the file names
+    """
+    sock = connect(args)
+    files = []
+    for i in range(args.files):
+        file_name = FILE_NAME.format(i)
+        send_recv(sock, CMD_CREATE_DATABASE, {
+            CMD_KW_DB: file_name,
+            CMD_KW_OVERWRITE: True,
+        })
+        send_recv(sock, CMD_CREATE_DATASET, {
+            CMD_KW_PATH: DS_PATH,
+            CMD_KW_DB: file_name
+        }, np.random.random(args.shape))
+        files.append(file_name)
+    sock.close()
+    return files
+
+
+def zipf_cdf(n, skew):
+    """
+    Returns:
+        cumulative distribution of n items with weights 1 / i^skew
+    """
+    weights = 1. / np.arange(1, n + 1) ** skew
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
 
-def slice_dataset(buffer, db, key):
-    resp = send_recv(buffer, CMD_SLICE_DATASET, {
-        CMD_KW_PATH: DS_PATH,
-        CMD_KW_DB: db,
-        CMD_KW_KEY: key
-    })
-    v_print(3, "Sliced dataset at '%s'" % DS_PATH)
-    return resp
 
+class Workload(object):
+    """
+    Draws the requests of the workload mix
+    """
 
-def broadcast_dataset(buffer, db, key, data):
-    resp = send_recv(buffer, CMD_BROADCAST_DATASET, {
-        CMD_KW_PATH: DS_PATH,
-        CMD_KW_DB: db,
-        CMD_KW_KEY: key
-    }, data)
-    v_print(3, "Broadcasted dataset at '%s'" % DS_PATH)
-    return resp
+    def __init__(self, args, files, seed):
+        self.files = files
+        self.rows = args.shape[0]
+        self.min_rows, self.max_rows = args.slice
+        self.write_ratio = args.write
+        self.metadata_ratio = args.metadata
+        self.random = np.random.RandomState(seed)
+        self.file_cdf = zipf_cdf(len(files), args.skew)
+        self.row_cdf = zipf_cdf(self.rows, args.skew)
+        self.data = self.random.random_sample((self.max_rows,
+                                               args.shape[1]))
+
+    def draw(self, cdf):
+        return min(int(np.searchsorted(cdf, self.random.random_sample())),
+                   len(cdf) - 1)
+
+    def request(self):
+        """
+        Returns:
+            kind, packed request
+        """
+        db = self.files[self.draw(self.file_cdf)]
+        p = self.random.random_sample()
+        if p < self.metadata_ratio:
+            cmd = METADATA_COMMANDS[self.random.randint(
+                len(METADATA_COMMANDS))]
+            arguments = {CMD_KW_DB: db, CMD_KW_PATH: '/'}
+            if cmd == CMD_GET_NODE:
+                arguments[CMD_KW_PATH] = DS_PATH
+            elif cmd == CMD_CONTAINS:
+                arguments[CMD_KW_KEY] = DS_PATH
+            return METADATA, pack(cmd, arguments)
+        rows = int(self.random.randint(self.min_rows, self.max_rows + 1))
+        start = min(self.draw(self.row_cdf), self.rows - rows)
+        key = slice(start, start + rows)
+        arguments = {CMD_KW_DB: db, CMD_KW_PATH: DS_PATH, CMD_KW_KEY: key}
+        if p < self.metadata_ratio + self.write_ratio:
+            return WRITE, pack(CMD_BROADCAST_DATASET, arguments,
+                               self.data[:rows])
+        return READ, pack(CMD_SLICE_DATASET, arguments)
+
+
+def arrivals(args, index, seed):
+    """
+    Yields the scheduled times (seconds since the start) of the requests of
+    client process ``index``
+    """
+    interval = args.processes / args.rate
+    if args.arrivals == 'poisson':
+        rand = np.random.RandomState([seed, 1])  # independent of the mix
+        t = rand.exponential(interval)
+        while t < args.duration:
+            yield t
+            t += rand.exponential(interval)
+    else:
+        # the processes take turns
+        t = index / args.rate
+        while t < args.duration:
+            yield t
+            t += interval
+
+
+class Connection(object):
+    """
+    A connection with (at most) one outstanding request
+    """
 
+    def __init__(self, sock):
+        self.sock = sock
+        self.record = None
+        self.buffer = bytearray()
+
+    def send(self, data, record):
+        self.record = record
+        self.sock.sendall(data)
+
+    def feed(self):
+        """
+        Read the available bytes of the response
+
+        Returns:
+            the status of the response if it is complete (else None)
+        """
+        chunk = self.sock.recv(262144)
+        if not chunk:
+            raise EOFError('connection closed by the server')
+        self.buffer += chunk
+        if len(self.buffer) < 2 * MSG_LEN:
+            return None
+        length = struct.unpack_from('>I', self.buffer, MSG_LEN)[0]
+        if len(self.buffer) < 2 * MSG_LEN + length:
+            return None
+        resp = msgpack.unpackb(bytes(self.buffer[2 * MSG_LEN:]), raw=False)
+        self.record[SIZE] += len(self.buffer)
+        self.buffer = bytearray()
+        return resp[CMD_KW_STATUS]
+
+
+def run_client(args, files, index, start):
+    """
+    Send the requests of client process ``index`` (starting at the time
+    ``start``)
 
-def initialize_file(buffer):
-    file_name = create_file(buffer)
-    create_dataset(buffer, file_name, np.random.random((MAX_SHAPE_SIZE, MAX_SHAPE_SIZE)))
-    return file_name
-
-
-def worker(host, port, requests, file_name=None):
-    """
-    Creates a new file, dataset ([MAX_SHAPE_SIZE, MAX_SHAPE_SIZE]) and send requests to hurray server: 10% write and 90% read with
-    random ([4,4] - [MAX_SHAPE_SIZE, MAX_SHAPE_SIZE]) slice sizes.
-    :param host:
-    :param port:
-    :param requests:
-    :param file_name:
-    :return:
-    """
-    buffer = connect(host, port)
-    if not file_name:
-        file_name = initialize_file(buffer)
-    stats = STATS.copy()
-    for request in range(requests):
-        start = random.randint(0, MAX_SHAPE_SIZE - 1)
-        sl = slice(start, random.randint(start + 1, MAX_SHAPE_SIZE))
-        st = time.perf_counter()
-        try:
-            # 10% write operations
-            if random.randint(0, 10) < 1:
-                data = np.random.random((sl.stop - sl.start, MAX_SHAPE_SIZE))
-                resp = broadcast_dataset(buffer, file_name, sl, data)
-                stats['write'] += 1
-                stats['data'] += data.nbytes
-            else:
-                resp = slice_dataset(buffer, file_name, sl)
-                stats['read'] += 1
-                stats['data'] += resp['data'].nbytes if 'data' in resp else 0
-            if resp[CMD_KW_STATUS] >= 200:
-                stats['errors'] += 1
-        except Exception:
-            stats['failed'] += 1
+    Returns:
+        array of the records of the requests (see INTENDED etc.; times in
+        seconds since the start; DONE is nan and STATUS -1 for requests that
+        did not complete)
+    """
+    seed = args.seed + index
+    workload = Workload(args, files, seed)
+    schedule = arrivals(args, index, seed)
+    connections = [Connection(connect(args)) for _ in range(args.connections)]
+    free = list(connections)
+    selector = selectors.DefaultSelector()
+    backlog = collections.deque()  # scheduled requests without connection
+    records = []
+    deadline = args.duration + args.timeout
+
+    while time.time() < start:
+        time.sleep(0.001)
+    t0 = time.perf_counter()
+    next_time = next(schedule, None)
+
+    while True:
+        now = time.perf_counter() - t0
+        while next_time is not None and next_time <= now:
+            backlog.append(next_time)
+            next_time = next(schedule, None)
+        while backlog and free:
+            kind, data = workload.request()
+            conn = free.pop()
+            record = [backlog.popleft(), time.perf_counter() - t0,
+                      math.nan, kind, -1, len(data)]
+            records.append(record)
+            conn.send(data, record)
+            selector.register(conn.sock, selectors.EVENT_READ, conn)
+        if next_time is None and (not backlog and not selector.get_map()
+                                  or now > deadline):
+            break
+        if next_time is None or backlog:
+            timeout = max(0., min(0.1, deadline - now))
         else:
-            if resp[CMD_KW_STATUS] >= 200:
-                stats['errors'] += 1
-        stats['time'] += [time.perf_counter() - st]
-
-    buffer.close()
+            timeout = max(0., next_time - (time.perf_counter() - t0))
+        for key, _ in selector.select(timeout):
+            conn = key.data
+            status = conn.feed()
+            if status is not None:
+                conn.record[DONE] = time.perf_counter() - t0
+                conn.record[STATUS] = status
+                selector.unregister(conn.sock)
+                free.append(conn)
+
+    # requests that were never sent
+    for intended in backlog:
+        records.append([intended, math.nan, math.nan, READ, -1, 0])
+    for conn in connections:
+        conn.sock.close()
+    return np.array(records, dtype=np.float64).reshape((-1, 6))
+
+
+def client(args, files, index, start, results):
+    try:
+        results.put(run_client(args, files, index, start))
+    except Exception as e:
+        results.put(e)
+
+
+def percentiles(latencies):
+    if not len(latencies):
+        return {}
+    values = np.percentile(latencies, PERCENTILES)
+    stats = {'p{:g}'.format(p): float(v) for p, v in zip(PERCENTILES, values)}
+    stats['mean'] = float(np.mean(latencies))
+    stats['max'] = float(np.max(latencies))
     return stats
 
 
-def stress(host, port, requests, concurrency, multiple=False):
-    print('Benchmarking %s:%d (be patient)' % (host, port), end='', flush=True)
-    file_name = None
-    if not multiple:
-        buffer = connect(host, port)
-        file_name = initialize_file(buffer)
-        buffer.close()
-    summary = STATS.copy()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
-        workers = [executor.submit(worker, host, port, requests, file_name) for _ in range(concurrency)]
-        for future in concurrent.futures.as_completed(workers):
-            stats = future.result()
-            for k in summary.keys():
-                summary[k] += stats[k]
-            print('.', end='', flush=True)
-    print('done\n')
+def histogram(latencies):
+    """
+    Returns:
+        list of [upper bound (seconds), count] of the non-empty buckets
+    """
+    counts = np.bincount(np.searchsorted(BUCKETS, latencies),
+                         minlength=len(BUCKETS) + 1)
+    bounds = list(BUCKETS) + [math.inf]
+    return [[float(bounds[i]), int(count)]
+            for i, count in enumerate(counts) if count]
+
 
-    request = summary['read'] + summary['write']
-    print('Concurrency Level:\t%d' % concurrency)
-    print('Time taken for tests:\t%.2f seconds' % sum(summary['time']))
-    print('Complete requests:\t%d (%d read, %d write)' % (request, summary['read'], summary['write']))
-    print('Failed requests:\t%d' % summary['failed'])
+def timeline(args, records):
+    """
+    Returns:
+        list of the completed requests, errors and latencies (corrected) per
+        args.interval seconds (by completion, including the warmup)
+    """
+    done = records[~np.isnan(records[:, DONE])]
+    slot = (done[:, DONE] // args.interval).astype(int)
+    ok = (done[:, STATUS] >= 0) & (done[:, STATUS] < 200)
+    latency = done[:, DONE] - done[:, INTENDED]
+    entries = []
+    for i in range(int(slot.max()) + 1 if len(slot) else 0):
+        sel = (slot == i) & ok
+        entries.append({
+            'time': i * args.interval,
+            'completed': int(np.sum(sel)),
+            'errors': int(np.sum((slot == i) & ~ok)),
+            'throughput': float(np.sum(sel) / args.interval),
+            'p50': float(np.percentile(latency[sel], 50))
+            if np.any(sel) else None,
+            'p99': float(np.percentile(latency[sel], 99))
+            if np.any(sel) else None,
+        })
+    return entries
+
+
+def summarize(args, records):
+    """
+    Returns:
+        dict of the results (see --json)
+    """
+    entries = timeline(args, records)
+    # requests scheduled during the warmup are not counted
+    records = records[records[:, INTENDED] >= args.warmup]
+    window = args.duration - args.warmup
+    done = records[~np.isnan(records[:, DONE])]
+    ok = done[(done[:, STATUS] >= 0) & (done[:, STATUS] < 200)]
+    corrected = ok[:, DONE] - ok[:, INTENDED]
+    service = ok[:, DONE] - ok[:, SENT]
+    sent = records[~np.isnan(records[:, SENT])]
+    lag = sent[:, SENT] - sent[:, INTENDED]
+
+    summary = {
+        'scheduled': len(records),
+        'completed': len(done),
+        'incomplete': len(records) - len(done),
+        'errors': len(done) - len(ok),
+        'late': int(np.sum(lag > 0.001)),
+        'send_lag_p99': float(np.percentile(lag, 99)) if len(lag) else None,
+        'target_rate': args.rate,
+        'throughput': len(ok) / window,
+        'transferred': float(np.sum(done[:, SIZE])),
+    }
+    latency = {
+        'corrected': percentiles(corrected),
+        'service': percentiles(service),
+    }
+    kinds = {}
+    for kind, name in enumerate(KINDS):
+        sel = ok[:, KIND] == kind
+        if np.any(sel):
+            kinds[name] = {
+                'count': int(np.sum(sel)),
+                'corrected': percentiles(corrected[sel]),
+                'service': percentiles(service[sel]),
+            }
+
+    return {
+        'config': {k: v for k, v in vars(args).items()
+                   if k not in ('json', 'csv')},
+        'summary': summary,
+        'latency': latency,
+        'kinds': kinds,
+        'histogram': {
+            'corrected': histogram(corrected),
+            'service': histogram(service),
+        },
+        'timeline': entries,
+    }
+
+
+def report(results):
+    summary = results['summary']
+    config = results['config']
+    print('Arrivals:\t\t%s, %.1f requests/s (%d processes, %d connections '
+          'each)' % (config['arrivals'], config['rate'],
+                     config['processes'], config['connections']))
+    print('Measured:\t\t%.1f seconds (after %.1f seconds warmup)'
+          % (config['duration'] - config['warmup'], config['warmup']))
+    print('Scheduled requests:\t%d' % summary['scheduled'])
+    print('Complete requests:\t%d' % summary['completed'])
+    print('Incomplete requests:\t%d' % summary['incomplete'])
     print('Non-1xx responses:\t%d' % summary['errors'])
-    print('Total transferred:\t%s' % sizeof_fmt(summary['data']))
-    print('Requests per second:\t%.2f [#/sec] (mean)' % (1 / np.mean(summary['time'])))
-    print('Time per request:\t%.2f [ms] (mean)' % (np.mean(summary['time']) * 1000))
+    print('Late requests:\t\t%d (sent > 1 ms after their scheduled time, '
+          'p99 %.2f ms)' % (summary['late'],
+                            (summary['send_lag_p99'] or 0.) * 1000))
+    print('Total transferred:\t%s' % sizeof_fmt(summary['transferred']))
+    print('Throughput:\t\t%.2f [#/sec]' % summary['throughput'])
+    print()
+    columns = ['p{:g}'.format(p) for p in PERCENTILES] + ['max', 'mean']
+    print('Latency [ms]  %s' % ''.join('%10s' % c for c in columns))
+    rows = [('all', results['latency'])] + \
+        sorted(results['kinds'].items())
+    for name, latency in rows:
+        for which in ('corrected', 'service'):
+            stats = latency[which]
+            if stats:
+                print('%-13s %s' % (
+                    '%s %s' % (name, which[:4]),
+                    ''.join('%10.2f' % (stats[c] * 1000) for c in columns)))
+    if config['v'] >= 1:
+        print()
+        print('Time [s]  Throughput [#/sec]  p99 [ms]')
+        for entry in results['timeline']:
+            print('%8.1f  %18.1f  %8s' % (
+                entry['time'], entry['throughput'],
+                '-' if entry['p99'] is None else
+                '%.2f' % (entry['p99'] * 1000)))
+
+
+def write_csv(path, results, label):
+    """
+    Append a row with the summary of a run to a CSV file (e.g., to compare
+    server builds)
+    """
+    columns = ['label', 'arrivals', 'target_rate', 'throughput',
+               'completed', 'incomplete', 'errors', 'late']
+    for which in ('corrected', 'service'):
+        columns += ['{}_{}'.format(which, c) for c in
+                    ['p{:g}'.format(p) for p in PERCENTILES] +
+                    ['max', 'mean']]
+    row = {'label': label, 'arrivals': results['config']['arrivals']}
+    row.update((k, v) for k, v in results['summary'].items()
+               if k in columns)
+    for which in ('corrected', 'service'):
+        for k, v in results['latency'][which].items():
+            row['{}_{}'.format(which, k)] = v
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    if not new:
+        # keep the columns of the existing file
+        with open(path, newline='') as f:
+            columns = next(csv.reader(f))
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        if new:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def stress(args):
+    target = args.socket or '%s:%d' % (args.host, args.port)
+    print('Benchmarking %s (be patient)' % target, end='', flush=True)
+    files = initialize_files(args)
+    results = multiprocessing.Queue()
+    start = time.time() + 1.
+    procs = [multiprocessing.Process(target=client,
+                                     args=(args, files, i, start, results))
+             for i in range(args.processes)]
+    for proc in procs:
+        proc.start()
+    outcomes = []
+    for _ in procs:
+        outcomes.append(results.get())
+        print('.', end='', flush=True)
+    for proc in procs:
+        proc.join()
+    print('done\n')
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            raise outcome
 
+    results = summarize(args, np.concatenate(outcomes))
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.csv:
+        write_csv(args.csv, results, args.label)
 
-if __name__ == '__main__':
+
+def main():
     import argparse
 
-    parser = argparse.ArgumentParser(description='Hurray server benchmarking tool')
+    parser = argparse.ArgumentParser(
+        description='Hurray server load generator (open-loop)')
     parser.add_argument('host', metavar='hostname', type=str,
                         help='hostname')
     parser.add_argument('port', metavar='port', type=int,
                         help='port')
-    parser.add_argument('-n', metavar='requests', type=int, default=1,
-                        help='Number of requests to perform for the benchmarking session. '
-                             'The default is to just perform a single request which usually '
-                             'leads to non-representative bench‐marking results.')
-    parser.add_argument('-c', metavar='concurrency', type=int, default=1,
-                        help='Number of multiple requests to perform at a time. Default is one request at a time.')
-    parser.add_argument('-m', action='store_true', default=False,
-                        help='Create and use an individual file for each concurrent worker')
+    parser.add_argument('--socket', metavar='path',
+                        help='Connect to this Unix socket (instead of '
+                             'hostname:port)')
+    parser.add_argument('-r', '--rate', type=float, default=100.,
+                        help='Requests per second (all processes)')
+    parser.add_argument('-d', '--duration', type=float, default=10.,
+                        help='Seconds to send requests')
+    parser.add_argument('-w', '--warmup', type=float, default=1.,
+                        help='Requests scheduled in the first seconds are '
+                             'not counted')
+    parser.add_argument('-p', '--processes', type=int, default=2,
+                        help='Client processes')
+    parser.add_argument('-c', '--connections', type=int, default=8,
+                        help='Connections per process (at most one '
+                             'outstanding request each)')
+    parser.add_argument('-a', '--arrivals', choices=('constant', 'poisson'),
+                        default='poisson', help='Arrival process')
+    parser.add_argument('--slice', type=int, nargs=2, default=(4, 850),
+                        metavar=('MIN', 'MAX'),
+                        help='Rows read or written per request')
+    parser.add_argument('--shape', type=int, nargs=2, default=(850, 850),
+                        metavar=('ROWS', 'COLUMNS'),
+                        help='Shape of the (float64) dataset of each file')
+    parser.add_argument('--write', type=float, default=0.1,
+                        help='Fraction of write requests')
+    parser.add_argument('--metadata', type=float, default=0.,
+                        help='Fraction of metadata requests (get_node, '
+                             'contains, get_keys)')
+    parser.add_argument('--files', type=int, default=1,
+                        help='Number of files')
+    parser.add_argument('--skew', type=float, default=0.,
+                        help='Zipf exponent of the file and row '
+                             'distributions (0 = uniform)')
+    parser.add_argument('--interval', type=float, default=1.,
+                        help='Seconds per entry of the throughput timeline')
+    parser.add_argument('--timeout', type=float, default=10.,
+                        help='Seconds to wait for outstanding responses')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of the workload')
+    parser.add_argument('--json', metavar='file',
+                        help='Write the results (incl. histograms and '
+                             'timeline) to this file')
+    parser.add_argument('--csv', metavar='file',
+                        help='Append a summary row to this CSV file')
+    parser.add_argument('--label', default='',
+                        help='Label of the run (CSV)')
     parser.add_argument('-v', metavar='level', type=int, default=0,
-                        help='How much troubleshooting info to print.')
+                        help='Verbosity (1: print the timeline)')
 
     args = parser.parse_args()
+    if args.slice[0] < 1 or args.slice[0] > args.slice[1] or \
+            args.slice[1] > args.shape[0]:
+        parser.error('--slice must be within 1 and the rows of --shape')
+    if args.write + args.metadata > 1:
+        parser.error('--write + --metadata must not exceed 1')
+    if args.warmup >= args.duration:
+        parser.error('--warmup must be shorter than --duration')
+    args.shape = tuple(args.shape)
+    args.slice = tuple(args.slice)
+    stress(args)
 
 
-    def v_print(v, *a, **k):
-        if v <= args.v:
-            print(*a, **k)
-
-
-    stress(args.host, args.port, args.n, args.c, args.m)
+if __name__ == '__main__':
+    main()
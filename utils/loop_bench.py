@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# Copyright (c) 2016, Meteotest
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of Meteotest nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Compare the event loops of the server (--loop=ioloop and --loop=asyncio).
+
+Starts a server with each loop on a temporary base directory and measures
+the request throughput of concurrent client processes for a few request
+types:
+
+  info    server_info (answered by the event loop process, no worker)
+  small   contains (a small request run by a worker)
+  read    slice of a float64 dataset (large response)
+  write   broadcast to a float64 dataset (large request)
+
+Usage: python loop_bench.py [-c concurrency] [-d seconds] [-s size]
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import msgpack
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hurray.msgpack_ext import decode, encode  # noqa: E402
+
+LOOPS = ('ioloop', 'asyncio')
+WORKLOADS = ('info', 'small', 'read', 'write')
+DB = 'bench.h5'
+PATH = 'ds'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if not n:
+            raise EOFError('connection closed')
+        pos += n
+    return buf
+
+
+def call(sock, cmd, args, data=None):
+    msg = msgpack.packb({'cmd': cmd, 'args': args, 'data': data},
+                        default=encode, use_bin_type=True)
+    sock.sendall(struct.pack('>II', 1, len(msg)) + msg)
+    _, length = struct.unpack('>II', recv_exactly(sock, 8))
+    resp = msgpack.unpackb(recv_exactly(sock, length), object_hook=decode,
+                           use_list=False, raw=False)
+    if resp['status'] >= 200:
+        raise RuntimeError('{} failed with status {}'
+                           .format(cmd, resp['status']))
+    return resp
+
+
+def connect(port):
+    for _ in range(100):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+
+def request(workload, size):
+    if workload == 'info':
+        return 'server_info', {}, None
+    if workload == 'small':
+        return 'contains', {'db': DB, 'path': '/', 'key': PATH}, None
+    if workload == 'read':
+        return 'slice_dataset', {'db': DB, 'path': PATH,
+                                 'key': (slice(0, size),)}, None
+    return 'broadcast_dataset', {'db': DB, 'path': PATH,
+                                 'key': (slice(0, size),)}, \
+        np.random.random((size, 128))
+
+
+def client(port, workload, size, duration, start, results):
+    try:
+        sock = connect(port)
+        cmd, args, data = request(workload, size)
+        while time.time() < start:
+            time.sleep(0.001)
+        count = 0
+        end = start + duration
+        while time.time() < end:
+            call(sock, cmd, args, data)
+            count += 1
+        sock.close()
+        results.put(count)
+    except Exception as e:
+        results.put(e)
+
+
+def run_workload(port, workload, concurrency, duration, size):
+    results = multiprocessing.Queue()
+    start = time.time() + 0.5
+    clients = [multiprocessing.Process(target=client,
+                                       args=(port, workload, size, duration,
+                                             start, results))
+               for _ in range(concurrency)]
+    for proc in clients:
+        proc.start()
+    counts = [results.get() for _ in clients]
+    for proc in clients:
+        proc.join()
+    for count in counts:
+        if isinstance(count, Exception):
+            raise count
+    return sum(counts) / duration
+
+
+def bench_loop(loop, args):
+    base = tempfile.mkdtemp()
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'hurray', '--base=' + base,
+         '--port={}'.format(port), '--processes=1',
+         '--workers={}'.format(args.workers), '--loop=' + loop,
+         '--pyramid_interval=0', '--logging=warning'],
+        cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+        start_new_session=True)
+    try:
+        sock = connect(port)
+        call(sock, 'create_db', {'db': DB, 'overwrite': True})
+        call(sock, 'create_dataset', {'db': DB, 'path': PATH},
+             np.random.random((args.size, 128)))
+        sock.close()
+        rates = {}
+        for workload in args.workloads:
+            rates[workload] = run_workload(port, workload, args.c, args.d,
+                                           args.size)
+            print('{:8s} {:6s} {:10.1f} req/s'.format(loop, workload,
+                                                     rates[workload]))
+        return rates
+    finally:
+        stop_server(server)
+        shutil.rmtree(base)
+
+
+def stop_server(server):
+    """
+    Stop a server started in a session of its own and the processes it
+    leaves behind (they would keep stdout open, e.g., of a pipe)
+    """
+    if server.poll() is None:
+        server.send_signal(signal.SIGTERM)
+        server.wait(30)
+    # the lock manager and the workers
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compare the throughput of the server event loops')
+    parser.add_argument('-c', metavar='concurrency', type=int, default=4,
+                        help='Number of client processes')
+    parser.add_argument('-d', metavar='seconds', type=float, default=3.0,
+                        help='Duration of each measurement')
+    parser.add_argument('-s', dest='size', metavar='rows', type=int,
+                        default=1024,
+                        help='Rows (of 128 float64 values) read or written '
+                             'per request')
+    parser.add_argument('-w', dest='workers', metavar='workers', type=int,
+                        default=2, help='Workers of the server process')
+    parser.add_argument('--loops', nargs='+', choices=LOOPS, default=LOOPS)
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS,
+                        default=WORKLOADS)
+    parser.add_argument('--json', metavar='file',
+                        help='Write the results (requests/s) to this file')
+    args = parser.parse_args()
+
+    results = {loop: bench_loop(loop, args) for loop in args.loops}
+    if len(args.loops) == 2:
+        for workload in args.workloads:
+            a, b = (results[loop][workload] for loop in LOOPS)
+            print('{:6s} asyncio/ioloop: {:.2f}'.format(workload, b / a))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -43,6 +43,9 @@ CMD_KW_STATUS = 'status'
 # commands
 CMD_CREATE_DATABASE = 'create_db'
 CMD_CREATE_DATASET = 'create_dataset'
+CMD_GET_NODE = 'get_node'
+CMD_CONTAINS = 'contains'
+CMD_GET_KEYS = 'get_keys'
 CMD_SLICE_DATASET = 'slice_dataset'
 CMD_BROADCAST_DATASET = 'broadcast_dataset'
 